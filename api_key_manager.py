@@ -1,77 +1,659 @@
-from typing import Dict, Optional
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple
+import asyncio
+import hashlib
 import logging
+import os
+import threading
+import time
+import uuid
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_KEY_STORE = os.environ.get("API_KEY_STORE", "sqlite")
+DEFAULT_KEY_STORE_URL = os.environ.get("API_KEY_STORE_URL", "sqlite:///api_keys.db")
+DEFAULT_CACHE_TTL = float(os.environ.get("API_KEY_CACHE_TTL", "5.0"))
+DEFAULT_LEASE_SIZE = int(os.environ.get("API_KEY_LEASE_SIZE", "20"))
+# Seconds without a renewal after which a worker's unused leases return to the pool
+DEFAULT_LEASE_SECONDS = float(os.environ.get("API_KEY_LEASE_SECONDS", "60"))
+DEFAULT_FLUSH_INTERVAL = float(os.environ.get("API_KEY_FLUSH_INTERVAL", "1.0"))
+# Bound on cached lookups so unknown keys cannot grow the cache without limit
+MAX_CACHED_KEYS = 10000
+# A lease holds at most this fraction of a key's limit, so one worker cannot hoard it
+MAX_LEASE_FRACTION = 0.1
+
+
+def hash_key(api_key: str) -> str:
+    """Hash an API key for storage; plaintext keys are never persisted"""
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+def key_id(key_hash: str) -> str:
+    """Short identifier for a hashed key, used in logs and admin listings"""
+    return key_hash[:12]
+
+
+class KeyStore(ABC):
+    """Interface for API key storage shared by all workers.
+
+    Each key has a committed ``usage`` count and a ``reserved`` count of
+    quota handed out to workers but not yet reported as used. Reservations
+    are held per worker as leases that expire ``lease_seconds`` after the
+    worker last renewed them; the next reservation on the key returns the
+    expired ones to the pool, so a worker that died does not keep its quota.
+    """
+
+    @abstractmethod
+    def add(self, key_hash: str) -> bool:
+        ...
+
+    @abstractmethod
+    def remove(self, key_hash: str) -> bool:
+        ...
+
+    @abstractmethod
+    def exists(self, key_hash: str) -> bool:
+        ...
+
+    @abstractmethod
+    def get_usage(self, key_hash: str) -> Optional[int]:
+        ...
+
+    @abstractmethod
+    def all_usage(self) -> Dict[str, int]:
+        ...
+
+    @abstractmethod
+    def reset(self, key_hash: str) -> bool:
+        ...
+
+    @abstractmethod
+    def reserve(self, key_hash: str, count: int, limit: int, worker: str,
+                lease_seconds: float) -> Tuple[int, int]:
+        """Atomically reserve up to ``count`` uses below ``limit`` for ``worker``.
+
+        Expired leases on the key are reclaimed first. Returns (granted,
+        committed usage).
+        """
+
+    @abstractmethod
+    def commit(self, used: Dict[str, int], released: Dict[str, int], worker: str,
+               lease_seconds: float) -> Dict[str, int]:
+        """Move ``worker``'s used reservations into usage and return unused ones.
+
+        Every lease the worker still holds is renewed. Returns the committed
+        usage of every key touched.
+        """
+
+    @abstractmethod
+    def get_setting(self, name: str) -> Optional[int]:
+        ...
+
+    @abstractmethod
+    def set_setting(self, name: str, value: int):
+        ...
+
+
+class MemoryKeyStore(KeyStore):
+    """Process-local key store, for tests and single-worker development"""
+
+    def __init__(self):
+        self._keys: Dict[str, list] = {}
+        # (key hash, worker) -> [count, expires]
+        self._leases: Dict[Tuple[str, str], list] = {}
+        self._settings: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, key_hash: str) -> bool:
+        with self._lock:
+            if key_hash in self._keys:
+                return False
+            self._keys[key_hash] = [0, 0]
+            return True
+
+    def remove(self, key_hash: str) -> bool:
+        with self._lock:
+            self._drop_leases(key_hash)
+            return self._keys.pop(key_hash, None) is not None
+
+    def _drop_leases(self, key_hash: str, before: float = float("inf")) -> int:
+        """Remove the key's leases expiring before ``before`` and return their count"""
+        expired = [lease for lease, (_, expires) in self._leases.items()
+                   if lease[0] == key_hash and expires < before]
+        return sum(self._leases.pop(lease)[0] for lease in expired)
+
+    def exists(self, key_hash: str) -> bool:
+        return key_hash in self._keys
+
+    def get_usage(self, key_hash: str) -> Optional[int]:
+        entry = self._keys.get(key_hash)
+        return entry[0] if entry else None
+
+    def all_usage(self) -> Dict[str, int]:
+        return {key_hash: entry[0] for key_hash, entry in self._keys.items()}
+
+    def reset(self, key_hash: str) -> bool:
+        with self._lock:
+            if key_hash not in self._keys:
+                return False
+            self._drop_leases(key_hash)
+            self._keys[key_hash] = [0, 0]
+            return True
+
+    def reserve(self, key_hash: str, count: int, limit: int, worker: str,
+                lease_seconds: float) -> Tuple[int, int]:
+        now = time.time()
+        with self._lock:
+            entry = self._keys.get(key_hash)
+            if entry is None:
+                return 0, 0
+            entry[1] = max(0, entry[1] - self._drop_leases(key_hash, now))
+            granted = max(0, min(count, limit - entry[0] - entry[1]))
+            entry[1] += granted
+            if granted:
+                self._leases.setdefault((key_hash, worker), [0, 0.0])[0] += granted
+                self._renew(worker, now + lease_seconds)
+            return granted, entry[0]
+
+    def _renew(self, worker: str, expires: float):
+        for lease, held in list(self._leases.items()):
+            if lease[1] == worker:
+                if held[0] <= 0:
+                    del self._leases[lease]
+                else:
+                    held[1] = expires
+
+    def commit(self, used: Dict[str, int], released: Dict[str, int], worker: str,
+               lease_seconds: float) -> Dict[str, int]:
+        usage = {}
+        with self._lock:
+            for key_hash in set(used) | set(released):
+                entry = self._keys.get(key_hash)
+                if entry is None:
+                    continue
+                count = used.get(key_hash, 0)
+                returned = count + released.get(key_hash, 0)
+                lease = self._leases.get((key_hash, worker))
+                # Uses of a lease that was already reclaimed are still counted
+                held = min(returned, lease[0]) if lease else 0
+                entry[0] += count
+                entry[1] = max(0, entry[1] - held)
+                if lease:
+                    lease[0] -= held
+                usage[key_hash] = entry[0]
+            self._renew(worker, time.time() + lease_seconds)
+        return usage
+
+    def get_setting(self, name: str) -> Optional[int]:
+        return self._settings.get(name)
+
+    def set_setting(self, name: str, value: int):
+        self._settings[name] = value
+
+
+class SQLiteKeyStore(KeyStore):
+    """Key store in a SQL database shared by every worker (SQLite by default).
+
+    Reservations are a single UPDATE ... RETURNING statement, so concurrent
+    workers can never reserve more than the limit between them. Each
+    worker's share is also kept as a row of api_key_leases, which is what
+    lets expired reservations be reclaimed.
+    """
+
+    def __init__(self, url: str = DEFAULT_KEY_STORE_URL):
+        from sqlalchemy import (
+            Column, Float, Integer, MetaData, String, Table, create_engine, event
+        )
+
+        self.url = url
+        self.engine = create_engine(url)
+        if self.engine.dialect.name == "sqlite":
+            @event.listens_for(self.engine, "connect")
+            def _configure_sqlite(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                cursor.execute("PRAGMA journal_mode=WAL")
+                cursor.execute("PRAGMA busy_timeout=5000")
+                cursor.close()
+
+        metadata = MetaData()
+        self.keys = Table(
+            "api_keys", metadata,
+            Column("key_hash", String(64), primary_key=True),
+            Column("usage", Integer, nullable=False, default=0),
+            Column("reserved", Integer, nullable=False, default=0),
+            Column("last_grant", Integer, nullable=False, default=0),
+        )
+        self.leases = Table(
+            "api_key_leases", metadata,
+            Column("key_hash", String(64), primary_key=True),
+            Column("worker", String(32), primary_key=True),
+            Column("count", Integer, nullable=False),
+            Column("expires", Float, nullable=False),
+        )
+        self.settings = Table(
+            "api_key_settings", metadata,
+            Column("name", String(64), primary_key=True),
+            Column("value", Integer, nullable=False),
+        )
+        metadata.create_all(self.engine)
+        logger.info(f"SQLite API key store initialized at {url}")
+
+    def add(self, key_hash: str) -> bool:
+        from sqlalchemy.exc import IntegrityError
+
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(self.keys.insert().values(
+                    key_hash=key_hash, usage=0, reserved=0, last_grant=0))
+            return True
+        except IntegrityError:
+            return False
+
+    def remove(self, key_hash: str) -> bool:
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                self.keys.delete().where(self.keys.c.key_hash == key_hash))
+            connection.execute(self.leases.delete().where(self.leases.c.key_hash == key_hash))
+        return result.rowcount > 0
+
+    def exists(self, key_hash: str) -> bool:
+        return self.get_usage(key_hash) is not None
+
+    def get_usage(self, key_hash: str) -> Optional[int]:
+        from sqlalchemy import select
+
+        with self.engine.connect() as connection:
+            return connection.execute(
+                select(self.keys.c.usage).where(self.keys.c.key_hash == key_hash)
+            ).scalar()
+
+    def all_usage(self) -> Dict[str, int]:
+        from sqlalchemy import select
+
+        with self.engine.connect() as connection:
+            rows = connection.execute(select(self.keys.c.key_hash, self.keys.c.usage))
+            return {row.key_hash: row.usage for row in rows}
+
+    def reset(self, key_hash: str) -> bool:
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                self.keys.update().where(self.keys.c.key_hash == key_hash)
+                .values(usage=0, reserved=0))
+            connection.execute(self.leases.delete().where(self.leases.c.key_hash == key_hash))
+        return result.rowcount > 0
+
+    def reserve(self, key_hash: str, count: int, limit: int, worker: str,
+                lease_seconds: float) -> Tuple[int, int]:
+        from sqlalchemy import func, select
+
+        keys, leases = self.keys, self.leases
+        now = time.time()
+        expired = (leases.c.key_hash == key_hash) & (leases.c.expires < now)
+        reclaimed = select(func.coalesce(func.sum(leases.c.count), 0)).where(expired).scalar_subquery()
+        # Right-hand sides see the old row, so last_grant and reserved agree
+        grant = func.min(count, limit - keys.c.usage - keys.c.reserved)
+        statement = (
+            keys.update()
+            .where(keys.c.key_hash == key_hash)
+            .where(keys.c.usage + keys.c.reserved < limit)
+            .values(last_grant=grant, reserved=keys.c.reserved + grant)
+            .returning(keys.c.last_grant, keys.c.usage)
+        )
+        with self.engine.begin() as connection:
+            # The first statement writes, so the transaction holds the write
+            # lock before it reads the leases it reclaims
+            connection.execute(
+                keys.update().where(keys.c.key_hash == key_hash)
+                .values(reserved=func.max(0, keys.c.reserved - reclaimed)))
+            connection.execute(leases.delete().where(expired))
+            row = connection.execute(statement).first()
+            if row is not None and row.last_grant > 0:
+                mine = (leases.c.key_hash == key_hash) & (leases.c.worker == worker)
+                result = connection.execute(leases.update().where(mine).values(
+                    count=leases.c.count + row.last_grant))
+                if result.rowcount == 0:
+                    connection.execute(leases.insert().values(
+                        key_hash=key_hash, worker=worker, count=row.last_grant, expires=now))
+                # Any grant renews all of the worker's leases, as commit() does
+                connection.execute(leases.update().where(leases.c.worker == worker)
+                                   .values(expires=now + lease_seconds))
+        if row is None:
+            return 0, self.get_usage(key_hash) or 0
+        return row.last_grant, row.usage
+
+    def commit(self, used: Dict[str, int], released: Dict[str, int], worker: str,
+               lease_seconds: float) -> Dict[str, int]:
+        from sqlalchemy import bindparam, func, select
+
+        keys, leases = self.keys, self.leases
+        params = [
+            {"hash": key_hash, "used": used.get(key_hash, 0),
+             "returned": used.get(key_hash, 0) + released.get(key_hash, 0)}
+            for key_hash in set(used) | set(released)
+        ]
+        mine = (leases.c.key_hash == bindparam("hash")) & (leases.c.worker == worker)
+        # Uses of a lease that was already reclaimed are still counted, but
+        # only what the worker still holds leaves the reserved count
+        held = func.min(bindparam("returned"), func.coalesce(
+            select(leases.c.count).where(mine).scalar_subquery(), 0))
+        with self.engine.begin() as connection:
+            if params:
+                connection.execute(
+                    keys.update().where(keys.c.key_hash == bindparam("hash"))
+                    .values(usage=keys.c.usage + bindparam("used"),
+                            reserved=func.max(0, keys.c.reserved - held)),
+                    params)
+                connection.execute(
+                    leases.update().where(mine)
+                    .values(count=leases.c.count - func.min(bindparam("returned"), leases.c.count)),
+                    params)
+            connection.execute(leases.delete().where((leases.c.worker == worker) & (leases.c.count <= 0)))
+            connection.execute(leases.update().where(leases.c.worker == worker)
+                               .values(expires=time.time() + lease_seconds))
+            if not params:
+                return {}
+            rows = connection.execute(
+                select(keys.c.key_hash, keys.c.usage)
+                .where(keys.c.key_hash.in_([param["hash"] for param in params])))
+            return {row.key_hash: row.usage for row in rows}
+
+    def get_setting(self, name: str) -> Optional[int]:
+        from sqlalchemy import select
+
+        with self.engine.connect() as connection:
+            return connection.execute(
+                select(self.settings.c.value).where(self.settings.c.name == name)
+            ).scalar()
+
+    def set_setting(self, name: str, value: int):
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                self.settings.update().where(self.settings.c.name == name)
+                .values(value=value))
+            if result.rowcount == 0:
+                connection.execute(self.settings.insert().values(name=name, value=value))
+
+
+def create_key_store(backend: str = DEFAULT_KEY_STORE) -> KeyStore:
+    """Create the configured key store ("sqlite" or "memory")"""
+    if backend == "memory":
+        return MemoryKeyStore()
+    if backend == "sqlite":
+        return SQLiteKeyStore()
+    raise ValueError(f"Unknown API key store: {backend}")
+
 
 class ApiKeyManager:
-    """Manages API keys and their usage limits"""
+    """Manages API keys and their usage limits.
 
-    def __init__(self, max_usage: int = 10):
-        self.api_keys: Dict[str, int] = {
-            "test_key": 0  # Default test key with 0 usage
-        }
+    Keys are stored hashed in a KeyStore shared by all workers. Lookups go
+    through an in-process cache with a TTL. Usage is enforced with quota
+    leases: a worker reserves a block of uses from the store in one atomic
+    write and counts requests against it locally, so the limit holds across
+    workers without a store write per request. A lease is at most
+    MAX_LEASE_FRACTION of the limit, so keys with very small limits are
+    reserved one use at a time. Used counts are written back in batches by
+    flush(), which a background task runs periodically and which also renews
+    the worker's leases; leases of a worker that stops renewing them expire
+    after ``lease_seconds`` and return to the pool.
+
+    validate_key_async() keeps store access off the event loop. A successful
+    validation claims one use for the request, which increment_usage() then
+    counts, or release() returns to the lease when the request fails first.
+    """
+
+    def __init__(self, max_usage: int = 10, store: Optional[KeyStore] = None,
+                 cache_ttl: float = DEFAULT_CACHE_TTL,
+                 lease_size: int = DEFAULT_LEASE_SIZE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        self.store = store if store is not None else create_key_store()
         self.admin_key = "admin_secret"  # Admin key for authentication
-        self.max_usage = max_usage
+        self.cache_ttl = cache_ttl
+        self.lease_size = lease_size
+        self.flush_interval = flush_interval
+        self.lease_seconds = lease_seconds
+        # Identifies this process's leases in the shared key store
+        self.worker_id = uuid.uuid4().hex
+
+        self._known: Dict[str, Tuple[bool, float]] = {}
+        self._max_usage: Optional[Tuple[int, float]] = None
+        self._leases: Dict[str, int] = {}
+        self._claimed: Dict[str, int] = {}
+        self._used: Dict[str, int] = {}
+        self._committed: Dict[str, int] = {}
+        # Local leases are only used while the store still holds them
+        self._leases_expire = 0.0
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        if self.store.get_setting("max_usage") is None:
+            self.store.set_setting("max_usage", max_usage)
+        self.store.add(hash_key("test_key"))  # Default test key
         logger.info(
-            f"API Key Manager initialized with max usage of {max_usage}")
+            f"API Key Manager initialized with max usage of {self.max_usage}")
+
+    @property
+    def max_usage(self) -> int:
+        """Usage limit per key, shared by all workers through the store"""
+        now = time.monotonic()
+        if self._max_usage is None or self._max_usage[1] <= now:
+            self._max_usage = (self.store.get_setting("max_usage"), now + self.cache_ttl)
+        return self._max_usage[0]
+
+    @max_usage.setter
+    def max_usage(self, value: int):
+        self.store.set_setting("max_usage", value)
+        self._max_usage = (value, time.monotonic() + self.cache_ttl)
+
+    def _is_known(self, key_hash: str) -> bool:
+        now = time.monotonic()
+        cached = self._known.get(key_hash)
+        if cached is None or cached[1] <= now:
+            cached = (self.store.exists(key_hash), now + self.cache_ttl)
+            if len(self._known) >= MAX_CACHED_KEYS:
+                self._known.clear()
+            self._known[key_hash] = cached
+        return cached[0]
+
+    async def is_known_async(self, api_key: str) -> bool:
+        """Whether the key exists, looked up off the event loop unless cached"""
+        key_hash = hash_key(api_key)
+        cached = self._known.get(key_hash)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        return await asyncio.to_thread(self._is_known, key_hash)
+
+    def _invalidate(self, key_hash: str):
+        with self._lock:
+            self._known.pop(key_hash, None)
+            self._leases.pop(key_hash, None)
+            self._claimed.pop(key_hash, None)
+            self._used.pop(key_hash, None)
+            self._committed.pop(key_hash, None)
+
+    def _expire_leases(self):
+        # Not renewed in time: the store may have handed these uses out again
+        if time.time() >= self._leases_expire:
+            self._leases.clear()
+
+    def _claim(self, key_hash: str) -> bool:
+        """Take one use from the key's lease for the current request"""
+        with self._lock:
+            self._expire_leases()
+            if self._leases.get(key_hash, 0) <= 0:
+                return False
+            self._leases[key_hash] -= 1
+            self._claimed[key_hash] = self._claimed.get(key_hash, 0) + 1
+            return True
+
+    def lease_count(self, max_usage: int) -> int:
+        """Uses reserved per store write for a key limited to ``max_usage``"""
+        return max(1, min(self.lease_size, int(max_usage * MAX_LEASE_FRACTION)))
 
     def validate_admin_key(self, admin_key: str) -> bool:
         """Validate the admin key"""
         return admin_key == self.admin_key
 
     def validate_key(self, api_key: str) -> bool:
-        """Check if API key exists and has not exceeded usage limit"""
-        if api_key not in self.api_keys:
-            logger.warning(f"Invalid API key attempted: {api_key}")
-            return False
+        """Check if API key exists and has not exceeded usage limit.
 
-        if self.api_keys[api_key] >= self.max_usage:
-            logger.warning(f"API key usage limit exceeded: {api_key}")
+        May read and write the key store; request handlers use
+        validate_key_async().
+        """
+        key_hash = hash_key(api_key)
+        if not self._is_known(key_hash):
+            logger.warning("Invalid API key attempted: %s", key_id(key_hash))
             return False
 
+        if self._claim(key_hash):
+            return True
+
+        max_usage = self.max_usage
+        renewed = time.time() + self.lease_seconds
+        granted, usage = self.store.reserve(
+            key_hash, self.lease_count(max_usage), max_usage, self.worker_id, self.lease_seconds)
+        with self._lock:
+            if granted:
+                self._leases_expire = renewed
+            self._leases[key_hash] = self._leases.get(key_hash, 0) + granted
+            self._committed[key_hash] = usage
+        if granted == 0 or not self._claim(key_hash):
+            logger.warning("API key usage limit exceeded: %s", key_id(key_hash))
+            return False
         return True
 
+    async def validate_key_async(self, api_key: str) -> bool:
+        """validate_key() for the event loop: a key with a lease in hand needs no
+        store access, anything else is looked up in a worker thread"""
+        key_hash = hash_key(api_key)
+        cached = self._known.get(key_hash)
+        if cached is not None and cached[0] and cached[1] > time.monotonic() and self._claim(key_hash):
+            return True
+        return await asyncio.to_thread(self.validate_key, api_key)
+
     def increment_usage(self, api_key: str) -> int:
-        """Increment usage count for an API key and return new count"""
-        if api_key in self.api_keys:
-            self.api_keys[api_key] += 1
-            usage = self.api_keys[api_key]
-            logger.info(f"API key {api_key} used ({usage}/{self.max_usage})")
-            return usage
-        return 0
+        """Count the use claimed by validate_key and return the new count"""
+        key_hash = hash_key(api_key)
+        with self._lock:
+            if self._claimed.get(key_hash, 0) <= 0:
+                return 0
+            self._claimed[key_hash] -= 1
+            self._used[key_hash] = self._used.get(key_hash, 0) + 1
+            usage = self._committed.get(key_hash, 0) + self._used[key_hash]
+        logger.info("API key %s used (%s/%s)", key_id(key_hash), usage, self.max_usage)
+        return usage
+
+    def release(self, api_key: str):
+        """Return the use claimed by validate_key to the lease, uncounted"""
+        key_hash = hash_key(api_key)
+        with self._lock:
+            if self._claimed.get(key_hash, 0) <= 0:
+                return
+            self._claimed[key_hash] -= 1
+            self._leases[key_hash] = self._leases.get(key_hash, 0) + 1
+
+    def flush(self, release: bool = False) -> int:
+        """Write pending usage counts to the store in one batch.
+
+        With ``release`` the unused part of every lease is returned as well,
+        which is done on shutdown. Leases still held are renewed. Returns the
+        number of uses written.
+        """
+        with self._lock:
+            self._expire_leases()
+            used, self._used = self._used, {}
+            released = {}
+            if release:
+                released, self._leases = self._leases, {}
+                for key_hash, count in self._claimed.items():
+                    released[key_hash] = released.get(key_hash, 0) + count
+                self._claimed = {}
+            holding = any(count > 0 for count in self._leases.values())
+        if not used and not released and not holding:
+            return 0
+        renewed = time.time() + self.lease_seconds
+        try:
+            usage = self.store.commit(used, released, self.worker_id, self.lease_seconds)
+        except Exception:
+            with self._lock:
+                for key_hash, count in used.items():
+                    self._used[key_hash] = self._used.get(key_hash, 0) + count
+                if release:
+                    for key_hash, count in released.items():
+                        self._leases[key_hash] = self._leases.get(key_hash, 0) + count
+            raise
+        with self._lock:
+            self._committed.update(usage)
+            if holding:
+                self._leases_expire = renewed
+        return sum(used.values())
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.error(f"Failed to flush API key usage: {e}")
+
+    async def start(self):
+        """Start the background usage writer on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._flusher())
+
+    async def stop(self):
+        """Stop the background writer, flush usage and release leases"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.flush, True)
 
     def reset_usage(self, api_key: str) -> bool:
         """Reset usage count for an API key"""
-        if api_key in self.api_keys:
-            self.api_keys[api_key] = 0
-            logger.info(f"API key usage reset: {api_key}")
+        key_hash = hash_key(api_key)
+        if self.store.reset(key_hash):
+            self._invalidate(key_hash)
+            logger.info(f"API key usage reset: {key_id(key_hash)}")
             return True
         return False
 
     def add_key(self, api_key: str) -> bool:
         """Add a new API key"""
-        if api_key in self.api_keys:
+        key_hash = hash_key(api_key)
+        if not self.store.add(key_hash):
             return False
-        self.api_keys[api_key] = 0
-        logger.info(f"New API key added: {api_key}")
+        self._invalidate(key_hash)
+        logger.info(f"New API key added: {key_id(key_hash)}")
         return True
 
     def remove_key(self, api_key: str) -> bool:
         """Remove an API key"""
-        if api_key in self.api_keys:
-            del self.api_keys[api_key]
-            logger.info(f"API key removed: {api_key}")
+        key_hash = hash_key(api_key)
+        if self.store.remove(key_hash):
+            self._invalidate(key_hash)
+            logger.info(f"API key removed: {key_id(key_hash)}")
             return True
         return False
 
     def get_usage(self, api_key: str) -> Optional[int]:
         """Get current usage count for an API key"""
-        return self.api_keys.get(api_key)
+        key_hash = hash_key(api_key)
+        usage = self.store.get_usage(key_hash)
+        if usage is None:
+            return None
+        return usage + self._used.get(key_hash, 0)
 
     def get_all_keys(self) -> Dict[str, int]:
-        """Get all API keys and their usage counts"""
-        return self.api_keys.copy()
+        """Get all API keys (by key id) and their usage counts"""
+        return {
+            key_id(key_hash): usage + self._used.get(key_hash, 0)
+            for key_hash, usage in self.store.all_usage().items()
+        }
 
 
 # Create a global instance
@@ -0,0 +1,240 @@
+from datetime import datetime
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from battery_diagnostics import ocv_table, spec_registry
+
+
+class BatchDiagnostics:
+    """Vectorized counterparts of the BatteryDiagnostics calculations.
+
+    Every method here mirrors a scalar method of BatteryDiagnostics and must
+    produce the same numbers for every valid row; the scalar implementation
+    remains the reference.
+    """
+
+    @staticmethod
+    def temperature_compensation(temperature: np.ndarray) -> np.ndarray:
+        """Vectorized form of BatteryDiagnostics._validate_temperature's factor"""
+        return np.select(
+            [temperature < 0, temperature < 10, temperature < 25,
+             temperature < 35, temperature < 40],
+            [0.8, 0.9, 0.95, 1.0, 0.95],
+            default=0.9
+        )
+
+    @staticmethod
+    def remaining_cycles(depth_of_discharge: np.ndarray, avg_temperature: np.ndarray,
+                         current_soh: np.ndarray) -> np.ndarray:
+        """Vectorized form of BatteryDiagnostics.estimate_cycle_life's remainingCycles"""
+        base_cycles = 2000 * np.select(
+            [depth_of_discharge > 80, depth_of_discharge < 50], [0.7, 1.3], default=1.0)
+        base_cycles = base_cycles * np.select(
+            [avg_temperature > 35, avg_temperature < 15], [0.8, 0.9], default=1.0)
+        return np.floor(base_cycles * (current_soh / 100))
+
+    @staticmethod
+    def eol_dates(remaining_cycles: np.ndarray, cycles_per_day: float = 2.0) -> np.ndarray:
+        """Vectorized form of estimate_cycle_life's estimatedEOL (None where NaN)"""
+        seconds = np.nan_to_num(remaining_cycles / cycles_per_day * 86400)
+        dates = np.datetime64(datetime.now(), "us") + seconds.astype("timedelta64[s]")
+        dates = dates.astype("datetime64[D]").astype(str).astype(object)
+        dates[np.isnan(remaining_cycles)] = None
+        return dates
+
+    @staticmethod
+    def estimate_cycle_life_batch(cycle_count: np.ndarray, depth_of_discharge: np.ndarray,
+                                  avg_temperature: np.ndarray, current_soh: np.ndarray) -> Dict:
+        """Vectorized form of BatteryDiagnostics.estimate_cycle_life"""
+        remaining = BatchDiagnostics.remaining_cycles(depth_of_discharge, avg_temperature, current_soh)
+        return {
+            "remainingCycles": remaining,
+            "estimatedEOL": BatchDiagnostics.eol_dates(remaining),
+            "confidenceLevel": np.clip(90 - cycle_count / 100, 60, 95),
+        }
+
+    @staticmethod
+    def calculate_soh_batch(current_capacity: np.ndarray, rated_capacity: np.ndarray,
+                            cycle_count: np.ndarray) -> Dict:
+        """Vectorized form of BatteryDiagnostics.calculate_soh; inputs must be valid"""
+        soh = (current_capacity / rated_capacity) * 100
+        cycle_factor = np.minimum(cycle_count / 1000, 1)
+        adjusted_soh = soh * (1 - cycle_factor * 0.1)
+        good, moderate = adjusted_soh >= 90, adjusted_soh >= 80
+        return {
+            "stateOfHealth": adjusted_soh,
+            "capacityLoss": np.maximum(100 - soh, 0),
+            "healthStatus": np.select([good, moderate], ["Good", "Moderate"], "Poor").astype(object),
+            "recommendedAction": np.select(
+                [good, moderate], ["Regular maintenance sufficient", "Monitor battery health closely"],
+                "Consider battery replacement").astype(object),
+            "cycleAging": cycle_factor * 100,
+        }
+
+    @staticmethod
+    def calculate_soc_batch(voltage: Sequence[float], battery_type: Sequence[str],
+                            temperature: Sequence[float], current: Sequence[float],
+                            nominal_voltage: Sequence[float]) -> Dict:
+        """Calculate State of Charge for a batch of readings.
+
+        Returns a dict of result columns (NaN/None for rejected rows), a boolean
+        ``valid`` mask and a list of per-row ``errors``.
+        """
+        voltage = np.asarray(voltage, dtype=np.float64)
+        temperature = np.asarray(temperature, dtype=np.float64)
+        current = np.asarray(current, dtype=np.float64)
+        nominal_voltage = np.asarray(nominal_voltage, dtype=np.float64)
+        n = voltage.shape[0]
+
+        # Resolve every row against the compiled spec tables in one pass
+        chem_ids = spec_registry.chemistry_ids_for(battery_type)
+        nominal_ids = spec_registry.nominal_ids_for(chem_ids, nominal_voltage)
+        specs = spec_registry.gather(chem_ids, nominal_ids)
+        max_voltage = specs["max_voltage"]
+        min_voltage = specs["min_voltage"]
+        max_temp = specs["max_temp"]
+        min_temp = specs["min_temp"]
+
+        spec_errors: Dict[int, str] = {}
+        for row in np.flatnonzero(chem_ids < 0):
+            spec_errors[int(row)] = f"Unknown battery type: {battery_type[row]}"
+        for row in np.flatnonzero((chem_ids >= 0) & (nominal_ids < 0)):
+            spec_errors[int(row)] = spec_registry.invalid_nominal_message(
+                int(chem_ids[row]), float(nominal_voltage[row]))
+
+        # Same check order as the scalar path so each row reports the same error
+        resolved = ~np.isnan(max_voltage)
+        over_voltage = resolved & (voltage > max_voltage)
+        under_voltage = resolved & ~over_voltage & (voltage < min_voltage)
+        voltage_ok = resolved & ~over_voltage & ~under_voltage
+        over_temp = voltage_ok & (temperature > max_temp)
+        under_temp = voltage_ok & ~over_temp & (temperature < min_temp)
+        # NaN readings pass every comparison above, and binary bodies can carry them
+        not_finite = voltage_ok & ~over_temp & ~under_temp & (
+            ~np.isfinite(voltage) | ~np.isfinite(temperature))
+        bad_current = voltage_ok & ~over_temp & ~under_temp & ~not_finite & ~np.isfinite(current)
+        valid = voltage_ok & ~over_temp & ~under_temp & ~not_finite & ~bad_current
+
+        errors: List[Dict] = [
+            {"index": row, "detail": detail} for row, detail in spec_errors.items()
+        ]
+        for row in np.flatnonzero(over_voltage):
+            errors.append({
+                "index": int(row),
+                "detail": f"Voltage {float(voltage[row])}V exceeds maximum allowed {float(max_voltage[row])}V"
+            })
+        for row in np.flatnonzero(under_voltage):
+            errors.append({
+                "index": int(row),
+                "detail": f"Voltage {float(voltage[row])}V below minimum allowed {float(min_voltage[row])}V"
+            })
+        for row in np.flatnonzero(over_temp):
+            errors.append({
+                "index": int(row),
+                "detail": f"Temperature {float(temperature[row])}°C exceeds maximum allowed {spec_registry.temperature_limits(battery_type[row])[0]}°C"
+            })
+        for row in np.flatnonzero(under_temp):
+            errors.append({
+                "index": int(row),
+                "detail": f"Temperature {float(temperature[row])}°C below minimum allowed {spec_registry.temperature_limits(battery_type[row])[1]}°C"
+            })
+        for row in np.flatnonzero(not_finite):
+            errors.append({
+                "index": int(row),
+                "detail": "cannot convert float NaN to integer"
+            })
+        for row in np.flatnonzero(bad_current):
+            errors.append({
+                "index": int(row),
+                "detail": f"Current {float(current[row])}A is not a finite number"
+            })
+        errors.sort(key=lambda error: error["index"])
+
+        soc = ocv_table.soc_batch(chem_ids, nominal_ids, voltage, temperature)
+        soc = np.where(valid, np.clip(soc, 0, 100), np.nan)
+
+        estimated_range = np.full(n, None, dtype=object)
+        estimated_range[valid] = np.char.add(
+            np.trunc(soc[valid] * 0.8).astype(np.int64).astype(str), " km")
+
+        charging_status = np.select(
+            [current > 0, current < 0, (current == 0) & (voltage == max_voltage)],
+            ["Charging", "Discharging", "Full"],
+            default="Idle"
+        ).astype(object)
+        charging_status[~valid] = None
+
+        temp_factor = np.where(
+            valid, BatchDiagnostics.temperature_compensation(temperature), np.nan)
+
+        return {
+            "stateOfCharge": soc,
+            "estimatedRange": estimated_range,
+            "chargingStatus": charging_status,
+            "temperatureCompensation": temp_factor,
+            "valid": valid,
+            "errors": errors
+        }
+
+    @staticmethod
+    def check_cell_balance_batch(cell_voltages: np.ndarray, series: int = None,
+                                 parallel: int = 1) -> Dict:
+        """Check cell balance for a packs × cells matrix of voltages.
+
+        Per pack, ``maxImbalance``, ``balanceStatus`` and the problem cells
+        match check_cell_balance. Problem cells come back both as a
+        ``problemMask`` matrix and in compressed form: the 1-based
+        ``problemCells`` of pack i are ``problemCells[problemOffsets[i]:
+        problemOffsets[i + 1]]``, with their ``problemZScores``.
+
+        Cells are grouped, in column order, into modules of ``series`` groups
+        of ``parallel`` adjacent cells (default: one module per pack). Module
+        columns are the module voltage (sum of its series groups, each the mean
+        of its parallel cells) and its lowest and highest cell.
+        """
+        cells = np.asarray(cell_voltages, dtype=np.float64)
+        packs, count = cells.shape
+        if series is None:
+            series = count // parallel
+        if count % (series * parallel):
+            raise ValueError(f"{count} cells do not divide into modules of series × parallel cells")
+
+        mean = cells.sum(axis=1) / count
+        deviation = cells - mean[:, None]
+        max_imbalance = cells.max(axis=1) - cells.min(axis=1)
+        std = np.sqrt(np.einsum("ij,ij->i", deviation, deviation) / count)
+        with np.errstate(divide="ignore"):
+            inverse_std = np.where(std > 0, 1 / std, 0.0)
+        z_scores = deviation * inverse_std[:, None]
+
+        # Same 100mV threshold as check_cell_balance
+        problem_mask = np.abs(deviation) > 0.1
+        problem_packs, problem_cells = np.divmod(np.flatnonzero(problem_mask), count)
+        problem_offsets = np.zeros(packs + 1, dtype=np.int64)
+        np.cumsum(problem_mask.sum(axis=1), out=problem_offsets[1:])
+
+        status = np.select(
+            [max_imbalance < 0.05, max_imbalance < 0.2],
+            ["Well Balanced", "Acceptable"],
+            default="Imbalanced"
+        ).astype(object)
+
+        # Each parallel group counts once at its mean voltage, so a module's
+        # voltage is the sum of its cells over the parallel count
+        modules = cells.reshape(packs, -1, series * parallel)
+
+        return {
+            "maxImbalance": max_imbalance,
+            "balanceStatus": status,
+            "meanVoltage": mean,
+            "stdVoltage": std,
+            "zScores": z_scores,
+            "problemMask": problem_mask,
+            "problemOffsets": problem_offsets,
+            "problemCells": problem_cells + 1,
+            "problemZScores": z_scores[problem_packs, problem_cells],
+            "moduleVoltage": modules.sum(axis=2) / parallel,
+            "moduleMinVoltage": modules.min(axis=2),
+            "moduleMaxVoltage": modules.max(axis=2),
+        }
@@ -0,0 +1,626 @@
+"""Asynchronous batch jobs for fleet-scale diagnostics.
+
+A job runs the full-report diagnostics over every row of an input far too
+large for one request: a CSV, Parquet or NDJSON upload. Stored diagnostic
+history cannot be an input, since it keeps results rather than the
+readings they were computed from.
+
+- POST /battery/jobs spools the input to ``<jobs dir>/<job id>/``, records
+  the job in the job table and returns at once.
+- A JobRunner in each API worker claims queued jobs from the shared table.
+  It reads the input ``chunk_rows`` rows at a time and diagnoses each chunk
+  in a pool of worker processes, which writes the chunk's results as one
+  NDJSON file. At most CHUNKS_PER_WORKER chunks per process are in flight,
+  so memory stays bounded whatever the input size.
+- A chunk is checkpointed in the chunk table once its file is in place. A
+  claim is a lease that the runner renews while it works; a job whose
+  runner stopped (at once after a clean shutdown, otherwise when the lease
+  expires) is claimed again and only its unfinished chunks are redone.
+
+Rows are validated and computed exactly like /battery/diagnose/full. A
+diagnostic whose input columns are missing from a row is reported in that
+row's ``errors`` instead of failing the job.
+"""
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple
+import asyncio
+import logging
+import math
+import os
+import shutil
+import time
+import uuid
+
+from pydantic import ValidationError
+
+from battery_diagnostics import BatteryDiagnostics
+from compute_pool import create_process_pool
+from fast_json import dumps, loads
+from models import FULL_REPORT_FIELDS, FullDiagnosticRequest
+
+logger = logging.getLogger(__name__)
+
+# Directory holding every job's input and result chunks
+DEFAULT_JOBS_DIR = os.environ.get("BATCH_JOBS_DIR", "batch_jobs")
+# Job and checkpoint tables, shared by all workers (kept with the job files by default)
+DEFAULT_JOBS_URL = os.environ.get(
+    "BATCH_JOBS_URL", f"sqlite:///{os.path.join(DEFAULT_JOBS_DIR, 'jobs.db')}")
+# Worker processes used by a running job
+DEFAULT_JOB_WORKERS = int(os.environ.get("BATCH_JOB_WORKERS", str(os.cpu_count() or 1)))
+# Rows per chunk; a chunk is the unit of parallelism and of checkpointing
+DEFAULT_JOB_CHUNK_ROWS = int(os.environ.get("BATCH_JOB_CHUNK_ROWS", "5000"))
+# Largest accepted upload
+DEFAULT_JOB_MAX_UPLOAD_BYTES = int(os.environ.get("BATCH_JOB_MAX_UPLOAD_BYTES", str(4 << 30)))
+# Seconds without a lease renewal after which another runner takes a job over
+DEFAULT_JOB_LEASE_SECONDS = float(os.environ.get("BATCH_JOB_LEASE_SECONDS", "30"))
+# Seconds a finished job and its files are kept
+DEFAULT_JOB_RETENTION = float(os.environ.get("BATCH_JOB_RETENTION", str(7 * 86400)))
+
+# Seconds between checks for claimable jobs (and for new chunks when streaming)
+POLL_INTERVAL = 1.0
+# Seconds between sweeps for expired jobs
+PURGE_INTERVAL = 3600.0
+# Chunks queued or running per worker process
+CHUNKS_PER_WORKER = 2
+# Bytes read at a time when streaming results
+RESULT_BLOCK_SIZE = 1 << 18
+
+UPLOAD_FORMATS = {
+    "text/csv": "csv",
+    "application/vnd.apache.parquet": "parquet",
+    "application/x-parquet": "parquet",
+    "application/x-ndjson": "ndjson",
+}
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+
+# Columns copied to each result line so it can be matched to its input row
+KEY_COLUMNS = ("batteryId",)
+# Columns read from the input; everything else is ignored
+INPUT_COLUMNS = tuple(name for name in FullDiagnosticRequest.model_fields if name != "sections")
+
+
+class UploadTooLarge(ValueError):
+    """The upload exceeds the configured size limit"""
+
+
+class LeaseLost(Exception):
+    """Another runner has taken over the job"""
+
+
+def chunk_path(directory: str, index: int) -> str:
+    return os.path.join(directory, f"chunk-{index:06d}.ndjson")
+
+
+def _clean_row(row: Dict) -> Tuple[Dict, Dict]:
+    """Key columns and diagnostic inputs of a row, without missing values"""
+    if not isinstance(row, dict):
+        raise ValueError("row is not an object")
+    keys = {}
+    params = {}
+    for name in KEY_COLUMNS + INPUT_COLUMNS:
+        value = row.get(name)
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            continue
+        if name == "cellVoltages" and isinstance(value, str):
+            # CSV cells hold the array as JSON
+            value = loads(value)
+        (keys if name in KEY_COLUMNS else params)[name] = value
+    return keys, params
+
+
+def diagnose_row(params: Dict, diagnostics: List[str]) -> Dict:
+    """Full report of one row; diagnostics missing their inputs become errors"""
+    errors = {}
+    sections = []
+    for name in diagnostics:
+        missing = [field for field in FULL_REPORT_FIELDS[name] if field not in params]
+        if missing:
+            errors[name] = f"Section '{name}' requires fields: {missing}"
+        else:
+            sections.append(name)
+    if not sections:
+        return {"results": {}, "errors": errors}
+
+    try:
+        request = FullDiagnosticRequest.model_validate({**params, "sections": sections})
+    except ValidationError as e:
+        message = "; ".join(error["msg"] for error in e.errors(include_url=False))
+        errors.update((name, message) for name in sections)
+        return {"results": {}, "errors": errors}
+    report = BatteryDiagnostics.full_report(request.model_dump(), request.sections)
+    report["errors"].update(errors)
+    return report
+
+
+def run_chunk(directory: str, index: int, first_row: int, rows: List[Dict],
+              diagnostics: List[str]) -> Tuple[int, int, int]:
+    """Worker side of a job: diagnose one chunk and write its result file.
+
+    Returns the chunk index, its row count and the number of rows with errors.
+    """
+    row_errors = 0
+    path = chunk_path(directory, index)
+    with open(path + ".tmp", "wb") as file:
+        for offset, row in enumerate(rows):
+            try:
+                keys, params = _clean_row(row)
+                report = diagnose_row(params, diagnostics)
+            except ValueError as e:
+                keys, report = {}, {"results": {}, "errors": {"row": f"Malformed row: {e}"}}
+            if report["errors"]:
+                row_errors += 1
+            file.write(dumps({"row": first_row + offset, **keys, **report}) + b"\n")
+    # The file only appears under its final name once complete
+    os.replace(path + ".tmp", path)
+    return index, len(rows), row_errors
+
+
+def _csv_batches(path: str, chunk_rows: int) -> Iterator[List[Dict]]:
+    import pyarrow as pa
+    from pyarrow import csv
+
+    # Cells are read as text and converted by the request model, so a bad
+    # value fails its row instead of the whole file; empty cells are missing
+    types = {name: pa.string() for name in KEY_COLUMNS + INPUT_COLUMNS}
+    reader = csv.open_csv(path, convert_options=csv.ConvertOptions(
+        column_types=types, include_columns=list(types), include_missing_columns=True,
+        strings_can_be_null=True))
+    for batch in reader:
+        yield batch.to_pylist()
+
+
+def _parquet_batches(path: str, chunk_rows: int) -> Iterator[List[Dict]]:
+    import pyarrow.parquet as pq
+
+    parquet = pq.ParquetFile(path)
+    columns = [name for name in parquet.schema_arrow.names if name in KEY_COLUMNS + INPUT_COLUMNS]
+    for batch in parquet.iter_batches(batch_size=chunk_rows, columns=columns):
+        yield batch.to_pylist()
+
+
+def _ndjson_batches(path: str, chunk_rows: int) -> Iterator[List[Dict]]:
+    rows = []
+    with open(path, "rb") as file:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                rows.append(loads(line))
+            except ValueError as e:
+                raise ValueError(f"Malformed NDJSON on line {number}: {e}")
+            if len(rows) == chunk_rows:
+                yield rows
+                rows = []
+    if rows:
+        yield rows
+
+
+BATCH_READERS = {
+    "csv": _csv_batches,
+    "parquet": _parquet_batches,
+    "ndjson": _ndjson_batches,
+}
+
+
+def iter_chunks(path: str, input_format: str, chunk_rows: int) -> Iterator[Tuple[int, List[Dict]]]:
+    """Yield (index, rows) for consecutive chunks of exactly ``chunk_rows`` rows.
+
+    Chunk boundaries depend only on row positions, so a resumed job sees the
+    same chunks as the run it continues.
+    """
+    buffer: List[Dict] = []
+    index = 0
+    for rows in BATCH_READERS[input_format](path, chunk_rows):
+        buffer.extend(rows)
+        while len(buffer) >= chunk_rows:
+            yield index, buffer[:chunk_rows]
+            del buffer[:chunk_rows]
+            index += 1
+    if buffer:
+        yield index, buffer
+
+
+def _parquet_row_count(path: str) -> int:
+    import pyarrow.parquet as pq
+
+    return pq.ParquetFile(path).metadata.num_rows
+
+
+def _isoformat(timestamp: Optional[float]) -> Optional[str]:
+    return None if timestamp is None else datetime.fromtimestamp(timestamp).isoformat()
+
+
+class JobStore:
+    """Job table and chunk checkpoints in a SQL database (SQLite by default)"""
+
+    def __init__(self, url: str = DEFAULT_JOBS_URL):
+        from sqlalchemy import (
+            Column, Float, Index, Integer, MetaData, String, Table, Text,
+            create_engine, event
+        )
+
+        self.url = url
+        self.engine = create_engine(url)
+        if self.engine.dialect.name == "sqlite":
+            @event.listens_for(self.engine, "connect")
+            def _configure_sqlite(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                cursor.execute("PRAGMA journal_mode=WAL")
+                cursor.execute("PRAGMA busy_timeout=5000")
+                cursor.close()
+
+        metadata = MetaData()
+        self.jobs = Table(
+            "batch_jobs", metadata,
+            Column("id", String(32), primary_key=True),
+            Column("owner", String(64), nullable=False),
+            Column("status", String(16), nullable=False),
+            Column("source", Text, nullable=False),
+            Column("diagnostics", Text, nullable=False),
+            Column("chunk_rows", Integer, nullable=False),
+            Column("created", Float, nullable=False),
+            Column("started", Float),
+            Column("finished", Float),
+            Column("rows", Integer, nullable=False, default=0),
+            Column("row_errors", Integer, nullable=False, default=0),
+            Column("chunks_done", Integer, nullable=False, default=0),
+            Column("chunks_total", Integer),
+            Column("error", Text),
+            Column("lease_owner", String(32)),
+            Column("lease_expires", Float, nullable=False, default=0),
+            Index("ix_batch_jobs_status", "status"),
+        )
+        self.chunks = Table(
+            "batch_job_chunks", metadata,
+            Column("job_id", String(32), primary_key=True),
+            Column("chunk", Integer, primary_key=True),
+            Column("rows", Integer, nullable=False),
+            Column("row_errors", Integer, nullable=False),
+        )
+        metadata.create_all(self.engine)
+        logger.info(f"Batch job store initialized at {url}")
+
+    def create(self, job_id: str, owner: str, source: Dict, diagnostics: List[str],
+               chunk_rows: int, chunks_total: Optional[int] = None):
+        with self.engine.begin() as connection:
+            connection.execute(self.jobs.insert().values(
+                id=job_id, owner=owner, status=STATUS_QUEUED,
+                source=dumps(source).decode(), diagnostics=dumps(diagnostics).decode(),
+                chunk_rows=chunk_rows, created=time.time(), rows=0, row_errors=0,
+                chunks_done=0, chunks_total=chunks_total, lease_expires=0))
+
+    def get(self, job_id: str):
+        from sqlalchemy import select
+
+        with self.engine.connect() as connection:
+            return connection.execute(
+                select(self.jobs).where(self.jobs.c.id == job_id)).first()
+
+    def claim(self, runner: str, lease_seconds: float):
+        """Take the oldest unfinished job whose lease has expired, if any"""
+        from sqlalchemy import func, select, update
+
+        jobs = self.jobs
+        now = time.time()
+        claimable = jobs.c.status.in_((STATUS_QUEUED, STATUS_RUNNING)) & (jobs.c.lease_expires < now)
+        with self.engine.begin() as connection:
+            candidates = connection.execute(
+                select(jobs.c.id).where(claimable).order_by(jobs.c.created).limit(8)).scalars().all()
+            for job_id in candidates:
+                # Conditional on the lease still being free, so two runners never both win
+                claimed = connection.execute(
+                    update(jobs).where((jobs.c.id == job_id) & claimable).values(
+                        status=STATUS_RUNNING, lease_owner=runner,
+                        lease_expires=now + lease_seconds,
+                        started=func.coalesce(jobs.c.started, now)))
+                if claimed.rowcount:
+                    return connection.execute(select(jobs).where(jobs.c.id == job_id)).first()
+        return None
+
+    def _update_leased(self, connection, job_id: str, runner: str, **values):
+        from sqlalchemy import update
+
+        jobs = self.jobs
+        result = connection.execute(update(jobs).where(
+            (jobs.c.id == job_id) & (jobs.c.lease_owner == runner)
+            & (jobs.c.status == STATUS_RUNNING)).values(**values))
+        if not result.rowcount:
+            raise LeaseLost(job_id)
+
+    def renew(self, job_id: str, runner: str, lease_seconds: float):
+        with self.engine.begin() as connection:
+            self._update_leased(connection, job_id, runner,
+                                lease_expires=time.time() + lease_seconds)
+
+    def release(self, job_id: str, runner: str):
+        """Give up a lease so the job can be claimed again at once"""
+        try:
+            with self.engine.begin() as connection:
+                self._update_leased(connection, job_id, runner, lease_expires=0)
+        except LeaseLost:
+            pass
+
+    def done_chunks(self, job_id: str) -> Set[int]:
+        from sqlalchemy import select
+
+        with self.engine.connect() as connection:
+            return set(connection.execute(
+                select(self.chunks.c.chunk).where(self.chunks.c.job_id == job_id)).scalars())
+
+    def checkpoint(self, job_id: str, runner: str, index: int, rows: int, row_errors: int,
+                   lease_seconds: float):
+        """Record a finished chunk, add it to the job's counters and renew the lease"""
+        jobs = self.jobs
+        with self.engine.begin() as connection:
+            self._update_leased(
+                connection, job_id, runner,
+                rows=jobs.c.rows + rows, row_errors=jobs.c.row_errors + row_errors,
+                chunks_done=jobs.c.chunks_done + 1,
+                lease_expires=time.time() + lease_seconds)
+            connection.execute(self.chunks.insert().values(
+                job_id=job_id, chunk=index, rows=rows, row_errors=row_errors))
+
+    def set_total(self, job_id: str, runner: str, chunks_total: int):
+        with self.engine.begin() as connection:
+            self._update_leased(connection, job_id, runner, chunks_total=chunks_total)
+
+    def finish(self, job_id: str, runner: str, status: str, error: Optional[str] = None):
+        with self.engine.begin() as connection:
+            self._update_leased(connection, job_id, runner, status=status, error=error,
+                                finished=time.time(), lease_owner=None, lease_expires=0)
+
+    def purge(self, finished_before: float) -> List[str]:
+        """Delete jobs finished before the given time; returns their ids"""
+        from sqlalchemy import delete, select
+
+        jobs = self.jobs
+        with self.engine.begin() as connection:
+            job_ids = connection.execute(select(jobs.c.id).where(
+                jobs.c.finished < finished_before)).scalars().all()
+            if job_ids:
+                connection.execute(delete(self.chunks).where(self.chunks.c.job_id.in_(job_ids)))
+                connection.execute(delete(jobs).where(jobs.c.id.in_(job_ids)))
+        return job_ids
+
+
+class JobRunner:
+    """Accepts batch jobs and runs claimed ones on a pool of worker processes"""
+
+    def __init__(self, directory: str = DEFAULT_JOBS_DIR,
+                 url: str = DEFAULT_JOBS_URL,
+                 workers: int = DEFAULT_JOB_WORKERS,
+                 chunk_rows: int = DEFAULT_JOB_CHUNK_ROWS,
+                 max_upload_bytes: int = DEFAULT_JOB_MAX_UPLOAD_BYTES,
+                 lease_seconds: float = DEFAULT_JOB_LEASE_SECONDS,
+                 retention: float = DEFAULT_JOB_RETENTION):
+        if workers < 1 or chunk_rows < 1:
+            raise ValueError("Job workers and chunk rows must be positive")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.workers = workers
+        self.chunk_rows = chunk_rows
+        self.max_upload_bytes = max_upload_bytes
+        self.lease_seconds = lease_seconds
+        self.retention = retention
+        self.store = JobStore(url)
+        # Identifies this process's leases in the shared job table
+        self.runner_id = uuid.uuid4().hex
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def job_directory(self, job_id: str) -> str:
+        return os.path.join(self.directory, job_id)
+
+    def describe(self, job) -> Dict:
+        """Public status of a job row"""
+        progress = None
+        if job.status == STATUS_COMPLETED:
+            progress = 1.0
+        elif job.chunks_total:
+            progress = job.chunks_done / job.chunks_total
+        return {
+            "id": job.id,
+            "status": job.status,
+            "source": loads(job.source),
+            "diagnostics": loads(job.diagnostics),
+            "createdAt": _isoformat(job.created),
+            "startedAt": _isoformat(job.started),
+            "finishedAt": _isoformat(job.finished),
+            "rows": job.rows,
+            "rowErrors": job.row_errors,
+            "chunksDone": job.chunks_done,
+            "chunksTotal": job.chunks_total,
+            "progress": progress,
+            "error": job.error,
+        }
+
+    async def get(self, job_id: str, owner: str):
+        """The job row, or None if it does not exist or belongs to another key"""
+        job = await asyncio.to_thread(self.store.get, job_id)
+        return job if job is not None and job.owner == owner else None
+
+    async def submit_upload(self, owner: str, media_type: str, body: AsyncIterator[bytes],
+                            diagnostics: List[str]) -> Dict:
+        """Spool an uploaded CSV, Parquet or NDJSON file and queue a job for it"""
+        input_format = UPLOAD_FORMATS[media_type]
+        job_id = uuid.uuid4().hex
+        directory = self.job_directory(job_id)
+        path = os.path.join(directory, f"input.{input_format}")
+        os.makedirs(directory)
+        size = 0
+        chunks_total = None
+        try:
+            with open(path, "wb") as file:
+                async for block in body:
+                    size += len(block)
+                    if size > self.max_upload_bytes:
+                        raise UploadTooLarge(
+                            f"Upload exceeds the limit of {self.max_upload_bytes} bytes")
+                    file.write(block)
+            if size == 0:
+                raise ValueError("The uploaded file is empty")
+            if input_format == "parquet":
+                # Also rejects a file that is not Parquet before the job is queued
+                rows = await asyncio.to_thread(_parquet_row_count, path)
+                chunks_total = -(-rows // self.chunk_rows)
+            source = {"format": input_format, "bytes": size}
+            await asyncio.to_thread(self.store.create, job_id, owner, source, diagnostics,
+                                    self.chunk_rows, chunks_total)
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        logger.info("Queued batch job %s for a %s byte %s upload", job_id, size, input_format)
+        return await self._queued(job_id)
+
+    async def _queued(self, job_id: str) -> Dict:
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return self.describe(await asyncio.to_thread(self.store.get, job_id))
+
+    async def iter_results(self, job_id: str) -> AsyncIterator[bytes]:
+        """Yield the result lines of each chunk in order, following a job until it finishes"""
+        directory = self.job_directory(job_id)
+        index = 0
+        while True:
+            path = chunk_path(directory, index)
+            if os.path.exists(path):
+                with open(path, "rb") as file:
+                    while True:
+                        block = await asyncio.to_thread(file.read, RESULT_BLOCK_SIZE)
+                        if not block:
+                            break
+                        yield block
+                index += 1
+                continue
+            job = await asyncio.to_thread(self.store.get, job_id)
+            # Checked again after the status, so a chunk written just before
+            # the job finished is not missed
+            if os.path.exists(path):
+                continue
+            if job is None or job.status in (STATUS_COMPLETED, STATUS_FAILED):
+                return
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def _heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await asyncio.to_thread(self.store.renew, job_id, self.runner_id, self.lease_seconds)
+            except LeaseLost:
+                return
+            except Exception as e:
+                logger.error("Failed to renew the lease on batch job %s: %s", job_id, e)
+
+    async def _checkpoint(self, job, pending: Set[asyncio.Future]) -> Set[asyncio.Future]:
+        """Wait for at least one chunk to finish and checkpoint every finished one"""
+        finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for future in finished:
+            index, rows, row_errors = future.result()
+            await asyncio.to_thread(self.store.checkpoint, job.id, self.runner_id,
+                                    index, rows, row_errors, self.lease_seconds)
+        return pending
+
+    async def _run(self, job):
+        directory = self.job_directory(job.id)
+        source = loads(job.source)
+        diagnostics = loads(job.diagnostics)
+        heartbeat = asyncio.create_task(self._heartbeat(job.id))
+        executor = None
+        try:
+            input_format = source["format"]
+            path = os.path.join(directory, f"input.{input_format}")
+            done = await asyncio.to_thread(self.store.done_chunks, job.id)
+            logger.info("Running batch job %s (%s chunks already done)", job.id, len(done))
+
+            executor = create_process_pool(self.workers)
+            loop = asyncio.get_running_loop()
+            chunks = iter_chunks(path, input_format, job.chunk_rows)
+            pending: Set[asyncio.Future] = set()
+            total = 0
+            while True:
+                # Parsing the input is blocking work, so it runs in a thread
+                item = await asyncio.to_thread(next, chunks, None)
+                if item is None:
+                    break
+                index, rows = item
+                total = index + 1
+                if index in done:
+                    continue
+                while len(pending) >= self.workers * CHUNKS_PER_WORKER:
+                    pending = await self._checkpoint(job, pending)
+                pending.add(loop.run_in_executor(
+                    executor, run_chunk, directory, index, index * job.chunk_rows,
+                    rows, diagnostics))
+            await asyncio.to_thread(self.store.set_total, job.id, self.runner_id, total)
+            while pending:
+                pending = await self._checkpoint(job, pending)
+            await asyncio.to_thread(self.store.finish, job.id, self.runner_id, STATUS_COMPLETED)
+            logger.info("Batch job %s completed", job.id)
+        except asyncio.CancelledError:
+            # Shutting down: the job resumes from its checkpoints on the next claim
+            self.store.release(job.id, self.runner_id)
+            raise
+        except LeaseLost:
+            logger.warning("Batch job %s was taken over by another runner", job.id)
+        except Exception as e:
+            logger.error("Batch job %s failed: %s", job.id, e)
+            try:
+                await asyncio.to_thread(self.store.finish, job.id, self.runner_id,
+                                        STATUS_FAILED, str(e))
+            except LeaseLost:
+                pass
+        finally:
+            heartbeat.cancel()
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _purge(self):
+        job_ids = await asyncio.to_thread(self.store.purge, time.time() - self.retention)
+        for job_id in job_ids:
+            await asyncio.to_thread(shutil.rmtree, self.job_directory(job_id), True)
+        if job_ids:
+            logger.info("Deleted %s expired batch jobs", len(job_ids))
+
+    async def _worker(self):
+        last_purge = 0.0
+        while True:
+            job = None
+            try:
+                if time.monotonic() - last_purge >= PURGE_INTERVAL:
+                    last_purge = time.monotonic()
+                    await self._purge()
+                job = await asyncio.to_thread(self.store.claim, self.runner_id, self.lease_seconds)
+            except Exception as e:
+                logger.error("Failed to claim a batch job: %s", e)
+            if job is not None:
+                try:
+                    await self._run(job)
+                except Exception as e:
+                    logger.error("Failed to record the outcome of batch job %s: %s", job.id, e)
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def start(self):
+        """Start claiming and running jobs on the running event loop"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._worker())
+
+    async def stop(self):
+        """Stop running jobs; an unfinished job is left to be resumed"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._wakeup = None
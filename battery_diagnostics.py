@@ -1,5 +1,9 @@
-from typing import List, Dict
+from typing import List, Dict, Tuple
 from datetime import datetime, timedelta
+import numpy as np
+
+from ocv_table import load_ocv_table
+from spec_registry import BatterySpec, SpecRegistry
 
 
 class BatteryDiagnostics:
@@ -9,6 +13,21 @@ class BatteryDiagnostics:
         "Li-ion": {
             "max_temp": 45,
             "min_temp": 0,
+            # First-order equivalent circuit of one cell (ohms, farads);
+            # pack values scale with the series count nominal / cell_voltage
+            "ecm": {
+                "cell_voltage": 3.7,
+                "r0": 0.02,
+                "r1": 0.015,
+                "c1": 2000
+            },
+            # Resting cell voltage at 25°C by SOC (%), and its shift in V/°C
+            # mid-curve; scaled onto each nominal's min/max voltage by OCVTable
+            "ocv": {
+                "soc": [0, 5, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100],
+                "cell_voltage": [3.00, 3.30, 3.45, 3.55, 3.62, 3.67, 3.72, 3.79, 3.87, 3.96, 4.06, 4.20],
+                "temperature_coefficient": 0.0003
+            },
             "voltage_specs": {
                 11.1: {
                     "max_voltage": 12.6,
@@ -60,6 +79,17 @@ class BatteryDiagnostics:
         "LFP": {
             "max_temp": 55,
             "min_temp": -20,
+            "ecm": {
+                "cell_voltage": 3.2,
+                "r0": 0.01,
+                "r1": 0.01,
+                "c1": 3000
+            },
+            "ocv": {
+                "soc": [0, 5, 10, 20, 30, 40, 50, 60, 70, 80, 90, 95, 100],
+                "cell_voltage": [2.50, 3.00, 3.20, 3.25, 3.27, 3.29, 3.30, 3.31, 3.32, 3.33, 3.35, 3.40, 3.65],
+                "temperature_coefficient": 0.0002
+            },
             "voltage_specs": {
                 12.8: {
                     "max_voltage": 14.6,
@@ -121,6 +151,17 @@ class BatteryDiagnostics:
         "Lead-acid": {
             "max_temp": 40,
             "min_temp": -15,
+            "ecm": {
+                "cell_voltage": 2.0,
+                "r0": 0.005,
+                "r1": 0.004,
+                "c1": 15000
+            },
+            "ocv": {
+                "soc": [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100],
+                "cell_voltage": [1.75, 1.90, 1.95, 1.98, 2.01, 2.03, 2.05, 2.07, 2.09, 2.11, 2.13],
+                "temperature_coefficient": 0.0002
+            },
             "voltage_specs": {
                 6.0: {
                     "max_voltage": 7.2,
@@ -159,50 +200,21 @@ class BatteryDiagnostics:
     @staticmethod
     def get_battery_specs(battery_type: str, nominal_voltage: float):
         """Generate battery specifications based on type and nominal voltage"""
-        if battery_type not in BatteryDiagnostics.BATTERY_TYPES:
-            raise ValueError(f"Unknown battery type: {battery_type}")
-
-        if nominal_voltage is None:
-            raise ValueError(
-                f"Nominal voltage must be provided for battery type: {battery_type}"
-            )
-
-        battery_info = BatteryDiagnostics.BATTERY_TYPES[battery_type]
-        voltage_specs = battery_info["voltage_specs"]
-
-        # Validate that the nominal voltage is one of the predefined values
-        if nominal_voltage not in voltage_specs:
-            available_voltages = list(voltage_specs.keys())
-            raise ValueError(
-                f"Invalid nominal voltage: {nominal_voltage}. Available nominal voltages for {battery_type}: {available_voltages}"
-            )
-
-        specs = {
-            "max_temp": battery_info["max_temp"],
-            "min_temp": battery_info["min_temp"],
-            "nominal_voltage": nominal_voltage,
-            "max_voltage": voltage_specs[nominal_voltage]["max_voltage"],
-            "min_voltage": voltage_specs[nominal_voltage]["min_voltage"]
-        }
-
-        return specs
+        return spec_registry.lookup(battery_type, nominal_voltage)._asdict()
 
     @staticmethod
     def _validate_temperature(temperature: float, battery_type: str) -> float:
         """Validate and calculate temperature compensation factor"""
-        # Get temperature specifications directly from the battery type
-        if battery_type not in BatteryDiagnostics.BATTERY_TYPES:
-            raise ValueError(f"Unknown battery type: {battery_type}")
-
-        specs = BatteryDiagnostics.BATTERY_TYPES[battery_type]
+        # Get temperature specifications from the compiled registry
+        max_temp, min_temp = spec_registry.temperature_limits(battery_type)
 
-        if temperature > specs["max_temp"]:
+        if temperature > max_temp:
             raise ValueError(
-                f"Temperature {temperature}°C exceeds maximum allowed {specs['max_temp']}°C"
+                f"Temperature {temperature}°C exceeds maximum allowed {max_temp}°C"
             )
-        if temperature < specs["min_temp"]:
+        if temperature < min_temp:
             raise ValueError(
-                f"Temperature {temperature}°C below minimum allowed {specs['min_temp']}°C"
+                f"Temperature {temperature}°C below minimum allowed {min_temp}°C"
             )
 
         # Enhanced temperature compensation
@@ -223,34 +235,36 @@ class BatteryDiagnostics:
     def calculate_soc(voltage: float, battery_type: str, temperature: float,
                       current: float, nominal_voltage: float) -> Dict:
         """Calculate State of Charge using voltage-based estimation with enhanced temperature compensation"""
-        if battery_type not in BatteryDiagnostics.BATTERY_TYPES:
-            raise ValueError(f"Unknown battery type: {battery_type}")
+        ids = spec_registry.resolve(battery_type, nominal_voltage)
+        specs = spec_registry.spec(*ids)
+        BatteryDiagnostics._validate_voltage(voltage, specs)
+
+        # Get temperature compensation
+        temp_factor = BatteryDiagnostics._validate_temperature(
+            temperature, battery_type)
 
-        specs = BatteryDiagnostics.get_battery_specs(battery_type,
-                                                     nominal_voltage)
+        return BatteryDiagnostics._soc_from_specs(voltage, temperature, current,
+                                                  specs, ids, temp_factor)
 
-        # Validate voltage
-        if voltage > specs["max_voltage"]:
+    @staticmethod
+    def _validate_voltage(voltage: float, specs: BatterySpec):
+        """Check a voltage reading against the resolved specification"""
+        if voltage > specs.max_voltage:
             raise ValueError(
-                f"Voltage {voltage}V exceeds maximum allowed {specs['max_voltage']}V"
+                f"Voltage {voltage}V exceeds maximum allowed {specs.max_voltage}V"
             )
-        if voltage < specs["min_voltage"]:
+        if voltage < specs.min_voltage:
             raise ValueError(
-                f"Voltage {voltage}V below minimum allowed {specs['min_voltage']}V"
+                f"Voltage {voltage}V below minimum allowed {specs.min_voltage}V"
             )
 
-        # Get temperature compensation
-        temp_factor = BatteryDiagnostics._validate_temperature(
-            temperature, battery_type)
-
-        # Enhanced SOC calculation with temperature compensation
-        voltage_range = specs["max_voltage"] - specs["min_voltage"]
-        voltage_normalized = voltage - specs["min_voltage"]
-
-        # Non-linear SOC estimation using sigmoid function
-        # soc = 100 * (1 / (1 + np.exp(-12 * (voltage_normalized/voltage_range - 0.5))))
-        soc = 100 * ((voltage_normalized / voltage_range))
-        # soc = soc * temp_factor
+    @staticmethod
+    def _soc_from_specs(voltage: float, temperature: float, current: float,
+                        specs: BatterySpec, ids: Tuple[int, int],
+                        temp_factor: float) -> Dict:
+        """SOC calculation for an already validated reading"""
+        # SOC from the chemistry's OCV curve for this nominal voltage and temperature
+        soc = ocv_table.soc(*ids, voltage, temperature)
 
         # Determine charging status
         Charging_status = "Idle"
@@ -259,7 +273,7 @@ class BatteryDiagnostics:
         elif current < 0:
             Charging_status = "Discharging"
         elif current == 0:
-            if voltage == specs["max_voltage"]:
+            if voltage == specs.max_voltage:
                 Charging_status = "Full"
 
         return {
@@ -370,16 +384,12 @@ class BatteryDiagnostics:
     def check_cell_balance(cell_voltages: List[float],
                            temperature: float) -> Dict:
         """Monitor cell voltage balance and identify issues"""
-        max_voltage = max(cell_voltages)
-        min_voltage = min(cell_voltages)
-        voltage_diff = max_voltage - min_voltage
+        cells = np.asarray(cell_voltages, dtype=np.float64)
+        voltage_diff = float(cells.max() - cells.min())
 
-        # Identify problematic cells
-        problem_cells = []
-        avg_voltage = sum(cell_voltages) / len(cell_voltages)
-        for idx, voltage in enumerate(cell_voltages):
-            if abs(voltage - avg_voltage) > 0.1:  # 100mV threshold
-                problem_cells.append(idx + 1)
+        # Identify problematic cells (100mV threshold, 1-based cell numbers)
+        avg_voltage = cells.sum() / len(cells)
+        problem_cells = (np.flatnonzero(np.abs(cells - avg_voltage) > 0.1) + 1).tolist()
 
         # Determine balance status
         if voltage_diff < 0.05:
@@ -399,20 +409,13 @@ class BatteryDiagnostics:
     def monitor_safety(voltage: float, current: float, temperature: float,
                        pressure: float, battery_type: str) -> Dict:
         """Monitor battery safety parameters and assess risks"""
-        if battery_type not in BatteryDiagnostics.BATTERY_TYPES:
-            raise ValueError(f"Unknown battery type: {battery_type}")
-            
-        battery_info = BatteryDiagnostics.BATTERY_TYPES[battery_type]
-        
-        # Use a default nominal voltage to get specs
-        # This is just for getting reference voltage values for safety monitoring
-        # We'll use the first available nominal voltage
-        first_nominal_voltage = list(battery_info["voltage_specs"].keys())[0]
-        max_voltage = battery_info["voltage_specs"][first_nominal_voltage]["max_voltage"]
-        min_voltage = battery_info["voltage_specs"][first_nominal_voltage]["min_voltage"]
-        max_temp = battery_info["max_temp"]
-        min_temp = battery_info["min_temp"]
-        
+        # Reference voltage values come from the first declared nominal voltage
+        reference = spec_registry.reference_spec(battery_type)
+        max_voltage = reference.max_voltage
+        min_voltage = reference.min_voltage
+        max_temp = reference.max_temp
+        min_temp = reference.min_temp
+
         warnings = []
         risk_level = "Low"
 
@@ -541,32 +544,26 @@ class BatteryDiagnostics:
                         nominal_voltage: float,
                         temperature: float) -> Dict:
             """Analyze voltage levels and provide detailed insights"""
-            if battery_type not in BatteryDiagnostics.BATTERY_TYPES:
-                raise ValueError(f"Unknown battery type: {battery_type}")
-
-            specs = BatteryDiagnostics.get_battery_specs(
-                battery_type, nominal_voltage)
-
-            # Validate voltage
-            if voltage > specs["max_voltage"]:
-                raise ValueError(
-                    f"Voltage {voltage}V exceeds maximum allowed {specs['max_voltage']}V"
-                )
-            if voltage < specs["min_voltage"]:
-                raise ValueError(
-                    f"Voltage {voltage}V below minimum allowed {specs['min_voltage']}V"
-                )
-
-            # Calculate voltage health percentage
-            voltage_range = specs["max_voltage"] - specs["min_voltage"]
-            voltage_normalized = voltage - specs["min_voltage"]
-            voltage_percentage = (voltage_normalized / voltage_range) * 100
+            ids = spec_registry.resolve(battery_type, nominal_voltage)
+            specs = spec_registry.spec(*ids)
+            BatteryDiagnostics._validate_voltage(voltage, specs)
+
+            return BatteryDiagnostics._voltage_from_specs(voltage, temperature,
+                                                          specs, ids)
+
+    @staticmethod
+    def _voltage_from_specs(voltage: float, temperature: float,
+                            specs: BatterySpec, ids: Tuple[int, int]) -> Dict:
+            """Voltage analysis for an already validated reading"""
+            # Calculate voltage health percentage: the charge level the
+            # voltage corresponds to on the chemistry's OCV curve
+            voltage_percentage = ocv_table.soc(*ids, voltage, temperature)
 
             # Analyze voltage stability (example with static values, real implementation would use time-series data)
             voltage_stability = "Stable"
-            if voltage > specs["nominal_voltage"] * 1.1:
+            if voltage > specs.nominal_voltage * 1.1:
                 voltage_stability = "High"
-            elif voltage < specs["nominal_voltage"] * 0.9:
+            elif voltage < specs.nominal_voltage * 0.9:
                 voltage_stability = "Low"
 
             # Determine voltage health status
@@ -589,17 +586,17 @@ class BatteryDiagnostics:
             # Calculate ripple (in a real implementation, this would use measured ripple)
             # Here we simulate a ripple value between 0.5% and 2% of nominal voltage
             ripple = (0.005 + (abs(hash(str(voltage))) % 15) /
-                      1000) * specs["nominal_voltage"]
+                      1000) * specs.nominal_voltage
 
             return {
                 "actualVoltage":
                 voltage,
                 "nominalVoltage":
-                specs["nominal_voltage"],
+                specs.nominal_voltage,
                 "minVoltage":
-                specs["min_voltage"],
+                specs.min_voltage,
                 "maxVoltage":
-                specs["max_voltage"],
+                specs.max_voltage,
                 "voltagePercentage":
                 round(voltage_percentage, 2),
                 "voltageStatus":
@@ -622,18 +619,9 @@ class BatteryDiagnostics:
         faults = []
         severity = "Normal"
 
-        # Get battery type info
-        if battery_type not in BatteryDiagnostics.BATTERY_TYPES:
-            raise ValueError(f"Unknown battery type: {battery_type}")
-            
-        battery_info = BatteryDiagnostics.BATTERY_TYPES[battery_type]
-        
-        # Use a default nominal voltage to get specs
-        # This is just for getting a reference min_voltage for fault detection
-        # We'll use the first available nominal voltage
-        first_nominal_voltage = list(battery_info["voltage_specs"].keys())[0]
-        min_voltage = battery_info["voltage_specs"][first_nominal_voltage]["min_voltage"]
-        
+        # Reference min_voltage comes from the first declared nominal voltage
+        min_voltage = spec_registry.reference_spec(battery_type).min_voltage
+
         # Check for short circuit
         if voltage < min_voltage * 0.5:
             faults.append("Possible short circuit")
@@ -668,3 +656,92 @@ class BatteryDiagnostics:
             "severity": severity,
             "recommendedActions": actions
         }
+
+
+    # Sections available in a full diagnostic report, with the inputs each
+    # needs in addition to batteryType and temperature
+    REPORT_FIELDS = {
+        "soc": ["nominalVoltage", "voltage", "current"],
+        "soh": ["currentCapacity", "ratedCapacity", "cycleCount"],
+        "voltage": ["nominalVoltage", "voltage"],
+        "resistance": ["voltage", "current"],
+        "capacity-fade": ["initialCapacity", "currentCapacity", "cycleCount", "timeInService"],
+        "cell-balance": ["cellVoltages"],
+        "safety": ["voltage", "current", "pressure"],
+        "thermal": ["rateOfChange", "ambientTemperature", "loadProfile"],
+        "cycle-life": ["cycleCount", "depthOfDischarge", "averageTemperature", "currentSOH"],
+        "faults": ["voltage", "current", "impedance"],
+    }
+    REPORT_SECTIONS = tuple(REPORT_FIELDS)
+
+    @staticmethod
+    def full_report(params: Dict, sections: List[str] = REPORT_SECTIONS) -> Dict:
+        """Run several analyses for one battery in a single pass.
+
+        The specification and temperature compensation are resolved once and
+        shared by the sections that need them. A section that fails is
+        reported under "errors" without affecting the others.
+        """
+        battery_type = params["batteryType"]
+        voltage = params.get("voltage")
+        temperature = params["temperature"]
+        results = {}
+        errors = {}
+
+        specs = None
+        ids = None
+        spec_error = None
+        if "soc" in sections or "voltage" in sections:
+            try:
+                ids = spec_registry.resolve(battery_type, params.get("nominalVoltage"))
+                specs = spec_registry.spec(*ids)
+                BatteryDiagnostics._validate_voltage(voltage, specs)
+            except ValueError as e:
+                spec_error = str(e)
+
+        runners = {
+            "soc": lambda: BatteryDiagnostics._soc_from_specs(
+                voltage, temperature, params["current"], specs, ids,
+                BatteryDiagnostics._validate_temperature(temperature, battery_type)),
+            "soh": lambda: BatteryDiagnostics.calculate_soh(
+                params["currentCapacity"], params["ratedCapacity"],
+                params["cycleCount"]),
+            "voltage": lambda: BatteryDiagnostics._voltage_from_specs(
+                voltage, temperature, specs, ids),
+            "resistance": lambda: BatteryDiagnostics.measure_internal_resistance(
+                voltage, params["current"], temperature, battery_type),
+            "capacity-fade": lambda: BatteryDiagnostics.analyze_capacity_fade(
+                params["initialCapacity"], params["currentCapacity"],
+                params["cycleCount"], params["timeInService"]),
+            "cell-balance": lambda: BatteryDiagnostics.check_cell_balance(
+                params["cellVoltages"], temperature),
+            "safety": lambda: BatteryDiagnostics.monitor_safety(
+                voltage, params["current"], temperature, params["pressure"],
+                battery_type),
+            "thermal": lambda: BatteryDiagnostics.analyze_thermal(
+                temperature, params["rateOfChange"],
+                params["ambientTemperature"], params["loadProfile"]),
+            "cycle-life": lambda: BatteryDiagnostics.estimate_cycle_life(
+                params["cycleCount"], params["depthOfDischarge"],
+                params["averageTemperature"], params["currentSOH"]),
+            "faults": lambda: BatteryDiagnostics.detect_faults(
+                voltage, params["current"], temperature, params["impedance"],
+                battery_type),
+        }
+
+        for section in sections:
+            if section in ("soc", "voltage") and spec_error is not None:
+                errors[section] = spec_error
+                continue
+            try:
+                results[section] = runners[section]()
+            except (ValueError, ZeroDivisionError) as e:
+                errors[section] = str(e)
+
+        return {"results": results, "errors": errors}
+
+
+# Specification tables compiled once at import
+spec_registry = SpecRegistry(BatteryDiagnostics.BATTERY_TYPES)
+# OCV-SOC curves, loaded from the cache when it is current
+ocv_table = load_ocv_table(BatteryDiagnostics.BATTERY_TYPES, spec_registry)
@@ -0,0 +1,683 @@
+"""Benchmarks for the diagnostic kernels and the /battery/diagnose/* routes.
+
+Kernel benchmarks call each BatteryDiagnostics static method directly.
+Endpoint benchmarks send requests through the ASGI app in-process, so they
+cover the middleware, validation and serialization stack without network
+noise. Serialization benchmarks compare the stdlib JSONResponse with
+fast_json on representative response bodies, and validation benchmarks
+compare the compiled request checks with the nested-model validators they
+replaced. Fleet benchmarks time one tick of the stateful SOC estimators
+for 1k, 10k and 100k batteries, fade-model fits over 2000-point capacity
+histories of 1k, 10k and 50k batteries, and full-budget Monte Carlo
+cycle-life runs for 100, 1k and 10k batteries.
+
+    python benchmarks.py                              # run everything
+    python benchmarks.py --suite kernels --filter soc
+    python benchmarks.py --suite serialization        # stdlib vs fast JSON per body
+    python benchmarks.py --suite validation           # per-request validation cost
+    python benchmarks.py --suite fleet                # estimator ticks, fade fits, cycle-life runs
+    python benchmarks.py --save benchmark_baseline.json
+    python benchmarks.py --compare benchmark_baseline.json --threshold 0.2
+
+With --compare the process exits with status 1 when any benchmark's p50
+latency or throughput is worse than the baseline by more than the threshold.
+"""
+import os
+
+# Benchmarks run against process-local state, and the rate limiter stays in
+# the stack without ever rejecting a request
+os.environ.setdefault("DIAGNOSTIC_HISTORY_BACKEND", "memory")
+os.environ.setdefault("API_KEY_STORE", "memory")
+os.environ.setdefault("RATE_LIMIT_BACKEND", "memory")
+os.environ.setdefault("RATE_LIMIT_BURST", str(10 ** 9))
+
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from battery_diagnostics import BatteryDiagnostics
+
+DEFAULT_ITERATIONS = int(os.environ.get("BENCHMARK_ITERATIONS", "2000"))
+DEFAULT_THRESHOLD = float(os.environ.get("BENCHMARK_THRESHOLD", "0.25"))
+# Calls traced for allocations; tracing is slow, so this is a separate pass
+ALLOCATION_SAMPLES = 20
+BENCHMARK_API_KEY = "benchmark_key"
+
+
+class BenchmarkResult(NamedTuple):
+    name: str
+    iterations: int
+    ops_per_sec: float
+    p50_us: float
+    p99_us: float
+    alloc_blocks: float
+    alloc_bytes: float
+
+
+def _summarize(name: str, timings_ns: np.ndarray, blocks: List[int],
+               peaks: List[int]) -> BenchmarkResult:
+    return BenchmarkResult(
+        name=name,
+        iterations=len(timings_ns),
+        ops_per_sec=len(timings_ns) / (timings_ns.sum() / 1e9),
+        p50_us=float(np.percentile(timings_ns, 50)) / 1e3,
+        p99_us=float(np.percentile(timings_ns, 99)) / 1e3,
+        alloc_blocks=float(np.median(blocks)),
+        alloc_bytes=float(np.median(peaks))
+    )
+
+
+def _traced_blocks() -> int:
+    return sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+
+
+def run_benchmark(name: str, fn: Callable, iterations: int = DEFAULT_ITERATIONS,
+                  warmup: int = 100, samples: int = ALLOCATION_SAMPLES) -> BenchmarkResult:
+    """Time ``fn()`` per call, then trace its allocations over ``samples`` calls.
+
+    Allocations are reported as the blocks still held after a call (what a
+    hot path leaves behind for the collector) and the peak bytes allocated
+    while it runs.
+    """
+    for _ in range(warmup):
+        fn()
+
+    timings = np.empty(iterations, dtype=np.int64)
+    clock = time.perf_counter_ns
+    for i in range(iterations):
+        start = clock()
+        fn()
+        timings[i] = clock() - start
+
+    blocks, peaks = [], []
+    tracemalloc.start()
+    try:
+        for _ in range(samples):
+            before = _traced_blocks()
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            result = fn()
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+            blocks.append(_traced_blocks() - before)
+            del result
+    finally:
+        tracemalloc.stop()
+
+    return _summarize(name, timings, blocks, peaks)
+
+
+async def run_async_benchmark(name: str, fn: Callable, iterations: int = DEFAULT_ITERATIONS,
+                              warmup: int = 100, samples: int = ALLOCATION_SAMPLES) -> BenchmarkResult:
+    """Async counterpart of run_benchmark; ``fn()`` returns an awaitable"""
+    for _ in range(warmup):
+        await fn()
+
+    timings = np.empty(iterations, dtype=np.int64)
+    clock = time.perf_counter_ns
+    for i in range(iterations):
+        start = clock()
+        await fn()
+        timings[i] = clock() - start
+
+    blocks, peaks = [], []
+    tracemalloc.start()
+    try:
+        for _ in range(samples):
+            before = _traced_blocks()
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            result = await fn()
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+            blocks.append(_traced_blocks() - before)
+            del result
+    finally:
+        tracemalloc.stop()
+
+    return _summarize(name, timings, blocks, peaks)
+
+
+FULL_REPORT_PARAMS = {
+    "batteryType": "Li-ion", "temperature": 25.0, "voltage": 51.8, "nominalVoltage": 48.0,
+    "current": -10.0, "currentCapacity": 2700, "ratedCapacity": 3000, "initialCapacity": 3000,
+    "cycleCount": 250, "timeInService": 365, "cellVoltages": [3.70, 3.71, 3.69, 3.72],
+    "pressure": 1.0, "rateOfChange": 0.5, "ambientTemperature": 25.0, "loadProfile": "medium",
+    "depthOfDischarge": 80.0, "averageTemperature": 25.0, "currentSOH": 90.0, "impedance": 0.05,
+}
+
+# Representative valid inputs for every BatteryDiagnostics static method
+KERNEL_CASES: Dict[str, Callable] = {
+    "get_battery_specs": lambda: BatteryDiagnostics.get_battery_specs("Li-ion", 48.0),
+    "calculate_soc": lambda: BatteryDiagnostics.calculate_soc(51.8, "Li-ion", 25.0, -10.0, 48.0),
+    "calculate_soh": lambda: BatteryDiagnostics.calculate_soh(2700, 3000, 250),
+    "measure_internal_resistance": lambda: BatteryDiagnostics.measure_internal_resistance(
+        3.7, 1.0, 25.0, "Li-ion"),
+    "analyze_capacity_fade": lambda: BatteryDiagnostics.analyze_capacity_fade(3000, 2700, 250, 365),
+    "check_cell_balance": lambda: BatteryDiagnostics.check_cell_balance(
+        [3.70, 3.71, 3.69, 3.72, 3.70, 3.68, 3.71, 3.70], 25.0),
+    "monitor_safety": lambda: BatteryDiagnostics.monitor_safety(3.7, 1.0, 25.0, 1.0, "Li-ion"),
+    "analyze_thermal": lambda: BatteryDiagnostics.analyze_thermal(30.0, 0.5, 25.0, "medium"),
+    "estimate_cycle_life": lambda: BatteryDiagnostics.estimate_cycle_life(250, 80.0, 25.0, 90.0),
+    "analyze_voltage": lambda: BatteryDiagnostics.analyze_voltage(51.8, "Li-ion", 48.0, 25.0),
+    "detect_faults": lambda: BatteryDiagnostics.detect_faults(3.7, 1.0, 25.0, 0.05, "Li-ion"),
+    "full_report": lambda: BatteryDiagnostics.full_report(FULL_REPORT_PARAMS),
+}
+
+# One valid request body per /battery/diagnose/* route
+ENDPOINT_CASES: Dict[str, Dict] = {
+    "/battery/diagnose/soc": {
+        "batteryType": "Li-ion", "voltage": 51.8, "temperature": 25.0,
+        "nominalVoltage": 48.0, "current": -10.0
+    },
+    "/battery/diagnose/soc/batch": {
+        "batteryType": ["Li-ion"] * 100, "nominalVoltage": [48.0] * 100,
+        "voltage": list(np.linspace(42.0, 53.7, 100)), "temperature": [25.0] * 100,
+        "current": [-10.0] * 100
+    },
+    # The tracked routes keep per-battery state between calls; readings without a
+    # timestamp are taken at request time, so repeated calls are consecutive readings
+    "/battery/diagnose/soc/coulomb": {
+        "batteryId": [f"coulomb-{i}" for i in range(100)], "batteryType": ["Li-ion"] * 100,
+        "nominalVoltage": [48.0] * 100, "voltage": list(np.linspace(42.0, 53.7, 100)),
+        "temperature": [25.0] * 100, "current": [-10.0] * 100, "capacity": [3000.0] * 100
+    },
+    "/battery/diagnose/soc/ekf": {
+        "batteryId": [f"ekf-{i}" for i in range(100)], "batteryType": ["Li-ion"] * 100,
+        "nominalVoltage": [48.0] * 100, "voltage": list(np.linspace(42.0, 53.7, 100)),
+        "temperature": [25.0] * 100, "current": [-10.0] * 100, "capacity": [3000.0] * 100
+    },
+    "/battery/diagnose/soh": {
+        "batteryType": "Li-ion", "currentCapacity": 2700, "ratedCapacity": 3000, "cycleCount": 250
+    },
+    "/battery/diagnose/voltage": {
+        "batteryType": "Li-ion", "voltage": 51.8, "nominalVoltage": 48.0, "temperature": 25.0
+    },
+    "/battery/diagnose/resistance": {
+        "batteryType": "Li-ion", "voltage": 3.7, "current": 1.0, "temperature": 25.0
+    },
+    "/battery/diagnose/capacity-fade": {
+        "batteryType": "Li-ion", "initialCapacity": 3000, "currentCapacity": 2700,
+        "cycleCount": 250, "timeInService": 365
+    },
+    "/battery/diagnose/cell-balance": {
+        "batteryType": "Li-ion", "cellVoltages": [3.70, 3.71, 3.69, 3.72], "temperature": 25.0
+    },
+    "/battery/diagnose/cell-balance/batch": {
+        "batteryType": "Li-ion", "series": 12, "parallel": 2,
+        "cellVoltages": (3.7 + 0.05 * np.sin(np.arange(100 * 96)).reshape(100, 96)).tolist()
+    },
+    "/battery/diagnose/capacity-fade/fit": {
+        "batteryType": "Li-ion", "cycles": list(np.arange(0.0, 1000.0, 5.0)),
+        "capacity": (3000 - np.outer(np.linspace(0.2, 0.6, 100), np.arange(0.0, 1000.0, 5.0))
+                     + 5 * np.sin(np.arange(100 * 200)).reshape(100, 200)).tolist()
+    },
+    "/battery/diagnose/safety": {
+        "batteryType": "Li-ion", "voltage": 3.7, "current": 1.0, "temperature": 25.0, "pressure": 1.0
+    },
+    "/battery/diagnose/thermal": {
+        "batteryType": "Li-ion", "temperature": 30.0, "rateOfChange": 0.5,
+        "ambientTemperature": 25.0, "loadProfile": "medium"
+    },
+    "/battery/diagnose/cycle-life": {
+        "batteryType": "Li-ion", "cycleCount": 250, "depthOfDischarge": 80.0,
+        "averageTemperature": 25.0, "currentSOH": 90.0
+    },
+    "/battery/diagnose/cycle-life/simulate": {
+        "batteryType": "Li-ion", "depthOfDischarge": [75.0] * 10, "averageTemperature": [30.0] * 10,
+        "currentSOH": [90.0] * 10, "draws": 2000, "seed": 1
+    },
+    "/battery/diagnose/rainflow": {
+        "batteryId": [f"rainflow-{i}" for i in range(10)], "batteryType": "Li-ion",
+        "stateOfCharge": [[90.0, 20.0, 75.0, 35.0, 95.0, 10.0] * 10] * 10,
+        "averageTemperature": [25.0] * 10, "currentSOH": [90.0] * 10
+    },
+    "/battery/diagnose/faults": {
+        "batteryType": "Li-ion", "voltage": 3.7, "current": 1.0, "temperature": 25.0,
+        "impedance": 0.05
+    },
+    "/battery/diagnose/full": FULL_REPORT_PARAMS,
+}
+
+
+def run_kernel_benchmarks(iterations: int = DEFAULT_ITERATIONS,
+                          name_filter: str = "") -> List[BenchmarkResult]:
+    return [
+        run_benchmark(f"kernel:{name}", fn, iterations)
+        for name, fn in KERNEL_CASES.items() if name_filter in name
+    ]
+
+
+def _serialization_cases() -> Dict[str, Tuple[Callable, Callable]]:
+    """(before, after) encoders of representative response bodies.
+
+    "before" is the stdlib JSONResponse that every route used to return,
+    including the list conversion the batch route needed for it; "after"
+    is fast_json, which takes the engine's NumPy arrays as they are.
+    """
+    from starlette.responses import JSONResponse
+    from batch_diagnostics import BatchDiagnostics
+    from diagnostic_history import DiagnosticHistory
+    from fast_json import dumps
+
+    stdlib = JSONResponse(None).render
+    cases = {}
+    for name in ("calculate_soc", "analyze_voltage", "full_report"):
+        result = KERNEL_CASES[name]()
+        cases[name] = (lambda result=result: stdlib(result), lambda result=result: dumps(result))
+
+    rows = 10000
+    batch = BatchDiagnostics.calculate_soc_batch(
+        voltage=np.linspace(40.0, 56.0, rows), battery_type=["Li-ion"] * rows,
+        temperature=np.full(rows, 25.0), current=np.full(rows, -10.0),
+        nominal_voltage=np.full(rows, 48.0))
+
+    def batch_before():
+        valid = batch["valid"].tolist()
+        return stdlib({
+            "count": rows,
+            "stateOfCharge": [soc if ok else None
+                              for soc, ok in zip(batch["stateOfCharge"].tolist(), valid)],
+            "estimatedRange": batch["estimatedRange"].tolist(),
+            "chargingStatus": batch["chargingStatus"].tolist(),
+            "temperatureCompensation": [factor if ok else None for factor, ok in
+                                        zip(batch["temperatureCompensation"].tolist(), valid)],
+            "errors": batch["errors"]
+        })
+
+    def batch_after():
+        return dumps({
+            "count": rows,
+            "stateOfCharge": batch["stateOfCharge"],
+            "estimatedRange": batch["estimatedRange"],
+            "chargingStatus": batch["chargingStatus"],
+            "temperatureCompensation": batch["temperatureCompensation"],
+            "errors": batch["errors"]
+        })
+
+    cases["soc_batch_10k"] = (batch_before, batch_after)
+
+    history = DiagnosticHistory(capacity=1000)
+    for _ in range(100):
+        history.record("soc", "Li-ion", KERNEL_CASES["calculate_soc"]())
+    page = {"logs": history.page(limit=100)[0], "next_cursor": None}
+    cases["logs_page_100"] = (lambda: stdlib(page), lambda: dumps(page))
+    return cases
+
+
+def run_serialization_benchmarks(iterations: int = DEFAULT_ITERATIONS,
+                                 name_filter: str = "") -> List[BenchmarkResult]:
+    results = []
+    for name, (before, after) in _serialization_cases().items():
+        if name_filter not in name:
+            continue
+        # Large bodies get fewer iterations so the suite stays quick
+        count = max(10, iterations // 20) if name == "soc_batch_10k" else iterations
+        results.append(run_benchmark(f"serialize:{name}:stdlib", before, count))
+        results.append(run_benchmark(f"serialize:{name}:fast", after, count))
+    return results
+
+
+VALIDATION_BODIES = {
+    "SOCRequest": {"batteryType": "Li-ion", "nominalVoltage": 48.0, "voltage": 50.0,
+                   "temperature": 25.0, "current": -10.0},
+    "VoltageRequest": {"batteryType": "LFP", "voltage": 13.1, "nominalVoltage": 12.8,
+                       "temperature": 25.0},
+    "ResistanceRequest": {"batteryType": "Li-ion", "voltage": 3.7, "current": 1.0,
+                          "temperature": 25.0},
+    "FaultRequest": {"batteryType": "Li-ion", "voltage": 3.7, "current": 1.0,
+                     "temperature": 25.0, "impedance": 15.0},
+}
+
+
+def _nested_validators() -> Dict[str, type]:
+    """The request models with the validators they had before the compiled checks.
+
+    These built a second BatteryParameters model, or imported
+    battery_diagnostics and listed BATTERY_TYPES, on every request.
+    """
+    import models
+    from models import BatteryParameters
+    from pydantic import model_validator
+
+    def soc(self):
+        from battery_diagnostics import BatteryDiagnostics
+
+        valid_types = list(BatteryDiagnostics.BATTERY_TYPES.keys())
+        if self.batteryType not in valid_types:
+            raise ValueError(f"Battery type '{self.batteryType}' is not valid")
+        if self.nominalVoltage <= 0 or self.nominalVoltage > 500:
+            raise ValueError("Nominal voltage must be positive and less than 500V")
+        BatteryParameters(batteryType=self.batteryType, voltage=self.voltage,
+                          temperature=self.temperature, current=None, capacity=None)
+        return self
+
+    def voltage(self):
+        from battery_diagnostics import BatteryDiagnostics
+
+        valid_types = list(BatteryDiagnostics.BATTERY_TYPES.keys())
+        if self.batteryType not in valid_types:
+            raise ValueError(f"Battery type '{self.batteryType}' is not valid")
+        if self.voltage <= 0 or self.voltage > 100:
+            raise ValueError("Voltage must be positive and less than 100V")
+        if self.nominalVoltage <= 0 or self.nominalVoltage > 500:
+            raise ValueError("Nominal voltage must be positive and less than 500V")
+        if self.temperature < -40 or self.temperature > 100:
+            raise ValueError("Temperature must be between -40°C and 100°C")
+        return self
+
+    def parameters(self):
+        BatteryParameters(batteryType=self.batteryType, voltage=self.voltage,
+                          temperature=self.temperature, current=self.current)
+        return self
+
+    validators = {"SOCRequest": soc, "VoltageRequest": voltage,
+                  "ResistanceRequest": parameters, "FaultRequest": parameters}
+    return {
+        name: type(f"Nested{name}", (getattr(models, name),),
+                   {"validate_parameters": model_validator(mode="after")(validator)})
+        for name, validator in validators.items()
+    }
+
+
+def run_validation_benchmarks(iterations: int = DEFAULT_ITERATIONS,
+                              name_filter: str = "") -> List[BenchmarkResult]:
+    """Parse and validate each JSON body the way request_body() does"""
+    import models
+
+    nested = _nested_validators()
+    results = []
+    for name, body in VALIDATION_BODIES.items():
+        if name_filter not in name:
+            continue
+        data = json.dumps(body).encode()
+        for label, model in (("nested", nested[name]), ("compiled", getattr(models, name))):
+            results.append(run_benchmark(
+                f"validate:{name}:{label}",
+                lambda model=model, data=data: model.model_validate_json(data), iterations))
+    return results
+
+
+FLEET_SIZES = (1000, 10000, 100000)
+FLEET_CASES = ("coulomb_tick", "ekf_tick")
+# Capacity histories are FADE_FIT_POINTS long, so fade fleets stay smaller
+FADE_FIT_SIZES = (1000, 10000, 50000)
+FADE_FIT_POINTS = 2000
+# Each size spends the whole draw budget (fewer draws per battery as it grows)
+CYCLE_LIFE_SIZES = (100, 1000, 10000)
+# Each call counts the next RAINFLOW_POINTS SOC samples of every battery
+RAINFLOW_SIZES = (1000, 10000)
+RAINFLOW_POINTS = 1000
+
+
+def _fleet_cases(size: int) -> Dict[str, Callable]:
+    """One tick of each stateful SOC estimator over ``size`` Li-ion 48 V batteries.
+
+    Every call advances the fleet by one second of discharge, so the
+    filter runs its full predict and update rather than re-anchoring.
+    """
+    from battery_diagnostics import spec_registry
+    from soc_tracking import SOCFilter, SOCTracker
+
+    ids = [f"battery-{i}" for i in range(size)]
+    voltage = np.linspace(44.0, 52.0, size)
+    current = np.full(size, -5.0)
+    temperature = np.linspace(0.0, 40.0, size)
+    capacity = np.full(size, 10.0)
+    voltage_soc = np.linspace(40.0, 80.0, size)
+    chem_ids = np.full(size, spec_registry.chemistry_ids["Li-ion"], dtype=np.intp)
+    nominal_ids = spec_registry.nominal_ids_for(chem_ids, np.full(size, 48.0))
+
+    tracker = SOCTracker(max_batteries=size, rest_seconds=float("inf"),
+                         max_batteries_per_owner=size)
+    soc_filter = SOCFilter(max_batteries=size, max_batteries_per_owner=size)
+    tracker_rows = tracker.rows_for("benchmark", ids)
+    filter_rows = soc_filter.rows_for("benchmark", ids)
+    clock = [0.0]
+
+    def tick_timestamp():
+        clock[0] += 1.0
+        return np.full(size, clock[0])
+
+    tracker.tick(tracker_rows, current, tick_timestamp(), capacity, voltage_soc)
+    soc_filter.tick(filter_rows, voltage, current, temperature, tick_timestamp(), capacity,
+                    chem_ids, nominal_ids, voltage_soc)
+    return {
+        "coulomb_tick": lambda: tracker.tick(
+            tracker_rows, current, tick_timestamp(), capacity, voltage_soc),
+        "ekf_tick": lambda: soc_filter.tick(
+            filter_rows, voltage, current, temperature, tick_timestamp(), capacity,
+            chem_ids, nominal_ids, voltage_soc),
+    }
+
+
+def _fade_fit_case(size: int) -> Callable:
+    """Every fade model fitted to ``size`` noisy float32 capacity histories"""
+    from capacity_fade import fit_capacity_fade
+
+    cycles = np.arange(FADE_FIT_POINTS, dtype=np.float32)
+    rate = np.linspace(0.1, 0.5, size, dtype=np.float32)
+    noise = np.random.default_rng(0).normal(0, 5, (size, FADE_FIT_POINTS)).astype(np.float32)
+    capacity = 3000 - rate[:, None] * cycles + noise
+    return lambda: fit_capacity_fade(capacity, cycles)
+
+
+def _cycle_life_case(size: int) -> Callable:
+    """A seeded Monte Carlo cycle-life run over ``size`` batteries"""
+    from cycle_life import DEFAULT_DRAW_BUDGET, simulate_cycle_life
+
+    dod = np.linspace(30.0, 95.0, size)
+    temperature = np.linspace(10.0, 40.0, size)
+    soh = np.linspace(70.0, 100.0, size)
+    draws = DEFAULT_DRAW_BUDGET // size
+    return lambda: simulate_cycle_life(dod, temperature, soh, draws=draws, seed=1,
+                                       horizon_days=730)
+
+
+def _rainflow_case(size: int) -> Callable:
+    """Successive random-walk SOC chunks of ``size`` batteries through one rainflow counter"""
+    from rainflow import RainflowCounter
+
+    counter = RainflowCounter(max_batteries=size, max_batteries_per_owner=size)
+    rows = counter.rows_for("benchmark", [f"battery-{i}" for i in range(size)])
+    rng = np.random.default_rng(0)
+    steps = rng.normal(0, 3, (size, RAINFLOW_POINTS))
+    start = rng.uniform(20, 80, size)
+
+    def chunk():
+        soc = np.clip(start[:, None] + np.cumsum(steps, axis=1), 0, 100)
+        start[:] = soc[:, -1]
+        rng.shuffle(steps, axis=1)
+        return counter.count(rows, soc)
+    return chunk
+
+
+def run_fleet_benchmarks(iterations: int = DEFAULT_ITERATIONS,
+                         name_filter: str = "") -> List[BenchmarkResult]:
+    """Estimator ticks per fleet size; batteries per second is ops/s times the size"""
+    results = []
+    for size in FLEET_SIZES:
+        label = f"{size // 1000}k"
+        # Iterations shrink with the fleet so each size takes similar time
+        count = max(5, iterations // 10 * 1000 // size)
+        names = [name for name in FLEET_CASES if name_filter in f"fleet:{name}:{label}"]
+        # Building a fleet's estimators is costly, so sizes nothing selects are skipped
+        if not names:
+            continue
+        cases = _fleet_cases(size)
+        for name in names:
+            results.append(run_benchmark(f"fleet:{name}:{label}", cases[name], count,
+                                         warmup=min(100, count)))
+
+    # Whole-fleet calls take seconds: a few timed runs and one traced run
+    count = max(1, iterations // 400)
+    for size in FADE_FIT_SIZES:
+        full_name = f"fleet:fade_fit:{size // 1000}k"
+        if name_filter in full_name:
+            fn = _fade_fit_case(size)
+            results.append(run_benchmark(full_name, fn, count, warmup=1, samples=1))
+
+    for size in CYCLE_LIFE_SIZES:
+        label = f"{size // 1000}k" if size >= 1000 else str(size)
+        full_name = f"fleet:cycle_life:{label}"
+        if name_filter in full_name:
+            fn = _cycle_life_case(size)
+            results.append(run_benchmark(full_name, fn, count, warmup=1, samples=1))
+
+    for size in RAINFLOW_SIZES:
+        full_name = f"fleet:rainflow:{size // 1000}k"
+        if name_filter in full_name:
+            fn = _rainflow_case(size)
+            results.append(run_benchmark(full_name, fn, count, warmup=1, samples=1))
+    return results
+
+
+async def _run_endpoint_benchmarks(iterations: int, name_filter: str) -> List[BenchmarkResult]:
+    import httpx
+    from main import app
+    from api_key_manager import api_key_manager
+
+    # Importing main configures INFO logging; per-request lines would flood the report
+    logging.getLogger().setLevel(logging.WARNING)
+
+    # A dedicated key whose quota the benchmark cannot exhaust
+    previous_max_usage = api_key_manager.max_usage
+    api_key_manager.add_key(BENCHMARK_API_KEY)
+    api_key_manager.max_usage = 10 ** 12
+    headers = {"x-api-key": BENCHMARK_API_KEY}
+
+    results = []
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            for path, payload in ENDPOINT_CASES.items():
+                if name_filter not in path:
+                    continue
+                body = json.dumps(payload).encode()
+                request_headers = dict(headers, **{"content-type": "application/json"})
+
+                response = await client.post(path, content=body, headers=request_headers)
+                if response.status_code != 200:
+                    raise RuntimeError(
+                        f"{path} returned {response.status_code}: {response.text}")
+
+                results.append(await run_async_benchmark(
+                    f"endpoint:{path}",
+                    lambda: client.post(path, content=body, headers=request_headers),
+                    iterations
+                ))
+    finally:
+        api_key_manager.max_usage = previous_max_usage
+        api_key_manager.remove_key(BENCHMARK_API_KEY)
+    return results
+
+
+def run_endpoint_benchmarks(iterations: int = DEFAULT_ITERATIONS,
+                            name_filter: str = "") -> List[BenchmarkResult]:
+    return asyncio.run(_run_endpoint_benchmarks(iterations, name_filter))
+
+
+def save_baseline(results: List[BenchmarkResult], path: str):
+    """Write results as JSON, with enough context to judge comparability"""
+    baseline = {
+        "created": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "results": {result.name: result._asdict() for result in results}
+    }
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2)
+
+
+def load_baseline(path: str) -> Dict[str, Dict]:
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def find_regressions(results: List[BenchmarkResult], baseline: Dict[str, Dict],
+                     threshold: float = DEFAULT_THRESHOLD) -> List[str]:
+    """Benchmarks whose p50 latency or throughput got worse by more than ``threshold``
+
+    Benchmarks missing from the baseline are skipped.
+    """
+    regressions = []
+    for result in results:
+        reference = baseline.get(result.name)
+        if reference is None:
+            continue
+        if result.p50_us > reference["p50_us"] * (1 + threshold):
+            regressions.append(
+                f"{result.name}: p50 {result.p50_us:.1f}us vs baseline {reference['p50_us']:.1f}us")
+        elif result.ops_per_sec < reference["ops_per_sec"] / (1 + threshold):
+            regressions.append(
+                f"{result.name}: {result.ops_per_sec:.0f} ops/s vs baseline "
+                f"{reference['ops_per_sec']:.0f} ops/s")
+    return regressions
+
+
+def format_results(results: List[BenchmarkResult]) -> str:
+    width = max([len(result.name) for result in results] + [9])
+    lines = [
+        f"{'benchmark':<{width}} {'ops/s':>10} {'p50 us':>9} {'p99 us':>9} "
+        f"{'blocks':>7} {'peak B':>9}"
+    ]
+    for result in results:
+        lines.append(
+            f"{result.name:<{width}} {result.ops_per_sec:>10.0f} {result.p50_us:>9.1f} "
+            f"{result.p99_us:>9.1f} {result.alloc_blocks:>7.0f} {result.alloc_bytes:>9.0f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Battery OS API benchmarks")
+    parser.add_argument("--suite", choices=["all", "kernels", "endpoints", "serialization", "validation", "fleet"], default="all")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--save", metavar="PATH", help="Write the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="Fail on regressions against a baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed slowdown as a fraction (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    results = []
+    if args.suite in ("all", "kernels"):
+        results += run_kernel_benchmarks(args.iterations, args.filter)
+    if args.suite in ("all", "serialization"):
+        results += run_serialization_benchmarks(args.iterations, args.filter)
+    if args.suite in ("all", "validation"):
+        results += run_validation_benchmarks(args.iterations, args.filter)
+    if args.suite in ("all", "fleet"):
+        results += run_fleet_benchmarks(args.iterations, args.filter)
+    if args.suite in ("all", "endpoints"):
+        results += run_endpoint_benchmarks(args.iterations, args.filter)
+    if not results:
+        print("No benchmarks matched")
+        return 1
+    print(format_results(results))
+
+    if args.save:
+        save_baseline(results, args.save)
+        print(f"Baseline saved to {args.save}")
+
+    if args.compare:
+        regressions = find_regressions(results, load_baseline(args.compare), args.threshold)
+        if regressions:
+            print(f"\nRegressions beyond {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nNo regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
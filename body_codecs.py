@@ -0,0 +1,307 @@
+"""Binary request and response bodies for the diagnose endpoints.
+
+Besides JSON, the diagnose endpoints accept and return:
+
+- ``application/msgpack``: a map of fields. Numeric arrays may be sent as
+  msgpack arrays or, without any per-element decoding, as ext types
+  1 (little-endian float32) and 2 (little-endian float64) holding the raw
+  values.
+- ``application/vnd.apache.arrow.stream``: an Arrow IPC stream. Array fields
+  are columns, and scalar fields are a JSON object in the schema metadata
+  under the key ``fields``. Requires pyarrow.
+- ``application/x-battery-frame``: the frame layout below.
+
+Battery frame layout (all integers little-endian)::
+
+    offset 0   4 bytes   magic b"BTF1"
+    offset 4   uint32    header length H
+    offset 8   H bytes   UTF-8 JSON header:
+                         {"fields": {...scalar fields...},
+                          "columns": [{"name": "cellVoltages", "dtype": "<f4", "length": 16}, ...]}
+    then zero padding up to a multiple of 8 bytes, then the raw values of each
+    column in header order, each column padded to a multiple of 8 bytes.
+
+Column dtypes are "<f4", "<f8", "<i4", "<i8" and "|u1". Numeric columns are
+decoded with np.frombuffer, so the arrays are views over the request body.
+"""
+from typing import Dict, Optional, Tuple
+import json
+import struct
+
+import numpy as np
+from fastapi import HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
+from starlette.responses import Response
+
+from fast_json import FastJSONResponse
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+FRAME_MEDIA_TYPE = "application/x-battery-frame"
+
+MSGPACK_ALIASES = {MSGPACK_MEDIA_TYPE, "application/x-msgpack", "application/vnd.msgpack"}
+BINARY_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, ARROW_MEDIA_TYPE, FRAME_MEDIA_TYPE)
+
+MSGPACK_FLOAT32_EXT = 1
+MSGPACK_FLOAT64_EXT = 2
+
+FRAME_MAGIC = b"BTF1"
+FRAME_PREFIX = struct.Struct("<4sI")
+FRAME_DTYPES = {"<f4", "<f8", "<i4", "<i8", "|u1"}
+
+
+def media_type_of(content_type: Optional[str]) -> str:
+    """Lower-cased media type without parameters ("" when absent)"""
+    media_type = (content_type or "").split(";", 1)[0].strip().lower()
+    return MSGPACK_MEDIA_TYPE if media_type in MSGPACK_ALIASES else media_type
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """First supported media type listed in the Accept header, JSON otherwise"""
+    for item in (accept or "").split(","):
+        media_type = media_type_of(item)
+        if media_type in BINARY_MEDIA_TYPES or media_type == JSON_MEDIA_TYPE:
+            return media_type
+    return JSON_MEDIA_TYPE
+
+
+def _pad(length: int) -> int:
+    return -length % 8
+
+
+def _json_default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _jsonable(value):
+    if isinstance(value, dict):
+        return {key: _jsonable(item) for key, item in value.items()}
+    if isinstance(value, (np.ndarray, np.generic)):
+        return _json_default(value)
+    return value
+
+
+def _split_columns(payload: Dict) -> Tuple[Dict, Dict[str, np.ndarray]]:
+    """Separate 1-D numeric/bool arrays (columns) from everything else (fields)"""
+    fields, columns = {}, {}
+    for name, value in payload.items():
+        if isinstance(value, np.ndarray) and value.ndim == 1 and value.dtype.kind in "fiub":
+            columns[name] = value
+        else:
+            fields[name] = value
+    return fields, columns
+
+
+# Frame
+
+def decode_frame(body: bytes) -> Dict:
+    if len(body) < FRAME_PREFIX.size:
+        raise ValueError("Frame is too short")
+    magic, header_length = FRAME_PREFIX.unpack_from(body)
+    if magic != FRAME_MAGIC:
+        raise ValueError("Frame does not start with the BTF1 magic")
+    offset = FRAME_PREFIX.size + header_length
+    if offset > len(body):
+        raise ValueError("Frame header length exceeds the body")
+    header = json.loads(body[FRAME_PREFIX.size:offset])
+    if not isinstance(header, dict):
+        raise ValueError("Frame header must be a JSON object")
+
+    payload = dict(header.get("fields") or {})
+    offset += _pad(offset)
+    for column in header.get("columns") or []:
+        dtype = column.get("dtype")
+        if dtype not in FRAME_DTYPES:
+            raise ValueError(f"Unsupported frame dtype {dtype!r}; use one of {sorted(FRAME_DTYPES)}")
+        length = column.get("length")
+        if not isinstance(length, int) or length < 0:
+            raise ValueError(f"Invalid length for column {column.get('name')!r}")
+        size = length * np.dtype(dtype).itemsize
+        if offset + size > len(body):
+            raise ValueError(f"Column {column.get('name')!r} extends past the end of the frame")
+        payload[column["name"]] = np.frombuffer(body, dtype=dtype, count=length, offset=offset)
+        offset += size + _pad(size)
+    return payload
+
+
+def encode_frame(payload: Dict) -> bytes:
+    fields, columns = _split_columns(payload)
+    arrays = []
+    for name, array in columns.items():
+        if array.dtype.kind == "b":
+            array = array.astype("|u1")
+        elif array.dtype.str not in FRAME_DTYPES:
+            array = array.astype("<f8" if array.dtype.kind == "f" else "<i8")
+        arrays.append((name, array))
+
+    header = json.dumps({
+        "fields": fields,
+        "columns": [
+            {"name": name, "dtype": array.dtype.str, "length": len(array)} for name, array in arrays
+        ]
+    }, default=_json_default).encode()
+    parts = [FRAME_PREFIX.pack(FRAME_MAGIC, len(header)), header,
+             b"\0" * _pad(FRAME_PREFIX.size + len(header))]
+    for _, array in arrays:
+        data = array.tobytes()
+        parts.append(data)
+        parts.append(b"\0" * _pad(len(data)))
+    return b"".join(parts)
+
+
+# msgpack
+
+def _msgpack_ext_hook(code: int, data: bytes):
+    import msgpack
+
+    if code == MSGPACK_FLOAT32_EXT:
+        return np.frombuffer(data, dtype="<f4")
+    if code == MSGPACK_FLOAT64_EXT:
+        return np.frombuffer(data, dtype="<f8")
+    return msgpack.ExtType(code, data)
+
+
+def _msgpack_default(value):
+    import msgpack
+
+    if isinstance(value, np.ndarray):
+        if value.ndim == 1 and value.dtype.kind == "f":
+            if value.dtype.itemsize == 4:
+                return msgpack.ExtType(MSGPACK_FLOAT32_EXT, value.astype("<f4").tobytes())
+            return msgpack.ExtType(MSGPACK_FLOAT64_EXT, value.astype("<f8").tobytes())
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot serialize {type(value).__name__} to msgpack")
+
+
+def decode_msgpack(body: bytes) -> Dict:
+    import msgpack
+
+    payload = msgpack.unpackb(body, ext_hook=_msgpack_ext_hook, raw=False)
+    if not isinstance(payload, dict):
+        raise ValueError("msgpack body must be a map")
+    return payload
+
+
+def encode_msgpack(payload: Dict) -> bytes:
+    import msgpack
+
+    return msgpack.packb(payload, default=_msgpack_default)
+
+
+# Arrow IPC
+
+def decode_arrow(body: bytes) -> Dict:
+    import pyarrow as pa
+
+    # py_buffer wraps the body without copying, so numeric columns stay views
+    table = pa.ipc.open_stream(pa.py_buffer(body)).read_all()
+    metadata = table.schema.metadata or {}
+    payload = json.loads(metadata.get(b"fields", b"{}"))
+    for name in table.column_names:
+        column = table.column(name)
+        if (pa.types.is_integer(column.type) or pa.types.is_floating(column.type)) \
+                and column.null_count == 0 and column.num_chunks == 1:
+            payload[name] = column.chunk(0).to_numpy(zero_copy_only=True)
+        else:
+            payload[name] = column.to_pylist()
+    return payload
+
+
+def encode_arrow(payload: Dict) -> bytes:
+    import pyarrow as pa
+
+    fields, columns = _split_columns(payload)
+    # A record batch needs equal-length columns; others travel as fields
+    lengths = [len(array) for array in columns.values()]
+    rows = max(set(lengths), key=lengths.count) if lengths else 0
+    for name in [name for name, array in columns.items() if len(array) != rows]:
+        fields[name] = columns.pop(name)
+
+    batch = pa.RecordBatch.from_arrays(
+        [pa.array(array) for array in columns.values()], names=list(columns))
+    schema = batch.schema.with_metadata(
+        {"fields": json.dumps(fields, default=_json_default)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+DECODERS = {
+    MSGPACK_MEDIA_TYPE: decode_msgpack,
+    ARROW_MEDIA_TYPE: decode_arrow,
+    FRAME_MEDIA_TYPE: decode_frame,
+}
+
+ENCODERS = {
+    MSGPACK_MEDIA_TYPE: encode_msgpack,
+    ARROW_MEDIA_TYPE: encode_arrow,
+    FRAME_MEDIA_TYPE: encode_frame,
+}
+
+
+def decode_body(body: bytes, media_type: str) -> Dict:
+    """Decode a binary request body into a dict of fields and NumPy arrays"""
+    decoder = DECODERS.get(media_type)
+    if decoder is None:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Unsupported content type {media_type!r}; use {JSON_MEDIA_TYPE} "
+                   f"or one of {list(BINARY_MEDIA_TYPES)}"
+        )
+    try:
+        return decoder(body)
+    except ImportError as e:
+        raise HTTPException(status_code=415, detail=f"{media_type} bodies are not available: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Malformed {media_type} body: {e}")
+
+
+def request_body(model: type):
+    """FastAPI dependency parsing ``model`` from a JSON or binary body.
+
+    Validation errors are reported exactly like FastAPI's own body errors.
+    """
+    async def parse(request: Request) -> BaseModel:
+        media_type = media_type_of(request.headers.get("content-type"))
+        body = await request.body()
+        try:
+            if media_type in ("", JSON_MEDIA_TYPE) or media_type.endswith("+json"):
+                return model.model_validate_json(body)
+            return model.model_validate(decode_body(body, media_type))
+        except ValidationError as e:
+            raise RequestValidationError([
+                {**error, "loc": ("body", *error["loc"]), "input": _jsonable(error["input"])}
+                for error in e.errors(include_url=False)
+            ])
+
+    return parse
+
+
+def request_body_openapi(model: type) -> Dict:
+    """openapi_extra documenting the body that request_body() parses"""
+    schema = model.model_json_schema()
+    content = {JSON_MEDIA_TYPE: {"schema": schema}}
+    for media_type in BINARY_MEDIA_TYPES:
+        content[media_type] = {"schema": {"type": "string", "format": "binary"}}
+    return {"requestBody": {"required": True, "content": content}}
+
+
+def encoded_response(result: Dict, accept: Optional[str]) -> Response:
+    """Encode ``result`` in the media type negotiated from the Accept header"""
+    media_type = negotiate(accept)
+    if media_type == JSON_MEDIA_TYPE:
+        return FastJSONResponse(result)
+    try:
+        content = ENCODERS[media_type](result)
+    except ImportError:
+        return FastJSONResponse(result)
+    return Response(content=content, media_type=media_type)
@@ -0,0 +1,258 @@
+"""Capacity-fade trajectory fitting over whole cycle histories.
+
+analyze_capacity_fade extrapolates two capacity points; fit_capacity_fade
+fits fade models to the capacity-vs-cycle series of many batteries at once:
+
+- ``linear``:       C(n) = a + b·n
+- ``sqrt``:         C(n) = a + b·√n
+- ``exponential``:  C(n) = a·exp(b·n), fitted as a line through ln C
+
+Each is a straight line y = a + b·x in a transformed space, so every
+battery's least-squares fit follows from a handful of masked row sums.
+Histories of different lengths are NaN-padded rows of one matrix. Rows are
+processed ``chunk_points`` values at a time, so memory stays bounded for
+any fleet size and float32 input is only widened one chunk at a time.
+
+End of life is the cycle where the fitted curve reaches ``eol_fraction``
+of the initial capacity. Its confidence interval is where the confidence
+band of the fitted mean crosses that threshold (inverse prediction); the
+upper bound is infinite when the fade is not significant at the chosen
+confidence.
+"""
+from statistics import NormalDist
+from typing import Dict, Optional, Sequence
+import os
+
+import numpy as np
+
+# Values per block of rows processed at once (bounds the working memory)
+DEFAULT_FADE_CHUNK_POINTS = int(os.environ.get("FADE_FIT_CHUNK_POINTS", "1000000"))
+
+CAPACITY_FADE_MODELS = ("linear", "sqrt", "exponential")
+# Fits need a residual degree of freedom
+MIN_FIT_POINTS = 3
+
+# Transformed x and y of each model: "cycles", "root" (√n), "capacity" or "log" (ln C)
+_MODEL_AXES = {
+    "linear": ("cycles", "capacity"),
+    "sqrt": ("root", "capacity"),
+    "exponential": ("cycles", "log"),
+}
+_MODEL_COLUMNS = ("Intercept", "Slope", "InterceptStdErr", "SlopeStdErr", "Rmse", "RSquared",
+                  "EolCycle", "EolCycleLower", "EolCycleUpper")
+
+
+def t_quantile(probability: float, dof: np.ndarray) -> np.ndarray:
+    """Student t quantile for each degrees of freedom (Cornish-Fisher expansion).
+
+    Exact for 1 and 2 degrees of freedom, within 1% from 3 on.
+    """
+    v = np.asarray(dof, dtype=np.float64)
+    z = NormalDist().inv_cdf(probability)
+    z2 = z * z
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = z * (1 + (z2 + 1) / (4 * v)
+                 + ((5 * z2 + 16) * z2 + 3) / (96 * v ** 2)
+                 + (((3 * z2 + 19) * z2 + 17) * z2 - 15) / (384 * v ** 3)
+                 + ((((79 * z2 + 776) * z2 + 1482) * z2 - 1920) * z2 - 945) / (92160 * v ** 4))
+    t = np.where(v == 1, np.tan(np.pi * (probability - 0.5)), t)
+    t = np.where(v == 2, (2 * probability - 1) / np.sqrt(2 * probability * (1 - probability)), t)
+    return np.where(v >= 1, t, np.nan)
+
+
+def _centered(values: np.ndarray, valid: np.ndarray, count: np.ndarray):
+    """Row means of the valid values and the values minus them (0 where invalid)"""
+    values = np.where(valid, values, 0.0)
+    mean = values.sum(axis=1) / count
+    values -= mean[:, None]
+    values *= valid
+    return mean, values
+
+
+def _row_dot(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return np.einsum("ij,ij->i", a, b)
+
+
+def _eol_interval(slope, mean_x, mean_y, sxx, count, k, y_eol):
+    """Bounds on x where the confidence band of the mean line meets y_eol.
+
+    Solves (c + b·u)² = k²(1/n + u²/Sxx) for u = x - x̄, with c = ȳ - y_eol.
+    """
+    c = mean_y - y_eol
+    a = slope * slope - k * k / sxx
+    half_b = c * slope
+    discriminant = half_b * half_b - a * (c * c - k * k / count)
+    root = np.sqrt(np.maximum(discriminant, 0.0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        first = (-half_b - root) / a
+        second = (-half_b + root) / a
+    low = np.minimum(first, second)
+    high = np.maximum(first, second)
+    # The point estimate always lies inside the region. With a significant
+    # slope (a > 0) the region is [low, high]; otherwise it is the unbounded
+    # ray on the point estimate's side of the roots
+    with np.errstate(divide="ignore", invalid="ignore"):
+        estimate = -c / slope
+    significant = a > 0
+    beyond = estimate >= high
+    lower = np.where(significant, low, np.where(beyond, high, -np.inf))
+    upper = np.where(significant, high, np.where(beyond, np.inf, low))
+    lower = np.where(discriminant < 0, -np.inf, lower)
+    upper = np.where(discriminant < 0, np.inf, upper)
+    # A significantly rising trajectory never reaches end of life
+    rising = significant & (slope > 0)
+    lower = np.where(rising, np.inf, lower)
+    upper = np.where(rising, np.inf, upper)
+    # A flat, noiseless trajectory (a = 0, so the roots above are 0/0) never
+    # reaches end of life while it is above it, and always has otherwise
+    flat = (slope == 0) & (k == 0)
+    lower = np.where(flat, np.where(c > 0, np.inf, -np.inf), lower)
+    upper = np.where(flat, np.inf, upper)
+    return mean_x + lower, mean_x + upper
+
+
+def _to_cycles(model: str, x: np.ndarray) -> np.ndarray:
+    x = np.maximum(x, 0.0)
+    return x * x if model == "sqrt" else x
+
+
+def _fit_block(capacity: np.ndarray, cycles: np.ndarray, initial: Optional[np.ndarray],
+               models: Sequence[str], eol_fraction: float, confidence: float) -> Dict:
+    valid = np.isfinite(capacity) & np.isfinite(cycles) & (capacity > 0) & (cycles >= 0)
+    count = valid.sum(axis=1).astype(np.float64)
+    fitted = count >= MIN_FIT_POINTS
+    count = np.where(fitted, count, np.nan)
+
+    if initial is None:
+        # Capacity at each battery's earliest valid cycle
+        first = np.argmin(np.where(valid, cycles, np.inf), axis=1)
+        initial = np.take_along_axis(capacity, first[:, None], axis=1)[:, 0]
+    initial = np.where(fitted, initial, np.nan)
+    last_cycle = np.where(valid, cycles, -np.inf).max(axis=1)
+
+    axes = {}
+
+    def axis(name):
+        if name not in axes:
+            if name == "cycles":
+                values = cycles
+            elif name == "root":
+                values = np.sqrt(np.maximum(cycles, 0.0))
+            elif name == "capacity":
+                values = capacity
+            else:
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    values = np.log(capacity)
+            axes[name] = _centered(values, valid, count)
+        return axes[name]
+
+    mean_capacity, centered_capacity = axis("capacity")
+    total = _row_dot(centered_capacity, centered_capacity)
+    t = t_quantile((1 + confidence) / 2, count - 2)
+
+    result = {"points": np.where(fitted, count, 0).astype(np.int64),
+              "initialCapacity": initial, "lastCycle": np.where(fitted, last_cycle, np.nan)}
+    for model in models:
+        x_name, y_name = _MODEL_AXES[model]
+        mean_x, dx = axis(x_name)
+        mean_y, dy = axis(y_name)
+        sxx = _row_dot(dx, dx)
+        sxy = _row_dot(dx, dy)
+        syy = _row_dot(dy, dy)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slope = sxy / sxx
+            intercept = mean_y - slope * mean_x
+            variance = np.maximum(syy - slope * sxy, 0.0) / (count - 2)
+            slope_error = np.sqrt(variance / sxx)
+            intercept_error = np.sqrt(variance * (1 / count + mean_x * mean_x / sxx))
+
+            if y_name == "log":
+                # Residuals in capacity space, so models compare on the same scale
+                residual = np.where(
+                    valid, capacity - np.exp(intercept[:, None] + slope[:, None] * cycles), 0.0)
+                sse = _row_dot(residual, residual)
+                y_eol = np.log(eol_fraction * initial)
+            else:
+                sse = np.maximum(syy - slope * sxy, 0.0)
+                y_eol = eol_fraction * initial
+            rmse = np.sqrt(sse / count)
+            r_squared = 1 - sse / total
+
+            # Only a fading trajectory reaches end of life
+            x_eol = np.where(slope < 0, (y_eol - intercept) / slope, np.inf)
+            lower, upper = _eol_interval(slope, mean_x, mean_y, sxx, count,
+                                         t * np.sqrt(variance), y_eol)
+
+        reported_intercept = np.exp(intercept) if y_name == "log" else intercept
+        columns = (reported_intercept, slope, intercept_error, slope_error, rmse, r_squared,
+                   _to_cycles(model, x_eol), _to_cycles(model, lower), _to_cycles(model, upper))
+        for name, column in zip(_MODEL_COLUMNS, columns):
+            result[model + name] = np.where(fitted, column, np.nan)
+    return result
+
+
+def fit_capacity_fade(capacity: np.ndarray, cycles: np.ndarray,
+                      initial_capacity: Optional[np.ndarray] = None,
+                      models: Sequence[str] = CAPACITY_FADE_MODELS,
+                      eol_fraction: float = 0.8, confidence: float = 0.95,
+                      chunk_points: int = DEFAULT_FADE_CHUNK_POINTS) -> Dict:
+    """Fit fade models to a batteries × points matrix of capacities.
+
+    ``cycles`` is either one row of cycle numbers shared by every battery or
+    a matrix shaped like ``capacity``. Missing points are NaN. Returns, per
+    battery, ``points`` (valid points used), ``initialCapacity`` (given, or
+    the capacity at the earliest cycle), ``lastCycle``, and for each model
+    ``<model>Intercept`` (capacity at cycle 0), ``<model>Slope``, their
+    standard errors (of ln a for the exponential intercept, i.e. its
+    relative error), ``<model>Rmse`` and ``<model>RSquared`` in capacity
+    units, and ``<model>EolCycle`` with its ``Lower``/``Upper`` bounds.
+    ``bestModel`` is the model with the lowest RMSE and ``eolCycle``,
+    ``eolCycleLower``, ``eolCycleUpper`` and ``remainingCycles`` are its
+    projections. Batteries with fewer than MIN_FIT_POINTS points are NaN
+    and not ``valid``.
+    """
+    unknown = [model for model in models if model not in _MODEL_AXES]
+    if unknown:
+        raise ValueError(f"Unknown fade models {unknown}. Valid models are: {list(CAPACITY_FADE_MODELS)}")
+    if not models:
+        raise ValueError("At least one fade model must be requested")
+    if not 0 < eol_fraction < 1:
+        raise ValueError("End-of-life fraction must be between 0 and 1")
+    if not 0 < confidence < 1:
+        raise ValueError("Confidence must be between 0 and 1")
+    if capacity.ndim != 2:
+        raise ValueError("Capacity must be a batteries × points matrix")
+    batteries, points = capacity.shape
+    shared_cycles = cycles.ndim == 1
+    if cycles.shape != ((points,) if shared_cycles else capacity.shape):
+        raise ValueError("Cycles must have one value per capacity point")
+    if initial_capacity is not None and initial_capacity.shape != (batteries,):
+        raise ValueError("Initial capacity must have one value per battery")
+
+    result = {}
+    rows = max(1, chunk_points // max(points, 1))
+    # An empty fleet still runs one (empty) block, so every column exists
+    for start in range(0, max(batteries, 1), rows):
+        stop = min(start + rows, batteries)
+        block_cycles = cycles if shared_cycles else cycles[start:stop]
+        block = _fit_block(
+            capacity[start:stop].astype(np.float64),
+            np.broadcast_to(np.asarray(block_cycles, dtype=np.float64), (stop - start, points)),
+            None if initial_capacity is None else np.asarray(initial_capacity[start:stop], dtype=np.float64),
+            models, eol_fraction, confidence)
+        for name, column in block.items():
+            if name not in result:
+                result[name] = np.empty(batteries, dtype=column.dtype)
+            result[name][start:stop] = column
+
+    rmse = np.stack([result[model + "Rmse"] for model in models])
+    valid = np.isfinite(rmse).any(axis=0)
+    best = np.argmin(np.where(np.isfinite(rmse), rmse, np.inf), axis=0)
+    names = np.array(models, dtype=object)
+    result["valid"] = valid
+    result["bestModel"] = np.where(valid, names[best], None)
+    for name in ("EolCycle", "EolCycleLower", "EolCycleUpper"):
+        column = np.stack([result[model + name] for model in models])
+        result[name[0].lower() + name[1:]] = np.where(valid, column[best, np.arange(batteries)], np.nan)
+    result["remainingCycles"] = np.maximum(result["eolCycle"] - result["lastCycle"], 0.0)
+    return result
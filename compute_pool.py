@@ -0,0 +1,314 @@
+"""Process-pool offload for CPU-heavy diagnostics.
+
+Handlers run on the event loop, so a large batch computed inline stalls
+every other request on the worker, /health included. ComputePool.run()
+decides per call:
+
+- small calls run inline, as before, because a round trip to another
+  process costs far more than they do;
+- calls whose size is at least ``min_elements`` elements, or whose
+  estimated cost is at least ``min_seconds``, go to a process pool. The
+  size is the number of elements in the NumPy/list payload, unless the
+  caller passes the work it knows the call does (e.g. batteries × draws).
+  The estimate is the operation's recent seconds per element, learned from
+  every run, times the call's size.
+
+Workers are started and warmed (engine modules imported) by start() and
+reused for every call. NumPy arrays of at least ``shared_memory_min_bytes``
+travel through multiprocessing.shared_memory in both directions, so only a
+small descriptor is pickled. Workers attach to the caller's blocks without
+copying, and results are copied once out of the worker's blocks.
+
+Offloaded calls record their queue wait (submission until a worker starts
+the call, including the transfer) separately from their compute time.
+"""
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from time import monotonic, perf_counter
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+
+import numpy as np
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Worker processes per API worker; 0 runs every calculation inline
+DEFAULT_COMPUTE_POOL_WORKERS = int(os.environ.get("COMPUTE_POOL_WORKERS", "2"))
+# Calls with at least this many array/list elements are offloaded
+DEFAULT_OFFLOAD_MIN_ELEMENTS = int(os.environ.get("COMPUTE_OFFLOAD_MIN_ELEMENTS", "200000"))
+# Calls estimated to take at least this many seconds are offloaded
+DEFAULT_OFFLOAD_MIN_SECONDS = float(os.environ.get("COMPUTE_OFFLOAD_MIN_SECONDS", "0.02"))
+# Smaller arrays are pickled; copying them through shared memory costs more
+DEFAULT_SHARED_MEMORY_MIN_BYTES = int(os.environ.get("COMPUTE_SHARED_MEMORY_MIN_BYTES", "65536"))
+
+# Modules imported by the fork server and by every worker before its first call
+WARM_MODULES = ("numpy", "battery_diagnostics", "batch_diagnostics", "capacity_fade", "cycle_life")
+# Weight of the newest run in an operation's seconds-per-element estimate
+COST_SMOOTHING = 0.2
+
+EXECUTOR_INLINE = "inline"
+EXECUTOR_PROCESS = "process"
+
+
+class SharedArray(NamedTuple):
+    """Pickled in place of an array that travels through shared memory"""
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+def payload_size(value: Any) -> int:
+    """Number of array and list elements in call arguments"""
+    if isinstance(value, np.ndarray):
+        return value.size
+    if isinstance(value, (list, tuple)):
+        return len(value) + sum(payload_size(item) for item in value
+                                if isinstance(item, (np.ndarray, list, tuple, dict)))
+    if isinstance(value, dict):
+        return sum(payload_size(item) for item in value.values())
+    return 0
+
+
+def _share(value: Any, blocks: List[shared_memory.SharedMemory], min_bytes: int) -> Any:
+    """Copy large numeric arrays in ``value`` into new shared memory blocks"""
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind not in "biuf" or value.nbytes < max(min_bytes, 1):
+            # Pickled; a view would keep its base (possibly shared memory) alive
+            return value if value.base is None else value.copy()
+        block = shared_memory.SharedMemory(create=True, size=value.nbytes)
+        blocks.append(block)
+        np.ndarray(value.shape, value.dtype, buffer=block.buf)[...] = value
+        return SharedArray(block.name, value.shape, value.dtype.str)
+    if isinstance(value, dict):
+        return {key: _share(item, blocks, min_bytes) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_share(item, blocks, min_bytes) for item in value)
+    return value
+
+
+def _attach(value: Any, blocks: List[shared_memory.SharedMemory]) -> Any:
+    """Views over the shared memory blocks described in ``value``"""
+    if isinstance(value, SharedArray):
+        block = shared_memory.SharedMemory(name=value.name)
+        blocks.append(block)
+        return np.ndarray(value.shape, np.dtype(value.dtype), buffer=block.buf)
+    if isinstance(value, dict):
+        return {key: _attach(item, blocks) for key, item in value.items()}
+    if isinstance(value, (list, tuple)) and not isinstance(value, SharedArray):
+        return type(value)(_attach(item, blocks) for item in value)
+    return value
+
+
+def _release(blocks: List[shared_memory.SharedMemory], unlink: bool):
+    for block in blocks:
+        try:
+            block.close()
+        except BufferError:
+            # A view is still referenced (e.g. by a traceback); the mapping
+            # goes away with it
+            pass
+        if unlink:
+            try:
+                block.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _collect(value: Any) -> Any:
+    """Copy a worker's shared result into private arrays and free its blocks"""
+    blocks: List[shared_memory.SharedMemory] = []
+    try:
+        return _share(_attach(value, blocks), [], min_bytes=np.iinfo(np.int64).max)
+    finally:
+        _release(blocks, unlink=True)
+
+
+def _discard(value: Any):
+    """Free a worker's shared result without copying it"""
+    blocks: List[shared_memory.SharedMemory] = []
+    _attach(value, blocks)
+    _release(blocks, unlink=True)
+
+
+def _abandon(blocks: List[shared_memory.SharedMemory], future: Future):
+    """Done callback of a call whose caller went away: free its result, then its inputs"""
+    try:
+        if not future.cancelled() and future.exception() is None:
+            _discard(future.result()[0])
+    finally:
+        _release(blocks, unlink=True)
+
+
+def _warm():
+    for module in WARM_MODULES:
+        __import__(module)
+    return os.getpid()
+
+
+def _call(fn: Callable, args: tuple, kwargs: dict, blocks: List[shared_memory.SharedMemory],
+          results: List[shared_memory.SharedMemory], min_bytes: int) -> Any:
+    args = _attach(args, blocks)
+    kwargs = _attach(kwargs, blocks)
+    # _share copies every array, so nothing returned points into the inputs
+    return _share(fn(*args, **kwargs), results, min_bytes)
+
+
+def _run_in_worker(fn: Callable, args: tuple, kwargs: dict, min_bytes: int):
+    """Worker side of ComputePool.run(): returns (result, start time, compute seconds)"""
+    started = monotonic()
+    blocks: List[shared_memory.SharedMemory] = []
+    results: List[shared_memory.SharedMemory] = []
+    try:
+        result = _call(fn, args, kwargs, blocks, results, min_bytes)
+    except BaseException:
+        _release(results, unlink=True)
+        raise
+    finally:
+        _release(blocks, unlink=False)
+    # The caller unlinks the result blocks once it has copied them
+    _release(results, unlink=False)
+    return result, started, monotonic() - started
+
+
+def create_process_pool(workers: int) -> ProcessPoolExecutor:
+    """Process pool whose workers start from a fork server with the engine preloaded"""
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(list(WARM_MODULES))
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_warm)
+
+
+class ComputePool:
+    """Runs diagnostics inline or in warm worker processes, by size and cost"""
+
+    def __init__(self, workers: int = DEFAULT_COMPUTE_POOL_WORKERS,
+                 min_elements: int = DEFAULT_OFFLOAD_MIN_ELEMENTS,
+                 min_seconds: float = DEFAULT_OFFLOAD_MIN_SECONDS,
+                 shared_memory_min_bytes: int = DEFAULT_SHARED_MEMORY_MIN_BYTES):
+        self.workers = workers
+        self.min_elements = min_elements
+        self.min_seconds = min_seconds
+        self.shared_memory_min_bytes = shared_memory_min_bytes
+        # Recent seconds per payload element, by operation
+        self.cost: Dict[str, float] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def running(self) -> bool:
+        return self._executor is not None
+
+    async def start(self):
+        if self.workers <= 0 or self._executor is not None:
+            return
+        self._executor = create_process_pool(self.workers)
+        loop = asyncio.get_running_loop()
+        # One call per worker so every process is spawned and warm before traffic
+        pids = await asyncio.gather(*[
+            loop.run_in_executor(self._executor, _warm) for _ in range(self.workers)])
+        logger.info("Compute pool started with %s workers", len(set(pids)))
+
+    async def stop(self):
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.to_thread(executor.shutdown)
+
+    def should_offload(self, operation: str, size: int) -> bool:
+        if self._executor is None:
+            return False
+        if size >= self.min_elements:
+            return True
+        rate = self.cost.get(operation)
+        return rate is not None and rate * size >= self.min_seconds
+
+    def _learn(self, operation: str, size: int, seconds: float):
+        if size <= 0:
+            return
+        rate = seconds / size
+        previous = self.cost.get(operation)
+        self.cost[operation] = rate if previous is None else (
+            previous + COST_SMOOTHING * (rate - previous))
+
+    async def run(self, operation: str, fn: Callable, *args, work: Optional[int] = None,
+                  **kwargs) -> Any:
+        """Call ``fn(*args, **kwargs)``, labelling metrics with ``operation``.
+
+        ``work`` is the call's size in elements when its payload understates
+        it, so that a call is offloaded before its cost has been learned.
+        ``fn`` must be importable by name (a module-level function or a
+        static method) for it to be offloaded.
+        """
+        size = payload_size(args) + payload_size(kwargs) if work is None else work
+        if not self.should_offload(operation, size):
+            with metrics.time_compute(operation) as timer:
+                result = fn(*args, **kwargs)
+            metrics.executions.inc((operation, EXECUTOR_INLINE))
+            self._learn(operation, size, perf_counter() - timer.start)
+            return result
+
+        submitted = monotonic()
+        try:
+            shared_result, started, compute = await self._offload(fn, args, kwargs)
+        except BrokenProcessPool:
+            logger.error("Compute pool broke during %s; restarting it", operation)
+            await self._restart()
+            # Still too big for the event loop, so the retry runs in a thread
+            with metrics.time_compute(operation):
+                return await asyncio.to_thread(fn, *args, **kwargs)
+
+        result = await asyncio.to_thread(_collect, shared_result)
+
+        metrics.observe_offload(operation, max(started - submitted, 0.0), compute)
+        metrics.executions.inc((operation, EXECUTOR_PROCESS))
+        self._learn(operation, size, compute)
+        return result
+
+    async def _offload(self, fn: Callable, args: tuple, kwargs: dict) -> Tuple[Any, float, float]:
+        """Run a call in a worker: returns its shared result, start time and compute seconds.
+
+        The input blocks are unlinked once the worker is done with them. If the
+        caller is cancelled first, the worker may still attach them or create
+        result blocks, so a callback frees both when the work finishes.
+        """
+        blocks: List[shared_memory.SharedMemory] = []
+        # Copies run in a thread (NumPy releases the GIL) so the loop keeps serving
+        sharing = asyncio.ensure_future(asyncio.to_thread(
+            _share, (args, kwargs), blocks, self.shared_memory_min_bytes))
+        try:
+            shared_args, shared_kwargs = await asyncio.shield(sharing)
+            future = self._executor.submit(
+                _run_in_worker, fn, shared_args, shared_kwargs, self.shared_memory_min_bytes)
+        except asyncio.CancelledError:
+            # The copy carries on in its thread and may still create blocks
+            sharing.add_done_callback(lambda _: _release(blocks, unlink=True))
+            raise
+        except BaseException:
+            _release(blocks, unlink=True)
+            raise
+
+        try:
+            result = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Cancelling the wrapper cancels ``future`` unless a worker already has it
+            future.add_done_callback(functools.partial(_abandon, blocks))
+            raise
+        except BaseException:
+            _release(blocks, unlink=True)
+            raise
+        _release(blocks, unlink=True)
+        return result
+
+    async def _restart(self):
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        await self.start()
+
+
+# Offload executor shared by every request served by this process
+compute_pool = ComputePool()
@@ -0,0 +1,144 @@
+"""Monte Carlo cycle-life projection for battery fleets.
+
+estimate_cycle_life turns one depth of discharge, temperature and SOH into
+one remaining-cycles number. simulate_cycle_life treats each of them as
+uncertain instead: for every battery it draws ``draws`` scenarios
+
+- depth of discharge ~ Normal(mean, dod_std), clipped to 0-100 %
+- average temperature ~ Normal(mean, temperature_std)
+- current SOH ~ Normal(mean, soh_std), clipped to 0-100 %
+
+and pushes them all through the same model (BatchDiagnostics.
+remaining_cycles), so with zero spread every draw is the point estimate.
+The draws are summarized per battery as the mean, standard deviation and
+percentiles of the remaining cycles, and the matching end-of-life dates at
+``cycles_per_day``.
+
+Draws come from one seeded numpy.random.Generator, so a request repeated
+with the same seed returns the same numbers. The fleet is processed
+``CHUNK_DRAWS`` scenarios at a time (memory stays bounded), and the total
+number of scenarios per call is capped by ``draw_budget``: larger fleets get
+fewer draws per battery, which keeps the latency of a call bounded.
+"""
+from typing import Dict, Optional, Sequence
+import os
+
+import numpy as np
+
+from batch_diagnostics import BatchDiagnostics
+
+# Scenarios drawn per call across all batteries (bounds the latency of a call)
+DEFAULT_DRAW_BUDGET = int(os.environ.get("CYCLE_LIFE_DRAW_BUDGET", "10000000"))
+
+DEFAULT_DRAWS = 20000
+# Fewer draws per battery than this would make the tail percentiles noise
+MIN_DRAWS = 1000
+# Largest fleet the draw budget covers at MIN_DRAWS per battery
+MAX_SIMULATED_BATTERIES = DEFAULT_DRAW_BUDGET // MIN_DRAWS
+DEFAULT_PERCENTILES = (5.0, 10.0, 50.0, 90.0, 95.0)
+# Scenarios held in memory at once; fixed, so results never depend on the host
+CHUNK_DRAWS = 1000000
+
+
+def percentile_name(percentile: float) -> str:
+    """Column suffix of a percentile, e.g. P5 or P97.5"""
+    return f"P{percentile:g}"
+
+
+def draws_within_budget(batteries: int, draws: int = DEFAULT_DRAWS,
+                        draw_budget: int = DEFAULT_DRAW_BUDGET) -> int:
+    """Draws per battery: ``draws``, reduced so the fleet stays within the budget"""
+    affordable = draw_budget // max(batteries, 1)
+    if affordable < MIN_DRAWS:
+        raise ValueError(
+            f"{batteries} batteries need at least {batteries * MIN_DRAWS} draws; "
+            f"the budget is {draw_budget}")
+    return min(draws, affordable)
+
+
+def _normal(rng: np.random.Generator, mean: np.ndarray, std: float, shape,
+            dtype=np.float32) -> np.ndarray:
+    """Normal draws around each row's mean.
+
+    Standard draws scaled in place are several times faster than
+    Generator.normal with an array of means.
+    """
+    values = rng.standard_normal(shape, dtype=dtype)
+    values *= dtype(std)
+    values += mean[:, None].astype(dtype)
+    return values
+
+
+def simulate_cycle_life(depth_of_discharge: np.ndarray, avg_temperature: np.ndarray,
+                        current_soh: np.ndarray, dod_std: float = 10.0,
+                        temperature_std: float = 5.0, soh_std: float = 2.0,
+                        cycles_per_day: float = 2.0, draws: int = DEFAULT_DRAWS,
+                        seed: Optional[int] = None,
+                        percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+                        horizon_days: Optional[float] = None,
+                        draw_budget: int = DEFAULT_DRAW_BUDGET) -> Dict:
+    """Distribution of remaining cycles and end-of-life date for each battery.
+
+    Returns ``draws`` (per battery, after the budget), ``seed`` (drawn when
+    not given, so the run can be repeated), and per battery
+    ``remainingCyclesMean``, ``remainingCyclesStd``, ``remainingCyclesP<p>``
+    and ``eolDateP<p>`` for each percentile, and, with ``horizon_days``,
+    ``eolProbability``: the share of scenarios reaching end of life within
+    that many days.
+    """
+    depth_of_discharge = np.asarray(depth_of_discharge, dtype=np.float64)
+    avg_temperature = np.asarray(avg_temperature, dtype=np.float64)
+    current_soh = np.asarray(current_soh, dtype=np.float64)
+    batteries = len(depth_of_discharge)
+    if avg_temperature.shape != (batteries,) or current_soh.shape != (batteries,):
+        raise ValueError("Every input must have one value per battery")
+    if min(dod_std, temperature_std, soh_std) < 0:
+        raise ValueError("Standard deviations cannot be negative")
+    if cycles_per_day <= 0:
+        raise ValueError("Cycles per day must be positive")
+    if draws < MIN_DRAWS:
+        raise ValueError(f"At least {MIN_DRAWS} draws per battery are required")
+    percentiles = np.asarray(percentiles, dtype=np.float64)
+    if not ((percentiles >= 0) & (percentiles <= 100)).all():
+        raise ValueError("Percentiles must be between 0 and 100")
+
+    draws = draws_within_budget(batteries, draws, draw_budget)
+    if seed is None:
+        seed = int(np.random.SeedSequence().entropy % 2 ** 63)
+    rng = np.random.default_rng(seed)
+
+    names = [percentile_name(percentile) for percentile in percentiles]
+    result = {"draws": draws, "seed": seed,
+              "remainingCyclesMean": np.empty(batteries),
+              "remainingCyclesStd": np.empty(batteries)}
+    for name in names:
+        result["remainingCycles" + name] = np.empty(batteries)
+    if horizon_days is not None:
+        result["eolProbability"] = np.empty(batteries)
+
+    rows = max(1, CHUNK_DRAWS // draws)
+    for start in range(0, batteries, rows):
+        stop = min(start + rows, batteries)
+        shape = (stop - start, draws)
+        dod = _normal(rng, depth_of_discharge[start:stop], dod_std, shape)
+        temperature = _normal(rng, avg_temperature[start:stop], temperature_std, shape)
+        # SOH scales the cycle count, so it stays double precision for
+        # whole-cycle results that match estimate_cycle_life
+        soh = _normal(rng, current_soh[start:stop], soh_std, shape, np.float64)
+        np.clip(dod, 0, 100, out=dod)
+        np.clip(soh, 0, 100, out=soh)
+        remaining = BatchDiagnostics.remaining_cycles(dod, temperature, soh)
+
+        result["remainingCyclesMean"][start:stop] = remaining.mean(axis=1)
+        result["remainingCyclesStd"][start:stop] = remaining.std(axis=1)
+        values = np.percentile(remaining, percentiles, axis=1)
+        for name, value in zip(names, values):
+            result["remainingCycles" + name][start:stop] = value
+        if horizon_days is not None:
+            result["eolProbability"][start:stop] = (
+                remaining <= horizon_days * cycles_per_day).mean(axis=1)
+
+    for name in names:
+        result["eolDate" + name] = BatchDiagnostics.eol_dates(
+            result["remainingCycles" + name], cycles_per_day)
+    return result
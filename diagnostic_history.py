@@ -0,0 +1,392 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+from datetime import datetime
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from fast_json import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HISTORY_SIZE = int(os.environ.get("DIAGNOSTIC_HISTORY_SIZE", "10000"))
+# Bound on distinct type/batteryType names; later names are recorded as "other"
+MAX_INTERNED_NAMES = 4096
+
+DEFAULT_HISTORY_BACKEND = os.environ.get("DIAGNOSTIC_HISTORY_BACKEND", "sqlite")
+DEFAULT_HISTORY_URL = os.environ.get("DIAGNOSTIC_HISTORY_URL", "sqlite:///diagnostic_history.db")
+DEFAULT_FLUSH_INTERVAL = float(os.environ.get("DIAGNOSTIC_HISTORY_FLUSH_INTERVAL", "0.5"))
+DEFAULT_FLUSH_BATCH_SIZE = int(os.environ.get("DIAGNOSTIC_HISTORY_FLUSH_BATCH_SIZE", "500"))
+DEFAULT_MAX_PENDING = int(os.environ.get("DIAGNOSTIC_HISTORY_MAX_PENDING", "100000"))
+
+
+class HistoryBackend(ABC):
+    """Interface shared by the diagnostic history backends"""
+
+    @abstractmethod
+    def record(self, diagnostic_type: str, battery_type: str, result: Dict) -> Optional[int]:
+        """Store a diagnostic result without blocking the caller"""
+
+    @abstractmethod
+    def page(self, limit: int = 100, cursor: Optional[int] = None,
+             since: Optional[datetime] = None, until: Optional[datetime] = None,
+             diagnostic_type: Optional[str] = None,
+             battery_type: Optional[str] = None) -> Tuple[List[Dict], Optional[int]]:
+        """Return up to ``limit`` matching entries in recording order and the next cursor.
+
+        ``cursor`` is the id of the first entry to consider (as handed out by a
+        previous page); ``since``/``until`` bound the recording time and
+        ``diagnostic_type``/``battery_type`` select exact matches. The next
+        cursor is None once no further entries can match.
+        """
+
+    async def fetch_page(self, **kwargs) -> Tuple[List[Dict], Optional[int]]:
+        """Awaitable form of page() for use from request handlers"""
+        return self.page(**kwargs)
+
+    async def iter_entries(self, chunk_size: int = 500, **filters) -> AsyncIterator[Dict]:
+        """Yield every matching entry, holding at most one page in memory"""
+        cursor = filters.pop("cursor", None)
+        while True:
+            entries, cursor = await self.fetch_page(limit=chunk_size, cursor=cursor, **filters)
+            for entry in entries:
+                yield entry
+            if cursor is None:
+                return
+
+    async def start(self):
+        """Start any background work the backend needs"""
+
+    async def stop(self):
+        """Stop background work and persist anything still buffered"""
+
+
+class _IdIndex:
+    """Ascending entry ids for one interned name, pruned from the front"""
+
+    __slots__ = ("ids", "head")
+
+    def __init__(self):
+        self.ids: List[int] = []
+        self.head = 0
+
+    def append(self, entry_id: int, oldest_id: int):
+        self.ids.append(entry_id)
+        while self.ids[self.head] < oldest_id:
+            self.head += 1
+        if self.head > 1024 and self.head * 2 > len(self.ids):
+            del self.ids[:self.head]
+            self.head = 0
+
+    def ids_from(self, first_id: int, last_id: int, limit: int) -> Tuple[List[int], Optional[int]]:
+        """Up to ``limit`` ids in [first_id, last_id) and the id after them"""
+        pos = bisect_left(self.ids, first_id, self.head)
+        end = bisect_left(self.ids, last_id, pos)
+        stop = min(pos + limit, end)
+        return self.ids[pos:stop], (self.ids[stop] if stop < end else None)
+
+
+class DiagnosticHistory(HistoryBackend):
+    """Fixed-capacity ring buffer of diagnostic results.
+
+    Entries get a monotonically increasing id; entry ``id`` lives in slot
+    ``(id - 1) % capacity`` so the oldest entries are overwritten once the
+    buffer is full. Timestamps and interned type codes are kept in NumPy
+    columns and results are stored as compact JSON bytes. Each interned
+    type and battery type keeps an index of its entry ids so filtered reads
+    never scan unrelated entries.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_HISTORY_SIZE):
+        if capacity < 1:
+            raise ValueError("History capacity must be positive")
+        self.capacity = capacity
+        self._timestamps = np.zeros(capacity, dtype=np.float64)
+        self._types = np.zeros(capacity, dtype=np.uint16)
+        self._battery_types = np.zeros(capacity, dtype=np.uint16)
+        self._results: List[Optional[bytes]] = [None] * capacity
+        self._names: List[str] = ["other"]
+        self._codes: Dict[str, int] = {"other": 0}
+        self._type_index: Dict[int, _IdIndex] = {}
+        self._battery_type_index: Dict[int, _IdIndex] = {}
+        self._next_id = 1
+        logger.info(f"Diagnostic history initialized with capacity {capacity}")
+
+    def _intern(self, name: str) -> int:
+        code = self._codes.get(name)
+        if code is None:
+            if len(self._names) >= MAX_INTERNED_NAMES:
+                return 0
+            code = len(self._names)
+            self._codes[name] = code
+            self._names.append(name)
+        return code
+
+    @property
+    def oldest_id(self) -> int:
+        """Id of the oldest entry still held in the buffer"""
+        return max(1, self._next_id - self.capacity)
+
+    def __len__(self) -> int:
+        return self._next_id - self.oldest_id
+
+    def record(self, diagnostic_type: str, battery_type: str, result: Dict) -> int:
+        """Store a diagnostic result and return its id"""
+        entry_id = self._next_id
+        slot = (entry_id - 1) % self.capacity
+        type_code = self._intern(diagnostic_type)
+        battery_code = self._intern(battery_type)
+        self._timestamps[slot] = time.time()
+        self._types[slot] = type_code
+        self._battery_types[slot] = battery_code
+        self._results[slot] = dumps(result)
+        self._next_id = entry_id + 1
+
+        oldest_id = self.oldest_id
+        self._type_index.setdefault(type_code, _IdIndex()).append(entry_id, oldest_id)
+        self._battery_type_index.setdefault(battery_code, _IdIndex()).append(entry_id, oldest_id)
+        return entry_id
+
+    def _entry(self, entry_id: int) -> Dict:
+        slot = (entry_id - 1) % self.capacity
+        return {
+            "id": entry_id,
+            "timestamp": datetime.fromtimestamp(self._timestamps[slot]).isoformat(),
+            "type": self._names[self._types[slot]],
+            "batteryType": self._names[self._battery_types[slot]],
+            "result": loads(self._results[slot])
+        }
+
+    def _first_id_since(self, since: float) -> int:
+        """Binary search for the first entry recorded at or after ``since``"""
+        low, high = self.oldest_id, self._next_id
+        while low < high:
+            mid = (low + high) // 2
+            if self._timestamps[(mid - 1) % self.capacity] < since:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def page(self, limit: int = 100, cursor: Optional[int] = None,
+             since: Optional[datetime] = None, until: Optional[datetime] = None,
+             diagnostic_type: Optional[str] = None,
+             battery_type: Optional[str] = None) -> Tuple[List[Dict], Optional[int]]:
+        start = self.oldest_id
+        if cursor is not None:
+            start = max(start, cursor)
+        if since is not None:
+            start = max(start, self._first_id_since(since.timestamp()))
+        end = self._next_id
+        if until is not None:
+            # Timestamps grow with ids, so the time bound is an id bound too
+            end = min(end, self._first_id_since(until.timestamp() + 1e-6))
+
+        indexes = []
+        for name, index in ((diagnostic_type, self._type_index),
+                            (battery_type, self._battery_type_index)):
+            if name is not None:
+                code = self._codes.get(name)
+                if code is None or code not in index:
+                    return [], None
+                indexes.append(index[code])
+
+        if not indexes:
+            stop = min(start + limit, end) if start < end else start
+            entries = [self._entry(entry_id) for entry_id in range(start, stop)]
+            return entries, (stop if stop < end else None)
+
+        # Walk the shorter index and check the other filter per entry
+        indexes.sort(key=lambda index: len(index.ids) - index.head)
+        entries = []
+        position = start
+        while len(entries) < limit and position is not None:
+            ids, position = indexes[0].ids_from(position, end, limit - len(entries))
+            for entry_id in ids:
+                slot = (entry_id - 1) % self.capacity
+                if diagnostic_type is not None and self._names[self._types[slot]] != diagnostic_type:
+                    continue
+                if battery_type is not None and self._names[self._battery_types[slot]] != battery_type:
+                    continue
+                entries.append(self._entry(entry_id))
+        return entries, position
+
+
+class SQLiteDiagnosticHistory(HistoryBackend):
+    """Durable diagnostic history stored through SQLAlchemy.
+
+    record() only appends to an in-memory queue. A background task started
+    by start() drains the queue every ``flush_interval`` seconds, or as soon
+    as ``batch_size`` entries are waiting, and writes them in one transaction
+    from a worker thread, so request handlers never wait on disk I/O.
+    SQLite databases are switched to WAL mode so readers do not block the
+    writer.
+    """
+
+    def __init__(self, url: str = DEFAULT_HISTORY_URL,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 batch_size: int = DEFAULT_FLUSH_BATCH_SIZE,
+                 max_pending: int = DEFAULT_MAX_PENDING):
+        from sqlalchemy import (
+            Column, Float, Index, Integer, MetaData, String, Table, Text,
+            create_engine, event
+        )
+
+        self.url = url
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._pending: Deque[Tuple[float, str, str, str]] = deque()
+        self._flush_lock = threading.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._dropped = 0
+
+        self.engine = create_engine(url)
+        if self.engine.dialect.name == "sqlite":
+            @event.listens_for(self.engine, "connect")
+            def _configure_sqlite(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                cursor.execute("PRAGMA journal_mode=WAL")
+                cursor.execute("PRAGMA synchronous=NORMAL")
+                cursor.execute("PRAGMA busy_timeout=5000")
+                cursor.close()
+
+        metadata = MetaData()
+        self.table = Table(
+            "diagnostic_history", metadata,
+            Column("id", Integer, primary_key=True, autoincrement=True),
+            Column("timestamp", Float, nullable=False),
+            Column("type", String(64), nullable=False),
+            Column("battery_type", String(128), nullable=False),
+            Column("result", Text, nullable=False),
+            Index("ix_diagnostic_history_timestamp", "timestamp"),
+            Index("ix_diagnostic_history_type", "type"),
+            Index("ix_diagnostic_history_battery_type", "battery_type"),
+        )
+        metadata.create_all(self.engine)
+        logger.info(f"SQLite diagnostic history initialized at {url}")
+
+    def record(self, diagnostic_type: str, battery_type: str, result: Dict) -> Optional[int]:
+        """Queue a diagnostic result for the background writer"""
+        if len(self._pending) >= self.max_pending:
+            self._pending.popleft()
+            self._dropped += 1
+            if self._dropped % 1000 == 1:
+                logger.warning(
+                    f"Diagnostic history queue full, dropped {self._dropped} entries so far")
+        self._pending.append((
+            time.time(), diagnostic_type, battery_type,
+            dumps(result).decode()
+        ))
+        if self._wakeup is not None and len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        return None
+
+    def flush(self) -> int:
+        """Write every queued entry in batched transactions; returns the count"""
+        written = 0
+        with self._flush_lock:
+            while self._pending:
+                batch = []
+                while self._pending and len(batch) < self.batch_size:
+                    timestamp, diagnostic_type, battery_type, result = self._pending.popleft()
+                    batch.append({
+                        "timestamp": timestamp,
+                        "type": diagnostic_type,
+                        "battery_type": battery_type,
+                        "result": result
+                    })
+                with self.engine.begin() as connection:
+                    connection.execute(self.table.insert(), batch)
+                written += len(batch)
+        return written
+
+    async def _writer(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._pending:
+                try:
+                    await asyncio.to_thread(self.flush)
+                except Exception as e:
+                    logger.error(f"Failed to flush diagnostic history: {e}")
+
+    async def start(self):
+        """Start the background writer on the running event loop"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._writer())
+
+    async def stop(self):
+        """Stop the background writer and flush the remaining queue"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._wakeup = None
+        await asyncio.to_thread(self.flush)
+
+    def _entry(self, row) -> Dict:
+        return {
+            "id": row.id,
+            "timestamp": datetime.fromtimestamp(row.timestamp).isoformat(),
+            "type": row.type,
+            "batteryType": row.battery_type,
+            "result": loads(row.result)
+        }
+
+    def page(self, limit: int = 100, cursor: Optional[int] = None,
+             since: Optional[datetime] = None, until: Optional[datetime] = None,
+             diagnostic_type: Optional[str] = None,
+             battery_type: Optional[str] = None) -> Tuple[List[Dict], Optional[int]]:
+        """Return up to ``limit`` matching entries in recording order and the next cursor.
+
+        Entries still queued for the writer are flushed first so callers
+        always see their own writes. Filters are answered from the
+        timestamp/type/battery_type indexes with keyset pagination on id.
+        """
+        from sqlalchemy import select
+
+        self.flush()
+        table = self.table
+        query = select(table).order_by(table.c.id).limit(limit + 1)
+        if cursor is not None:
+            query = query.where(table.c.id >= cursor)
+        if since is not None:
+            query = query.where(table.c.timestamp >= since.timestamp())
+        if until is not None:
+            query = query.where(table.c.timestamp <= until.timestamp())
+        if diagnostic_type is not None:
+            query = query.where(table.c.type == diagnostic_type)
+        if battery_type is not None:
+            query = query.where(table.c.battery_type == battery_type)
+        with self.engine.connect() as connection:
+            rows = connection.execute(query).fetchall()
+        next_cursor = rows[limit].id if len(rows) > limit else None
+        return [self._entry(row) for row in rows[:limit]], next_cursor
+
+    async def fetch_page(self, **kwargs) -> Tuple[List[Dict], Optional[int]]:
+        """Run the query on a worker thread so the event loop is not blocked"""
+        return await asyncio.to_thread(self.page, **kwargs)
+
+
+def create_diagnostic_history(backend: str = DEFAULT_HISTORY_BACKEND) -> HistoryBackend:
+    """Create the configured history backend ("sqlite" or "memory")"""
+    if backend == "memory":
+        return DiagnosticHistory()
+    if backend == "sqlite":
+        return SQLiteDiagnosticHistory()
+    raise ValueError(f"Unknown diagnostic history backend: {backend}")
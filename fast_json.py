@@ -0,0 +1,75 @@
+"""JSON encoding for every response, using orjson when it is installed.
+
+NumPy arrays and scalars are serialized directly (orjson's native NumPy
+support, or a ``default`` hook on the stdlib path), so handlers can return
+engine output without converting it to lists first. Non-finite floats (NaN
+and +/-inf) become ``null`` on both paths, as orjson encodes them, so
+rejected batch rows can stay NaN in the arrays.
+"""
+from typing import Any
+import json
+import math
+
+import numpy as np
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised only without orjson
+    orjson = None
+
+ORJSON_OPTIONS = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+
+def _finite_only(content: Any) -> Any:
+    if isinstance(content, float) and not math.isfinite(content):
+        return None
+    if isinstance(content, dict):
+        return {key: _finite_only(value) for key, value in content.items()}
+    if isinstance(content, (list, tuple)):
+        return [_finite_only(value) for value in content]
+    return content
+
+
+def _default(value: Any):
+    """Types neither encoder handles natively: non-native arrays and NumPy scalars"""
+    if isinstance(value, np.ndarray):
+        # tolist() nests multi-dimensional arrays, and object arrays may hold floats
+        return _finite_only(value.tolist()) if value.dtype.kind in "fO" else value.tolist()
+    if isinstance(value, np.generic):
+        value = value.item()
+        return None if isinstance(value, float) and not math.isfinite(value) else value
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _stdlib_dumps(content: Any) -> bytes:
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=_default
+    ).encode("utf-8")
+
+
+def dumps(content: Any) -> bytes:
+    """Encode ``content`` as compact UTF-8 JSON"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(content, default=_default, option=ORJSON_OPTIONS)
+        except TypeError:
+            # Values orjson rejects (e.g. integers beyond 64 bits) take the stdlib path
+            pass
+    try:
+        return _stdlib_dumps(content)
+    except ValueError:
+        # Plain non-finite floats, which the stdlib refuses to encode
+        return _stdlib_dumps(_finite_only(content))
+
+
+def loads(data):
+    """Decode JSON bytes or text"""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with :func:`dumps`; the app's default response class"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,190 @@
+from contextvars import ContextVar
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+
+DEFAULT_LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+# "text" keeps the historical line format, "json" writes one object per line
+DEFAULT_LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+# Records are handed to a background thread unless LOG_QUEUE=0
+DEFAULT_LOG_QUEUE = os.environ.get("LOG_QUEUE", "1") != "0"
+DEFAULT_LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+# Fraction of requests whose INFO/DEBUG lines are kept
+DEFAULT_LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "1.0"))
+# Per-route overrides, e.g. "/battery/diagnose/soc=0.01,/battery/diagnose/*=0.1"
+DEFAULT_LOG_SAMPLE_RATES = os.environ.get("LOG_SAMPLE_RATES", "")
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Sampling decision for the current request; records outside a request are kept
+_request_sampled: ContextVar[bool] = ContextVar("request_sampled", default=True)
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """Parse "path=rate,prefix*=rate" into a dict, validating each rate"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        path, _, rate = item.rpartition("=")
+        if not path:
+            raise ValueError(f"Invalid log sample rate: {item}")
+        value = float(rate)
+        if not 0 <= value <= 1:
+            raise ValueError(f"Log sample rate for {path} must be between 0 and 1")
+        rates[path] = value
+    return rates
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record; the message is formatted here, off the event loop"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Drop INFO and below for requests that were not sampled"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or _request_sampled.get()
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks and never formats on the caller's thread.
+
+    The stock prepare() merges the message and arguments before enqueueing.
+    Here the record goes onto the queue as-is, so %-style arguments are
+    formatted by the listener thread. When the queue is full the record is
+    dropped and counted rather than stalling the event loop.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogSamplingMiddleware:
+    """ASGI middleware deciding once per request whether its INFO lines are kept"""
+
+    def __init__(self, app, default_rate: float = DEFAULT_LOG_SAMPLE_RATE,
+                 rates: Optional[Dict[str, float]] = None):
+        self.app = app
+        self.default_rate = default_rate
+        rates = parse_sample_rates(DEFAULT_LOG_SAMPLE_RATES) if rates is None else rates
+        self.exact = {path: rate for path, rate in rates.items() if not path.endswith("*")}
+        # Longest prefix first, so the most specific pattern wins
+        self.prefixes = sorted(
+            ((path[:-1], rate) for path, rate in rates.items() if path.endswith("*")),
+            key=lambda item: len(item[0]), reverse=True
+        )
+
+    def rate_for(self, path: str) -> float:
+        rate = self.exact.get(path)
+        if rate is not None:
+            return rate
+        for prefix, rate in self.prefixes:
+            if path.startswith(prefix):
+                return rate
+        return self.default_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        rate = self.rate_for(scope["path"])
+        if rate >= 1:
+            await self.app(scope, receive, send)
+            return
+        token = _request_sampled.set(random.random() < rate)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_sampled.reset(token)
+
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+_configured = False
+
+
+def configure_logging(level: str = DEFAULT_LOG_LEVEL, log_format: str = DEFAULT_LOG_FORMAT,
+                      use_queue: bool = DEFAULT_LOG_QUEUE,
+                      queue_size: int = DEFAULT_LOG_QUEUE_SIZE):
+    """Install the root handlers; replaces logging.basicConfig.
+
+    With ``use_queue`` the root logger only enqueues records, and a
+    QueueListener thread owns the stream handler, so formatting and I/O
+    never run on the event loop. Calling this again is a no-op.
+    """
+    global _listener, _queue_handler, _configured
+    if _configured:
+        return
+    _configured = True
+
+    if log_format == "json":
+        formatter = JSONFormatter()
+    elif log_format == "text":
+        formatter = logging.Formatter(TEXT_FORMAT)
+    else:
+        raise ValueError(f"Unknown log format: {log_format}")
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    if use_queue:
+        _queue_handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+        _queue_handler.addFilter(SamplingFilter())
+        _listener = QueueListener(_queue_handler.queue, stream_handler,
+                                  respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+        root.addHandler(_queue_handler)
+    else:
+        stream_handler.addFilter(SamplingFilter())
+        root.addHandler(stream_handler)
+
+
+def stop_logging():
+    """Drain the queue and stop the listener thread.
+
+    Its handlers move onto the root logger, so anything logged during
+    interpreter shutdown is still written (synchronously).
+    """
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    _listener.stop()
+    root = logging.getLogger()
+    root.removeHandler(_queue_handler)
+    for handler in _listener.handlers:
+        handler.addFilter(SamplingFilter())
+        root.addHandler(handler)
+    if _queue_handler.dropped:
+        logging.getLogger(__name__).warning(
+            "Dropped %d log records while the queue was full", _queue_handler.dropped)
+    _listener = None
+    _queue_handler = None
@@ -1,25 +1,41 @@
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from datetime import datetime
 from typing import Optional, List
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, Field, ValidationError, validator
 import logging
 import os
-from starlette.responses import JSONResponse
+
+import numpy as np
+from starlette.responses import PlainTextResponse, StreamingResponse
 from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.requests import ClientDisconnect
 
 from models import (
-    BatteryParameters, SOCRequest, SOHRequest, ResistanceRequest, VoltageRequest,
-    CapacityFadeRequest, CellBalanceRequest, SafetyRequest, ThermalRequest,
-    CycleLifeRequest, FaultRequest
+    BatteryParameters, SOCRequest, SOCBatchRequest, TrackedSOCRequest, SOHRequest, ResistanceRequest, VoltageRequest,
+    CapacityFadeRequest, CapacityFadeFitRequest, CellBalanceRequest, PackBalanceRequest, SafetyRequest, ThermalRequest,
+    CycleLifeRequest, CycleLifeSimulationRequest, RainflowRequest, FaultRequest, FullDiagnosticRequest, BatchJobRequest
 )
 from battery_diagnostics import BatteryDiagnostics
+from batch_diagnostics import BatchDiagnostics
+from diagnostic_history import create_diagnostic_history
+from rate_limiter import RateLimiter, RateLimitMiddleware, create_rate_limit_backend
+from metrics import METRICS_CONTENT_TYPE, MetricsMiddleware, metrics
+from fast_json import FastJSONResponse, dumps
+from body_codecs import encoded_response, media_type_of, negotiate, request_body, request_body_openapi, JSON_MEDIA_TYPE
+from logging_config import LogSamplingMiddleware, configure_logging
+from telemetry_stream import DuplexStreamingResponse, stream_state
+from soc_tracking import filtered_soc, soc_filter, soc_tracker, tracked_soc
+from compute_pool import compute_pool
+from capacity_fade import fit_capacity_fade
+from cycle_life import draws_within_budget, simulate_cycle_life
+from rainflow import DEPTH_BINS, MEAN_SOC_BINS, counted_cycles, rainflow_counter
+from batch_jobs import JobRunner, UploadTooLarge, UPLOAD_FORMATS
+from api_key_manager import api_key_manager, hash_key
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging (queued to a background thread unless LOG_QUEUE=0)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 app = FastAPI(
@@ -27,7 +43,16 @@ app = FastAPI(
     description="Advanced Battery Diagnostics and Analysis API",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=FastJSONResponse
+)
+
+# Per-key token bucket on every /battery/diagnose/* route; only existing keys get a bucket
+rate_limiter = RateLimiter(create_rate_limit_backend())
+app.add_middleware(
+    RateLimitMiddleware,
+    limiter=rate_limiter,
+    is_known=api_key_manager.is_known_async
 )
 
 # Enable CORS for Replit environment
@@ -39,17 +64,27 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-# For testing without database
-test_db = {
-    "diagnostic_history": [],
-    "prediction_history": []
-}
+# Per-route sampling of INFO logs (LOG_SAMPLE_RATE / LOG_SAMPLE_RATES)
+app.add_middleware(LogSamplingMiddleware)
+
+# Outermost, so latency includes CORS and rate limiting
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+# Endpoints keeping per-battery state in this process. run.py turns them off
+# when several workers would each hold a different copy of that state
+STATEFUL_ENDPOINTS = os.environ.get("STATEFUL_ENDPOINTS", "1") == "1"
+STATEFUL_ENDPOINTS_DISABLED = "Stateful endpoints are disabled on servers running several workers"
+
+# Diagnostic history backend (SQLite by default, shared by all workers)
+diagnostic_history = create_diagnostic_history()
+# Fleet-scale batch jobs, persisted under BATCH_JOBS_DIR and shared by all workers
+job_runner = JobRunner()
 
 @app.exception_handler(StarletteHTTPException)
 async def http_exception_handler(request, exc):
     """Custom exception handler for HTTP errors"""
-    logger.error(f"HTTP error occurred: {exc.detail}")
-    return JSONResponse(
+    logger.error("HTTP error occurred: %s", exc.detail)
+    return FastJSONResponse(
         status_code=exc.status_code,
         content={
             "detail": exc.detail,
@@ -60,8 +95,8 @@ async def http_exception_handler(request, exc):
 @app.exception_handler(404)
 async def not_found_exception_handler(request, exc):
     """Custom 404 handler"""
-    logger.error(f"404 error: Path {request.url.path} not found")
-    return JSONResponse(
+    logger.error("404 error: Path %s not found", request.url.path)
+    return FastJSONResponse(
         status_code=404,
         content={
             "detail": "The requested resource was not found",
@@ -72,8 +107,10 @@ async def not_found_exception_handler(request, exc):
                 "/api-list",
                 "/api-detail/{parameter}",
                 "/battery/diagnose/soc",
+                "/battery/diagnose/soc/batch",
                 "/battery/diagnose/soh",
                 "/battery/diagnose/resistance",
+                "/battery/diagnose/full",
                 "/battery/logs"
             ]
         }
@@ -83,19 +120,29 @@ async def not_found_exception_handler(request, exc):
 async def startup_event():
     """Execute on application startup"""
     logger.info("FastAPI application starting up...")
+    await diagnostic_history.start()
+    await api_key_manager.start()
+    await rate_limiter.start()
+    await metrics.start()
+    await compute_pool.start()
+    await job_runner.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Execute on application shutdown"""
     logger.info("FastAPI application shutting down...")
-
-from api_key_manager import api_key_manager
+    await diagnostic_history.stop()
+    await api_key_manager.stop()
+    await rate_limiter.stop()
+    await metrics.stop()
+    await job_runner.stop()
+    await compute_pool.stop()
 
 @app.get("/")
 async def root():
     """Root endpoint to verify API is running"""
     logger.info("Root endpoint accessed")
-    return JSONResponse({
+    return FastJSONResponse({
         "status": "online",
         "message": "Welcome to Battery OS API",
         "documentation": "/docs",
@@ -107,15 +154,15 @@ async def health_check():
     """Health check endpoint"""
     logger.info("Health check endpoint accessed")
     try:
-        return JSONResponse({
+        return FastJSONResponse({
             "status": "healthy",
             "timestamp": datetime.now().isoformat(),
             "version": "1.0.0",
             "server": "FastAPI"
         })
     except Exception as e:
-        logger.error(f"Health check failed: {e}")
-        return JSONResponse(
+        logger.error("Health check failed: %s", e)
+        return FastJSONResponse(
             status_code=500,
             content={
                 "status": "unhealthy",
@@ -123,14 +170,21 @@ async def health_check():
             }
         )
 
-@app.post("/battery/diagnose/soc")
-async def diagnose_soc(request: SOCRequest, x_api_key: Optional[str] = Header(None)):
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Request and computation metrics in Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+@app.post("/battery/diagnose/soc", openapi_extra=request_body_openapi(SOCRequest))
+async def diagnose_soc(request: SOCRequest = Depends(request_body(SOCRequest)),
+                       x_api_key: Optional[str] = Header(None),
+                       accept: Optional[str] = Header(None)):
     """Calculate State of Charge based on voltage"""
     if not x_api_key:
         raise HTTPException(status_code=422, detail="API key is required")
         
     # Validate API key usage
-    if not api_key_manager.validate_key(x_api_key):
+    if not await api_key_manager.validate_key_async(x_api_key):
         raise HTTPException(status_code=401, detail="Invalid API key or usage limit exceeded")
         
     try:
@@ -138,8 +192,55 @@ async def diagnose_soc(request: SOCRequest, x_api_key: Optional[str] = Header(No
         usage = api_key_manager.increment_usage(x_api_key)
         remaining = api_key_manager.max_usage - usage
         
-        logger.info(f"SOC diagnosis for {request.batteryType} battery with nominal voltage {request.nominalVoltage}V")
-        result = BatteryDiagnostics.calculate_soc(
+        logger.info("SOC diagnosis for %s battery with nominal voltage %sV", request.batteryType, request.nominalVoltage)
+        with metrics.time_compute("calculate_soc"):
+            result = BatteryDiagnostics.calculate_soc(
+                voltage=request.voltage,
+                battery_type=request.batteryType,
+                temperature=request.temperature,
+                current=request.current,
+                nominal_voltage=request.nominalVoltage
+            )
+
+        # Store diagnostic history for logs
+        diagnostic_history.record("soc", request.batteryType, result)
+
+        # Add usage info to response
+        result["api_usage"] = {
+            "used": usage,
+            "remaining": remaining,
+            "limit": api_key_manager.max_usage
+        }
+
+        return encoded_response(result, accept)
+    except ValueError as e:
+        logger.error("SOC calculation error: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("Unexpected error in SOC diagnosis: %s", e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.post("/battery/diagnose/soc/batch", openapi_extra=request_body_openapi(SOCBatchRequest))
+async def diagnose_soc_batch(request: SOCBatchRequest = Depends(request_body(SOCBatchRequest)),
+                             x_api_key: Optional[str] = Header(None),
+                             accept: Optional[str] = Header(None)):
+    """Calculate State of Charge for a columnar batch of readings"""
+    if not x_api_key:
+        raise HTTPException(status_code=422, detail="API key is required")
+
+    # Validate API key usage; a batch counts as a single request
+    if not await api_key_manager.validate_key_async(x_api_key):
+        raise HTTPException(status_code=401, detail="Invalid API key or usage limit exceeded")
+
+    try:
+        usage = api_key_manager.increment_usage(x_api_key)
+        remaining = api_key_manager.max_usage - usage
+
+        logger.info("Batch SOC diagnosis for %s readings", len(request.voltage))
+        # Large batches run in a worker process so the event loop stays responsive
+        batch = await compute_pool.run(
+            "calculate_soc_batch",
+            BatchDiagnostics.calculate_soc_batch,
             voltage=request.voltage,
             battery_type=request.batteryType,
             temperature=request.temperature,
@@ -147,310 +248,891 @@ async def diagnose_soc(request: SOCRequest, x_api_key: Optional[str] = Header(No
             nominal_voltage=request.nominalVoltage
         )
 
-        # Store diagnostic history for logs
-        test_db["diagnostic_history"].append({
-            "timestamp": datetime.now().isoformat(),
-            "type": "soc",
-            "batteryType": request.batteryType,
-            "result": result
-        })
+        # Engine arrays are serialized as-is; rejected rows are NaN, which JSON renders as null
+        result = {
+            "count": len(batch["valid"]),
+            "stateOfCharge": batch["stateOfCharge"],
+            "estimatedRange": batch["estimatedRange"],
+            "chargingStatus": batch["chargingStatus"],
+            "temperatureCompensation": batch["temperatureCompensation"],
+            "errors": batch["errors"]
+        }
+        if negotiate(accept) != JSON_MEDIA_TYPE:
+            # Binary numeric columns have no null, so rejected rows are flagged instead
+            result["valid"] = batch["valid"]
+
+        # Store a single summary entry for the whole batch
+        diagnostic_history.record(
+            "soc-batch",
+            ",".join(sorted(set(request.batteryType))),
+            {"count": result["count"], "errors": len(result["errors"])}
+        )
+
+        result["api_usage"] = {
+            "used": usage,
+            "remaining": remaining,
+            "limit": api_key_manager.max_usage
+        }
+
+        return encoded_response(result, accept)
+    except ValueError as e:
+        logger.error("Batch SOC calculation error: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("Unexpected error in batch SOC diagnosis: %s", e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+def require_stateful_endpoints():
+    """Refuse a request to an endpoint whose state this process cannot keep"""
+    if not STATEFUL_ENDPOINTS:
+        raise HTTPException(status_code=503, detail=STATEFUL_ENDPOINTS_DISABLED)
+
+@app.post("/battery/diagnose/soc/coulomb", openapi_extra=request_body_openapi(TrackedSOCRequest))
+async def diagnose_soc_coulomb(request: TrackedSOCRequest = Depends(request_body(TrackedSOCRequest)),
+                               x_api_key: Optional[str] = Header(None),
+                               accept: Optional[str] = Header(None)):
+    """Track State of Charge per battery by Coulomb counting, anchored to the voltage method at rest"""
+    require_stateful_endpoints()
+    if not x_api_key:
+        raise HTTPException(status_code=422, detail="API key is required")
+
+    # A batch counts as a single request
+    if not await api_key_manager.validate_key_async(x_api_key):
+        raise HTTPException(status_code=401, detail="Invalid API key or usage limit exceeded")
+
+    try:
+        usage = api_key_manager.increment_usage(x_api_key)
+        remaining = api_key_manager.max_usage - usage
+
+        logger.info("Coulomb-counting SOC for %s readings", len(request.voltage))
+        timestamp = request.timestamp
+        if timestamp is None:
+            timestamp = np.full(len(request.voltage), datetime.now().timestamp())
+        with metrics.time_compute("calculate_soc_coulomb"):
+            voltage_batch = BatchDiagnostics.calculate_soc_batch(
+                voltage=request.voltage,
+                battery_type=request.batteryType,
+                temperature=request.temperature,
+                current=request.current,
+                nominal_voltage=request.nominalVoltage
+            )
+            batch = tracked_soc(
+                soc_tracker, hash_key(x_api_key), request.batteryId, voltage_batch,
+                current=request.current, timestamp=timestamp, capacity=request.capacity
+            )
+
+        result = {
+            "count": len(batch["valid"]),
+            "stateOfCharge": batch["stateOfCharge"],
+            "estimatedRange": batch["estimatedRange"],
+            "chargingStatus": batch["chargingStatus"],
+            "method": batch["method"],
+            "errors": batch["errors"]
+        }
+        if negotiate(accept) != JSON_MEDIA_TYPE:
+            result["valid"] = batch["valid"]
+
+        diagnostic_history.record(
+            "soc-coulomb",
+            ",".join(sorted(set(request.batteryType))),
+            {"count": result["count"], "errors": len(result["errors"])}
+        )
 
-        # Add usage info to response
         result["api_usage"] = {
             "used": usage,
             "remaining": remaining,
             "limit": api_key_manager.max_usage
         }
 
-        return JSONResponse(result)
+        return encoded_response(result, accept)
     except ValueError as e:
-        logger.error(f"SOC calculation error: {str(e)}")
+        logger.error("Coulomb-counting SOC error: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"Unexpected error in SOC diagnosis: {str(e)}")
+        logger.error("Unexpected error in Coulomb-counting SOC: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.post("/battery/diagnose/soc/ekf", openapi_extra=request_body_openapi(TrackedSOCRequest))
+async def diagnose_soc_ekf(request: TrackedSOCRequest = Depends(request_body(TrackedSOCRequest)),
+                           x_api_key: Optional[str] = Header(None),
+                           accept: Optional[str] = Header(None)):
+    """Estimate State of Charge per battery with an Extended Kalman Filter"""
+    require_stateful_endpoints()
+    if not x_api_key:
+        raise HTTPException(status_code=422, detail="API key is required")
+
+    # A batch counts as a single request
+    if not await api_key_manager.validate_key_async(x_api_key):
+        raise HTTPException(status_code=401, detail="Invalid API key or usage limit exceeded")
+
+    try:
+        usage = api_key_manager.increment_usage(x_api_key)
+        remaining = api_key_manager.max_usage - usage
+
+        logger.info("EKF SOC for %s readings", len(request.voltage))
+        timestamp = request.timestamp
+        if timestamp is None:
+            timestamp = np.full(len(request.voltage), datetime.now().timestamp())
+        with metrics.time_compute("calculate_soc_ekf"):
+            voltage_batch = BatchDiagnostics.calculate_soc_batch(
+                voltage=request.voltage,
+                battery_type=request.batteryType,
+                temperature=request.temperature,
+                current=request.current,
+                nominal_voltage=request.nominalVoltage
+            )
+            batch = filtered_soc(
+                soc_filter, hash_key(x_api_key), request.batteryId, request.batteryType,
+                request.nominalVoltage, voltage_batch, voltage=request.voltage,
+                current=request.current, temperature=request.temperature,
+                timestamp=timestamp, capacity=request.capacity
+            )
+
+        result = {
+            "count": len(batch["valid"]),
+            "stateOfCharge": batch["stateOfCharge"],
+            "stateOfChargeStdDev": batch["stateOfChargeStdDev"],
+            "estimatedRange": batch["estimatedRange"],
+            "chargingStatus": batch["chargingStatus"],
+            "method": batch["method"],
+            "errors": batch["errors"]
+        }
+        if negotiate(accept) != JSON_MEDIA_TYPE:
+            result["valid"] = batch["valid"]
+
+        diagnostic_history.record(
+            "soc-ekf",
+            ",".join(sorted(set(request.batteryType))),
+            {"count": result["count"], "errors": len(result["errors"])}
+        )
+
+        result["api_usage"] = {
+            "used": usage,
+            "remaining": remaining,
+            "limit": api_key_manager.max_usage
+        }
+
+        return encoded_response(result, accept)
+    except ValueError as e:
+        logger.error("EKF SOC error: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("Unexpected error in EKF SOC: %s", e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+async def open_stream(api_key: str) -> bool:
+    """Check a stream's key before any frame arrives.
+
+    Each frame claims its own use, so the use claimed here is handed back:
+    a connection that closes without sending a frame costs nothing.
+    """
+    if not await api_key_manager.validate_key_async(api_key):
+        return False
+    api_key_manager.release(api_key)
+    return True
+
+async def count_frame(api_key: str) -> bool:
+    """Count one stream frame against the key's quota; False once it is used up"""
+    if not await api_key_manager.validate_key_async(api_key):
+        return False
+    api_key_manager.increment_usage(api_key)
+    return True
+
+@app.websocket("/battery/stream")
+async def battery_stream(websocket: WebSocket, x_api_key: Optional[str] = Header(None)):
+    """Ingest continuous telemetry frames and push back only the results that changed"""
+    if not STATEFUL_ENDPOINTS:
+        await websocket.close(code=1013, reason=STATEFUL_ENDPOINTS_DISABLED)
+        return
+    # Every frame counts as a request against the key's quota
+    if not x_api_key or not await open_stream(x_api_key):
+        await websocket.close(code=1008, reason="Invalid API key or usage limit exceeded")
+        return
+    owner = hash_key(x_api_key)
+
+    await websocket.accept()
+    logger.info("Telemetry stream opened")
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if not await count_frame(x_api_key):
+                await websocket.close(code=1008, reason="Usage limit exceeded")
+                return
+            frame = message.get("bytes") or message.get("text") or ""
+            with metrics.time_compute("stream_ingest"):
+                result = stream_state.ingest_frame(owner, frame)
+            if result is not None:
+                await websocket.send_text(dumps(result).decode())
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error("Unexpected error in telemetry stream: %s", e)
+        await websocket.close(code=1011)
+        return
+    logger.info("Telemetry stream closed")
+
+@app.post("/battery/stream")
+async def battery_stream_http(request: Request, x_api_key: Optional[str] = Header(None)):
+    """HTTP equivalent of the telemetry WebSocket: NDJSON frames in, NDJSON changes out"""
+    require_stateful_endpoints()
+    if not x_api_key:
+        raise HTTPException(status_code=422, detail="API key is required")
+
+    # Every frame counts as a request against the key's quota
+    if not await open_stream(x_api_key):
+        raise HTTPException(status_code=401, detail="Invalid API key or usage limit exceeded")
+    owner = hash_key(x_api_key)
+    exhausted = dumps({"updates": [], "errors": [{"index": None, "detail": "Usage limit exceeded"}]}) + b"\n"
+
+    async def changed_results():
+        # Frames are applied as their lines arrive, so a chunked upload gets
+        # its results while it is still being sent
+        pending = b""
+        try:
+            async for chunk in request.stream():
+                lines = (pending + chunk).split(b"\n")
+                pending = lines.pop()
+                for line in lines:
+                    if line.strip():
+                        if not await count_frame(x_api_key):
+                            yield exhausted
+                            return
+                        with metrics.time_compute("stream_ingest"):
+                            result = stream_state.ingest_frame(owner, line)
+                        if result is not None:
+                            yield dumps(result) + b"\n"
+        except ClientDisconnect:
+            logger.info("Telemetry stream client disconnected")
+            return
+        if pending.strip():
+            if not await count_frame(x_api_key):
+                yield exhausted
+                return
+            with metrics.time_compute("stream_ingest"):
+                result = stream_state.ingest_frame(owner, pending)
+            if result is not None:
+                yield dumps(result) + b"\n"
+
+    logger.info("Telemetry stream opened over HTTP")
+    return DuplexStreamingResponse(changed_results(), media_type="application/x-ndjson")
+
 @app.get("/battery/logs")
-async def get_diagnostic_history(x_api_key: Optional[str] = Header(None)):
-    """Retrieve battery diagnostic history"""
+async def get_diagnostic_history(
+    x_api_key: Optional[str] = Header(None),
+    accept: Optional[str] = Header(None),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of entries to return"),
+    cursor: Optional[int] = Query(None, ge=1, description="Cursor returned by the previous page"),
+    since: Optional[datetime] = Query(None, description="Only return entries recorded at or after this time"),
+    until: Optional[datetime] = Query(None, description="Only return entries recorded at or before this time"),
+    diagnostic_type: Optional[str] = Query(None, alias="type", description="Only return this diagnostic type"),
+    battery_type: Optional[str] = Query(None, alias="batteryType", description="Only return this battery type")
+):
+    """Retrieve battery diagnostic history one page at a time, or stream it as NDJSON"""
     if not x_api_key:
         raise HTTPException(status_code=422, detail="API key is required")
+    filters = {
+        "since": since,
+        "until": until,
+        "diagnostic_type": diagnostic_type,
+        "battery_type": battery_type
+    }
     try:
+        if accept and "application/x-ndjson" in accept:
+            logger.info("Streaming diagnostic history")
+            # Bound the stream to entries recorded before it started
+            if filters["until"] is None:
+                filters["until"] = datetime.now()
+
+            async def ndjson_lines():
+                async for entry in diagnostic_history.iter_entries(
+                        cursor=cursor, **filters):
+                    yield dumps(entry) + b"\n"
+
+            return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
         logger.info("Retrieving diagnostic history")
-        return JSONResponse({
-            "logs": test_db["diagnostic_history"]
+        logs, next_cursor = await diagnostic_history.fetch_page(
+            limit=limit, cursor=cursor, **filters)
+        return FastJSONResponse({
+            "logs": logs,
+            "next_cursor": next_cursor
         })
     except Exception as e:
-        logger.error(f"Error retrieving diagnostic history: {str(e)}")
+        logger.error("Error retrieving diagnostic history: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
-@app.post("/battery/diagnose/soh")
-async def diagnose_soh(request: SOHRequest, x_api_key: Optional[str] = Header(None)):
+@app.post("/battery/jobs", tags=["jobs"], status_code=202, openapi_extra={"requestBody": {
+    "required": True,
+    "content": {
+        media_type: {"schema": {"type": "string", "format": "binary"}} for media_type in UPLOAD_FORMATS
+    }
+}})
+async def create_batch_job(request: Request,
+                           x_api_key: Optional[str] = Header(None),
+                           diagnostics: Optional[List[str]] = Query(
+                               None, description="Diagnostics to run on an uploaded file (default: all)")):
+    """Queue a job running diagnostics over an uploaded CSV/Parquet/NDJSON file"""
+    if not x_api_key:
+        raise HTTPException(status_code=422, detail="API key is required")
+
+    # Requests rejected before the upload starts claim no use
+    media_type = media_type_of(request.headers.get("content-type"))
+    if media_type not in UPLOAD_FORMATS:
+        # Stored history keeps diagnostic results, not the readings a job needs as input
+        raise HTTPException(
+            status_code=422,
+            detail=f"Upload the input rows as one of {list(UPLOAD_FORMATS)}; "
+                   "stored history cannot be used, as it keeps results rather than their inputs")
+    try:
+        job_request = BatchJobRequest(diagnostics=diagnostics)
+    except ValidationError as e:
+        raise RequestValidationError([
+            {**error, "loc": ("query", "diagnostics")} for error in e.errors(include_url=False)])
+
+    # A job counts as a single request, whatever its size
+    if not await api_key_manager.validate_key_async(x_api_key):
+        raise HTTPException(status_code=401, detail="Invalid API key or usage limit exceeded")
+
+    try:
+        try:
+            job = await job_runner.submit_upload(
+                hash_key(x_api_key), media_type, request.stream(), job_request.diagnostics)
+        except BaseException:
+            # No job was queued, so the claimed use goes back uncounted
+            api_key_manager.release(x_api_key)
+            raise
+
+        usage = api_key_manager.increment_usage(x_api_key)
+        job["api_usage"] = {
+            "used": usage,
+            "remaining": api_key_manager.max_usage - usage,
+            "limit": api_key_manager.max_usage
+        }
+        return FastJSONResponse(job, status_code=202)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        logger.error("Batch job rejected: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except ClientDisconnect:
+        logger.info("Client disconnected during a batch job upload")
+        raise HTTPException(status_code=400, detail="Upload interrupted")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Unexpected error creating a batch job: %s", e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.get("/battery/jobs/{job_id}", tags=["jobs"])
+async def get_batch_job(job_id: str,
+                        x_api_key: Optional[str] = Header(None),
+                        accept: Optional[str] = Header(None)):
+    """Report a job's progress, or stream its results as NDJSON"""
+    if not x_api_key:
+        raise HTTPException(status_code=422, detail="API key is required")
+    job = await job_runner.get(job_id, hash_key(x_api_key))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if accept and "application/x-ndjson" in accept:
+        # Finished chunks in order, following the job until it completes
+        return StreamingResponse(job_runner.iter_results(job_id), media_type="application/x-ndjson")
+    return FastJSONResponse(job_runner.describe(job))
+
+@app.post("/battery/diagnose/soh", openapi_extra=request_body_openapi(SOHRequest))
+async def diagnose_soh(request: SOHRequest = Depends(request_body(SOHRequest)),
+                       x_api_key: Optional[str] = Header(None),
+                       accept: Optional[str] = Header(None)):
     """Calculate State of Health based on capacity"""
     if not x_api_key:
         raise HTTPException(status_code=422, detail="API key is required")
     try:
-        logger.info(f"SOH diagnosis for {request.batteryType} battery")
-        result = BatteryDiagnostics.calculate_soh(
-            current_capacity=request.currentCapacity,
-            rated_capacity=request.ratedCapacity,
-            cycle_count=request.cycleCount
-        )
+        logger.info("SOH diagnosis for %s battery", request.batteryType)
+        with metrics.time_compute("calculate_soh"):
+            result = BatteryDiagnostics.calculate_soh(
+                current_capacity=request.currentCapacity,
+                rated_capacity=request.ratedCapacity,
+                cycle_count=request.cycleCount
+            )
 
         # Store diagnostic history for logs
-        test_db["diagnostic_history"].append({
-            "timestamp": datetime.now().isoformat(),
-            "type": "soh",
-            "batteryType": request.batteryType,
-            "result": result
-        })
+        diagnostic_history.record("soh", request.batteryType, result)
 
-        return JSONResponse(result)
+        return encoded_response(result, accept)
     except ValueError as e:
-        logger.error(f"SOH calculation error: {str(e)}")
+        logger.error("SOH calculation error: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"Unexpected error in SOH diagnosis: {str(e)}")
+        logger.error("Unexpected error in SOH diagnosis: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
-@app.post("/battery/diagnose/voltage", tags=["diagnostics"])
-async def analyze_voltage(request: VoltageRequest, x_api_key: Optional[str] = Header(None)):
+@app.post("/battery/diagnose/voltage", tags=["diagnostics"], openapi_extra=request_body_openapi(VoltageRequest))
+async def analyze_voltage(request: VoltageRequest = Depends(request_body(VoltageRequest)),
+                          x_api_key: Optional[str] = Header(None),
+                          accept: Optional[str] = Header(None)):
     """Analyze voltage levels and provide detailed insights"""
     if not x_api_key:
         raise HTTPException(status_code=422, detail="API key is required")
     try:
-        logger.info(f"Voltage analysis for {request.batteryType} battery with nominal voltage {request.nominalVoltage}V")
-        result = BatteryDiagnostics.analyze_voltage(
-            voltage=request.voltage,
-            battery_type=request.batteryType,
-            nominal_voltage=request.nominalVoltage,
-            temperature=request.temperature
-        )
+        logger.info("Voltage analysis for %s battery with nominal voltage %sV", request.batteryType, request.nominalVoltage)
+        with metrics.time_compute("analyze_voltage"):
+            result = BatteryDiagnostics.analyze_voltage(
+                voltage=request.voltage,
+                battery_type=request.batteryType,
+                nominal_voltage=request.nominalVoltage,
+                temperature=request.temperature
+            )
 
         # Store diagnostic history for logs
-        test_db["diagnostic_history"].append({
-            "timestamp": datetime.now().isoformat(),
-            "type": "voltage",
-            "batteryType": request.batteryType,
-            "result": result
-        })
+        diagnostic_history.record("voltage", request.batteryType, result)
 
-        return JSONResponse(result)
+        return encoded_response(result, accept)
     except ValueError as e:
-        logger.error(f"Voltage analysis error: {str(e)}")
+        logger.error("Voltage analysis error: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"Unexpected error in voltage analysis: {str(e)}")
+        logger.error("Unexpected error in voltage analysis: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
-@app.post("/battery/diagnose/resistance")
-async def diagnose_resistance(request: ResistanceRequest, x_api_key: Optional[str] = Header(None)):
+@app.post("/battery/diagnose/resistance", openapi_extra=request_body_openapi(ResistanceRequest))
+async def diagnose_resistance(request: ResistanceRequest = Depends(request_body(ResistanceRequest)),
+                              x_api_key: Optional[str] = Header(None),
+                              accept: Optional[str] = Header(None)):
     """Calculate internal resistance"""
     if not x_api_key:
         raise HTTPException(status_code=422, detail="API key is required")
     try:
-        logger.info(f"Resistance diagnosis for {request.batteryType} battery")
-        result = BatteryDiagnostics.measure_internal_resistance(
-            voltage=request.voltage,
-            current=request.current,
-            temperature=request.temperature,
-            battery_type=request.batteryType
-        )
+        logger.info("Resistance diagnosis for %s battery", request.batteryType)
+        with metrics.time_compute("measure_internal_resistance"):
+            result = BatteryDiagnostics.measure_internal_resistance(
+                voltage=request.voltage,
+                current=request.current,
+                temperature=request.temperature,
+                battery_type=request.batteryType
+            )
 
         # Store diagnostic history for logs
-        test_db["diagnostic_history"].append({
-            "timestamp": datetime.now().isoformat(),
-            "type": "resistance",
-            "batteryType": request.batteryType,
-            "result": result
-        })
+        diagnostic_history.record("resistance", request.batteryType, result)
 
-        return JSONResponse(result)
+        return encoded_response(result, accept)
     except ValueError as e:
-        logger.error(f"Resistance calculation error: {str(e)}")
+        logger.error("Resistance calculation error: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"Unexpected error in resistance diagnosis: {str(e)}")
+        logger.error("Unexpected error in resistance diagnosis: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
         
-@app.post("/battery/diagnose/capacity-fade", tags=["diagnostics"])
-async def analyze_capacity_fade(request: CapacityFadeRequest, x_api_key: Optional[str] = Header(None)):
+@app.post("/battery/diagnose/capacity-fade", tags=["diagnostics"], openapi_extra=request_body_openapi(CapacityFadeRequest))
+async def analyze_capacity_fade(request: CapacityFadeRequest = Depends(request_body(CapacityFadeRequest)),
+                                x_api_key: Optional[str] = Header(None),
+                                accept: Optional[str] = Header(None)):
     """Analyze capacity fade and predict remaining lifetime"""
     if not x_api_key:
         raise HTTPException(status_code=422, detail="API key is required")
     try:
-        logger.info(f"Capacity fade analysis for {request.batteryType} battery")
-        result = BatteryDiagnostics.analyze_capacity_fade(
-            initial_capacity=request.initialCapacity,
-            current_capacity=request.currentCapacity,
-            cycle_count=request.cycleCount,
-            time_in_service=request.timeInService
-        )
+        logger.info("Capacity fade analysis for %s battery", request.batteryType)
+        with metrics.time_compute("analyze_capacity_fade"):
+            result = BatteryDiagnostics.analyze_capacity_fade(
+                initial_capacity=request.initialCapacity,
+                current_capacity=request.currentCapacity,
+                cycle_count=request.cycleCount,
+                time_in_service=request.timeInService
+            )
 
         # Store diagnostic history for logs
-        test_db["diagnostic_history"].append({
-            "timestamp": datetime.now().isoformat(),
-            "type": "capacity-fade",
-            "batteryType": request.batteryType,
-            "result": result
-        })
+        diagnostic_history.record("capacity-fade", request.batteryType, result)
 
-        return JSONResponse(result)
+        return encoded_response(result, accept)
     except ValueError as e:
-        logger.error(f"Capacity fade analysis error: {str(e)}")
+        logger.error("Capacity fade analysis error: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"Unexpected error in capacity fade analysis: {str(e)}")
+        logger.error("Unexpected error in capacity fade analysis: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
-@app.post("/battery/diagnose/cell-balance", tags=["diagnostics"])
-async def check_cell_balance(request: CellBalanceRequest, x_api_key: Optional[str] = Header(None)):
-    """Monitor cell voltage balance and identify issues"""
+@app.post("/battery/diagnose/capacity-fade/fit", tags=["diagnostics"], openapi_extra=request_body_openapi(CapacityFadeFitRequest))
+async def fit_capacity_fade_batch(request: CapacityFadeFitRequest = Depends(request_body(CapacityFadeFitRequest)),
+                                  x_api_key: Optional[str] = Header(None),
+                                  accept: Optional[str] = Header(None)):
+    """Fit fade models to the capacity history of many batteries and project end of life"""
     if not x_api_key:
         raise HTTPException(status_code=422, detail="API key is required")
+
+    # A batch counts as a single request
+    if not await api_key_manager.validate_key_async(x_api_key):
+        raise HTTPException(status_code=401, detail="Invalid API key or usage limit exceeded")
+
     try:
-        logger.info(f"Cell balance check for {request.batteryType} battery")
-        result = BatteryDiagnostics.check_cell_balance(
-            cell_voltages=request.cellVoltages,
-            temperature=request.temperature
+        usage = api_key_manager.increment_usage(x_api_key)
+        remaining = api_key_manager.max_usage - usage
+
+        batteries, points = request.capacity.shape
+        logger.info("Capacity fade fit for %s %s batteries of %s points", batteries, request.batteryType, points)
+        fit = await compute_pool.run(
+            "fit_capacity_fade", fit_capacity_fade,
+            request.capacity, request.cycles, initial_capacity=request.initialCapacity,
+            models=request.models, eol_fraction=request.eolFraction, confidence=request.confidence)
+
+        # Batteries with too few points are NaN, which JSON renders as null
+        valid = fit.pop("valid")
+        result = {"count": batteries, **fit}
+        if negotiate(accept) != JSON_MEDIA_TYPE:
+            # Binary numeric columns have no null, so unfitted batteries are flagged instead
+            result["valid"] = valid
+
+        diagnostic_history.record(
+            "capacity-fade-fit",
+            request.batteryType,
+            {"count": batteries, "points": points, "fitted": int(valid.sum())}
         )
 
+        result["api_usage"] = {
+            "used": usage,
+            "remaining": remaining,
+            "limit": api_key_manager.max_usage
+        }
+
+        return encoded_response(result, accept)
+    except ValueError as e:
+        logger.error("Capacity fade fit error: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("Unexpected error in capacity fade fit: %s", e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.post("/battery/diagnose/cell-balance", tags=["diagnostics"], openapi_extra=request_body_openapi(CellBalanceRequest))
+async def check_cell_balance(request: CellBalanceRequest = Depends(request_body(CellBalanceRequest)),
+                             x_api_key: Optional[str] = Header(None),
+                             accept: Optional[str] = Header(None)):
+    """Monitor cell voltage balance and identify issues"""
+    if not x_api_key:
+        raise HTTPException(status_code=422, detail="API key is required")
+    try:
+        logger.info("Cell balance check for %s battery", request.batteryType)
+        with metrics.time_compute("check_cell_balance"):
+            result = BatteryDiagnostics.check_cell_balance(
+                cell_voltages=request.cellVoltages,
+                temperature=request.temperature
+            )
+
         # Store diagnostic history for logs
-        test_db["diagnostic_history"].append({
-            "timestamp": datetime.now().isoformat(),
-            "type": "cell-balance",
-            "batteryType": request.batteryType,
-            "result": result
-        })
+        diagnostic_history.record("cell-balance", request.batteryType, result)
 
-        return JSONResponse(result)
+        return encoded_response(result, accept)
     except ValueError as e:
-        logger.error(f"Cell balance check error: {str(e)}")
+        logger.error("Cell balance check error: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"Unexpected error in cell balance check: {str(e)}")
+        logger.error("Unexpected error in cell balance check: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
-@app.post("/battery/diagnose/safety", tags=["diagnostics"])
-async def monitor_safety(request: SafetyRequest, x_api_key: Optional[str] = Header(None)):
-    """Monitor battery safety parameters and assess risks"""
+@app.post("/battery/diagnose/cell-balance/batch", tags=["diagnostics"], openapi_extra=request_body_openapi(PackBalanceRequest))
+async def check_cell_balance_batch(request: PackBalanceRequest = Depends(request_body(PackBalanceRequest)),
+                                   x_api_key: Optional[str] = Header(None),
+                                   accept: Optional[str] = Header(None)):
+    """Check cell balance for many packs given as a packs × cells matrix"""
     if not x_api_key:
         raise HTTPException(status_code=422, detail="API key is required")
+
+    # A batch counts as a single request
+    if not await api_key_manager.validate_key_async(x_api_key):
+        raise HTTPException(status_code=401, detail="Invalid API key or usage limit exceeded")
+
     try:
-        logger.info(f"Safety monitoring for {request.batteryType} battery")
-        result = BatteryDiagnostics.monitor_safety(
-            voltage=request.voltage,
-            current=request.current,
-            temperature=request.temperature,
-            pressure=request.pressure,
-            battery_type=request.batteryType
+        usage = api_key_manager.increment_usage(x_api_key)
+        remaining = api_key_manager.max_usage - usage
+
+        packs, cells = request.cellVoltages.shape
+        logger.info("Cell balance check for %s %s packs of %s cells", packs, request.batteryType, cells)
+        batch = await compute_pool.run(
+            "check_cell_balance_batch", BatchDiagnostics.check_cell_balance_batch,
+            request.cellVoltages, series=request.series, parallel=request.parallel)
+
+        # Problem cells go out as compact index arrays rather than the full masks
+        result = {"count": packs}
+        for name in ("maxImbalance", "balanceStatus", "meanVoltage", "stdVoltage",
+                     "problemOffsets", "problemCells", "problemZScores",
+                     "moduleVoltage", "moduleMinVoltage", "moduleMaxVoltage"):
+            result[name] = batch[name]
+
+        diagnostic_history.record(
+            "cell-balance-batch",
+            request.batteryType,
+            {"count": packs, "cells": cells, "problemCells": len(batch["problemCells"])}
         )
 
+        result["api_usage"] = {
+            "used": usage,
+            "remaining": remaining,
+            "limit": api_key_manager.max_usage
+        }
+
+        return encoded_response(result, accept)
+    except ValueError as e:
+        logger.error("Batch cell balance check error: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("Unexpected error in batch cell balance check: %s", e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.post("/battery/diagnose/safety", tags=["diagnostics"], openapi_extra=request_body_openapi(SafetyRequest))
+async def monitor_safety(request: SafetyRequest = Depends(request_body(SafetyRequest)),
+                         x_api_key: Optional[str] = Header(None),
+                         accept: Optional[str] = Header(None)):
+    """Monitor battery safety parameters and assess risks"""
+    if not x_api_key:
+        raise HTTPException(status_code=422, detail="API key is required")
+    try:
+        logger.info("Safety monitoring for %s battery", request.batteryType)
+        with metrics.time_compute("monitor_safety"):
+            result = BatteryDiagnostics.monitor_safety(
+                voltage=request.voltage,
+                current=request.current,
+                temperature=request.temperature,
+                pressure=request.pressure,
+                battery_type=request.batteryType
+            )
+
         # Store diagnostic history for logs
-        test_db["diagnostic_history"].append({
-            "timestamp": datetime.now().isoformat(),
-            "type": "safety",
-            "batteryType": request.batteryType,
-            "result": result
-        })
+        diagnostic_history.record("safety", request.batteryType, result)
 
-        return JSONResponse(result)
+        return encoded_response(result, accept)
     except ValueError as e:
-        logger.error(f"Safety monitoring error: {str(e)}")
+        logger.error("Safety monitoring error: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"Unexpected error in safety monitoring: {str(e)}")
+        logger.error("Unexpected error in safety monitoring: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
-@app.post("/battery/diagnose/thermal", tags=["diagnostics"])
-async def analyze_thermal(request: ThermalRequest, x_api_key: Optional[str] = Header(None)):
+@app.post("/battery/diagnose/thermal", tags=["diagnostics"], openapi_extra=request_body_openapi(ThermalRequest))
+async def analyze_thermal(request: ThermalRequest = Depends(request_body(ThermalRequest)),
+                          x_api_key: Optional[str] = Header(None),
+                          accept: Optional[str] = Header(None)):
     """Analyze thermal conditions and predict thermal runaway risks"""
     if not x_api_key:
         raise HTTPException(status_code=422, detail="API key is required")
     try:
-        logger.info(f"Thermal analysis for {request.batteryType} battery")
-        result = BatteryDiagnostics.analyze_thermal(
-            temperature=request.temperature,
-            rate_of_change=request.rateOfChange,
-            ambient_temp=request.ambientTemperature,
-            load_profile=request.loadProfile
-        )
+        logger.info("Thermal analysis for %s battery", request.batteryType)
+        with metrics.time_compute("analyze_thermal"):
+            result = BatteryDiagnostics.analyze_thermal(
+                temperature=request.temperature,
+                rate_of_change=request.rateOfChange,
+                ambient_temp=request.ambientTemperature,
+                load_profile=request.loadProfile
+            )
 
         # Store diagnostic history for logs
-        test_db["diagnostic_history"].append({
-            "timestamp": datetime.now().isoformat(),
-            "type": "thermal",
-            "batteryType": request.batteryType,
-            "result": result
-        })
+        diagnostic_history.record("thermal", request.batteryType, result)
 
-        return JSONResponse(result)
+        return encoded_response(result, accept)
     except ValueError as e:
-        logger.error(f"Thermal analysis error: {str(e)}")
+        logger.error("Thermal analysis error: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"Unexpected error in thermal analysis: {str(e)}")
+        logger.error("Unexpected error in thermal analysis: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
-@app.post("/battery/diagnose/cycle-life", tags=["diagnostics"])
-async def estimate_cycle_life(request: CycleLifeRequest, x_api_key: Optional[str] = Header(None)):
+@app.post("/battery/diagnose/cycle-life", tags=["diagnostics"], openapi_extra=request_body_openapi(CycleLifeRequest))
+async def estimate_cycle_life(request: CycleLifeRequest = Depends(request_body(CycleLifeRequest)),
+                              x_api_key: Optional[str] = Header(None),
+                              accept: Optional[str] = Header(None)):
     """Predict remaining cycle life based on usage patterns"""
     if not x_api_key:
         raise HTTPException(status_code=422, detail="API key is required")
     try:
-        logger.info(f"Cycle life estimation for {request.batteryType} battery")
-        result = BatteryDiagnostics.estimate_cycle_life(
-            cycle_count=request.cycleCount,
-            depth_of_discharge=request.depthOfDischarge,
-            avg_temperature=request.averageTemperature,
-            current_soh=request.currentSOH
-        )
+        logger.info("Cycle life estimation for %s battery", request.batteryType)
+        with metrics.time_compute("estimate_cycle_life"):
+            result = BatteryDiagnostics.estimate_cycle_life(
+                cycle_count=request.cycleCount,
+                depth_of_discharge=request.depthOfDischarge,
+                avg_temperature=request.averageTemperature,
+                current_soh=request.currentSOH
+            )
 
         # Store diagnostic history for logs
-        test_db["diagnostic_history"].append({
-            "timestamp": datetime.now().isoformat(),
-            "type": "cycle-life",
-            "batteryType": request.batteryType,
-            "result": result
-        })
+        diagnostic_history.record("cycle-life", request.batteryType, result)
 
-        return JSONResponse(result)
+        return encoded_response(result, accept)
     except ValueError as e:
-        logger.error(f"Cycle life estimation error: {str(e)}")
+        logger.error("Cycle life estimation error: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"Unexpected error in cycle life estimation: {str(e)}")
+        logger.error("Unexpected error in cycle life estimation: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
-@app.post("/battery/diagnose/faults", tags=["diagnostics"])
-async def detect_faults(request: FaultRequest, x_api_key: Optional[str] = Header(None)):
-    """Detect and diagnose battery faults"""
+@app.post("/battery/diagnose/cycle-life/simulate", tags=["diagnostics"], openapi_extra=request_body_openapi(CycleLifeSimulationRequest))
+async def simulate_cycle_life_batch(request: CycleLifeSimulationRequest = Depends(request_body(CycleLifeSimulationRequest)),
+                                    x_api_key: Optional[str] = Header(None),
+                                    accept: Optional[str] = Header(None)):
+    """Project the distribution of remaining cycle life for many batteries by Monte Carlo"""
     if not x_api_key:
         raise HTTPException(status_code=422, detail="API key is required")
+
+    # A batch counts as a single request
+    if not await api_key_manager.validate_key_async(x_api_key):
+        raise HTTPException(status_code=401, detail="Invalid API key or usage limit exceeded")
+
     try:
-        logger.info(f"Fault detection for {request.batteryType} battery")
-        result = BatteryDiagnostics.detect_faults(
-            voltage=request.voltage,
-            current=request.current,
-            temperature=request.temperature,
-            impedance=request.impedance,
-            battery_type=request.batteryType
+        usage = api_key_manager.increment_usage(x_api_key)
+        remaining = api_key_manager.max_usage - usage
+
+        batteries = len(request.depthOfDischarge)
+        logger.info("Cycle life simulation for %s %s batteries", batteries, request.batteryType)
+        # The cost grows with the draws, which the three input arrays do not show
+        simulation = await compute_pool.run(
+            "simulate_cycle_life", simulate_cycle_life,
+            request.depthOfDischarge, request.averageTemperature, request.currentSOH,
+            dod_std=request.depthOfDischargeStdDev, temperature_std=request.temperatureStdDev,
+            soh_std=request.sohStdDev, cycles_per_day=request.cyclesPerDay, draws=request.draws,
+            seed=request.seed, percentiles=request.percentiles, horizon_days=request.horizonDays,
+            work=batteries * draws_within_budget(batteries, request.draws))
+
+        result = {"count": batteries, **simulation}
+
+        diagnostic_history.record(
+            "cycle-life-simulation",
+            request.batteryType,
+            {"count": batteries, "draws": simulation["draws"], "seed": simulation["seed"]}
+        )
+
+        result["api_usage"] = {
+            "used": usage,
+            "remaining": remaining,
+            "limit": api_key_manager.max_usage
+        }
+
+        return encoded_response(result, accept)
+    except ValueError as e:
+        logger.error("Cycle life simulation error: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("Unexpected error in cycle life simulation: %s", e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.post("/battery/diagnose/rainflow", tags=["diagnostics"], openapi_extra=request_body_openapi(RainflowRequest))
+async def count_rainflow_cycles(request: RainflowRequest = Depends(request_body(RainflowRequest)),
+                                x_api_key: Optional[str] = Header(None),
+                                accept: Optional[str] = Header(None)):
+    """Count charge cycles per battery from streamed SOC series (rainflow counting)"""
+    require_stateful_endpoints()
+    if not x_api_key:
+        raise HTTPException(status_code=422, detail="API key is required")
+
+    # A batch counts as a single request
+    if not await api_key_manager.validate_key_async(x_api_key):
+        raise HTTPException(status_code=401, detail="Invalid API key or usage limit exceeded")
+
+    try:
+        usage = api_key_manager.increment_usage(x_api_key)
+        remaining = api_key_manager.max_usage - usage
+
+        logger.info("Rainflow counting for %s %s batteries", len(request.batteryId), request.batteryType)
+        with metrics.time_compute("count_rainflow"):
+            batch = counted_cycles(
+                rainflow_counter, hash_key(x_api_key), request.batteryId, request.stateOfCharge,
+                avg_temperature=request.averageTemperature, current_soh=request.currentSOH,
+                current_capacity=request.currentCapacity, rated_capacity=request.ratedCapacity
+            )
+
+        result = {
+            "count": len(batch["valid"]),
+            "depthBins": DEPTH_BINS,
+            "meanSocBins": MEAN_SOC_BINS,
+            **{name: column for name, column in batch.items() if name != "valid"}
+        }
+        if negotiate(accept) != JSON_MEDIA_TYPE:
+            result["valid"] = batch["valid"]
+
+        diagnostic_history.record(
+            "rainflow",
+            request.batteryType,
+            {"count": result["count"], "samples": int(np.isfinite(request.stateOfCharge).sum()),
+             "errors": len(result["errors"])}
         )
 
+        result["api_usage"] = {
+            "used": usage,
+            "remaining": remaining,
+            "limit": api_key_manager.max_usage
+        }
+
+        return encoded_response(result, accept)
+    except ValueError as e:
+        logger.error("Rainflow counting error: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("Unexpected error in rainflow counting: %s", e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.post("/battery/diagnose/faults", tags=["diagnostics"], openapi_extra=request_body_openapi(FaultRequest))
+async def detect_faults(request: FaultRequest = Depends(request_body(FaultRequest)),
+                        x_api_key: Optional[str] = Header(None),
+                        accept: Optional[str] = Header(None)):
+    """Detect and diagnose battery faults"""
+    if not x_api_key:
+        raise HTTPException(status_code=422, detail="API key is required")
+    try:
+        logger.info("Fault detection for %s battery", request.batteryType)
+        with metrics.time_compute("detect_faults"):
+            result = BatteryDiagnostics.detect_faults(
+                voltage=request.voltage,
+                current=request.current,
+                temperature=request.temperature,
+                impedance=request.impedance,
+                battery_type=request.batteryType
+            )
+
         # Store diagnostic history for logs
-        test_db["diagnostic_history"].append({
-            "timestamp": datetime.now().isoformat(),
-            "type": "faults",
-            "batteryType": request.batteryType,
-            "result": result
-        })
+        diagnostic_history.record("faults", request.batteryType, result)
+
+        return encoded_response(result, accept)
+    except ValueError as e:
+        logger.error("Fault detection error: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("Unexpected error in fault detection: %s", e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.post("/battery/diagnose/full", tags=["diagnostics"], openapi_extra=request_body_openapi(FullDiagnosticRequest))
+async def diagnose_full(request: FullDiagnosticRequest = Depends(request_body(FullDiagnosticRequest)),
+                        x_api_key: Optional[str] = Header(None),
+                        accept: Optional[str] = Header(None)):
+    """Run the selected diagnostics for one battery in a single pass"""
+    if not x_api_key:
+        raise HTTPException(status_code=422, detail="API key is required")
+
+    # A full report counts as a single request against the API key
+    if not await api_key_manager.validate_key_async(x_api_key):
+        raise HTTPException(status_code=401, detail="Invalid API key or usage limit exceeded")
+
+    try:
+        usage = api_key_manager.increment_usage(x_api_key)
+        remaining = api_key_manager.max_usage - usage
+
+        logger.info("Full diagnosis for %s battery (%s)", request.batteryType, ', '.join(request.sections))
+        with metrics.time_compute("full_report"):
+            result = BatteryDiagnostics.full_report(
+                params=request.model_dump(),
+                sections=request.sections
+            )
+
+        # Store one history record for the whole report
+        diagnostic_history.record("full", request.batteryType, result)
+
+        result["api_usage"] = {
+            "used": usage,
+            "remaining": remaining,
+            "limit": api_key_manager.max_usage
+        }
 
-        return JSONResponse(result)
+        return encoded_response(result, accept)
     except ValueError as e:
-        logger.error(f"Fault detection error: {str(e)}")
+        logger.error("Full diagnosis error: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"Unexpected error in fault detection: {str(e)}")
+        logger.error("Unexpected error in full diagnosis: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 if __name__ == "__main__":
@@ -458,10 +1140,10 @@ if __name__ == "__main__":
     try:
         # ALWAYS serve the app on port 5000
         port = 5000
-        logger.info(f"Starting FastAPI server on port {port}")
+        logger.info("Starting FastAPI server on port %s", port)
         uvicorn.run(app, host="0.0.0.0", port=port, reload=True)
     except Exception as e:
-        logger.error(f"Failed to start server: {e}")
+        logger.error("Failed to start server: %s", e)
 
 # Admin API key management endpoints
 @app.get("/admin/api-keys")
@@ -470,7 +1152,7 @@ async def get_api_keys(admin_key: str = Header(None)):
     if not api_key_manager.validate_admin_key(admin_key):
         raise HTTPException(status_code=401, detail="Invalid admin credentials")
         
-    return JSONResponse({
+    return FastJSONResponse({
         "api_keys": api_key_manager.get_all_keys(),
         "max_usage": api_key_manager.max_usage
     })
@@ -488,7 +1170,7 @@ async def add_api_key(admin_key: str = Header(None), api_key: str = None):
     if not success:
         raise HTTPException(status_code=400, detail="API key already exists")
         
-    return JSONResponse({"status": "success", "message": f"API key '{api_key}' added"})
+    return FastJSONResponse({"status": "success", "message": f"API key '{api_key}' added"})
 
 @app.delete("/admin/api-keys/{api_key}")
 async def remove_api_key(api_key: str, admin_key: str = Header(None)):
@@ -500,7 +1182,7 @@ async def remove_api_key(api_key: str, admin_key: str = Header(None)):
     if not success:
         raise HTTPException(status_code=404, detail="API key not found")
         
-    return JSONResponse({"status": "success", "message": f"API key '{api_key}' removed"})
+    return FastJSONResponse({"status": "success", "message": f"API key '{api_key}' removed"})
 
 @app.post("/admin/api-keys/{api_key}/reset")
 async def reset_api_key_usage(api_key: str, admin_key: str = Header(None)):
@@ -512,7 +1194,7 @@ async def reset_api_key_usage(api_key: str, admin_key: str = Header(None)):
     if not success:
         raise HTTPException(status_code=404, detail="API key not found")
         
-    return JSONResponse({"status": "success", "message": f"Usage reset for API key '{api_key}'"})
+    return FastJSONResponse({"status": "success", "message": f"Usage reset for API key '{api_key}'"})
 
 @app.post("/admin/max-usage")
 async def set_max_usage(admin_key: str = Header(None), max_usage: int = None):
@@ -524,9 +1206,9 @@ async def set_max_usage(admin_key: str = Header(None), max_usage: int = None):
         raise HTTPException(status_code=400, detail="Valid max usage value required")
         
     api_key_manager.max_usage = max_usage
-    logger.info(f"Max usage limit changed to {max_usage}")
+    logger.info("Max usage limit changed to %s", max_usage)
     
-    return JSONResponse({
+    return FastJSONResponse({
         "status": "success", 
         "message": f"Maximum usage limit set to {max_usage}"
     })
\ No newline at end of file
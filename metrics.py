@@ -0,0 +1,347 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Dict, List, Optional, Sequence, Tuple
+import asyncio
+import glob
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Directory shared by worker processes; empty means metrics are process-local
+DEFAULT_METRICS_DIR = os.environ.get("METRICS_MULTIPROCESS_DIR", "")
+DEFAULT_METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "1.0"))
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COMPUTE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+                   0.0025, 0.005, 0.01, 0.025, 0.1)
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds spent in BatteryDiagnostics by the current request, summed by
+# compute timers and read back by the middleware
+_request_compute: ContextVar[Optional[List[float]]] = ContextVar("request_compute", default=None)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """Monotonic counter keyed by a tuple of label values.
+
+    Updates are plain dict operations. They are only made from the event
+    loop thread, so no lock is needed. Label values are converted to
+    strings when rendered, not on the hot path.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1):
+        values = self.values
+        values[labels] = values.get(labels, 0) + amount
+
+    def samples(self, values: Dict) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+    def merge(self, into: Dict, values: Dict):
+        for key, value in values.items():
+            into[key] = into.get(key, 0) + value
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    kind = "gauge"
+
+    def dec(self, labels: Tuple[str, ...] = (), amount: float = 1):
+        values = self.values
+        values[labels] = values.get(labels, 0) - amount
+
+
+class Histogram:
+    """Fixed-bucket histogram keyed by a tuple of label values.
+
+    Each series is a flat list: per-bucket counts (non-cumulative, with a
+    final +Inf bucket) followed by the sum. observe() is a bisect and two
+    list increments; buckets are made cumulative only when rendered.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self, values: Dict) -> List[str]:
+        lines = []
+        bounds = [_format_value(bound) for bound in self.buckets] + ["+Inf"]
+        for key, series in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                labels = _format_labels(self.labels, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+    def merge(self, into: Dict, values: Dict):
+        for key, series in values.items():
+            current = into.get(key)
+            into[key] = list(series) if current is None else [
+                a + b for a, b in zip(current, series)
+            ]
+
+
+class _ComputeTimer:
+    """Context manager timing one BatteryDiagnostics call"""
+
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, operation: str):
+        self.histogram = histogram
+        self.labels = (operation,)
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        elapsed = perf_counter() - self.start
+        self.histogram.observe(self.labels, elapsed)
+        spent = _request_compute.get()
+        if spent is not None:
+            spent[0] += elapsed
+        return False
+
+
+class Metrics:
+    """Request and computation metrics rendered in Prometheus text format.
+
+    Each worker records into its own process. If ``multiprocess_dir`` is
+    set, every worker writes a snapshot there periodically, and /metrics
+    merges the snapshots from all workers, whichever one serves the scrape.
+    """
+
+    def __init__(self, multiprocess_dir: str = DEFAULT_METRICS_DIR,
+                 flush_interval: float = DEFAULT_METRICS_FLUSH_INTERVAL):
+        self.requests = Counter(
+            "http_requests_total", "HTTP requests by route, method and status",
+            ("route", "method", "status"))
+        self.errors = Counter(
+            "http_request_errors_total", "HTTP responses with a 4xx or 5xx status",
+            ("route", "method", "status"))
+        self.in_flight = Gauge(
+            "http_requests_in_flight", "HTTP requests currently being served", ("method",))
+        self.latency = Histogram(
+            "http_request_duration_seconds", "Time from request start to the last response byte",
+            ("route", "method"), LATENCY_BUCKETS)
+        self.overhead = Histogram(
+            "http_request_overhead_seconds",
+            "Request time outside BatteryDiagnostics (validation, middleware, serialization)",
+            ("route",), LATENCY_BUCKETS)
+        self.compute = Histogram(
+            "battery_diagnostics_compute_seconds", "Time spent in BatteryDiagnostics calculations",
+            ("operation",), COMPUTE_BUCKETS)
+        self.queue_wait = Histogram(
+            "battery_diagnostics_queue_wait_seconds",
+            "Time offloaded calculations waited for a compute worker, including the transfer",
+            ("operation",), LATENCY_BUCKETS)
+        self.executions = Counter(
+            "battery_diagnostics_executions_total",
+            "Calculations run through the compute pool, by executor (inline or process)",
+            ("operation", "executor"))
+        self.metrics = [self.requests, self.errors, self.in_flight,
+                        self.latency, self.overhead, self.compute,
+                        self.queue_wait, self.executions]
+
+        self.multiprocess_dir = multiprocess_dir
+        self.flush_interval = flush_interval
+        self._task: Optional[asyncio.Task] = None
+        if multiprocess_dir:
+            os.makedirs(multiprocess_dir, exist_ok=True)
+
+    def time_compute(self, operation: str) -> _ComputeTimer:
+        """Time a diagnostics call: ``with metrics.time_compute("calculate_soc"): ...``"""
+        return _ComputeTimer(self.compute, operation)
+
+    def observe_offload(self, operation: str, wait: float, compute: float):
+        """Record a calculation that ran in a compute worker"""
+        self.queue_wait.observe((operation,), wait)
+        self.compute.observe((operation,), compute)
+        spent = _request_compute.get()
+        if spent is not None:
+            # The request spent both waiting and computing outside the loop's own work
+            spent[0] += wait + compute
+
+    def observe_request(self, route: str, method: str, status: int,
+                        elapsed: float, compute: float):
+        labels = (route, method, status)
+        requests = self.requests.values
+        requests[labels] = requests.get(labels, 0) + 1
+        if status >= 400:
+            self.errors.inc(labels)
+        self.latency.observe((route, method), elapsed)
+        if compute:
+            self.overhead.observe((route,), elapsed - compute)
+
+    def snapshot(self) -> Dict:
+        """JSON-serializable copy of every metric's values"""
+        return {
+            metric.name: [[list(key), value] for key, value in metric.values.items()]
+            for metric in self.metrics
+        }
+
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(self.multiprocess_dir, f"metrics-{pid}.json")
+
+    def write_snapshot(self):
+        """Publish this worker's values for the other workers' scrapes"""
+        path = self._snapshot_path(os.getpid())
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+    def _collect(self) -> Dict[str, Dict]:
+        values = {metric.name: {} for metric in self.metrics}
+        for metric in self.metrics:
+            metric.merge(values[metric.name], metric.values)
+        if not self.multiprocess_dir:
+            return values
+
+        own = self._snapshot_path(os.getpid())
+        by_name = {metric.name: metric for metric in self.metrics}
+        for path in glob.glob(os.path.join(self.multiprocess_dir, "metrics-*.json")):
+            if path == own:
+                continue
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable metrics snapshot {path}: {e}")
+                continue
+            for name, entries in snapshot.items():
+                if name in by_name:
+                    by_name[name].merge(
+                        values[name], {tuple(key): value for key, value in entries})
+        return values
+
+    def render(self) -> str:
+        """All metrics in Prometheus text exposition format"""
+        values = self._collect()
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples(values[metric.name]))
+        return "\n".join(lines) + "\n"
+
+    async def _writer(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.write_snapshot)
+            except OSError as e:
+                logger.error(f"Failed to write metrics snapshot: {e}")
+
+    async def start(self):
+        if self.multiprocess_dir and self._task is None:
+            self._task = asyncio.create_task(self._writer())
+            logger.info(f"Metrics snapshots shared through {self.multiprocess_dir}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self.write_snapshot()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording count, in-flight, latency and errors per route.
+
+    Routes are labelled with their path template, so path parameters do not
+    create new series. Requests that match no route share one label.
+    """
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+        self._static_paths = None
+
+    def _route_label(self, scope) -> str:
+        route = scope.get("route")
+        if route is not None:
+            return route.path
+        # Requests rejected before routing (e.g. rate limited) keep their path
+        # when it is a known parameterless route
+        if self._static_paths is None:
+            self._static_paths = {
+                route.path for route in getattr(scope.get("app"), "routes", ())
+                if "{" not in getattr(route, "path", "{")
+            }
+        return scope["path"] if scope["path"] in self._static_paths else "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        method = scope["method"]
+        in_flight = self.metrics.in_flight.values
+        in_flight[(method,)] = in_flight.get((method,), 0) + 1
+        spent = [0.0]
+        token = _request_compute.set(spent)
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = perf_counter() - start
+            _request_compute.reset(token)
+            in_flight[(method,)] -= 1
+            self.metrics.observe_request(
+                self._route_label(scope), method, status[0], elapsed, spent[0])
+
+
+metrics = Metrics()
@@ -1,7 +1,123 @@
-from pydantic import BaseModel, Field, model_validator
-from typing import List, Optional
+from pydantic import BaseModel, Field, PlainSerializer, PlainValidator, WithJsonSchema, model_validator
+from typing import Annotated, List, Optional
 from datetime import datetime
 
+import numpy as np
+
+from battery_diagnostics import BatteryDiagnostics, spec_registry
+from capacity_fade import CAPACITY_FADE_MODELS
+from cycle_life import DEFAULT_DRAWS, DEFAULT_PERCENTILES, MAX_SIMULATED_BATTERIES, MIN_DRAWS
+
+# Upper bound on the number of rows accepted by the columnar batch endpoints
+MAX_BATCH_SIZE = 100000
+# Upper bound on the cells, across all packs, of one pack-balance batch
+MAX_BATCH_CELLS = 2000000
+# Upper bound on the capacity points, across all batteries, of one fade fit
+MAX_BATCH_FADE_POINTS = 100000000
+# Upper bound on the SOC samples, across all batteries, of one rainflow chunk
+MAX_BATCH_SOC_SAMPLES = 10000000
+
+# Request bounds, compiled once at import instead of rebuilt by every validator.
+# PARAMETER_BATTERY_TYPES is the chemistry list of BatteryParameters, which the
+# SOC, resistance and fault requests also apply; SPEC_BATTERY_TYPES holds the
+# chemistries with voltage specifications
+PARAMETER_BATTERY_TYPES = ["Li-ion", "LiFePO₄", "Lead-acid"]
+_PARAMETER_BATTERY_TYPES = frozenset(PARAMETER_BATTERY_TYPES)
+SPEC_BATTERY_TYPES = list(spec_registry.chemistries)
+_SPEC_BATTERY_TYPES = frozenset(SPEC_BATTERY_TYPES)
+SOC_BATTERY_TYPE_EXAMPLES = ["Li-ion_24V", "LFP_48V", "Li-ion", "LFP", "Lead-acid"]
+MAX_VOLTAGE = 100
+MAX_NOMINAL_VOLTAGE = 500
+MIN_TEMPERATURE = -40
+MAX_TEMPERATURE = 100
+
+def _check_voltage(voltage: float):
+    if voltage <= 0 or voltage > MAX_VOLTAGE:
+        raise ValueError("Voltage must be positive and less than 100V")
+
+def _check_nominal_voltage(nominal_voltage: float):
+    if nominal_voltage <= 0 or nominal_voltage > MAX_NOMINAL_VOLTAGE:
+        raise ValueError("Nominal voltage must be positive and less than 500V")
+
+def _check_temperature(temperature: float):
+    if temperature < MIN_TEMPERATURE or temperature > MAX_TEMPERATURE:
+        raise ValueError("Temperature must be between -40°C and 100°C")
+
+def _check_battery_parameters(battery_type: str, voltage: float, temperature: float):
+    """The BatteryParameters checks, applied without building a BatteryParameters"""
+    if battery_type not in _PARAMETER_BATTERY_TYPES:
+        raise ValueError(f"Battery type must be one of {PARAMETER_BATTERY_TYPES}")
+    _check_voltage(voltage)
+    _check_temperature(temperature)
+
+def _as_float_array(value) -> np.ndarray:
+    """Accept a JSON list or an already decoded NumPy array (binary bodies, no copy)"""
+    if isinstance(value, np.ndarray) and value.dtype.kind == "f":
+        return value
+    if isinstance(value, list) and None in value:
+        raise ValueError("Array values must be numbers")
+    try:
+        return np.asarray(value, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError("Expected an array of numbers")
+
+def _float_array(value) -> np.ndarray:
+    array = _as_float_array(value)
+    if array.ndim != 1:
+        raise ValueError("Expected a one-dimensional array of numbers")
+    return array
+
+def _float_matrix(value) -> np.ndarray:
+    """A list of equal-length rows, or a flat array to be reshaped by the model"""
+    array = _as_float_array(value)
+    if array.ndim not in (1, 2):
+        raise ValueError("Expected a list of rows of numbers")
+    return array
+
+def _padded_matrix(value) -> np.ndarray:
+    """Like _float_matrix, but rows may differ in length and hold nulls; gaps become NaN"""
+    if isinstance(value, list) and value and all(isinstance(row, list) for row in value):
+        width = max(len(row) for row in value)
+        if any(len(row) != width for row in value):
+            value = [row + [None] * (width - len(row)) for row in value]
+    if isinstance(value, np.ndarray) and value.dtype.kind == "f":
+        array = value
+    else:
+        try:
+            array = np.asarray(value, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError("Expected a list of rows of numbers")
+    if array.ndim not in (1, 2):
+        raise ValueError("Expected a list of rows of numbers")
+    return array
+
+# List of floats held as a float NumPy array. JSON lists are converted in one
+# C-level pass instead of being validated element by element
+FloatArray = Annotated[
+    np.ndarray,
+    PlainValidator(_float_array),
+    PlainSerializer(lambda array: array.tolist(), when_used="json"),
+    WithJsonSchema({"type": "array", "items": {"type": "number"}})
+]
+
+# Rows of floats held as a 2-D float NumPy array. Binary bodies may send the
+# values flat (row after row) for the model to reshape
+FloatMatrix = Annotated[
+    np.ndarray,
+    PlainValidator(_float_matrix),
+    PlainSerializer(lambda array: array.tolist(), when_used="json"),
+    WithJsonSchema({"type": "array", "items": {"type": "array", "items": {"type": "number"}}})
+]
+
+# Rows of floats of any length, with nulls for missing values, held as a
+# NaN-padded 2-D float NumPy array (or flat, like FloatMatrix)
+PaddedMatrix = Annotated[
+    np.ndarray,
+    PlainValidator(_padded_matrix),
+    PlainSerializer(lambda array: array.tolist(), when_used="json"),
+    WithJsonSchema({"type": "array", "items": {"type": "array", "items": {"type": ["number", "null"]}}})
+]
+
 class BatteryParameters(BaseModel):
     batteryType: str = Field(..., description="Battery chemistry type (Li-ion, LiFePO₄, Lead-acid)")
     voltage: float = Field(..., description="Battery voltage in volts")
@@ -12,16 +128,7 @@ class BatteryParameters(BaseModel):
 
     @model_validator(mode='after')
     def validate_parameters(self) -> 'BatteryParameters':
-        valid_types = ["Li-ion", "LiFePO₄", "Lead-acid"]
-        if self.batteryType not in valid_types:
-            raise ValueError(f"Battery type must be one of {valid_types}")
-
-        if self.voltage <= 0 or self.voltage > 100:
-            raise ValueError("Voltage must be positive and less than 100V")
-
-        if self.temperature < -40 or self.temperature > 100:
-            raise ValueError("Temperature must be between -40°C and 100°C")
-
+        _check_battery_parameters(self.batteryType, self.voltage, self.temperature)
         return self
 
 class SOCRequest(BaseModel):
@@ -33,23 +140,57 @@ class SOCRequest(BaseModel):
 
     @model_validator(mode='after')
     def validate_parameters(self) -> 'SOCRequest':
-        from battery_diagnostics import BatteryDiagnostics
-        
-        valid_types = list(BatteryDiagnostics.BATTERY_TYPES.keys())
-        if self.batteryType not in valid_types:
-            valid_type_examples = ["Li-ion_24V", "LFP_48V", "Li-ion", "LFP", "Lead-acid"]
-            raise ValueError(f"Battery type '{self.batteryType}' is not valid. Examples of valid types: {valid_type_examples}")
-            
-        if self.nominalVoltage <= 0 or self.nominalVoltage > 500:
-            raise ValueError("Nominal voltage must be positive and less than 500V")
-            
-        params = BatteryParameters(
-            batteryType=self.batteryType,
-            voltage=self.voltage,
-            temperature=self.temperature,
-            current=None,
-            capacity=None
-        )
+        if self.batteryType not in _SPEC_BATTERY_TYPES:
+            raise ValueError(f"Battery type '{self.batteryType}' is not valid. Examples of valid types: {SOC_BATTERY_TYPE_EXAMPLES}")
+        _check_nominal_voltage(self.nominalVoltage)
+        _check_battery_parameters(self.batteryType, self.voltage, self.temperature)
+        return self
+
+class SOCBatchRequest(BaseModel):
+    batteryType: List[str] = Field(..., description="Battery chemistry type for each reading")
+    nominalVoltage: FloatArray = Field(..., description="Nominal voltage for each reading")
+    voltage: FloatArray = Field(..., description="Battery voltage for each reading")
+    temperature: FloatArray = Field(..., description="Battery temperature in Celsius for each reading")
+    current: FloatArray = Field(..., description="Current flow in amperes for each reading")
+
+    @model_validator(mode='after')
+    def validate_columns(self) -> 'SOCBatchRequest':
+        lengths = {len(self.batteryType), len(self.nominalVoltage), len(self.voltage),
+                   len(self.temperature), len(self.current)}
+        if len(lengths) != 1:
+            raise ValueError("All columns must have the same length")
+        if not len(self.voltage):
+            raise ValueError("Batch must contain at least one reading")
+        if len(self.voltage) > MAX_BATCH_SIZE:
+            raise ValueError(f"Batch size must not exceed {MAX_BATCH_SIZE} readings")
+        return self
+
+class TrackedSOCRequest(BaseModel):
+    batteryId: List[str] = Field(..., description="Identifier of each battery; SOC is tracked per battery between requests")
+    batteryType: List[str] = Field(..., description="Battery chemistry type for each reading")
+    nominalVoltage: FloatArray = Field(..., description="Nominal voltage for each reading")
+    voltage: FloatArray = Field(..., description="Battery voltage for each reading")
+    temperature: FloatArray = Field(..., description="Battery temperature in Celsius for each reading")
+    current: FloatArray = Field(..., description="Current flow in amperes for each reading (positive when charging)")
+    capacity: FloatArray = Field(..., description="Usable capacity (mAh) of each battery")
+    timestamp: Optional[FloatArray] = Field(None, description="Unix time in seconds of each reading (default: time of the request)")
+
+    @model_validator(mode='after')
+    def validate_columns(self) -> 'TrackedSOCRequest':
+        lengths = {len(self.batteryId), len(self.batteryType), len(self.nominalVoltage),
+                   len(self.voltage), len(self.temperature), len(self.current), len(self.capacity)}
+        if self.timestamp is not None:
+            lengths.add(len(self.timestamp))
+        if len(lengths) != 1:
+            raise ValueError("All columns must have the same length")
+        if not len(self.voltage):
+            raise ValueError("Batch must contain at least one reading")
+        if len(self.voltage) > MAX_BATCH_SIZE:
+            raise ValueError(f"Batch size must not exceed {MAX_BATCH_SIZE} readings")
+        if len(set(self.batteryId)) != len(self.batteryId):
+            raise ValueError("Each batteryId may appear only once per request")
+        if not (self.capacity > 0).all():
+            raise ValueError("Capacity values must be positive")
         return self
 
 class SOHRequest(BaseModel):
@@ -74,12 +215,7 @@ class ResistanceRequest(BaseModel):
 
     @model_validator(mode='after')
     def validate_parameters(self) -> 'ResistanceRequest':
-        params = BatteryParameters(
-            batteryType=self.batteryType,
-            voltage=self.voltage,
-            temperature=self.temperature,
-            current=self.current
-        )
+        _check_battery_parameters(self.batteryType, self.voltage, self.temperature)
         return self
 
 class CapacityFadeRequest(BaseModel):
@@ -97,17 +233,92 @@ class CapacityFadeRequest(BaseModel):
 
 class CellBalanceRequest(BaseModel):
     batteryType: str = Field(..., description="Battery chemistry type")
-    cellVoltages: List[float] = Field(..., description="Array of individual cell voltages")
+    cellVoltages: FloatArray = Field(..., description="Array of individual cell voltages")
     temperature: float = Field(..., description="Battery temperature")
 
     @model_validator(mode='after')
     def validate_cell_voltages(self) -> 'CellBalanceRequest':
         if len(self.cellVoltages) < 2:
             raise ValueError("Must provide at least 2 cell voltages")
-        if any(volt <= 0 for volt in self.cellVoltages):
+        if not (self.cellVoltages > 0).all():
             raise ValueError("All cell voltages must be positive")
         return self
 
+class PackBalanceRequest(BaseModel):
+    batteryType: str = Field(..., description="Battery chemistry type")
+    cellVoltages: FloatMatrix = Field(..., description="Cell voltages, one row per pack and one column per cell")
+    cellsPerPack: Optional[int] = Field(None, description="Cells per pack when cellVoltages is sent flat")
+    series: Optional[int] = Field(None, description="Series groups per module (default: the whole pack is one module)")
+    parallel: int = Field(1, description="Adjacent cells wired in parallel within each series group")
+    temperature: Optional[float] = Field(None, description="Battery temperature")
+
+    @model_validator(mode='after')
+    def validate_pack(self) -> 'PackBalanceRequest':
+        if self.cellVoltages.ndim == 1:
+            if not self.cellsPerPack or len(self.cellVoltages) % self.cellsPerPack:
+                raise ValueError("Flat cellVoltages need a cellsPerPack that divides their length")
+            self.cellVoltages = self.cellVoltages.reshape(-1, self.cellsPerPack)
+        packs, cells = self.cellVoltages.shape
+        if not packs:
+            raise ValueError("Batch must contain at least one pack")
+        if cells < 2:
+            raise ValueError("Must provide at least 2 cell voltages")
+        if self.cellVoltages.size > MAX_BATCH_CELLS:
+            raise ValueError(f"Batch must not exceed {MAX_BATCH_CELLS} cells")
+        if not (self.cellVoltages > 0).all() or not np.isfinite(self.cellVoltages).all():
+            raise ValueError("All cell voltages must be positive")
+        if self.parallel < 1 or (self.series is not None and self.series < 1):
+            raise ValueError("series and parallel must be positive")
+        if cells % (self.parallel * (self.series or 1)):
+            raise ValueError(f"{cells} cells do not divide into modules of series × parallel cells")
+        return self
+
+class CapacityFadeFitRequest(BaseModel):
+    batteryType: str = Field(..., description="Battery chemistry type")
+    capacity: PaddedMatrix = Field(..., description="Measured capacity (mAh), one row per battery; shorter rows or nulls mark missing points")
+    cycles: PaddedMatrix = Field(..., description="Cycle number of each capacity point: one row shared by every battery, or one row per battery")
+    pointsPerBattery: Optional[int] = Field(None, description="Points per battery when capacity is sent flat")
+    initialCapacity: Optional[FloatArray] = Field(None, description="Initial capacity (mAh) of each battery (default: the capacity at its earliest cycle)")
+    models: List[str] = Field(list(CAPACITY_FADE_MODELS), description=f"Fade models to fit, of {list(CAPACITY_FADE_MODELS)}")
+    eolFraction: float = Field(0.8, description="End of life as a fraction of the initial capacity")
+    confidence: float = Field(0.95, description="Confidence level of the end-of-life bounds")
+
+    @model_validator(mode='after')
+    def validate_fit(self) -> 'CapacityFadeFitRequest':
+        if self.capacity.ndim == 1:
+            if not self.pointsPerBattery or len(self.capacity) % self.pointsPerBattery:
+                raise ValueError("Flat capacity needs a pointsPerBattery that divides its length")
+            self.capacity = self.capacity.reshape(-1, self.pointsPerBattery)
+        batteries, points = self.capacity.shape
+        if not batteries:
+            raise ValueError("Batch must contain at least one battery")
+        if self.capacity.size > MAX_BATCH_FADE_POINTS:
+            raise ValueError(f"Batch must not exceed {MAX_BATCH_FADE_POINTS} capacity points")
+        if self.cycles.ndim == 1 and self.cycles.size == self.capacity.size and self.cycles.size != points:
+            self.cycles = self.cycles.reshape(self.capacity.shape)
+        if self.cycles.shape not in ((points,), self.capacity.shape):
+            raise ValueError("Cycles must be one row of the capacity width or match the capacity shape")
+        if (self.capacity <= 0).any():
+            raise ValueError("Capacity values must be positive")
+        if (self.cycles < 0).any():
+            raise ValueError("Cycle count cannot be negative")
+        if self.initialCapacity is not None:
+            if self.initialCapacity.shape != (batteries,):
+                raise ValueError("initialCapacity must have one value per battery")
+            if not (self.initialCapacity > 0).all():
+                raise ValueError("Capacity values must be positive")
+        unknown = [model for model in self.models if model not in CAPACITY_FADE_MODELS]
+        if unknown:
+            raise ValueError(f"Unknown fade models {unknown}. Valid models are: {list(CAPACITY_FADE_MODELS)}")
+        if not self.models:
+            raise ValueError("At least one fade model must be requested")
+        self.models = list(dict.fromkeys(self.models))
+        if not 0 < self.eolFraction < 1:
+            raise ValueError("End-of-life fraction must be between 0 and 1")
+        if not 0 < self.confidence < 1:
+            raise ValueError("Confidence must be between 0 and 1")
+        return self
+
 class CycleLifeRequest(BaseModel):
     batteryType: str = Field(..., description="Battery chemistry type")
     cycleCount: int = Field(..., description="Number of charge cycles")
@@ -123,6 +334,99 @@ class CycleLifeRequest(BaseModel):
             raise ValueError("Current SOH must be between 0 and 100")
         return self
 
+class CycleLifeSimulationRequest(BaseModel):
+    batteryType: str = Field(..., description="Battery chemistry type")
+    depthOfDischarge: FloatArray = Field(..., description="Mean depth of discharge (%) of each battery")
+    averageTemperature: FloatArray = Field(..., description="Mean operating temperature (°C) of each battery")
+    currentSOH: FloatArray = Field(..., description="Current State of Health (%) of each battery")
+    depthOfDischargeStdDev: float = Field(10.0, description="Standard deviation of the depth of discharge (%)")
+    temperatureStdDev: float = Field(5.0, description="Standard deviation of the operating temperature (°C)")
+    sohStdDev: float = Field(2.0, description="Standard deviation of the State of Health estimate (%)")
+    cyclesPerDay: float = Field(2.0, description="Charge cycles per day, to date end of life")
+    draws: int = Field(DEFAULT_DRAWS, description="Scenarios per battery (reduced for large fleets to stay within the draw budget)")
+    seed: Optional[int] = Field(None, description="Random seed; repeat a run by sending the seed it returned")
+    percentiles: List[float] = Field(list(DEFAULT_PERCENTILES), description="Percentiles of remaining cycles and end-of-life date to report")
+    horizonDays: Optional[float] = Field(None, description="Also report the probability of end of life within this many days")
+
+    @model_validator(mode='after')
+    def validate_simulation(self) -> 'CycleLifeSimulationRequest':
+        count = len(self.depthOfDischarge)
+        if not count:
+            raise ValueError("Batch must contain at least one battery")
+        if count > MAX_BATCH_SIZE:
+            raise ValueError(f"Batch size must not exceed {MAX_BATCH_SIZE} batteries")
+        # The draw budget has to cover MIN_DRAWS scenarios for every battery
+        if count > MAX_SIMULATED_BATTERIES:
+            raise ValueError(
+                f"Batch size must not exceed {MAX_SIMULATED_BATTERIES} batteries "
+                f"({MIN_DRAWS} draws each within the draw budget)")
+        if len(self.averageTemperature) != count or len(self.currentSOH) != count:
+            raise ValueError("All fields must have one value per battery")
+        if not ((self.depthOfDischarge >= 0) & (self.depthOfDischarge <= 100)).all():
+            raise ValueError("Depth of discharge must be between 0 and 100")
+        if not ((self.currentSOH >= 0) & (self.currentSOH <= 100)).all():
+            raise ValueError("Current SOH must be between 0 and 100")
+        if not np.isfinite(self.averageTemperature).all():
+            raise ValueError("Average temperature must be a number")
+        if min(self.depthOfDischargeStdDev, self.temperatureStdDev, self.sohStdDev) < 0:
+            raise ValueError("Standard deviations cannot be negative")
+        if self.cyclesPerDay <= 0:
+            raise ValueError("Cycles per day must be positive")
+        if self.draws < MIN_DRAWS:
+            raise ValueError(f"At least {MIN_DRAWS} draws per battery are required")
+        if self.seed is not None and self.seed < 0:
+            raise ValueError("Seed cannot be negative")
+        if not self.percentiles or not all(0 <= p <= 100 for p in self.percentiles):
+            raise ValueError("Percentiles must be between 0 and 100")
+        self.percentiles = sorted(set(self.percentiles))
+        if self.horizonDays is not None and self.horizonDays < 0:
+            raise ValueError("Horizon cannot be negative")
+        return self
+
+class RainflowRequest(BaseModel):
+    batteryId: List[str] = Field(..., description="Identifier of each battery; cycles are counted per battery between requests")
+    batteryType: str = Field(..., description="Battery chemistry type")
+    stateOfCharge: PaddedMatrix = Field(..., description="Next SOC samples (%) of each battery in time order, one row per battery; shorter rows or nulls mark missing samples")
+    samplesPerBattery: Optional[int] = Field(None, description="Samples per battery when stateOfCharge is sent flat")
+    averageTemperature: Optional[FloatArray] = Field(None, description="Average operating temperature (°C) of each battery, with currentSOH, for a cycle-life estimate")
+    currentSOH: Optional[FloatArray] = Field(None, description="Current State of Health (%) of each battery, with averageTemperature, for a cycle-life estimate")
+    currentCapacity: Optional[FloatArray] = Field(None, description="Current measured capacity (mAh) of each battery, with ratedCapacity, for an SOH estimate")
+    ratedCapacity: Optional[FloatArray] = Field(None, description="Original rated capacity (mAh) of each battery, with currentCapacity, for an SOH estimate")
+
+    @model_validator(mode='after')
+    def validate_series(self) -> 'RainflowRequest':
+        if self.stateOfCharge.ndim == 1:
+            if not self.samplesPerBattery or len(self.stateOfCharge) % self.samplesPerBattery:
+                raise ValueError("Flat stateOfCharge needs a samplesPerBattery that divides its length")
+            self.stateOfCharge = self.stateOfCharge.reshape(-1, self.samplesPerBattery)
+        count = len(self.batteryId)
+        if not count:
+            raise ValueError("Batch must contain at least one battery")
+        if count > MAX_BATCH_SIZE:
+            raise ValueError(f"Batch size must not exceed {MAX_BATCH_SIZE} batteries")
+        if len(self.stateOfCharge) != count:
+            raise ValueError("stateOfCharge must have one row per battery")
+        if self.stateOfCharge.size > MAX_BATCH_SOC_SAMPLES:
+            raise ValueError(f"Batch must not exceed {MAX_BATCH_SOC_SAMPLES} SOC samples")
+        if len(set(self.batteryId)) != count:
+            raise ValueError("Each batteryId may appear only once per request")
+        if (self.stateOfCharge < 0).any() or (self.stateOfCharge > 100).any():
+            raise ValueError("State of charge must be between 0 and 100")
+        for first, second in (("averageTemperature", "currentSOH"), ("currentCapacity", "ratedCapacity")):
+            given = [getattr(self, name) is not None for name in (first, second)]
+            if any(given) and not all(given):
+                raise ValueError(f"{first} and {second} must be given together")
+            if all(given) and (len(getattr(self, first)) != count or len(getattr(self, second)) != count):
+                raise ValueError(f"{first} and {second} must have one value per battery")
+        if self.averageTemperature is not None:
+            if not np.isfinite(self.averageTemperature).all():
+                raise ValueError("Average temperature must be a number")
+            if not ((self.currentSOH >= 0) & (self.currentSOH <= 100)).all():
+                raise ValueError("Current SOH must be between 0 and 100")
+        if self.currentCapacity is not None:
+            if not ((self.currentCapacity > 0) & (self.ratedCapacity > 0)).all():
+                raise ValueError("Capacity values must be positive")
+        return self
 
 class SafetyRequest(BaseModel):
     batteryType: str = Field(..., description="Battery chemistry type")
@@ -148,21 +452,11 @@ class VoltageRequest(BaseModel):
 
     @model_validator(mode='after')
     def validate_parameters(self) -> 'VoltageRequest':
-        from battery_diagnostics import BatteryDiagnostics
-        
-        valid_types = list(BatteryDiagnostics.BATTERY_TYPES.keys())
-        if self.batteryType not in valid_types:
-            raise ValueError(f"Battery type '{self.batteryType}' is not valid. Valid types are: {valid_types}")
-            
-        if self.voltage <= 0 or self.voltage > 100:
-            raise ValueError("Voltage must be positive and less than 100V")
-            
-        if self.nominalVoltage <= 0 or self.nominalVoltage > 500:
-            raise ValueError("Nominal voltage must be positive and less than 500V")
-            
-        if self.temperature < -40 or self.temperature > 100:
-            raise ValueError("Temperature must be between -40°C and 100°C")
-            
+        if self.batteryType not in _SPEC_BATTERY_TYPES:
+            raise ValueError(f"Battery type '{self.batteryType}' is not valid. Valid types are: {SPEC_BATTERY_TYPES}")
+        _check_voltage(self.voltage)
+        _check_nominal_voltage(self.nominalVoltage)
+        _check_temperature(self.temperature)
         return self
 
 class ThermalRequest(BaseModel):
@@ -188,14 +482,94 @@ class FaultRequest(BaseModel):
 
     @model_validator(mode='after')
     def validate_parameters(self) -> 'FaultRequest':
-        params = BatteryParameters(
-            batteryType=self.batteryType,
-            voltage=self.voltage,
-            temperature=self.temperature,
-            current=self.current
-        )
+        _check_battery_parameters(self.batteryType, self.voltage, self.temperature)
+        return self
+
+
+# Inputs each full-report section needs in addition to batteryType and temperature
+FULL_REPORT_FIELDS = BatteryDiagnostics.REPORT_FIELDS
+
+class FullDiagnosticRequest(BaseModel):
+    batteryType: str = Field(..., description="Battery chemistry type")
+    temperature: float = Field(..., description="Battery temperature in Celsius")
+    sections: Optional[List[str]] = Field(None, description=f"Sections to compute (default: all of {list(FULL_REPORT_FIELDS)})")
+    nominalVoltage: Optional[float] = Field(None, description="Nominal voltage of the battery")
+    voltage: Optional[float] = Field(None, description="Battery voltage in volts")
+    current: Optional[float] = Field(None, description="Current flow in amperes")
+    currentCapacity: Optional[float] = Field(None, description="Current measured capacity (mAh)")
+    ratedCapacity: Optional[float] = Field(None, description="Original rated capacity (mAh)")
+    initialCapacity: Optional[float] = Field(None, description="Initial battery capacity (mAh)")
+    cycleCount: Optional[int] = Field(None, description="Number of charge cycles completed")
+    timeInService: Optional[int] = Field(None, description="Days in service")
+    cellVoltages: Optional[FloatArray] = Field(None, description="Array of individual cell voltages")
+    pressure: Optional[float] = Field(None, description="Internal pressure (atm)")
+    rateOfChange: Optional[float] = Field(None, description="Temperature change rate (°C/min)")
+    ambientTemperature: Optional[float] = Field(None, description="Ambient temperature")
+    loadProfile: Optional[str] = Field(None, description="Current load profile")
+    depthOfDischarge: Optional[float] = Field(None, description="Depth of discharge (%)")
+    averageTemperature: Optional[float] = Field(None, description="Average operating temperature (°C)")
+    currentSOH: Optional[float] = Field(None, description="Current State of Health (%)")
+    impedance: Optional[float] = Field(None, description="Internal impedance (Ohms)")
+
+    @model_validator(mode='after')
+    def validate_sections(self) -> 'FullDiagnosticRequest':
+        if self.sections is None:
+            self.sections = list(FULL_REPORT_FIELDS)
+        unknown = [section for section in self.sections if section not in FULL_REPORT_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown sections {unknown}. Valid sections are: {list(FULL_REPORT_FIELDS)}")
+        if not self.sections:
+            raise ValueError("At least one section must be requested")
+        self.sections = list(dict.fromkeys(self.sections))
+
+        for section in self.sections:
+            missing = [name for name in FULL_REPORT_FIELDS[section] if getattr(self, name) is None]
+            if missing:
+                raise ValueError(f"Section '{section}' requires fields: {missing}")
+
+        # Same input checks as the individual request models, applied once
+        if self.currentCapacity is not None and self.currentCapacity <= 0:
+            raise ValueError("Capacity values must be positive")
+        if self.ratedCapacity is not None and self.ratedCapacity <= 0:
+            raise ValueError("Capacity values must be positive")
+        if self.cycleCount is not None and self.cycleCount < 0:
+            raise ValueError("Cycle count cannot be negative")
+        if self.timeInService is not None and self.timeInService < 0:
+            raise ValueError("Time in service cannot be negative")
+        if self.cellVoltages is not None:
+            if len(self.cellVoltages) < 2:
+                raise ValueError("Must provide at least 2 cell voltages")
+            if not (self.cellVoltages > 0).all():
+                raise ValueError("All cell voltages must be positive")
+        if self.pressure is not None:
+            if self.pressure <= 0:
+                raise ValueError("Pressure must be positive")
+            if self.pressure > 2.0:
+                raise ValueError("Pressure exceeds safety threshold")
+        if self.loadProfile is not None:
+            valid_profiles = ["low", "medium", "high"]
+            if self.loadProfile.lower() not in valid_profiles:
+                raise ValueError(f"Load profile must be one of {valid_profiles}")
+        if self.depthOfDischarge is not None and not 0 <= self.depthOfDischarge <= 100:
+            raise ValueError("Depth of discharge must be between 0 and 100")
+        if self.currentSOH is not None and not 0 <= self.currentSOH <= 100:
+            raise ValueError("Current SOH must be between 0 and 100")
         return self
 
+class BatchJobRequest(BaseModel):
+    diagnostics: Optional[List[str]] = Field(None, description=f"Diagnostics to run on every row (default: all of {list(FULL_REPORT_FIELDS)})")
+
+    @model_validator(mode='after')
+    def validate_diagnostics(self) -> 'BatchJobRequest':
+        if self.diagnostics is None:
+            self.diagnostics = list(FULL_REPORT_FIELDS)
+        unknown = [name for name in self.diagnostics if name not in FULL_REPORT_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown diagnostics {unknown}. Valid diagnostics are: {list(FULL_REPORT_FIELDS)}")
+        if not self.diagnostics:
+            raise ValueError("At least one diagnostic must be requested")
+        self.diagnostics = list(dict.fromkeys(self.diagnostics))
+        return self
 
 class DiagnosticResult(BaseModel):
     timestamp: datetime
@@ -0,0 +1,317 @@
+"""Open-circuit voltage (OCV) to SOC curves per chemistry, nominal voltage and temperature.
+
+Each chemistry in BATTERY_TYPES declares an "ocv" entry: its resting cell
+voltage at 25°C at a few SOC points, and a temperature coefficient. The
+curve is scaled onto every nominal voltage's [min_voltage, max_voltage]
+range, so a pack at its lower cutoff reads 0% and at its upper cutoff 100%,
+as the validation limits expect. Temperature moves the middle of the curve
+by the coefficient per °C away from 25°C, leaving the end points fixed.
+
+All curves are compiled into one sorted table::
+
+    voltages[chemistry id, nominal id, temperature index, SOC index]
+
+on a shared SOC grid (the union of the declared SOC points, so resampling is
+exact) and temperature grid. Lookups interpolate linearly between the two
+nearest temperatures and then along SOC. The scalar path walks plain
+Python lists with bisect and the batched path uses np.searchsorted-style
+indexing; both use np.interp's formula, so they agree to the last bit.
+
+Building the table is cheap but it is cached as an .npz file, keyed by a
+hash of its inputs. ``python ocv_table.py --spreadsheet PATH`` regenerates
+the cache after checking that the cutoff voltages in
+attached_assets/Battery_Specification.xlsx (the sheet BATTERY_TYPES was
+transcribed from) still match, so the server never parses Excel at startup.
+"""
+from bisect import bisect_right
+from typing import Dict, List, Optional, Sequence, Tuple
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+
+from spec_registry import SpecRegistry
+
+logger = logging.getLogger(__name__)
+
+# Where the compiled table is cached between runs
+DEFAULT_OCV_TABLE_PATH = os.environ.get("OCV_TABLE_PATH", "ocv_table.npz")
+# Temperatures (°C) the curves are tabulated at; lookups interpolate between them
+OCV_TEMPERATURES = (-20.0, -10.0, 0.0, 10.0, 25.0, 40.0, 55.0)
+OCV_REFERENCE_TEMPERATURE = 25.0
+# Blended scalar-path curves kept before the cache starts over
+OCV_CURVE_CACHE_SIZE = 4096
+# Bump when the table layout or the way curves are derived changes
+OCV_TABLE_VERSION = 1
+
+# Spreadsheet chemistry names that differ from the BATTERY_TYPES keys
+SPREADSHEET_CHEMISTRIES = {"LiFePO4": "LFP", "Li-Ion": "Li-ion"}
+
+
+class OCVTable:
+    """Compiled OCV curves with scalar and batched SOC lookups"""
+
+    def __init__(self, soc_points: np.ndarray, temperatures: np.ndarray, voltages: np.ndarray):
+        self.soc_points = soc_points
+        self.temperatures = temperatures
+        self.voltages = voltages
+        # Python copies for the scalar path: _curves[chem id][nominal id][temperature index]
+        self._soc_list: List[float] = soc_points.tolist()
+        self._temperature_list: List[float] = temperatures.tolist()
+        self._curves: List[List[List[List[float]]]] = [
+            [layers.tolist() for layers in chemistry if not np.isnan(layers).all()]
+            for chemistry in voltages
+        ]
+        # Blended curves by (chem id, nominal id, temperature); readings repeat temperatures
+        self._curve_cache: Dict[Tuple[int, int, float], List[float]] = {}
+
+    @classmethod
+    def build(cls, battery_types: Dict, registry: SpecRegistry,
+              temperatures: Sequence[float] = OCV_TEMPERATURES) -> "OCVTable":
+        """Compile the "ocv" entries of ``battery_types`` onto the registry's nominals"""
+        soc_points = np.unique(np.concatenate([
+            np.asarray(battery_types[name]["ocv"]["soc"], dtype=np.float64)
+            for name in registry.chemistries
+        ]))
+        temperatures = np.asarray(temperatures, dtype=np.float64)
+        voltages = np.full(registry.nominal_voltages.shape + (len(temperatures), len(soc_points)), np.nan)
+
+        for chem_id, name in enumerate(registry.chemistries):
+            ocv = battery_types[name]["ocv"]
+            points = np.asarray(ocv["soc"], dtype=np.float64)
+            cell = np.asarray(ocv["cell_voltage"], dtype=np.float64)
+            if points[0] != 0 or points[-1] != 100 or np.any(np.diff(points) <= 0):
+                raise ValueError(f"OCV SOC points for {name} must rise from 0 to 100")
+
+            cell = np.interp(soc_points, points, cell)
+            fraction = soc_points / 100
+            # Temperature shifts the middle of the curve; the cutoffs stay put
+            shift = (ocv["temperature_coefficient"] * (temperatures[:, None] - OCV_REFERENCE_TEMPERATURE)
+                     * 4 * fraction * (1 - fraction))
+            normalized = (cell + shift - cell[0]) / (cell[-1] - cell[0])
+            if np.any(np.diff(normalized, axis=1) <= 0):
+                raise ValueError(f"OCV curve for {name} must rise strictly with SOC at every temperature")
+
+            count = registry.nominal_counts[chem_id]
+            low = registry.min_voltages[chem_id, :count, None, None]
+            high = registry.max_voltages[chem_id, :count, None, None]
+            voltages[chem_id, :count] = low + (high - low) * normalized
+        return cls(soc_points, temperatures, voltages)
+
+    # Scalar lookups
+
+    def curve(self, chem_id: int, nominal_id: int, temperature: float) -> List[float]:
+        """Pack OCV at every SOC grid point for one spec and temperature"""
+        key = (chem_id, nominal_id, temperature)
+        curve = self._curve_cache.get(key)
+        if curve is not None:
+            return curve
+
+        temperatures = self._temperature_list
+        index = bisect_right(temperatures, temperature) - 1
+        if index < 0:
+            index = 0
+        elif index > len(temperatures) - 2:
+            index = len(temperatures) - 2
+        weight = (temperature - temperatures[index]) / (temperatures[index + 1] - temperatures[index])
+        weight = min(max(weight, 0.0), 1.0)
+        low, high = self._curves[chem_id][nominal_id][index:index + 2]
+        curve = [a + weight * (b - a) for a, b in zip(low, high)]
+
+        if len(self._curve_cache) >= OCV_CURVE_CACHE_SIZE:
+            self._curve_cache.clear()
+        self._curve_cache[key] = curve
+        return curve
+
+    def soc(self, chem_id: int, nominal_id: int, voltage: float, temperature: float) -> float:
+        """SOC in % for a resting voltage, clamped to the curve's ends"""
+        curve = self.curve(chem_id, nominal_id, temperature)
+        soc_points = self._soc_list
+        if voltage <= curve[0]:
+            return soc_points[0]
+        if voltage >= curve[-1]:
+            return soc_points[-1]
+        j = bisect_right(curve, voltage) - 1
+        slope = (soc_points[j + 1] - soc_points[j]) / (curve[j + 1] - curve[j])
+        return slope * (voltage - curve[j]) + soc_points[j]
+
+    # Array lookups
+
+    def _temperature_weights(self, temperature: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        temperatures = self.temperatures
+        index = np.clip(np.searchsorted(temperatures, temperature, side="right") - 1,
+                        0, len(temperatures) - 2)
+        weight = (temperature - temperatures[index]) / (temperatures[index + 1] - temperatures[index])
+        return index, np.clip(weight, 0.0, 1.0)
+
+    def curves_for(self, chem_ids: np.ndarray, nominal_ids: np.ndarray,
+                   temperature: np.ndarray) -> np.ndarray:
+        """(n, SOC points) pack OCV curves per row; unresolved rows are NaN"""
+        resolved = (chem_ids >= 0) & (nominal_ids >= 0)
+        c = np.where(resolved, chem_ids, 0)
+        k = np.where(resolved, nominal_ids, 0)
+        index, weight = self._temperature_weights(temperature)
+        low = self.voltages[c, k, index]
+        curves = low + weight[:, None] * (self.voltages[c, k, index + 1] - low)
+        curves[~resolved] = np.nan
+        return curves
+
+    def soc_batch(self, chem_ids: np.ndarray, nominal_ids: np.ndarray,
+                  voltage: np.ndarray, temperature: np.ndarray) -> np.ndarray:
+        """Vectorized soc(); NaN for unresolved rows"""
+        voltage = np.asarray(voltage, dtype=np.float64)
+        temperature = np.asarray(temperature, dtype=np.float64)
+        curves = self.curves_for(chem_ids, nominal_ids, temperature)
+        soc_points = self.soc_points
+        rows = np.arange(len(voltage))
+        # Last grid point at or below each voltage, kept inside the curve
+        j = np.clip((curves <= voltage[:, None]).sum(axis=1) - 1, 0, len(soc_points) - 2)
+        low, high = curves[rows, j], curves[rows, j + 1]
+        with np.errstate(invalid="ignore"):
+            slope = (soc_points[j + 1] - soc_points[j]) / (high - low)
+            soc = slope * (voltage - low) + soc_points[j]
+        soc = np.where(voltage >= curves[:, -1], soc_points[-1], soc)
+        soc = np.where(voltage <= curves[:, 0], soc_points[0], soc)
+        return np.where(np.isnan(curves[:, 0]), np.nan, soc)
+
+    def voltage_batch(self, chem_ids: np.ndarray, nominal_ids: np.ndarray, soc: np.ndarray,
+                      temperature: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Pack OCV at ``soc`` (%) per row, and its slope in volts per unit SOC fraction.
+
+        Only the two curve points around each SOC are blended, rather than
+        whole curves; unresolved rows are NaN.
+        """
+        resolved = (chem_ids >= 0) & (nominal_ids >= 0)
+        c = np.where(resolved, chem_ids, 0)
+        k = np.where(resolved, nominal_ids, 0)
+        index, weight = self._temperature_weights(np.asarray(temperature, dtype=np.float64))
+        soc_points = self.soc_points
+        soc = np.clip(soc, soc_points[0], soc_points[-1])
+        j = np.clip(np.searchsorted(soc_points, soc, side="right") - 1, 0, len(soc_points) - 2)
+
+        # Flat offsets into the table: +1 steps along SOC, +width along temperature
+        _, nominals, temperatures, width = self.voltages.shape
+        flat = ((c * nominals + k) * temperatures + index) * width + j
+        voltages = self.voltages.ravel()
+        points = []
+        for offset in (flat, flat + 1):
+            cold = voltages[offset]
+            points.append(cold + weight * (voltages[offset + width] - cold))
+        low, high = points
+        slope = (high - low) / (soc_points[j + 1] - soc_points[j])
+        ocv = low + slope * (soc - soc_points[j])
+        slope *= 100
+        ocv[~resolved] = slope[~resolved] = np.nan
+        return ocv, slope
+
+    # Cache
+
+    def save(self, path: str, key: str):
+        np.savez(path, key=np.array(key), soc_points=self.soc_points,
+                 temperatures=self.temperatures, voltages=self.voltages)
+
+    @classmethod
+    def load(cls, path: str, key: str) -> Optional["OCVTable"]:
+        """Load a cached table; None when it is missing or was built from other inputs"""
+        try:
+            with np.load(path, allow_pickle=False) as cached:
+                if str(cached["key"]) != key:
+                    return None
+                return cls(cached["soc_points"], cached["temperatures"], cached["voltages"])
+        except (OSError, KeyError, ValueError):
+            return None
+
+
+def table_key(battery_types: Dict, temperatures: Sequence[float] = OCV_TEMPERATURES) -> str:
+    """Hash of everything a compiled table depends on"""
+    inputs = {
+        "version": OCV_TABLE_VERSION,
+        "temperatures": list(temperatures),
+        "chemistries": {
+            name: {
+                "ocv": info["ocv"],
+                "voltage_specs": {
+                    str(nominal): [spec["min_voltage"], spec["max_voltage"]]
+                    for nominal, spec in info["voltage_specs"].items()
+                }
+            } for name, info in battery_types.items()
+        }
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def read_spreadsheet_cutoffs(path: str) -> Dict[Tuple[str, float], Tuple[float, float]]:
+    """(chemistry, nominal) -> (lower cutoff, upper cutoff) from the specification sheet"""
+    import pandas as pd
+
+    def volts(value) -> float:
+        return float(str(value).strip().rstrip("Vv"))
+
+    cutoffs = {}
+    for row in pd.read_excel(path).to_dict("records"):
+        chemistry = SPREADSHEET_CHEMISTRIES.get(row["Chemistry"], row["Chemistry"])
+        cutoffs[(chemistry, volts(row["Nominal Voltage"]))] = (
+            volts(row["Lower Cutoff Voltage"]), volts(row["Upper Cutoff Voltage"]))
+    return cutoffs
+
+
+def check_spreadsheet(path: str, registry: SpecRegistry):
+    """Raise ValueError listing every sheet row that disagrees with the registry"""
+    mismatches = []
+    for (chemistry, nominal), (low, high) in read_spreadsheet_cutoffs(path).items():
+        try:
+            spec = registry.lookup(chemistry, nominal)
+        except ValueError as e:
+            mismatches.append(str(e))
+            continue
+        if (spec.min_voltage, spec.max_voltage) != (low, high):
+            mismatches.append(
+                f"{chemistry} {nominal}V: sheet has {low}-{high}V, "
+                f"BATTERY_TYPES has {spec.min_voltage}-{spec.max_voltage}V")
+    if mismatches:
+        raise ValueError(f"{path} disagrees with BATTERY_TYPES: " + "; ".join(mismatches))
+
+
+def load_ocv_table(battery_types: Dict, registry: SpecRegistry,
+                   path: str = DEFAULT_OCV_TABLE_PATH) -> OCVTable:
+    """Cached table when it matches ``battery_types``, otherwise compile and re-cache it"""
+    key = table_key(battery_types)
+    table = OCVTable.load(path, key)
+    if table is not None:
+        return table
+    table = OCVTable.build(battery_types, registry)
+    try:
+        table.save(path, key)
+    except OSError as e:
+        logger.warning("Could not cache the OCV table at %s: %s", path, e)
+    return table
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from battery_diagnostics import BatteryDiagnostics, spec_registry
+
+    parser = argparse.ArgumentParser(description="Compile the OCV-SOC table cache")
+    parser.add_argument("--spreadsheet", metavar="PATH",
+                        help="Check cutoff voltages against this specification sheet first")
+    parser.add_argument("--output", metavar="PATH", default=DEFAULT_OCV_TABLE_PATH)
+    args = parser.parse_args(argv)
+
+    if args.spreadsheet:
+        try:
+            check_spreadsheet(args.spreadsheet, spec_registry)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+    table = OCVTable.build(BatteryDiagnostics.BATTERY_TYPES, spec_registry)
+    table.save(args.output, table_key(BatteryDiagnostics.BATTERY_TYPES))
+    print(f"Wrote {args.output}: {table.voltages.shape[0]} chemistries, "
+          f"{len(table.temperatures)} temperatures, {len(table.soc_points)} SOC points")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,322 @@
+"""Streaming rainflow cycle counting of SOC series, vectorized across batteries.
+
+estimate_cycle_life and calculate_soh need a cycle count and a depth of
+discharge, but a BMS reports SOC over time. RainflowCounter turns SOC
+series into both, one chunk of samples per battery at a time:
+
+- turning points are found with NumPy over the whole batch: gaps (NaN)
+  and repeated values are dropped and only reversals of direction, plus
+  each series' last sample, are kept;
+- the turning points go through the ASTM E1049 three-point rainflow rule,
+  stepping every battery's stack together, one turning point per step.
+  Closed cycles are counted into a depth × mean-SOC histogram (full
+  cycles count 1, half cycles at the start of the history 0.5).
+
+Batteries are counted in blocks of about ``chunk_points`` samples, so the
+working memory stays bounded for any batch.
+
+Between requests a battery keeps only its residual stack (the turning
+points not yet closed into a cycle, the last of them still open), its
+histogram and a few totals. Equivalent full cycles are the SOC throughput
+divided by 200 % (one full discharge and charge).
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+import os
+
+import numpy as np
+
+from batch_diagnostics import BatchDiagnostics
+from soc_tracking import BatteryTable
+
+# Upper bound on the number of batteries counted by one process
+DEFAULT_RAINFLOW_MAX_BATTERIES = int(os.environ.get("RAINFLOW_MAX_BATTERIES", "100000"))
+# Upper bound on the number of batteries counted for one API key
+DEFAULT_RAINFLOW_MAX_BATTERIES_PER_OWNER = int(
+    os.environ.get("RAINFLOW_MAX_BATTERIES_PER_OWNER", "10000"))
+# Seconds without samples after which a battery's counts may be reclaimed; cycle
+# counts build up over a battery's life, so this is far longer than for SOC
+DEFAULT_RAINFLOW_IDLE_SECONDS = float(os.environ.get("RAINFLOW_IDLE_SECONDS", str(30 * 86400)))
+# SOC samples per block of batteries counted at once (bounds the working memory)
+DEFAULT_RAINFLOW_CHUNK_POINTS = int(os.environ.get("RAINFLOW_CHUNK_POINTS", "1000000"))
+
+# Histogram bin edges in SOC %, for cycle depth and cycle mean
+DEPTH_BINS = np.linspace(0, 100, 11)
+MEAN_SOC_BINS = np.linspace(0, 100, 11)
+# Initial residual stack depth; stacks grow by doubling when a battery needs more
+INITIAL_STACK_DEPTH = 16
+# With fewer batteries than this still stepping, a plain loop per battery is faster
+MIN_STEPPING_BATTERIES = 16
+
+
+def rainflow_cycles(series: Sequence[float]) -> List[Tuple[float, float, float]]:
+    """(depth, mean, count) of every closed cycle of one complete series.
+
+    Plain-Python reference for RainflowCounter; the residue is not counted.
+    """
+    return _push(series, [])
+
+
+def _push(series: Sequence[float], stack: List[float]) -> List[Tuple[float, float, float]]:
+    """Push a series onto a residual stack, returning the cycles it closes"""
+    cycles = []
+    for value in series:
+        if value != value or (stack and value == stack[-1]):
+            continue
+        if len(stack) >= 2 and (value - stack[-1]) * (stack[-1] - stack[-2]) > 0:
+            stack[-1] = value
+        else:
+            stack.append(value)
+        while len(stack) >= 3 and abs(stack[-1] - stack[-2]) >= abs(stack[-2] - stack[-3]):
+            cycles.append((abs(stack[-2] - stack[-3]), (stack[-2] + stack[-3]) / 2,
+                           0.5 if len(stack) == 3 else 1.0))
+            if len(stack) == 3:
+                del stack[0]
+            else:
+                del stack[-3:-1]
+    return cycles
+
+
+def _compact(values: np.ndarray, keep: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Each row's kept values moved to its front (NaN after), and their count"""
+    lengths = keep.sum(axis=1)
+    compacted = np.full((len(values), max(int(lengths.max(initial=0)), 1)), np.nan)
+    rows, columns = np.nonzero(keep)
+    compacted[rows, (np.cumsum(keep, axis=1) - 1)[rows, columns]] = values[rows, columns]
+    return compacted, lengths
+
+
+def turning_points(soc: np.ndarray, top: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Points to push onto each battery's stack, their count, and the SOC throughput.
+
+    ``top`` is each battery's open stack point (NaN for an empty stack); the
+    chunk continues from it, so a chunk that keeps going in the same
+    direction extends that point rather than adding one.
+    """
+    started = ~np.isnan(top)
+    points, lengths = _compact(np.column_stack([top, soc]), ~np.isnan(np.column_stack([top, soc])))
+    column = np.arange(points.shape[1])
+    inside = column < lengths[:, None]
+
+    # Runs of equal values become one point
+    step = np.diff(points, axis=1)
+    distinct = np.ones(points.shape, dtype=bool)
+    distinct[:, 1:] = step != 0
+    points, lengths = _compact(points, distinct & inside)
+    column = np.arange(points.shape[1])
+    inside = column < lengths[:, None]
+
+    step = np.diff(points, axis=1)
+    throughput = np.nansum(np.abs(step), axis=1)
+    reversal = np.zeros(points.shape, dtype=bool)
+    reversal[:, 1:-1] = step[:, :-1] * step[:, 1:] < 0
+    last = column == (lengths - 1)[:, None]
+    # A known battery's open point is already on its stack; a new battery's
+    # first sample starts its stack
+    fed = (reversal | last) & inside & (column > 0)
+    fed[:, 0] |= ~started & (lengths > 0)
+    feed, count = _compact(points, fed)
+    return feed, count, throughput
+
+
+class RainflowCounter(BatteryTable):
+    """Per-battery rainflow state; count() consumes the next SOC chunk of any set of rows"""
+
+    def __init__(self, max_batteries: int = DEFAULT_RAINFLOW_MAX_BATTERIES,
+                 chunk_points: int = DEFAULT_RAINFLOW_CHUNK_POINTS,
+                 max_batteries_per_owner: int = DEFAULT_RAINFLOW_MAX_BATTERIES_PER_OWNER,
+                 idle_seconds: float = DEFAULT_RAINFLOW_IDLE_SECONDS):
+        self.stack_depth = INITIAL_STACK_DEPTH
+        self.chunk_points = chunk_points
+        super().__init__(max_batteries, max_batteries_per_owner, idle_seconds)
+
+    def _columns(self, size: int) -> Dict[str, np.ndarray]:
+        return {
+            "stack": np.full((size, self.stack_depth), np.nan),
+            "stack_size": np.zeros(size, dtype=np.intp),
+            # Half cycles stay exact in single precision up to 2**23 cycles per bin
+            "histogram": np.zeros((size, len(DEPTH_BINS) - 1, len(MEAN_SOC_BINS) - 1), dtype=np.float32),
+            "cycles": np.zeros(size),
+            "depth_sum": np.zeros(size),  # Σ count · depth
+            "depth_square_sum": np.zeros(size),  # Σ count · depth²
+            "throughput": np.zeros(size),  # Σ |ΔSOC|
+            "samples": np.zeros(size, dtype=np.int64),
+        }
+
+    def _grow_stack(self, depth: int):
+        stack = np.full((self.allocated, depth), np.nan)
+        stack[:, :self.stack_depth] = self.stack
+        self.stack, self.stack_depth = stack, depth
+
+    def count(self, rows: np.ndarray, soc: np.ndarray) -> Dict[str, np.ndarray]:
+        """Consume one chunk of SOC samples (one row per battery, NaN-padded).
+
+        ``rows`` must be distinct. Returns each battery's running totals:
+        ``equivalentFullCycles``, ``cycleCount`` (whole equivalent full
+        cycles), ``depthOfDischarge`` (mean closed-cycle depth weighted by
+        throughput, NaN before the first cycle closes), ``closedCycles``,
+        ``residualPoints`` and ``histogram`` (batteries × depth bins × mean
+        SOC bins).
+        """
+        block = max(1, self.chunk_points // max(soc.shape[1], 1))
+        for start in range(0, len(rows), block):
+            self._consume(rows[start:start + block], soc[start:start + block])
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            depth_of_discharge = self.depth_square_sum[rows] / self.depth_sum[rows]
+        equivalent = self.throughput[rows] / 200
+        return {
+            "equivalentFullCycles": equivalent,
+            "cycleCount": np.floor(equivalent).astype(np.int64),
+            "depthOfDischarge": depth_of_discharge,
+            "closedCycles": self.cycles[rows],
+            "residualPoints": self.stack_size[rows],
+            "histogram": self.histogram[rows],
+        }
+
+    def _consume(self, rows: np.ndarray, soc: np.ndarray):
+        size = self.stack_size[rows]
+        top = np.where(size > 0, self.stack[rows, np.maximum(size - 1, 0)], np.nan)
+        feed, feed_count, throughput = turning_points(soc, top)
+
+        # Batteries with the most turning points first, so the batteries
+        # still stepping are always a prefix of the working arrays
+        order = np.argsort(-feed_count, kind="stable")
+        rows = rows[order]
+        soc, feed, feed_count, throughput = soc[order], feed[order], feed_count[order], throughput[order]
+        stack = self.stack[rows]
+        size = size[order]
+        stepping = np.searchsorted(-feed_count, -np.arange(int(feed_count.max(initial=0))), side="left")
+
+        events = []
+        for step, active in enumerate(stepping):
+            if active < MIN_STEPPING_BATTERIES:
+                stack = self._finish(stack, size, feed, feed_count, step, active, events)
+                break
+            width = stack.shape[1]
+            flat = stack.reshape(-1)
+            value = feed[:active, step]
+            height = size[:active]
+            base = np.arange(active) * width
+            top = flat[base + np.maximum(height - 1, 0)]
+            previous = flat[base + np.maximum(height - 2, 0)]
+            # Still moving the same way: the open point moves with it, otherwise
+            # it is a new point
+            extend = (height >= 2) & ((value - top) * (top - previous) > 0)
+            if height.max(initial=0) >= width:
+                stack = np.hstack([stack, np.full(stack.shape, np.nan)])
+                width, flat = stack.shape[1], stack.reshape(-1)
+                base = np.arange(active) * width
+            flat[base + np.where(extend, height - 1, height)] = value
+            height += ~extend
+
+            closing = np.arange(active)
+            while closing.size:
+                height = size[closing]
+                closing, height = closing[height >= 3], height[height >= 3]
+                at = closing * width + height
+                a, b, c = flat[at - 3], flat[at - 2], flat[at - 1]
+                closed = np.abs(c - b) >= np.abs(b - a)
+                closing, at, a, b, c = closing[closed], at[closed], a[closed], b[closed], c[closed]
+                # A cycle starting at the first point of the history is half a cycle
+                half = at - closing * width == 3
+                events.append((closing, np.abs(b - a), (a + b) / 2, np.where(half, 0.5, 1.0)))
+                # Half: drop the first point; full: drop the cycle's two points
+                flat[at - 3] = np.where(half, b, c)
+                flat[at - 2] = np.where(half, c, flat[at - 2])
+                size[closing] -= np.where(half, 1, 2)
+
+        if stack.shape[1] > self.stack_depth:
+            self._grow_stack(stack.shape[1])
+        self.stack[rows, :stack.shape[1]] = stack
+        self.stack_size[rows] = size
+        self.throughput[rows] += throughput
+        self.samples[rows] += (~np.isnan(soc)).sum(axis=1)
+        if events:
+            position, depth, mean, count = (np.concatenate(column) for column in zip(*events))
+            self._record(rows, position, depth, mean, count)
+
+    @staticmethod
+    def _finish(stack: np.ndarray, size: np.ndarray, feed: np.ndarray, feed_count: np.ndarray,
+                step: int, active: int, events: List) -> np.ndarray:
+        """Push the remaining turning points of the first ``active`` batteries one battery at a time"""
+        for position in range(active):
+            residual = stack[position, :size[position]].tolist()
+            cycles = _push(feed[position, step:feed_count[position]].tolist(), residual)
+            if len(residual) > stack.shape[1]:
+                grown = np.full((len(stack), 2 ** int(np.ceil(np.log2(len(residual))))), np.nan)
+                grown[:, :stack.shape[1]] = stack
+                stack = grown
+            stack[position, :len(residual)] = residual
+            size[position] = len(residual)
+            if cycles:
+                depth, mean, count = np.array(cycles).T
+                events.append((np.full(len(cycles), position), depth, mean, count))
+        return stack
+
+    def _record(self, rows: np.ndarray, position: np.ndarray, depth: np.ndarray,
+                mean: np.ndarray, count: np.ndarray):
+        batteries = len(rows)
+        depth_bins, mean_bins = len(DEPTH_BINS) - 1, len(MEAN_SOC_BINS) - 1
+        depth_bin = np.clip(np.searchsorted(DEPTH_BINS, depth, side="right") - 1, 0, depth_bins - 1)
+        mean_bin = np.clip(np.searchsorted(MEAN_SOC_BINS, mean, side="right") - 1, 0, mean_bins - 1)
+        cell = (position * depth_bins + depth_bin) * mean_bins + mean_bin
+        self.histogram[rows] += np.bincount(
+            cell, weights=count, minlength=batteries * depth_bins * mean_bins
+        ).reshape(batteries, depth_bins, mean_bins).astype(np.float32)
+        self.cycles[rows] += np.bincount(position, weights=count, minlength=batteries)
+        self.depth_sum[rows] += np.bincount(position, weights=count * depth, minlength=batteries)
+        self.depth_square_sum[rows] += np.bincount(
+            position, weights=count * depth * depth, minlength=batteries)
+
+
+def _scatter(columns: Dict[str, np.ndarray], mask: np.ndarray) -> Dict[str, np.ndarray]:
+    """Columns computed for the rows in ``mask``, spread over all rows (NaN/None elsewhere)"""
+    if mask.all():
+        return dict(columns)
+    spread = {}
+    for name, column in columns.items():
+        kind = column.dtype.kind
+        full = np.full((len(mask),) + column.shape[1:], None if kind == "O" else np.nan,
+                       dtype=object if kind == "O" else np.float64)
+        full[mask] = column
+        spread[name] = full
+    return spread
+
+
+def counted_cycles(counter: RainflowCounter, owner: str, battery_ids: List[str], soc: np.ndarray,
+                   avg_temperature: Optional[np.ndarray] = None,
+                   current_soh: Optional[np.ndarray] = None,
+                   current_capacity: Optional[np.ndarray] = None,
+                   rated_capacity: Optional[np.ndarray] = None) -> Dict:
+    """Rainflow totals for a batch of SOC chunks, fed into the cycle-life and SOH models.
+
+    With ``avg_temperature`` and ``current_soh`` the result also carries
+    estimate_cycle_life's columns, and with ``current_capacity`` and
+    ``rated_capacity`` (mAh) calculate_soh's, for every battery whose
+    counted cycles can feed them.
+    """
+    n = len(battery_ids)
+    rows = counter.rows_for(owner, battery_ids)
+    valid = rows >= 0
+    counted = counter.count(rows[valid], soc[valid])
+    result = _scatter(counted, valid)
+
+    if avg_temperature is not None and current_soh is not None:
+        # The depth of discharge is known once a first cycle has closed
+        known = valid & ~np.isnan(result["depthOfDischarge"])
+        result.update(_scatter(BatchDiagnostics.estimate_cycle_life_batch(
+            result["cycleCount"][known], result["depthOfDischarge"][known],
+            avg_temperature[known], current_soh[known]), known))
+    if current_capacity is not None and rated_capacity is not None:
+        result.update(_scatter(BatchDiagnostics.calculate_soh_batch(
+            current_capacity[valid], rated_capacity[valid], result["cycleCount"][valid]), valid))
+
+    result["valid"] = valid
+    result["errors"] = [
+        {"index": int(index), "detail": counter.full_detail(owner, "Rainflow counter")}
+        for index in np.flatnonzero(~valid)]
+    return result
+
+
+# Counter shared by every request served by this process
+rainflow_counter = RainflowCounter()
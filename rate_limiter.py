@@ -0,0 +1,332 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+import asyncio
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from api_key_manager import hash_key
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE = float(os.environ.get("RATE_LIMIT_RPS", "20"))
+DEFAULT_BURST = int(os.environ.get("RATE_LIMIT_BURST", "40"))
+DEFAULT_RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "sqlite")
+DEFAULT_RATE_LIMIT_URL = os.environ.get("RATE_LIMIT_URL", "sqlite:///rate_limits.db")
+# Seconds between writes of each worker's hits to a shared backend
+DEFAULT_RATE_LIMIT_SYNC_INTERVAL = float(os.environ.get("RATE_LIMIT_SYNC_INTERVAL", "0.25"))
+# Bound on buckets held by the memory backend; least recently used are evicted
+MAX_TRACKED_KEYS = 10000
+
+RATE_LIMITED_PREFIX = "/battery/diagnose/"
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_after: float
+    retry_after: float
+
+
+class RateLimitBackend(ABC):
+    """Token bucket state store.
+
+    take() refills the bucket for the elapsed time, removes one token if
+    one is available and returns (allowed, tokens left). Each key holds two
+    numbers, so state does not grow with traffic.
+
+    A ``shared`` backend is shared by several workers. RateLimiter does not
+    call it per request; it takes tokens from in-process buckets and
+    settles the hits with the backend in the background.
+    """
+
+    shared = False
+
+    @abstractmethod
+    def take(self, key: str, rate: float, burst: int, now: float) -> Tuple[bool, float]:
+        ...
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """Process-local buckets, for a single worker or tests"""
+
+    def __init__(self, max_keys: int = MAX_TRACKED_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: int, now: float) -> Tuple[bool, float]:
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + max(now - updated, 0) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._store(key, tokens, now)
+            return allowed, tokens
+
+    def set(self, key: str, tokens: float, now: float):
+        """Overwrite a bucket, e.g. with the state settled by a shared backend"""
+        with self._lock:
+            self._buckets.pop(key, None)
+            self._store(key, tokens, now)
+
+    def _store(self, key: str, tokens: float, now: float):
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+
+class SQLiteRateLimitBackend(RateLimitBackend):
+    """Buckets in a SQLite file shared by every worker on the host.
+
+    Each hit is a single upsert, so concurrent workers update a bucket
+    atomically. Bucket state is disposable, so the database runs with
+    synchronous=OFF to keep the write off the disk's critical path. A
+    bucket left alone for burst / rate seconds is full again, the same as
+    no row at all, so evict() deletes such rows losslessly.
+    """
+
+    shared = True
+
+    def __init__(self, url: str = DEFAULT_RATE_LIMIT_URL):
+        from sqlalchemy import create_engine, event, text
+
+        self.engine = create_engine(url)
+
+        @event.listens_for(self.engine, "connect")
+        def _configure_sqlite(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=OFF")
+            cursor.execute("PRAGMA busy_timeout=5000")
+            cursor.close()
+
+        with self.engine.begin() as connection:
+            connection.execute(text(
+                "CREATE TABLE IF NOT EXISTS rate_limits ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, "
+                "updated REAL NOT NULL, allowed INTEGER NOT NULL)"
+            ))
+        # Right-hand sides see the old row, so "refilled" is computed once per hit
+        refilled = "MIN(:burst, tokens + MAX(:now - updated, 0) * :rate)"
+        self._statement = text(
+            "INSERT INTO rate_limits (key, tokens, updated, allowed) "
+            "VALUES (:key, :burst - 1, :now, 1) "
+            "ON CONFLICT(key) DO UPDATE SET "
+            f"allowed = {refilled} >= 1, "
+            f"tokens = CASE WHEN {refilled} >= 1 THEN {refilled} - 1 ELSE {refilled} END, "
+            "updated = :now "
+            "RETURNING allowed, tokens"
+        )
+        # Tokens never go below zero, so hits over the limit are not carried over
+        self._settle_statement = text(
+            "INSERT INTO rate_limits (key, tokens, updated, allowed) "
+            "VALUES (:key, MAX(:burst - :hits, 0), :now, :hits <= :burst) "
+            "ON CONFLICT(key) DO UPDATE SET "
+            f"allowed = {refilled} >= :hits, "
+            f"tokens = MAX({refilled} - :hits, 0), "
+            "updated = :now "
+            "RETURNING tokens"
+        )
+        self._evict_statement = text("DELETE FROM rate_limits WHERE updated < :before")
+        logger.info(f"SQLite rate limit backend initialized at {url}")
+
+    def take(self, key: str, rate: float, burst: int, now: float) -> Tuple[bool, float]:
+        with self.engine.begin() as connection:
+            row = connection.execute(
+                self._statement,
+                {"key": key, "rate": rate, "burst": burst, "now": now}
+            ).first()
+        return bool(row.allowed), row.tokens
+
+    def settle(self, hits: Dict[str, int], rate: float, burst: int, now: float) -> Dict[str, float]:
+        """Take each key's hits from its bucket in one transaction; returns the tokens left"""
+        tokens = {}
+        with self.engine.begin() as connection:
+            for key, count in hits.items():
+                tokens[key] = connection.execute(
+                    self._settle_statement,
+                    {"key": key, "hits": count, "rate": rate, "burst": burst, "now": now}
+                ).scalar()
+        return tokens
+
+    def evict(self, before: float) -> int:
+        """Delete buckets last updated before ``before``"""
+        with self.engine.begin() as connection:
+            return connection.execute(self._evict_statement, {"before": before}).rowcount
+
+
+def create_rate_limit_backend(backend: str = DEFAULT_RATE_LIMIT_BACKEND) -> RateLimitBackend:
+    """Create the configured rate limit backend ("sqlite" or "memory")"""
+    if backend == "memory":
+        return MemoryRateLimitBackend()
+    if backend == "sqlite":
+        return SQLiteRateLimitBackend()
+    raise ValueError(f"Unknown rate limit backend: {backend}")
+
+
+class RateLimiter:
+    """Per-key token bucket: ``rate`` requests per second with ``burst`` headroom.
+
+    Requests always take tokens from in-process buckets, so the event loop
+    never waits on storage. With a shared backend the hits of the last
+    ``sync_interval`` seconds are settled with it by a background task,
+    which then sets each local bucket to the tokens all workers left. Each
+    worker can therefore overshoot the shared limit by at most what it
+    admits within one interval. The task also evicts idle buckets.
+    """
+
+    def __init__(self, backend: RateLimitBackend, rate: float = DEFAULT_RATE,
+                 burst: int = DEFAULT_BURST,
+                 sync_interval: float = DEFAULT_RATE_LIMIT_SYNC_INTERVAL):
+        self.backend = backend
+        self.rate = rate
+        self.burst = burst
+        self.sync_interval = sync_interval
+        self.buckets = MemoryRateLimitBackend() if backend.shared else backend
+        self._pending: Dict[str, int] = {}
+        self._evicted = 0.0
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        logger.info(f"Rate limiter initialized with {rate} requests/s, burst {burst}")
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def hit(self, key: str) -> RateLimitResult:
+        """Consume one request for ``key``"""
+        allowed, tokens = self.buckets.take(key, self.rate, self.burst, time.time())
+        if allowed and self.backend.shared:
+            with self._lock:
+                self._pending[key] = self._pending.get(key, 0) + 1
+        return RateLimitResult(
+            allowed=allowed,
+            limit=self.burst,
+            remaining=max(0, int(tokens)),
+            reset_after=(self.burst - tokens) / self.rate,
+            retry_after=0.0 if allowed else (1 - tokens) / self.rate
+        )
+
+    def sync(self) -> int:
+        """Settle pending hits with the shared backend and evict idle buckets.
+
+        Returns the number of keys settled.
+        """
+        if not self.backend.shared or not self.enabled:
+            return 0
+        with self._lock:
+            hits, self._pending = self._pending, {}
+        now = time.time()
+        try:
+            settled = self.backend.settle(hits, self.rate, self.burst, now) if hits else {}
+        except Exception:
+            with self._lock:
+                for key, count in hits.items():
+                    self._pending[key] = self._pending.get(key, 0) + count
+            raise
+        with self._lock:
+            for key, tokens in settled.items():
+                # Hits taken while the settle ran still come off the shared state
+                self.buckets.set(key, max(tokens - self._pending.get(key, 0), 0), now)
+        # Buckets refill completely in burst / rate seconds, so evicting once per period is enough
+        if now - self._evicted >= self.burst / self.rate:
+            self.backend.evict(now - self.burst / self.rate)
+            self._evicted = now
+        return len(settled)
+
+    async def _syncer(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await asyncio.to_thread(self.sync)
+            except Exception as e:
+                logger.error(f"Failed to sync rate limits: {e}")
+
+    async def start(self):
+        """Start settling hits with a shared backend on the running event loop"""
+        if self._task is None and self.backend.shared:
+            self._task = asyncio.create_task(self._syncer())
+
+    async def stop(self):
+        """Stop the background task and settle the remaining hits"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.sync)
+
+
+def rate_limit_headers(result: RateLimitResult) -> list:
+    """X-RateLimit-* (and Retry-After when limited) as raw ASGI headers"""
+    headers = [
+        (b"x-ratelimit-limit", str(result.limit).encode()),
+        (b"x-ratelimit-remaining", str(result.remaining).encode()),
+        (b"x-ratelimit-reset", str(math.ceil(result.reset_after)).encode()),
+    ]
+    if not result.allowed:
+        headers.append((b"retry-after", str(max(1, math.ceil(result.retry_after))).encode()))
+    return headers
+
+
+class RateLimitMiddleware:
+    """ASGI middleware applying the rate limiter to every /battery/diagnose/* route.
+
+    Requests without an API key, or with one ``is_known`` rejects, pass
+    through so the route can reject them; unknown keys never get a bucket.
+    """
+
+    def __init__(self, app, limiter: RateLimiter, prefix: str = RATE_LIMITED_PREFIX,
+                 is_known: Optional[Callable[[str], Awaitable[bool]]] = None):
+        self.app = app
+        self.limiter = limiter
+        self.prefix = prefix
+        self.is_known = is_known
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or not self.limiter.enabled
+                or not scope["path"].startswith(self.prefix)):
+            await self.app(scope, receive, send)
+            return
+
+        api_key = None
+        for name, value in scope["headers"]:
+            if name == b"x-api-key":
+                api_key = value.decode("latin-1")
+                break
+        if not api_key or (self.is_known is not None and not await self.is_known(api_key)):
+            await self.app(scope, receive, send)
+            return
+
+        # Buckets are keyed by the key hash so plaintext keys are never stored
+        result = self.limiter.hit(hash_key(api_key))
+        headers = rate_limit_headers(result)
+
+        if not result.allowed:
+            body = json.dumps({"detail": "Rate limit exceeded", "status_code": 429}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                ] + headers,
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
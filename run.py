@@ -1,39 +1,118 @@
 import uvicorn
+import argparse
 import logging
 import os
 import signal
 import sys
+import tempfile
 from main import app
+from logging_config import configure_logging
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging (already done by importing main; kept explicit here)
+configure_logging()
 logger = logging.getLogger(__name__)
 
+# Environment variables selecting each shared-state backend
+STATE_BACKENDS = {
+    "DIAGNOSTIC_HISTORY_BACKEND": "sqlite",
+    "API_KEY_STORE": "sqlite",
+    "RATE_LIMIT_BACKEND": "sqlite",
+}
+
 def signal_handler(sig, frame):
     logger.info("Received shutdown signal, exiting...")
     sys.exit(0)
 
+def parse_args(argv=None):
+    """Parse command line options; each one can also be set from the environment"""
+    parser = argparse.ArgumentParser(description="Battery OS API server")
+    parser.add_argument("--production", action="store_true",
+                        default=os.environ.get("API_PRODUCTION", "") == "1",
+                        help="Run with multiple workers and no reloader")
+    parser.add_argument("--host", default=os.environ.get("API_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "5001")))
+    parser.add_argument("--workers", type=int,
+                        default=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)),
+                        help="Worker processes in production mode (default: CPU count)")
+    parser.add_argument("--keep-alive", type=int,
+                        default=int(os.environ.get("API_KEEP_ALIVE", "5")),
+                        help="Seconds to keep idle connections open")
+    parser.add_argument("--backlog", type=int,
+                        default=int(os.environ.get("API_BACKLOG", "2048")),
+                        help="Maximum number of pending connections")
+    return parser.parse_args(argv)
+
+def check_shared_state(workers: int):
+    """Refuse to start several workers on process-local state.
+
+    Endpoints keeping per-battery state in memory (telemetry streams, SOC
+    tracking, rainflow counting) are turned off for the workers unless STATEFUL_ENDPOINTS=1
+    asks for them, which is refused as well.
+    """
+    if workers <= 1:
+        return
+    local = [name for name, default in STATE_BACKENDS.items()
+             if os.environ.get(name, default) == "memory"]
+    if local:
+        raise RuntimeError(
+            f"{', '.join(local)} set to 'memory' cannot be shared by {workers} workers"
+        )
+    if os.environ.get("STATEFUL_ENDPOINTS") == "1":
+        raise RuntimeError(f"STATEFUL_ENDPOINTS=1 needs a single worker, not {workers}")
+    os.environ["STATEFUL_ENDPOINTS"] = "0"
+
+def share_job_workers(workers: int):
+    """Split the cores between the batch job pools of ``workers`` API workers.
+
+    Every API worker runs the jobs it claims on its own process pool, so
+    unless BATCH_JOB_WORKERS is set, each gets its share of the CPU count.
+    """
+    if "BATCH_JOB_WORKERS" not in os.environ:
+        os.environ["BATCH_JOB_WORKERS"] = str(max(1, (os.cpu_count() or 1) // workers))
+
 if __name__ == "__main__":
     logger.info("Starting FastAPI server...")
     try:
+        args = parse_args()
+
         # Register signal handlers
         signal.signal(signal.SIGINT, signal_handler)
         signal.signal(signal.SIGTERM, signal_handler)
 
-        # Get port from environment or use default
-        port = 5001  # Fixed port for FastAPI
-        logger.info(f"Using port {port}")
-
-        # Start the server
-        uvicorn.run(
-            app,
-            host="0.0.0.0",
-            port=port,
-            reload=True,
-            log_level="info"
-        )
+        logger.info(f"Using port {args.port}")
+
+        if args.production:
+            check_shared_state(args.workers)
+            share_job_workers(args.workers)
+            logger.info(f"Production mode with {args.workers} workers")
+            # Workers merge their metrics through a directory fresh to this launch
+            if args.workers > 1 and not os.environ.get("METRICS_MULTIPROCESS_DIR"):
+                os.environ["METRICS_MULTIPROCESS_DIR"] = tempfile.mkdtemp(prefix="battery-metrics-")
+            # Importing main above created the shared databases, so the
+            # workers do not race each other creating tables
+            uvicorn.run(
+                "main:app",
+                host=args.host,
+                port=args.port,
+                workers=args.workers,
+                timeout_keep_alive=args.keep_alive,
+                backlog=args.backlog,
+                log_level="info",
+                # Leave uvicorn's loggers unconfigured so they propagate into the
+                # queued, sampled root handler
+                log_config=None
+            )
+        else:
+            # Start the development server
+            uvicorn.run(
+                app,
+                host=args.host,
+                port=args.port,
+                reload=True,
+                timeout_keep_alive=args.keep_alive,
+                backlog=args.backlog,
+                log_level="info",
+                log_config=None
+            )
     except Exception as e:
-        logger.error(f"Failed to start server: {e}")
\ No newline at end of file
+        logger.error(f"Failed to start server: {e}")
@@ -0,0 +1,457 @@
+"""Stateful SOC estimation across requests, vectorized across batteries.
+
+Two estimators carry each battery's state between requests:
+
+- SOCTracker counts Coulombs. It advances SOC by integrating current over
+  the time since the battery's previous reading. Positive current is
+  charging, as in BatteryDiagnostics. Integration drifts, so the estimate
+  is re-anchored to the voltage method (BatteryDiagnostics.calculate_soc)
+  when a battery is first seen, when the gap since its previous reading is
+  too long to integrate, or after it has rested long enough for its
+  terminal voltage to settle.
+- SOCFilter is an Extended Kalman Filter on a first-order equivalent
+  circuit. It fuses the counted charge with every voltage reading, weighing
+  each by its uncertainty, and reports the SOC standard deviation.
+
+Both start from, and fall back to, the voltage method.
+"""
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Sequence, Tuple
+import os
+import time
+
+import numpy as np
+
+from battery_diagnostics import ocv_table, spec_registry
+
+# Upper bound on the number of batteries tracked by one process (per estimator)
+DEFAULT_SOC_TRACKER_MAX_BATTERIES = int(os.environ.get("SOC_TRACKER_MAX_BATTERIES", "100000"))
+# Upper bound on the number of batteries tracked for one API key (per estimator)
+DEFAULT_SOC_TRACKER_MAX_BATTERIES_PER_OWNER = int(
+    os.environ.get("SOC_TRACKER_MAX_BATTERIES_PER_OWNER", "10000"))
+# Seconds without a reading after which a battery's state may be reclaimed
+DEFAULT_SOC_TRACKER_IDLE_SECONDS = float(os.environ.get("SOC_TRACKER_IDLE_SECONDS", "86400"))
+# A battery is at rest while |current| stays at or below this C-rate
+DEFAULT_SOC_REST_C_RATE = float(os.environ.get("SOC_REST_C_RATE", "0.01"))
+# Seconds at rest after which SOC is re-anchored to the voltage method
+DEFAULT_SOC_REST_SECONDS = float(os.environ.get("SOC_REST_SECONDS", "600"))
+# Longest gap between readings that is still integrated
+DEFAULT_SOC_MAX_GAP_SECONDS = float(os.environ.get("SOC_MAX_GAP_SECONDS", "3600"))
+
+# EKF noise: SOC (fraction) and RC voltage (V²) variance added per second,
+# pack voltage measurement standard deviation (V), and the initial SOC
+# standard deviation (fraction) of a battery anchored to its voltage
+DEFAULT_EKF_SOC_NOISE = float(os.environ.get("EKF_SOC_NOISE", "1e-7"))
+DEFAULT_EKF_RC_NOISE = float(os.environ.get("EKF_RC_NOISE", "1e-6"))
+DEFAULT_EKF_VOLTAGE_NOISE = float(os.environ.get("EKF_VOLTAGE_NOISE", "0.05"))
+DEFAULT_EKF_INITIAL_SOC_STD = float(os.environ.get("EKF_INITIAL_SOC_STD", "0.05"))
+
+SOC_METHOD_COULOMB = "coulomb"
+SOC_METHOD_EKF = "ekf"
+SOC_METHOD_VOLTAGE = "voltage"
+
+
+class BatteryTable(ABC):
+    """Per-battery state in parallel NumPy arrays, one row per battery.
+
+    Rows are found through a dict keyed by (owner, battery id) so that
+    different API keys cannot see each other's batteries, and each owner
+    holds at most ``max_batteries_per_owner`` rows. Subclasses name their
+    arrays in _columns(); arrays grow by doubling up to ``max_batteries``.
+    Once the table is full, rows unused for ``idle_seconds`` are reclaimed,
+    or else the least recently used ones, and reused from their initial
+    values.
+    """
+
+    def __init__(self, max_batteries: int = DEFAULT_SOC_TRACKER_MAX_BATTERIES,
+                 max_batteries_per_owner: int = DEFAULT_SOC_TRACKER_MAX_BATTERIES_PER_OWNER,
+                 idle_seconds: float = DEFAULT_SOC_TRACKER_IDLE_SECONDS):
+        self.max_batteries = max_batteries
+        self.max_batteries_per_owner = max_batteries_per_owner
+        self.idle_seconds = idle_seconds
+        self.rows: Dict[Tuple[str, str], int] = {}
+        self.keys: List[Optional[Tuple[str, str]]] = []  # row -> key, None once released
+        self.free: List[int] = []
+        self.owner_batteries: Dict[str, int] = {}
+        self._allocate(min(64, max_batteries))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @abstractmethod
+    def _columns(self, size: int) -> Dict[str, np.ndarray]:
+        """Arrays of ``size`` rows, each holding the column's initial value"""
+
+    def _allocate(self, size: int):
+        # Free rows are last used at +inf so that they are never reclaimed
+        columns = {**self._columns(size), "last_used": np.full(size, np.inf)}
+        for name, array in columns.items():
+            if hasattr(self, name):
+                old = getattr(self, name)
+                array[:len(old)] = old
+            setattr(self, name, array)
+        self.allocated = size
+
+    def rows_for(self, owner: str, battery_ids: Sequence[str],
+                 now: Optional[float] = None) -> np.ndarray:
+        """Resolve battery ids to rows, adding new batteries; -1 when the table is full"""
+        now = time.time() if now is None else now
+        rows = np.fromiter((self.rows.get((owner, battery_id), -1) for battery_id in battery_ids),
+                           dtype=np.intp, count=len(battery_ids))
+        self.last_used[rows[rows >= 0]] = now
+        missing = list(dict.fromkeys(battery_ids[position] for position in np.flatnonzero(rows < 0)))
+        if not missing:
+            return rows
+
+        missing = missing[:max(self.max_batteries_per_owner - self.owner_batteries.get(owner, 0), 0)]
+        spare = len(self.free) + self.max_batteries - len(self.keys)
+        if len(missing) > spare:
+            self._reclaim(len(missing) - spare, now)
+        for battery_id in missing:
+            if self.free:
+                row = self.free.pop()
+            elif len(self.keys) < self.max_batteries:
+                row = len(self.keys)
+                if row == self.allocated:
+                    self._allocate(min(2 * self.allocated, self.max_batteries))
+                self.keys.append(None)
+            else:
+                break
+            self.keys[row] = (owner, battery_id)
+            self.rows[(owner, battery_id)] = row
+            self.last_used[row] = now
+            self.owner_batteries[owner] = self.owner_batteries.get(owner, 0) + 1
+        added = np.flatnonzero(rows < 0)
+        rows[added] = [self.rows.get((owner, battery_ids[position]), -1) for position in added]
+        return rows
+
+    def _reclaim(self, count: int, now: float):
+        """Release idle rows, or else up to ``count`` least recently used ones"""
+        last_used = self.last_used[:len(self.keys)]
+        rows = np.flatnonzero(last_used < now - self.idle_seconds)
+        if len(rows) < count:
+            # Rows already used at ``now`` belong to the batch being resolved
+            rows = np.flatnonzero(last_used < now)
+            if len(rows) > count:
+                rows = rows[np.argpartition(last_used[rows], count - 1)[:count]]
+        self.release(rows)
+
+    def release(self, rows: np.ndarray):
+        """Forget the batteries in ``rows`` and reset the rows for reuse"""
+        rows = np.unique(rows)
+        for row in rows:
+            owner = self.keys[row][0]
+            del self.rows[self.keys[row]]
+            self.keys[row] = None
+            self.owner_batteries[owner] -= 1
+            if not self.owner_batteries[owner]:
+                del self.owner_batteries[owner]
+        for name, array in self._columns(1).items():
+            getattr(self, name)[rows] = array[0]
+        self.last_used[rows] = np.inf
+        self.free.extend(rows.tolist())
+
+    def full_detail(self, owner: str, name: str) -> str:
+        """Why a new battery of ``owner`` got no row"""
+        if self.owner_batteries.get(owner, 0) >= self.max_batteries_per_owner:
+            return f"{name} is full for this API key ({self.max_batteries_per_owner} batteries)"
+        return f"{name} is full ({self.max_batteries} batteries)"
+
+
+class SOCTracker(BatteryTable):
+    """Per-battery Coulomb counters; tick() advances any set of rows in one step"""
+
+    def __init__(self, max_batteries: int = DEFAULT_SOC_TRACKER_MAX_BATTERIES,
+                 rest_c_rate: float = DEFAULT_SOC_REST_C_RATE,
+                 rest_seconds: float = DEFAULT_SOC_REST_SECONDS,
+                 max_gap_seconds: float = DEFAULT_SOC_MAX_GAP_SECONDS,
+                 max_batteries_per_owner: int = DEFAULT_SOC_TRACKER_MAX_BATTERIES_PER_OWNER,
+                 idle_seconds: float = DEFAULT_SOC_TRACKER_IDLE_SECONDS):
+        self.rest_c_rate = rest_c_rate
+        self.rest_seconds = rest_seconds
+        self.max_gap_seconds = max_gap_seconds
+        super().__init__(max_batteries, max_batteries_per_owner, idle_seconds)
+
+    def _columns(self, size: int) -> Dict[str, np.ndarray]:
+        return {
+            "soc": np.full(size, np.nan),
+            "capacity": np.full(size, np.nan),  # Ah
+            "timestamp": np.full(size, np.nan),
+            "current": np.zeros(size),
+            "rest": np.zeros(size),  # seconds spent at rest
+        }
+
+    def tick(self, rows: np.ndarray, current: np.ndarray, timestamp: np.ndarray,
+             capacity_ah: np.ndarray, voltage_soc: np.ndarray) -> Dict[str, np.ndarray]:
+        """Advance the given rows by one reading each.
+
+        ``voltage_soc`` is the voltage-method SOC of each reading (NaN where
+        the voltage method rejected it). Returns the new ``stateOfCharge``,
+        an ``anchored`` mask (SOC taken from the voltage method) and an
+        ``ok`` mask; rows that are not ok keep their previous state.
+        """
+        started = ~np.isnan(self.soc[rows])
+        elapsed = timestamp - self.timestamp[rows]
+        voltage_ok = ~np.isnan(voltage_soc)
+
+        integrate = started & (elapsed >= 0) & (elapsed <= self.max_gap_seconds)
+        hours = np.where(integrate, elapsed, 0) / 3600
+        # Trapezoidal charge in Ah between the previous reading and this one
+        charge = 0.5 * (current + self.current[rows]) * hours
+        counted = self.soc[rows] + 100 * charge / capacity_ah
+
+        limit = self.rest_c_rate * capacity_ah
+        at_rest = np.abs(current) <= limit
+        was_at_rest = np.abs(self.current[rows]) <= limit
+        rest = np.where(at_rest, np.where(integrate & was_at_rest, self.rest[rows] + hours * 3600, 0), 0)
+
+        anchored = voltage_ok & (~integrate | (rest >= self.rest_seconds))
+        # Readings older than the battery's last one, or a first reading the
+        # voltage method rejected, cannot be used
+        ok = (anchored | integrate) & ~(started & (elapsed < 0))
+        soc = np.clip(np.where(anchored, voltage_soc, counted), 0, 100)
+
+        updated = rows[ok]
+        self.soc[updated] = soc[ok]
+        self.capacity[updated] = capacity_ah[ok]
+        self.timestamp[updated] = timestamp[ok]
+        self.current[updated] = current[ok]
+        self.rest[updated] = rest[ok]
+        return {"stateOfCharge": np.where(ok, soc, np.nan), "anchored": anchored & ok, "ok": ok}
+
+
+class SOCFilter(BatteryTable):
+    """Extended Kalman Filter SOC for many batteries at once.
+
+    The model is a first-order equivalent circuit: terminal voltage is
+    OCV(SOC) + V_rc + R0·I, and V_rc relaxes towards R1·I with time
+    constant R1·C1. OCV(SOC) and its slope come from the OCV table, the
+    curve the voltage method uses. Cell parameters come from the "ecm" entry
+    of BatteryDiagnostics.BATTERY_TYPES and are scaled by the pack's series
+    count.
+
+    State is stacked as ``x`` (N, 2) = [SOC fraction, V_rc] and ``P``
+    (N, 2, 2). Each tick runs predict and update for every given row at
+    once; the 2x2 matrix products are expanded into element-wise array
+    expressions, which NumPy runs far faster than batched matmul on
+    matrices this small.
+    """
+
+    def __init__(self, max_batteries: int = DEFAULT_SOC_TRACKER_MAX_BATTERIES,
+                 soc_noise: float = DEFAULT_EKF_SOC_NOISE,
+                 rc_noise: float = DEFAULT_EKF_RC_NOISE,
+                 voltage_noise: float = DEFAULT_EKF_VOLTAGE_NOISE,
+                 initial_soc_std: float = DEFAULT_EKF_INITIAL_SOC_STD,
+                 max_gap_seconds: float = DEFAULT_SOC_MAX_GAP_SECONDS,
+                 max_batteries_per_owner: int = DEFAULT_SOC_TRACKER_MAX_BATTERIES_PER_OWNER,
+                 idle_seconds: float = DEFAULT_SOC_TRACKER_IDLE_SECONDS):
+        self.soc_noise = soc_noise
+        self.rc_noise = rc_noise
+        self.voltage_variance = voltage_noise ** 2
+        self.initial_covariance = np.diag([initial_soc_std ** 2, self.voltage_variance])
+        self.max_gap_seconds = max_gap_seconds
+        super().__init__(max_batteries, max_batteries_per_owner, idle_seconds)
+
+    def _columns(self, size: int) -> Dict[str, np.ndarray]:
+        return {
+            "x": np.full((size, 2), np.nan),
+            "P": np.zeros((size, 2, 2)),
+            "timestamp": np.full(size, np.nan),
+        }
+
+    def tick(self, rows: np.ndarray, voltage: np.ndarray, current: np.ndarray,
+             temperature: np.ndarray, timestamp: np.ndarray, capacity_ah: np.ndarray,
+             chem_ids: np.ndarray, nominal_ids: np.ndarray,
+             voltage_soc: np.ndarray) -> Dict[str, np.ndarray]:
+        """Predict and update the given rows with one reading each.
+
+        ``chem_ids`` and ``nominal_ids`` are resolved spec indexes, and
+        ``voltage_soc`` is the voltage-method SOC in % (NaN where rejected),
+        used to initialize new batteries and those not seen for too long.
+        Returns ``stateOfCharge`` and ``stateOfChargeStdDev`` in %, an
+        ``anchored`` mask and an ``ok`` mask; rows that are not ok keep
+        their previous state.
+        """
+        resolved = (chem_ids >= 0) & (nominal_ids >= 0)
+        c = np.where(resolved, chem_ids, 0)
+        nominal_voltage = spec_registry.nominal_voltages[c, np.where(resolved, nominal_ids, 0)]
+        series = nominal_voltage / spec_registry.cell_voltages[c]
+        r0 = spec_registry.ecm_r0[c] * series
+        r1 = spec_registry.ecm_r1[c] * series
+        tau = r1 * spec_registry.ecm_c1[c] / series
+
+        x = self.x[rows]
+        P = self.P[rows]
+        started = ~np.isnan(x[:, 0])
+        elapsed = timestamp - self.timestamp[rows]
+        usable = resolved & ~np.isnan(r0)
+        filtered = usable & started & (elapsed >= 0) & (elapsed <= self.max_gap_seconds)
+        anchored = usable & ~filtered & ~np.isnan(voltage_soc) & ~(started & (elapsed < 0))
+
+        # Predict. F = diag(1, decay), so F·P·Fᵀ + Q is written out per element
+        dt = np.where(filtered, elapsed, 0)
+        decay = np.exp(-dt / tau)
+        x_soc = x[:, 0] + current * dt / (3600 * capacity_ah)
+        x_rc = decay * x[:, 1] + r1 * (1 - decay) * current
+        p00 = P[:, 0, 0] + self.soc_noise * dt
+        p01 = decay * P[:, 0, 1]
+        p11 = decay * decay * P[:, 1, 1] + self.rc_noise * dt
+
+        # Update with the terminal voltage, H = [dOCV/dSOC, 1]. u = P·Hᵀ,
+        # and the Joseph form (I-KH)·P·(I-KH)ᵀ + K·R·Kᵀ reduces to
+        # P - K·uᵀ - u·Kᵀ + S·K·Kᵀ, which stays symmetric
+        ocv, slope = ocv_table.voltage_batch(chem_ids, nominal_ids, 100 * x_soc, temperature)
+        innovation = voltage - (ocv + x_rc + r0 * current)
+        u0 = p00 * slope + p01
+        u1 = p01 * slope + p11
+        S = slope * u0 + u1 + self.voltage_variance
+        k0 = u0 / S
+        k1 = u1 / S
+
+        x_new = np.empty_like(x)
+        x_new[:, 0] = np.clip(x_soc + k0 * innovation, 0, 1)
+        x_new[:, 1] = x_rc + k1 * innovation
+        P[:, 0, 0] = p00 - 2 * k0 * u0 + S * k0 * k0
+        P[:, 0, 1] = P[:, 1, 0] = p01 - k0 * u1 - u0 * k1 + S * k0 * k1
+        P[:, 1, 1] = p11 - 2 * k1 * u1 + S * k1 * k1
+
+        x_new[anchored, 0] = voltage_soc[anchored] / 100
+        x_new[anchored, 1] = 0
+        P[anchored] = self.initial_covariance
+        ok = filtered | anchored
+
+        updated = rows[ok]
+        self.x[updated] = x_new[ok]
+        self.P[updated] = P[ok]
+        self.timestamp[updated] = timestamp[ok]
+        return {
+            "stateOfCharge": np.where(ok, 100 * x_new[:, 0], np.nan),
+            "stateOfChargeStdDev": np.where(ok, 100 * np.sqrt(np.maximum(P[:, 0, 0], 0)), np.nan),
+            "anchored": anchored,
+            "ok": ok
+        }
+
+
+def _tracked_errors(table: BatteryTable, owner: str, battery_ids: List[str], rows: np.ndarray,
+                    valid: np.ndarray, timestamp: np.ndarray, voltage_errors: Dict[int, str]) -> List[Dict]:
+    errors = []
+    for row in np.flatnonzero(~valid):
+        if rows[row] < 0:
+            detail = voltage_errors.get(int(row), table.full_detail(owner, "SOC tracker"))
+        elif timestamp[row] < table.timestamp[rows[row]]:
+            detail = f"Reading for battery {battery_ids[row]} is older than its last reading"
+        else:
+            # The reading had to be anchored to a voltage the voltage method rejected
+            detail = voltage_errors[int(row)]
+        errors.append({"index": int(row), "detail": detail})
+    return errors
+
+
+def _release_unstarted(table: BatteryTable, rows: np.ndarray, ok: np.ndarray):
+    """Give back the rows of new batteries whose first reading was rejected"""
+    rejected = rows[~ok]
+    table.release(rejected[np.isnan(table.timestamp[rejected])])
+
+
+def _result_columns(soc: np.ndarray, valid: np.ndarray, method: np.ndarray,
+                    current: np.ndarray) -> Dict:
+    method = method.astype(object)
+    method[~valid] = None
+    estimated_range = np.full(len(soc), None, dtype=object)
+    estimated_range[valid] = np.char.add(
+        np.trunc(soc[valid] * 0.8).astype(np.int64).astype(str), " km")
+    charging_status = np.select(
+        [current > 0, current < 0, (current == 0) & (soc == 100)],
+        ["Charging", "Discharging", "Full"], default="Idle").astype(object)
+    charging_status[~valid] = None
+    return {
+        "stateOfCharge": soc,
+        "estimatedRange": estimated_range,
+        "chargingStatus": charging_status,
+        "method": method,
+        "valid": valid
+    }
+
+
+def tracked_soc(tracker: SOCTracker, owner: str, battery_ids: List[str], voltage_batch: Dict,
+                current: np.ndarray, timestamp: np.ndarray, capacity: np.ndarray) -> Dict:
+    """Coulomb-counted SOC for a batch, falling back to the voltage method per row.
+
+    ``voltage_batch`` is BatchDiagnostics.calculate_soc_batch's result for the
+    same readings, and ``capacity`` is in mAh. Result columns follow that of
+    the batch endpoint, plus the ``method`` used for each row.
+    """
+    n = len(battery_ids)
+    rows = tracker.rows_for(owner, battery_ids)
+    tracked = rows >= 0
+    voltage_soc = np.where(voltage_batch["valid"], voltage_batch["stateOfCharge"], np.nan)
+
+    soc = np.full(n, np.nan)
+    anchored = np.zeros(n, dtype=bool)
+    ok = np.zeros(n, dtype=bool)
+    if tracked.any():
+        ticked = tracker.tick(rows[tracked], current[tracked], timestamp[tracked],
+                              capacity[tracked] / 1000, voltage_soc[tracked])
+        soc[tracked] = ticked["stateOfCharge"]
+        anchored[tracked] = ticked["anchored"]
+        ok[tracked] = ticked["ok"]
+
+    # Voltage fallback for batteries the tracker could not take
+    fallback = ~tracked & voltage_batch["valid"]
+    soc[fallback] = voltage_soc[fallback]
+    valid = ok | fallback
+
+    voltage_errors = {error["index"]: error["detail"] for error in voltage_batch["errors"]}
+    errors = _tracked_errors(tracker, owner, battery_ids, rows, valid, timestamp, voltage_errors)
+    _release_unstarted(tracker, rows[tracked], ok[tracked])
+    method = np.where(anchored | fallback, SOC_METHOD_VOLTAGE, SOC_METHOD_COULOMB)
+    return {**_result_columns(soc, valid, method, current), "errors": errors}
+
+
+def filtered_soc(soc_filter: SOCFilter, owner: str, battery_ids: List[str],
+                 battery_type: Sequence[str], nominal_voltage: np.ndarray, voltage_batch: Dict,
+                 voltage: np.ndarray, current: np.ndarray, temperature: np.ndarray,
+                 timestamp: np.ndarray, capacity: np.ndarray) -> Dict:
+    """EKF SOC for a batch, falling back to the voltage method per row.
+
+    Arguments and result columns are those of tracked_soc(), plus
+    ``stateOfChargeStdDev``, the filter's SOC uncertainty in %.
+    """
+    n = len(battery_ids)
+    chem_ids = spec_registry.chemistry_ids_for(battery_type)
+    nominal_ids = spec_registry.nominal_ids_for(chem_ids, nominal_voltage)
+    rows = soc_filter.rows_for(owner, battery_ids)
+    tracked = rows >= 0
+    voltage_soc = np.where(voltage_batch["valid"], voltage_batch["stateOfCharge"], np.nan)
+
+    soc = np.full(n, np.nan)
+    std = np.full(n, np.nan)
+    anchored = np.zeros(n, dtype=bool)
+    ok = np.zeros(n, dtype=bool)
+    if tracked.any():
+        ticked = soc_filter.tick(
+            rows[tracked], voltage[tracked], current[tracked], temperature[tracked],
+            timestamp[tracked], capacity[tracked] / 1000, chem_ids[tracked], nominal_ids[tracked], voltage_soc[tracked])
+        soc[tracked] = ticked["stateOfCharge"]
+        std[tracked] = ticked["stateOfChargeStdDev"]
+        anchored[tracked] = ticked["anchored"]
+        ok[tracked] = ticked["ok"]
+
+    fallback = ~tracked & voltage_batch["valid"]
+    soc[fallback] = voltage_soc[fallback]
+    valid = ok | fallback
+
+    voltage_errors = {error["index"]: error["detail"] for error in voltage_batch["errors"]}
+    errors = _tracked_errors(soc_filter, owner, battery_ids, rows, valid, timestamp, voltage_errors)
+    _release_unstarted(soc_filter, rows[tracked], ok[tracked])
+    method = np.where(anchored | fallback, SOC_METHOD_VOLTAGE, SOC_METHOD_EKF)
+    return {
+        **_result_columns(soc, valid, method, current),
+        "stateOfChargeStdDev": std,
+        "errors": errors
+    }
+
+
+# Estimators shared by every request served by this process
+soc_tracker = SOCTracker()
+soc_filter = SOCFilter()
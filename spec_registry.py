@@ -0,0 +1,194 @@
+from bisect import bisect_left
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+import os
+
+import numpy as np
+
+# Maximum distance (in volts) between a requested nominal voltage and a
+# catalogued one for the two to be treated as the same pack, so that values
+# such as 47.99 coming from gateway float formatting resolve to 48.0.
+DEFAULT_NOMINAL_TOLERANCE = float(os.environ.get("NOMINAL_VOLTAGE_TOLERANCE", "0.05"))
+
+
+class BatterySpec(NamedTuple):
+    max_temp: float
+    min_temp: float
+    nominal_voltage: float
+    max_voltage: float
+    min_voltage: float
+
+
+class SpecRegistry:
+    """Battery chemistry specifications compiled into flat lookup tables.
+
+    The nested ``BATTERY_TYPES`` mapping is walked once at construction time.
+    Chemistries get a dense integer id and the nominal voltages of each
+    chemistry are stored sorted, so that a (chemistry id, nominal id) pair
+    indexes directly into 2-D NumPy arrays for batched callers, while scalar
+    callers get prebuilt ``BatterySpec`` tuples.
+    """
+
+    def __init__(self, battery_types: Dict, tolerance: float = DEFAULT_NOMINAL_TOLERANCE):
+        self.tolerance = tolerance
+        self.chemistries: Tuple[str, ...] = tuple(battery_types.keys())
+        self.chemistry_ids: Dict[str, int] = {
+            name: idx for idx, name in enumerate(self.chemistries)
+        }
+
+        width = max(len(info["voltage_specs"]) for info in battery_types.values())
+        shape = (len(self.chemistries), width)
+        self.nominal_voltages = np.full(shape, np.nan)
+        self.max_voltages = np.full(shape, np.nan)
+        self.min_voltages = np.full(shape, np.nan)
+        self.nominal_counts = np.zeros(len(self.chemistries), dtype=np.intp)
+        self.max_temps = np.empty(len(self.chemistries))
+        self.min_temps = np.empty(len(self.chemistries))
+        self.reference_nominal_ids = np.zeros(len(self.chemistries), dtype=np.intp)
+        # Equivalent-circuit cell parameters per chemistry (NaN when not declared)
+        self.cell_voltages = np.full(len(self.chemistries), np.nan)
+        self.ecm_r0 = np.full(len(self.chemistries), np.nan)
+        self.ecm_r1 = np.full(len(self.chemistries), np.nan)
+        self.ecm_c1 = np.full(len(self.chemistries), np.nan)
+
+        self._temperature_limits: List[Tuple[float, float]] = []
+        self._declared_nominals: List[List[float]] = []
+        self._sorted_nominals: List[List[float]] = []
+        self._specs: List[List[BatterySpec]] = []
+
+        for chem_id, name in enumerate(self.chemistries):
+            info = battery_types[name]
+            voltage_specs = info["voltage_specs"]
+            declared = list(voltage_specs.keys())
+            ordered = sorted(declared)
+
+            self.max_temps[chem_id] = info["max_temp"]
+            self.min_temps[chem_id] = info["min_temp"]
+            self.nominal_counts[chem_id] = len(ordered)
+            ecm = info.get("ecm")
+            if ecm is not None:
+                self.cell_voltages[chem_id] = ecm["cell_voltage"]
+                self.ecm_r0[chem_id] = ecm["r0"]
+                self.ecm_r1[chem_id] = ecm["r1"]
+                self.ecm_c1[chem_id] = ecm["c1"]
+            # monitor_safety/detect_faults reference the first declared nominal
+            self.reference_nominal_ids[chem_id] = ordered.index(declared[0])
+
+            specs = []
+            for nominal_id, nominal in enumerate(ordered):
+                self.nominal_voltages[chem_id, nominal_id] = nominal
+                self.max_voltages[chem_id, nominal_id] = voltage_specs[nominal]["max_voltage"]
+                self.min_voltages[chem_id, nominal_id] = voltage_specs[nominal]["min_voltage"]
+                specs.append(BatterySpec(
+                    max_temp=info["max_temp"],
+                    min_temp=info["min_temp"],
+                    nominal_voltage=nominal,
+                    max_voltage=voltage_specs[nominal]["max_voltage"],
+                    min_voltage=voltage_specs[nominal]["min_voltage"]
+                ))
+
+            self._temperature_limits.append((info["max_temp"], info["min_temp"]))
+            self._declared_nominals.append(declared)
+            self._sorted_nominals.append(ordered)
+            self._specs.append(specs)
+
+    # Scalar lookups
+
+    def chemistry_id(self, battery_type: str) -> int:
+        """Return the dense id of a chemistry"""
+        chem_id = self.chemistry_ids.get(battery_type)
+        if chem_id is None:
+            raise ValueError(f"Unknown battery type: {battery_type}")
+        return chem_id
+
+    def nominal_id(self, chem_id: int, nominal_voltage: float) -> int:
+        """Resolve a nominal voltage to its index within a chemistry"""
+        ordered = self._sorted_nominals[chem_id]
+        pos = bisect_left(ordered, nominal_voltage)
+        best = None
+        for candidate in (pos - 1, pos):
+            if 0 <= candidate < len(ordered):
+                distance = abs(ordered[candidate] - nominal_voltage)
+                if distance <= self.tolerance and (
+                        best is None or distance < abs(ordered[best] - nominal_voltage)):
+                    best = candidate
+        if best is None:
+            raise ValueError(
+                f"Invalid nominal voltage: {nominal_voltage}. Available nominal voltages for {self.chemistries[chem_id]}: {self._declared_nominals[chem_id]}"
+            )
+        return best
+
+    def resolve(self, battery_type: str, nominal_voltage: float) -> Tuple[int, int]:
+        """Return the (chemistry id, nominal id) of a chemistry and nominal voltage"""
+        chem_id = self.chemistry_id(battery_type)
+        if nominal_voltage is None:
+            raise ValueError(
+                f"Nominal voltage must be provided for battery type: {battery_type}"
+            )
+        return chem_id, self.nominal_id(chem_id, nominal_voltage)
+
+    def spec(self, chem_id: int, nominal_id: int) -> BatterySpec:
+        """Return the specification of resolved ids"""
+        return self._specs[chem_id][nominal_id]
+
+    def lookup(self, battery_type: str, nominal_voltage: float) -> BatterySpec:
+        """Return the specification for a chemistry and nominal voltage"""
+        return self.spec(*self.resolve(battery_type, nominal_voltage))
+
+    def reference_spec(self, battery_type: str) -> BatterySpec:
+        """Return the specification of the first declared nominal voltage"""
+        chem_id = self.chemistry_id(battery_type)
+        return self._specs[chem_id][self.reference_nominal_ids[chem_id]]
+
+    def temperature_limits(self, battery_type: str) -> Tuple[float, float]:
+        """Return (max_temp, min_temp) for a chemistry"""
+        return self._temperature_limits[self.chemistry_id(battery_type)]
+
+    def invalid_nominal_message(self, chem_id: int, nominal_voltage: float) -> str:
+        """Error message for a nominal voltage that did not resolve"""
+        return (
+            f"Invalid nominal voltage: {nominal_voltage}. Available nominal voltages for {self.chemistries[chem_id]}: {self._declared_nominals[chem_id]}"
+        )
+
+    # Array lookups
+
+    def chemistry_ids_for(self, battery_types: Sequence[str]) -> np.ndarray:
+        """Map chemistry names to ids; unknown names map to -1"""
+        get = self.chemistry_ids.get
+        return np.fromiter((get(name, -1) for name in battery_types),
+                           dtype=np.intp, count=len(battery_types))
+
+    def nominal_ids_for(self, chem_ids: np.ndarray, nominal_voltages: np.ndarray) -> np.ndarray:
+        """Resolve nominal voltages per row; unresolvable rows map to -1"""
+        nominal_voltages = np.asarray(nominal_voltages, dtype=np.float64)
+        nominal_ids = np.full(chem_ids.shape, -1, dtype=np.intp)
+        for chem_id in range(len(self.chemistries)):
+            rows = np.flatnonzero(chem_ids == chem_id)
+            if rows.size == 0:
+                continue
+            ordered = self.nominal_voltages[chem_id, :self.nominal_counts[chem_id]]
+            values = nominal_voltages[rows]
+            pos = np.searchsorted(ordered, values)
+            lower = np.clip(pos - 1, 0, ordered.size - 1)
+            upper = np.clip(pos, 0, ordered.size - 1)
+            use_upper = np.abs(ordered[upper] - values) < np.abs(ordered[lower] - values)
+            nearest = np.where(use_upper, upper, lower)
+            matched = np.abs(ordered[nearest] - values) <= self.tolerance
+            nominal_ids[rows] = np.where(matched, nearest, -1)
+        return nominal_ids
+
+    def gather(self, chem_ids: np.ndarray, nominal_ids: np.ndarray) -> Dict[str, np.ndarray]:
+        """Gather spec columns for resolved rows; unresolved rows are NaN"""
+        resolved = (chem_ids >= 0) & (nominal_ids >= 0)
+        c = np.where(resolved, chem_ids, 0)
+        k = np.where(resolved, nominal_ids, 0)
+        return {
+            "max_temp": np.where(resolved, self.max_temps[c], np.nan),
+            "min_temp": np.where(resolved, self.min_temps[c], np.nan),
+            "nominal_voltage": np.where(resolved, self.nominal_voltages[c, k], np.nan),
+            "max_voltage": np.where(resolved, self.max_voltages[c, k], np.nan),
+            "min_voltage": np.where(resolved, self.min_voltages[c, k], np.nan),
+        }
+
+    def gather_reference(self, chem_ids: np.ndarray) -> Dict[str, np.ndarray]:
+        """Gather the reference (first declared nominal) spec columns per row"""
+        return self.gather(chem_ids, self.reference_nominal_ids[np.where(chem_ids >= 0, chem_ids, 0)])
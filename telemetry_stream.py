@@ -0,0 +1,396 @@
+"""Stateful telemetry ingest for the /battery/stream endpoints.
+
+Gateways push frames of samples for many batteries. The server keeps the
+latest reading of each battery, so clients no longer compute derived inputs
+such as the temperature rate of change, and answers each frame with only
+the results that changed since they were last pushed.
+
+A sample is a JSON object::
+
+    {"batteryId": "pack-17", "batteryType": "Li-ion", "nominalVoltage": 48.0,
+     "voltage": 50.1, "current": -12.0, "temperature": 31.5,
+     "timestamp": 1718000000.0, "impedance": 15.0, "pressure": 1.0,
+     "ambientTemperature": 25.0}
+
+``batteryType`` and ``nominalVoltage`` are only required in the first
+sample of a battery. ``timestamp`` (Unix seconds) defaults to the time of
+arrival. ``impedance``, ``pressure`` and ``ambientTemperature`` are
+optional and keep their last reported value.
+"""
+from typing import Dict, List, Optional, Tuple
+import math
+import os
+import time
+
+import numpy as np
+from starlette.responses import StreamingResponse
+
+from batch_diagnostics import BatchDiagnostics
+from battery_diagnostics import BatteryDiagnostics, spec_registry
+from fast_json import loads
+
+# Upper bound on the number of batteries tracked by one process
+DEFAULT_STREAM_MAX_BATTERIES = int(os.environ.get("STREAM_MAX_BATTERIES", "100000"))
+# Upper bound on the number of batteries tracked for one API key
+DEFAULT_STREAM_MAX_BATTERIES_PER_OWNER = int(os.environ.get("STREAM_MAX_BATTERIES_PER_OWNER", "10000"))
+# Seconds without a sample after which a battery's state may be reclaimed
+DEFAULT_STREAM_IDLE_SECONDS = float(os.environ.get("STREAM_IDLE_SECONDS", "86400"))
+# SOC movement (percentage points) that is pushed even if the status is unchanged
+DEFAULT_STREAM_SOC_DELTA = float(os.environ.get("STREAM_SOC_DELTA", "1.0"))
+# Rate of change movement (°C/min) that is pushed even if the status is unchanged
+DEFAULT_STREAM_RATE_DELTA = float(os.environ.get("STREAM_RATE_DELTA", "0.5"))
+# Weight of the newest sample in the smoothed rate of change (1 disables smoothing)
+DEFAULT_STREAM_RATE_SMOOTHING = float(os.environ.get("STREAM_RATE_SMOOTHING", "0.5"))
+
+# Thresholds of BatteryDiagnostics.analyze_thermal, detect_faults and monitor_safety
+THERMAL_WARNING, THERMAL_CRITICAL, THERMAL_RUNAWAY = 45, 60, 70
+THERMAL_RATE_LIMIT = 2.0
+SAFETY_CURRENT_LIMIT = 2.0
+SAFETY_PRESSURE_LIMIT = 1.2
+FAULT_IMPEDANCE_LIMIT = 200
+FAULT_REVERSE_CURRENT = -0.1
+
+CHARGING_STATUSES = ("Idle", "Charging", "Discharging", "Full")
+
+# One record per battery: the latest reading plus what was last pushed.
+# Sent codes start at -1 so the first sample of a battery always reports.
+# ``seen`` is the arrival time of the battery's latest sample.
+STATE_DTYPE = np.dtype([
+    ("seen", np.float64),
+    ("chem_id", np.int16),
+    ("nominal_voltage", np.float64),
+    ("timestamp", np.float64),
+    ("temperature", np.float64),
+    ("rate", np.float64),
+    ("ambient", np.float64),
+    ("impedance", np.float64),
+    ("pressure", np.float64),
+    ("sent_soc", np.float64),
+    ("sent_charging", np.int8),
+    ("sent_soc_error", np.bool_),
+    ("sent_rate", np.float64),
+    ("sent_thermal", np.int8),
+    ("sent_safety", np.int8),
+    ("sent_faults", np.int8),
+])
+
+_OPTIONAL_FIELDS = (("impedance", "impedance"), ("pressure", "pressure"),
+                    ("ambientTemperature", "ambient"))
+
+
+def _number(sample: Dict, name: str) -> Optional[float]:
+    value = sample.get(name)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"{name} must be a finite number")
+    return float(value)
+
+
+def _required(sample: Dict, name: str) -> float:
+    value = _number(sample, name)
+    if value is None:
+        raise ValueError(f"{name} is required")
+    return value
+
+
+class StreamState:
+    """Per-battery stream state in one NumPy record array.
+
+    Each battery is a row, found through a dict keyed by (owner, battery id),
+    so gateways using different API keys cannot see each other's batteries.
+    Each key holds at most ``max_batteries_per_owner`` batteries. When the
+    table is full, batteries idle for ``idle_seconds`` are reclaimed, or
+    else the least recently seen one, and their rows are reused.
+    A frame is applied column-wise: rate of change, SOC and the thermal,
+    safety and fault classifications are computed for all of its samples at
+    once, compared with what was last pushed, and only changed rows are
+    turned into result dicts.
+    """
+
+    def __init__(self, max_batteries: int = DEFAULT_STREAM_MAX_BATTERIES,
+                 max_batteries_per_owner: int = DEFAULT_STREAM_MAX_BATTERIES_PER_OWNER,
+                 idle_seconds: float = DEFAULT_STREAM_IDLE_SECONDS,
+                 soc_delta: float = DEFAULT_STREAM_SOC_DELTA,
+                 rate_delta: float = DEFAULT_STREAM_RATE_DELTA,
+                 rate_smoothing: float = DEFAULT_STREAM_RATE_SMOOTHING):
+        self.max_batteries = max_batteries
+        self.max_batteries_per_owner = max_batteries_per_owner
+        self.idle_seconds = idle_seconds
+        self.soc_delta = soc_delta
+        self.rate_delta = rate_delta
+        self.rate_smoothing = rate_smoothing
+        self.rows: Dict[Tuple[str, str], int] = {}
+        self.keys: List[Optional[Tuple[str, str]]] = []  # row -> key, None once reclaimed
+        self.free: List[int] = []
+        self.owner_batteries: Dict[str, int] = {}
+        self.state = self._empty(min(64, max_batteries))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @staticmethod
+    def _empty(size: int) -> np.ndarray:
+        state = np.zeros(size, dtype=STATE_DTYPE)
+        for name in ("timestamp", "temperature", "rate", "ambient", "impedance",
+                     "pressure", "sent_soc", "sent_rate"):
+            state[name] = np.nan
+        for name in ("sent_charging", "sent_thermal", "sent_safety", "sent_faults"):
+            state[name] = -1
+        return state
+
+    def _add_row(self, key: Tuple[str, str], now: float) -> int:
+        owner = key[0]
+        if self.owner_batteries.get(owner, 0) >= self.max_batteries_per_owner:
+            raise ValueError(
+                f"Stream state is full for this API key ({self.max_batteries_per_owner} batteries)")
+        if not self.free and len(self.rows) >= self.max_batteries:
+            self._reclaim(now)
+        if self.free:
+            row = self.free.pop()
+            self.state[row] = self._empty(1)[0]
+            self.keys[row] = key
+        else:
+            row = len(self.keys)
+            if row == len(self.state):
+                size = min(2 * len(self.state), self.max_batteries)
+                self.state = np.concatenate([self.state, self._empty(size - len(self.state))])
+            self.keys.append(key)
+        self.rows[key] = row
+        self.owner_batteries[owner] = self.owner_batteries.get(owner, 0) + 1
+        return row
+
+    def _reclaim(self, now: float):
+        """Free the rows of idle batteries, or else of the least recently seen one"""
+        seen = self.state["seen"][:len(self.keys)]
+        rows = np.flatnonzero(seen < now - self.idle_seconds)
+        if not len(rows):
+            oldest = int(np.argmin(seen))
+            # Batteries in the frame being applied must keep their rows
+            if seen[oldest] >= now:
+                raise ValueError(f"Stream state is full ({self.max_batteries} batteries)")
+            rows = [oldest]
+        for row in rows:
+            key = self.keys[row]
+            del self.rows[key]
+            self.keys[row] = None
+            self.owner_batteries[key[0]] -= 1
+            if not self.owner_batteries[key[0]]:
+                del self.owner_batteries[key[0]]
+            self.free.append(int(row))
+
+    def ingest(self, owner: str, samples: List[Dict], now: Optional[float] = None) -> Dict:
+        """Apply a frame of samples and return the results that changed.
+
+        Returns ``{"updates": [...], "errors": [...]}``. Each update holds a
+        ``batteryId`` and one entry per changed section (``soc``, ``thermal``,
+        ``safety``, ``faults``). Errors give the sample ``index`` and a
+        ``detail``; a rejected sample leaves its battery's state unchanged.
+        """
+        now = time.time() if now is None else now
+        errors = []
+        generations: List[List[Tuple]] = []
+        # Row -> (samples already taken from this frame, latest timestamp)
+        seen: Dict[int, Tuple[int, float]] = {}
+        for index, sample in enumerate(samples):
+            try:
+                entry = self._parse(owner, sample, now, seen)
+            except ValueError as e:
+                errors.append({"index": index, "detail": str(e)})
+                continue
+            row, timestamp = entry[1], entry[5]
+            generation = seen.get(row, (0, 0.0))[0]
+            seen[row] = (generation + 1, timestamp)
+            # A battery seen twice in one frame is applied in order, one pass per repeat
+            if generation == len(generations):
+                generations.append([])
+            generations[generation].append((index, *entry))
+
+        updates: Dict[int, Dict] = {}
+        for batch in generations:
+            self._apply(batch, updates)
+        return {"updates": list(updates.values()), "errors": errors}
+
+    def ingest_frame(self, owner: str, frame) -> Optional[Dict]:
+        """Apply a JSON frame (one sample or an array of samples).
+
+        Returns None when nothing changed, so callers only send real updates.
+        """
+        try:
+            samples = loads(frame)
+        except ValueError as e:
+            return {"updates": [], "errors": [{"index": None, "detail": f"Malformed frame: {e}"}]}
+        if not isinstance(samples, list):
+            samples = [samples]
+        result = self.ingest(owner, samples)
+        return result if result["updates"] or result["errors"] else None
+
+    def _parse(self, owner: str, sample, now: float, seen: Dict[int, Tuple[int, float]]) -> Tuple:
+        """Validate one sample and resolve its row; nothing is changed if it is rejected"""
+        if not isinstance(sample, dict):
+            raise ValueError("Sample must be an object")
+        battery_id = sample.get("batteryId")
+        if not isinstance(battery_id, str) or not battery_id:
+            raise ValueError("batteryId is required")
+        voltage = _required(sample, "voltage")
+        current = _required(sample, "current")
+        temperature = _required(sample, "temperature")
+        timestamp = _number(sample, "timestamp")
+        timestamp = now if timestamp is None else timestamp
+        nominal_voltage = _number(sample, "nominalVoltage")
+        optional = tuple(_number(sample, name) for name, _ in _OPTIONAL_FIELDS)
+
+        battery_type = sample.get("batteryType")
+        chem_id = None
+        if battery_type is not None:
+            chem_id = spec_registry.chemistry_ids.get(battery_type)
+            if chem_id is None:
+                raise ValueError(f"Unknown battery type: {battery_type}")
+
+        key = (owner, battery_id)
+        row = self.rows.get(key)
+        if row is None:
+            if chem_id is None or nominal_voltage is None:
+                raise ValueError(
+                    f"First sample for battery {battery_id} needs batteryType and nominalVoltage")
+            row = self._add_row(key, now)
+        else:
+            latest = seen[row][1] if row in seen else self.state["timestamp"][row]
+            if timestamp < latest:
+                raise ValueError(f"Sample for battery {battery_id} is older than its last sample")
+        if chem_id is not None:
+            self.state["chem_id"][row] = chem_id
+        if nominal_voltage is not None:
+            self.state["nominal_voltage"][row] = nominal_voltage
+        self.state["seen"][row] = now
+        return battery_id, row, voltage, current, temperature, timestamp, optional
+
+    def _apply(self, batch: List[Tuple], updates: Dict[int, Dict]):
+        state = self.state
+        battery_ids = [entry[1] for entry in batch]
+        rows = np.fromiter((entry[2] for entry in batch), dtype=np.intp, count=len(batch))
+        voltage = np.array([entry[3] for entry in batch])
+        current = np.array([entry[4] for entry in batch])
+        temperature = np.array([entry[5] for entry in batch])
+        timestamp = np.array([entry[6] for entry in batch])
+        for position, (_, column) in enumerate(_OPTIONAL_FIELDS):
+            for offset, entry in enumerate(batch):
+                if entry[7][position] is not None:
+                    state[column][rows[offset]] = entry[7][position]
+
+        # Smoothed temperature rate of change in °C/min
+        minutes = (timestamp - state["timestamp"][rows]) / 60
+        has_previous = minutes > 0  # False for first samples (NaN) and repeated timestamps
+        instant = np.where(has_previous, temperature - state["temperature"][rows], 0) \
+            / np.where(has_previous, minutes, 1)
+        previous_rate = state["rate"][rows]
+        rate = np.where(
+            has_previous,
+            np.where(np.isnan(previous_rate), instant,
+                     self.rate_smoothing * instant + (1 - self.rate_smoothing) * previous_rate),
+            previous_rate
+        )
+        state["rate"][rows] = rate
+        state["timestamp"][rows] = timestamp
+        state["temperature"][rows] = temperature
+        rate = np.nan_to_num(rate)
+
+        chem_ids = state["chem_id"][rows].astype(np.intp)
+        battery_types = [spec_registry.chemistries[chem_id] for chem_id in chem_ids]
+        soc = BatchDiagnostics.calculate_soc_batch(
+            voltage=voltage, battery_type=battery_types, temperature=temperature,
+            current=current, nominal_voltage=state["nominal_voltage"][rows])
+        valid = soc["valid"]
+        charging = np.select(
+            [current > 0, current < 0, (current == 0) & (soc["stateOfCharge"] == 100)],
+            [1, 2, 3], default=0).astype(np.int8)
+
+        thermal = np.select(
+            [temperature > THERMAL_RUNAWAY, temperature > THERMAL_CRITICAL,
+             temperature > THERMAL_WARNING], [3, 2, 1], default=0).astype(np.int8)
+        thermal[(thermal == 0) & (rate > THERMAL_RATE_LIMIT)] = 1
+
+        reference = spec_registry.gather_reference(chem_ids)
+        over_voltage = voltage > reference["max_voltage"]
+        over_temp = temperature > reference["max_temp"]
+        safety = (over_voltage * 1 + (~over_voltage & (voltage < reference["min_voltage"])) * 2
+                  + over_temp * 4 + (~over_temp & (temperature < reference["min_temp"])) * 8
+                  + (np.abs(current) > SAFETY_CURRENT_LIMIT) * 16
+                  + (state["pressure"][rows] > SAFETY_PRESSURE_LIMIT) * 32).astype(np.int8)
+        faults = ((voltage < reference["min_voltage"] * 0.5) * 1
+                  + (state["impedance"][rows] > FAULT_IMPEDANCE_LIMIT) * 2
+                  + (current < FAULT_REVERSE_CURRENT) * 4
+                  + (temperature > THERMAL_CRITICAL) * 8).astype(np.int8)
+
+        sent_soc = state["sent_soc"][rows]
+        soc_changed = np.where(
+            valid,
+            np.isnan(sent_soc) | (np.abs(soc["stateOfCharge"] - sent_soc) >= self.soc_delta)
+            | (charging != state["sent_charging"][rows]),
+            ~state["sent_soc_error"][rows]
+        )
+        thermal_changed = (thermal != state["sent_thermal"][rows]) \
+            | ~(np.abs(rate - state["sent_rate"][rows]) < self.rate_delta)
+        safety_changed = safety != state["sent_safety"][rows]
+        faults_changed = faults != state["sent_faults"][rows]
+
+        soc_errors = {error["index"]: error["detail"] for error in soc["errors"]}
+        changed = soc_changed | thermal_changed | safety_changed | faults_changed
+        for offset in np.flatnonzero(changed):
+            row = rows[offset]
+            record = state[row]
+            update = updates.setdefault(row, {"batteryId": battery_ids[offset]})
+            battery_type = battery_types[offset]
+            if soc_changed[offset]:
+                if valid[offset]:
+                    update["soc"] = {
+                        "stateOfCharge": float(soc["stateOfCharge"][offset]),
+                        "estimatedRange": str(soc["estimatedRange"][offset]),
+                        "chargingStatus": CHARGING_STATUSES[charging[offset]],
+                        "temperatureCompensation": float(soc["temperatureCompensation"][offset])
+                    }
+                    record["sent_soc"] = soc["stateOfCharge"][offset]
+                    record["sent_charging"] = charging[offset]
+                    record["sent_soc_error"] = False
+                else:
+                    update["soc"] = {"error": soc_errors[offset]}
+                    record["sent_soc"] = np.nan
+                    record["sent_charging"] = -1
+                    record["sent_soc_error"] = True
+            if thermal_changed[offset]:
+                update["thermal"] = {
+                    **BatteryDiagnostics.analyze_thermal(
+                        float(temperature[offset]), float(rate[offset]),
+                        float(record["ambient"]), None),
+                    "rateOfChange": float(rate[offset])
+                }
+                record["sent_thermal"] = thermal[offset]
+                record["sent_rate"] = rate[offset]
+            if safety_changed[offset]:
+                update["safety"] = BatteryDiagnostics.monitor_safety(
+                    float(voltage[offset]), float(current[offset]), float(temperature[offset]),
+                    float(record["pressure"]), battery_type)
+                record["sent_safety"] = safety[offset]
+            if faults_changed[offset]:
+                update["faults"] = BatteryDiagnostics.detect_faults(
+                    float(voltage[offset]), float(current[offset]), float(temperature[offset]),
+                    float(record["impedance"]), battery_type)
+                record["sent_faults"] = faults[offset]
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """StreamingResponse whose body iterator consumes the request body.
+
+    The stock response also waits on receive() for a client disconnect,
+    which would take request body messages away from the iterator. Here a
+    disconnect surfaces through request.stream() instead.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+# Stream state shared by every connection served by this process
+stream_state = StreamState()
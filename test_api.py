@@ -1,7 +1,25 @@
+import os
+import tempfile
+
+# Tests use the in-memory backends instead of the SQLite files
+os.environ.setdefault("DIAGNOSTIC_HISTORY_BACKEND", "memory")
+os.environ.setdefault("API_KEY_STORE", "memory")
+os.environ.setdefault("RATE_LIMIT_BACKEND", "memory")
+# Batch job files and tables go to a scratch directory
+os.environ.setdefault("BATCH_JOBS_DIR", tempfile.mkdtemp(prefix="battery-jobs-"))
+
+from fastapi import FastAPI
 from fastapi.testclient import TestClient
 from main import app
+from battery_diagnostics import BatteryDiagnostics
+from diagnostic_history import DiagnosticHistory, SQLiteDiagnosticHistory
+from api_key_manager import ApiKeyManager, MemoryKeyStore, SQLiteKeyStore, hash_key
+from rate_limiter import (
+    MemoryRateLimitBackend, RateLimiter, RateLimitMiddleware, SQLiteRateLimitBackend
+)
 import pytest
 import json
+import time
 
 client = TestClient(app)
 
@@ -250,6 +268,1344 @@ def test_diagnostic_history():
     print("RESULT: PASSED ✓")
 
 
+def test_soc_batch_endpoint():
+    """Test batch State of Charge endpoint against the scalar calculation"""
+    print("\n===========================================================")
+    print("TEST: Batch State of Charge (SOC) Endpoint")
+    print("===========================================================")
+
+    headers = {"x-api-key": "test_key"}
+
+    batch_data = {
+        "batteryType": ["Li-ion", "Li-ion", "LFP", "Lead-acid", "Invalid", "Li-ion"],
+        "nominalVoltage": [48.0, 48.0, 12.8, 12.0, 48.0, 10.5],
+        "voltage": [53.7, 54.6, 13.1, 15.0, 50.0, 10.0],
+        "temperature": [35.0, 20.0, -5.0, 25.0, 25.0, 25.0],
+        "current": [-10.0, 0.0, 2.5, 1.0, 1.0, 1.0]
+    }
+    print("\n=== SOC BATCH ENDPOINT ===")
+    print(f"Request: POST /battery/diagnose/soc/batch")
+    print(f"Request Body: {json.dumps(batch_data, indent=2)}")
+
+    response = client.post("/battery/diagnose/soc/batch",
+                           json=batch_data,
+                           headers=headers)
+    print(f"Status Code: {response.status_code}")
+    print(f"Response: {json.dumps(response.json(), indent=2)}")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["count"] == 6
+    assert [error["index"] for error in body["errors"]] == [3, 4, 5]
+
+    for row in range(body["count"]):
+        try:
+            expected = BatteryDiagnostics.calculate_soc(
+                voltage=batch_data["voltage"][row],
+                battery_type=batch_data["batteryType"][row],
+                temperature=batch_data["temperature"][row],
+                current=batch_data["current"][row],
+                nominal_voltage=batch_data["nominalVoltage"][row])
+        except ValueError as e:
+            error = next(error for error in body["errors"] if error["index"] == row)
+            assert error["detail"] == str(e)
+            assert body["stateOfCharge"][row] is None
+            continue
+        for key, value in expected.items():
+            assert body[key][row] == value
+    print("RESULT: PASSED ✓")
+
+
+def test_nominal_voltage_tolerance():
+    """Test that nominal voltages within tolerance resolve to the catalogued value"""
+    print("\n===========================================================")
+    print("TEST: Nominal Voltage Tolerance")
+    print("===========================================================")
+
+    headers = {"x-api-key": "test_key"}
+
+    voltage_data = {
+        "batteryType": "Li-ion",
+        "voltage": 50.0,
+        "nominalVoltage": 47.99,  # Gateway float formatting of 48.0
+        "temperature": 25.0
+    }
+    print("\n=== VOLTAGE ENDPOINT (NOMINAL 47.99V) ===")
+    print(f"Request: POST /battery/diagnose/voltage")
+    print(f"Request Body: {json.dumps(voltage_data, indent=2)}")
+
+    response = client.post("/battery/diagnose/voltage",
+                           json=voltage_data,
+                           headers=headers)
+    print(f"Status Code: {response.status_code}")
+    print(f"Response: {json.dumps(response.json(), indent=2)}")
+    assert response.status_code == 200
+    assert response.json()["nominalVoltage"] == 48.0
+    print("RESULT: PASSED ✓")
+
+
+def test_diagnostic_history_pagination():
+    """Test cursor pagination and ring-buffer eviction of diagnostic history"""
+    print("\n===========================================================")
+    print("TEST: Diagnostic History Pagination")
+    print("===========================================================")
+
+    history = DiagnosticHistory(capacity=5)
+    for cycle in range(8):
+        history.record("soh", "Li-ion", {"cycle": cycle})
+    print(f"Recorded 8 entries into a buffer of capacity {history.capacity}")
+
+    first_page, cursor = history.page(limit=3)
+    second_page, last_cursor = history.page(limit=3, cursor=cursor)
+    print(f"First page: {json.dumps(first_page, indent=2)}")
+    print(f"Second page: {json.dumps(second_page, indent=2)}")
+    assert len(history) == 5
+    assert [entry["result"]["cycle"] for entry in first_page] == [3, 4, 5]
+    assert [entry["result"]["cycle"] for entry in second_page] == [6, 7]
+    assert last_cursor is None
+
+    headers = {"x-api-key": "test_key"}
+    print("\n=== DIAGNOSTIC HISTORY (LIMIT 1) ===")
+    print(f"Request: GET /battery/logs?limit=1")
+    response = client.get("/battery/logs", params={"limit": 1}, headers=headers)
+    print(f"Status Code: {response.status_code}")
+    print(f"Response: {json.dumps(response.json(), indent=2)}")
+    assert response.status_code == 200
+    assert len(response.json()["logs"]) == 1
+    assert "next_cursor" in response.json()
+    print("RESULT: PASSED ✓")
+
+
+def test_sqlite_diagnostic_history(tmp_path):
+    """Test that the SQLite history backend persists batched writes"""
+    print("\n===========================================================")
+    print("TEST: SQLite Diagnostic History")
+    print("===========================================================")
+
+    url = f"sqlite:///{tmp_path / 'history.db'}"
+    history = SQLiteDiagnosticHistory(url=url, batch_size=2)
+    for cycle in range(5):
+        history.record("soh", "Li-ion", {"cycle": cycle})
+    assert history.flush() == 5
+
+    # A fresh instance reads back what the previous one wrote
+    reopened = SQLiteDiagnosticHistory(url=url)
+    first_page, cursor = reopened.page(limit=3)
+    second_page, last_cursor = reopened.page(limit=3, cursor=cursor)
+    print(f"First page: {json.dumps(first_page, indent=2)}")
+    print(f"Second page: {json.dumps(second_page, indent=2)}")
+    assert [entry["result"]["cycle"] for entry in first_page] == [0, 1, 2]
+    assert [entry["result"]["cycle"] for entry in second_page] == [3, 4]
+    assert last_cursor is None
+    print("RESULT: PASSED ✓")
+
+
+def test_diagnostic_history_ndjson_stream():
+    """Test filtered NDJSON streaming of diagnostic history"""
+    print("\n===========================================================")
+    print("TEST: Diagnostic History NDJSON Stream")
+    print("===========================================================")
+
+    headers = {"x-api-key": "test_key"}
+
+    thermal_data = {
+        "batteryType": "Lead-acid",
+        "temperature": 30.0,
+        "rateOfChange": 0.5,
+        "ambientTemperature": 25.0,
+        "loadProfile": "low"
+    }
+    for _ in range(3):
+        client.post("/battery/diagnose/thermal", json=thermal_data, headers=headers)
+
+    print("\n=== DIAGNOSTIC HISTORY (NDJSON, type=thermal) ===")
+    print(f"Request: GET /battery/logs?type=thermal&batteryType=Lead-acid")
+    response = client.get("/battery/logs",
+                          params={"type": "thermal", "batteryType": "Lead-acid"},
+                          headers={**headers, "Accept": "application/x-ndjson"})
+    print(f"Status Code: {response.status_code}")
+    print(f"Response: {response.text}")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    entries = [json.loads(line) for line in response.text.splitlines()]
+    assert len(entries) >= 3
+    assert all(entry["type"] == "thermal" for entry in entries)
+    assert all(entry["batteryType"] == "Lead-acid" for entry in entries)
+
+    history = DiagnosticHistory(capacity=10)
+    for cycle in range(12):
+        history.record("soh" if cycle % 2 else "soc", "LFP", {"cycle": cycle})
+    page, cursor = history.page(limit=2, diagnostic_type="soh")
+    rest, last_cursor = history.page(limit=10, cursor=cursor, diagnostic_type="soh")
+    assert [entry["result"]["cycle"] for entry in page] == [3, 5]
+    assert [entry["result"]["cycle"] for entry in rest] == [7, 9, 11]
+    assert last_cursor is None
+    print("RESULT: PASSED ✓")
+
+
+def test_full_diagnostic_endpoint():
+    """Test the single-pass full diagnostic report"""
+    print("\n===========================================================")
+    print("TEST: Full Diagnostic Report Endpoint")
+    print("===========================================================")
+
+    headers = {"x-api-key": "test_key"}
+
+    full_data = {
+        "batteryType": "Li-ion",
+        "nominalVoltage": 48.0,
+        "voltage": 50.0,
+        "current": -1.5,
+        "temperature": 30.0,
+        "currentCapacity": 2800,
+        "ratedCapacity": 3000,
+        "cycleCount": 250,
+        "cellVoltages": [3.9, 3.85, 3.92, 3.88],
+        "pressure": 1.0,
+        "rateOfChange": 0.5,
+        "ambientTemperature": 25.0,
+        "loadProfile": "medium",
+        "impedance": 15.0,
+        "sections": ["soc", "soh", "cell-balance", "safety", "thermal", "faults"]
+    }
+    print("\n=== FULL DIAGNOSTIC ENDPOINT ===")
+    print(f"Request: POST /battery/diagnose/full")
+    print(f"Request Body: {json.dumps(full_data, indent=2)}")
+
+    response = client.post("/battery/diagnose/full",
+                           json=full_data,
+                           headers=headers)
+    print(f"Status Code: {response.status_code}")
+    print(f"Response: {json.dumps(response.json(), indent=2)}")
+    assert response.status_code == 200
+    body = response.json()
+    assert list(body["results"]) == full_data["sections"]
+    assert body["errors"] == {}
+    assert body["results"]["soc"] == BatteryDiagnostics.calculate_soc(
+        voltage=50.0, battery_type="Li-ion", temperature=30.0,
+        current=-1.5, nominal_voltage=48.0)
+    assert body["results"]["faults"] == BatteryDiagnostics.detect_faults(
+        voltage=50.0, current=-1.5, temperature=30.0, impedance=15.0,
+        battery_type="Li-ion")
+
+    # Sections missing their inputs are rejected up front
+    response = client.post("/battery/diagnose/full",
+                           json={"batteryType": "Li-ion", "temperature": 25.0,
+                                 "sections": ["cycle-life"]},
+                           headers=headers)
+    print(f"Status Code (missing inputs): {response.status_code}")
+    assert response.status_code == 422
+    print("RESULT: PASSED ✓")
+
+
+def test_api_key_limit_across_workers(tmp_path):
+    """Test that two managers sharing a key store enforce one usage limit"""
+    print("\n===========================================================")
+    print("TEST: API Key Limit Across Workers")
+    print("===========================================================")
+
+    url = f"sqlite:///{tmp_path / 'keys.db'}"
+    workers = [ApiKeyManager(max_usage=30, store=SQLiteKeyStore(url)) for _ in range(2)]
+
+    served = 0
+    for request_number in range(60):
+        manager = workers[request_number % 2]
+        if manager.validate_key("test_key"):
+            manager.increment_usage("test_key")
+            served += 1
+    for manager in workers:
+        manager.flush(release=True)
+
+    usage = workers[0].get_usage("test_key")
+    print(f"Requests served: {served}, stored usage: {usage}")
+    assert served == 30
+    assert usage == 30
+    assert "test_key" not in workers[0].get_all_keys()
+    print("RESULT: PASSED ✓")
+
+
+def test_api_key_leases(tmp_path):
+    """Test that leases batch store writes and that a stopped worker's lease is reclaimed"""
+    import asyncio
+    import time
+
+    class CountingKeyStore(MemoryKeyStore):
+        reserves = 0
+
+        def reserve(self, *args):
+            self.reserves += 1
+            return super().reserve(*args)
+
+    store = CountingKeyStore()
+    manager = ApiKeyManager(max_usage=1000, store=store, lease_size=20)
+    for request_number in range(200):
+        if request_number % 2:
+            assert asyncio.run(manager.validate_key_async("test_key"))
+        else:
+            assert manager.validate_key("test_key")
+        assert manager.increment_usage("test_key") == request_number + 1
+    assert store.reserves == 10
+    manager.flush()
+    assert manager.get_usage("test_key") == 200
+
+    # A released claim goes back to the lease without being counted
+    limited = ApiKeyManager(max_usage=1, store=MemoryKeyStore())
+    for _ in range(3):
+        assert limited.validate_key("test_key")
+        limited.release("test_key")
+    limited.release("test_key")
+    assert limited.validate_key("test_key")
+    assert limited.increment_usage("test_key") == 1
+    assert not limited.validate_key("test_key")
+    limited.flush(release=True)
+    assert limited.get_usage("test_key") == 1
+
+    # Small limits still get leases of a tenth of the limit
+    assert manager.lease_count(30) == 3 and manager.lease_count(10) == 1
+
+    url = f"sqlite:///{tmp_path / 'keys.db'}"
+    stopped = ApiKeyManager(max_usage=40, store=SQLiteKeyStore(url), lease_seconds=0.05)
+    assert stopped.validate_key("test_key")
+    stopped.increment_usage("test_key")
+    stopped.flush()
+    time.sleep(0.1)
+    # The three uses still leased to the stopped worker return to the pool
+    survivor = ApiKeyManager(max_usage=40, store=SQLiteKeyStore(url))
+    served = 0
+    for _ in range(50):
+        if survivor.validate_key("test_key"):
+            survivor.increment_usage("test_key")
+            served += 1
+    assert served == 39
+    # and the stopped worker can no longer spend them
+    assert not stopped.validate_key("test_key")
+    survivor.flush(release=True)
+    assert survivor.get_usage("test_key") == 40
+
+
+def test_rate_limit_middleware():
+    """Test token bucket rate limiting on diagnose routes"""
+    print("\n===========================================================")
+    print("TEST: Rate Limit Middleware")
+    print("===========================================================")
+
+    limited_app = FastAPI()
+    limited_app.add_middleware(
+        RateLimitMiddleware,
+        limiter=RateLimiter(MemoryRateLimitBackend(), rate=0.5, burst=2))
+
+    @limited_app.get("/battery/diagnose/ping")
+    async def ping():
+        return {"status": "ok"}
+
+    limited_client = TestClient(limited_app)
+    headers = {"x-api-key": "test_key"}
+    statuses = []
+    for _ in range(3):
+        response = limited_client.get("/battery/diagnose/ping", headers=headers)
+        statuses.append(response.status_code)
+        print(f"Status Code: {response.status_code}, headers: {dict(response.headers)}")
+    assert statuses == [200, 200, 429]
+    assert response.headers["retry-after"] == "2"
+    assert response.headers["x-ratelimit-remaining"] == "0"
+    assert response.headers["x-ratelimit-limit"] == "2"
+
+    # Other keys have their own bucket
+    response = limited_client.get("/battery/diagnose/ping", headers={"x-api-key": "other"})
+    assert response.status_code == 200
+
+    # Keys the route will reject never get a bucket
+    async def is_known(api_key):
+        return api_key == "test_key"
+
+    buckets = MemoryRateLimitBackend()
+    known_app = FastAPI()
+    known_app.add_middleware(RateLimitMiddleware, is_known=is_known,
+                             limiter=RateLimiter(buckets, rate=0.5, burst=2))
+    known_app.get("/battery/diagnose/ping")(ping)
+    for key in ("test_key", "random-1", "random-2"):
+        response = TestClient(known_app).get("/battery/diagnose/ping", headers={"x-api-key": key})
+        assert ("x-ratelimit-limit" in response.headers) == (key == "test_key")
+    assert list(buckets._buckets) == [hash_key("test_key")]
+    print("RESULT: PASSED ✓")
+
+
+def test_sqlite_rate_limit_backend(tmp_path):
+    """Test that the shared SQLite bucket refills and denies like the memory one"""
+    backend = SQLiteRateLimitBackend(f"sqlite:///{tmp_path / 'limits.db'}")
+    assert backend.take("key", 1.0, 2, 100.0) == (True, 1.0)
+    assert backend.take("key", 1.0, 2, 100.0) == (True, 0.0)
+    assert backend.take("key", 1.0, 2, 100.5) == (False, 0.5)
+    assert backend.take("key", 1.0, 2, 101.0) == (True, 0.0)
+
+    # Workers limit locally and settle their hits through the shared bucket
+    workers = [RateLimiter(backend, rate=0.01, burst=4) for _ in range(2)]
+    assert [workers[0].hit("shared").allowed for _ in range(3)] == [True] * 3
+    assert workers[0].sync() == 1
+    # The second worker's bucket learns of the first worker's hits on its next sync
+    assert workers[1].hit("shared").allowed
+    workers[1].sync()
+    assert not workers[1].hit("shared").allowed
+    # A bucket idle long enough to be full again is deleted
+    assert backend.evict(time.time() + 1000) >= 1
+
+
+def test_production_mode_requires_shared_state():
+    """Test that several workers are refused on process-local backends"""
+    import run
+
+    args = run.parse_args(["--production", "--workers", "4", "--port", "8080"])
+    assert args.production and args.workers == 4 and args.port == 8080
+    # The test environment uses memory backends
+    with pytest.raises(RuntimeError):
+        run.check_shared_state(args.workers)
+    run.check_shared_state(1)
+
+    # On shared backends, stateful endpoints are turned off for the workers
+    names = [*run.STATE_BACKENDS, "STATEFUL_ENDPOINTS", "BATCH_JOB_WORKERS"]
+    saved = {name: os.environ.get(name) for name in names}
+    try:
+        for name in run.STATE_BACKENDS:
+            os.environ[name] = "sqlite"
+        os.environ.pop("STATEFUL_ENDPOINTS", None)
+        run.check_shared_state(args.workers)
+        assert os.environ["STATEFUL_ENDPOINTS"] == "0"
+        os.environ["STATEFUL_ENDPOINTS"] = "1"
+        with pytest.raises(RuntimeError):
+            run.check_shared_state(args.workers)
+
+        # The API workers' batch job pools share the cores instead of each taking them all
+        os.environ.pop("BATCH_JOB_WORKERS", None)
+        run.share_job_workers(os.cpu_count() * 2)
+        assert os.environ["BATCH_JOB_WORKERS"] == "1"
+        os.environ.pop("BATCH_JOB_WORKERS")
+        run.share_job_workers(1)
+        assert os.environ["BATCH_JOB_WORKERS"] == str(os.cpu_count())
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def test_benchmark_regression_gate(tmp_path):
+    """Test that the benchmark gate flags slowdowns beyond the threshold"""
+    import benchmarks
+
+    results = benchmarks.run_kernel_benchmarks(iterations=50, name_filter="calculate_soc")
+    assert [result.name for result in results] == ["kernel:calculate_soc"]
+    assert results[0].ops_per_sec > 0 and results[0].p99_us >= results[0].p50_us
+
+    path = tmp_path / "baseline.json"
+    benchmarks.save_baseline(results, str(path))
+    baseline = benchmarks.load_baseline(str(path))
+    assert benchmarks.find_regressions(results, baseline, threshold=0.25) == []
+
+    slower = [results[0]._replace(p50_us=results[0].p50_us * 2)]
+    assert len(benchmarks.find_regressions(slower, baseline, threshold=0.25)) == 1
+    assert benchmarks.find_regressions(slower, baseline, threshold=1.5) == []
+
+
+def test_compiled_request_validation():
+    """Test that the compiled checks match the nested-model validators they replaced"""
+    import benchmarks
+    import models
+    from pydantic import ValidationError
+
+    nested = benchmarks._nested_validators()
+    for name, body in benchmarks.VALIDATION_BODIES.items():
+        model = getattr(models, name)
+        assert model.model_validate(body).model_dump() == nested[name].model_validate(body).model_dump()
+        for field, value in (("voltage", 150.0), ("temperature", -60.0)):
+            for candidate in (model, nested[name]):
+                with pytest.raises(ValidationError):
+                    candidate.model_validate({**body, field: value})
+
+    # SOC keeps the BatteryParameters chemistry list, so spec-only names stay rejected
+    with pytest.raises(ValidationError, match="Battery type must be one of"):
+        models.SOCRequest.model_validate({**benchmarks.VALIDATION_BODIES["SOCRequest"],
+                                          "batteryType": "LFP"})
+
+    results = benchmarks.run_validation_benchmarks(iterations=20, name_filter="SOCRequest")
+    assert [result.name for result in results] == [
+        "validate:SOCRequest:nested", "validate:SOCRequest:compiled"]
+
+
+def test_metrics_endpoint(tmp_path):
+    """Test Prometheus metrics for requests, errors and compute time"""
+    from api_key_manager import api_key_manager
+    from metrics import Metrics
+
+    api_key_manager.add_key("metrics_key")
+    headers = {"x-api-key": "metrics_key"}
+    client.post("/battery/diagnose/soh",
+                json={"batteryType": "Li-ion", "currentCapacity": 2700,
+                      "ratedCapacity": 3000, "cycleCount": 250},
+                headers=headers)
+    client.post("/battery/diagnose/soh",
+                json={"batteryType": "Li-ion", "currentCapacity": -1,
+                      "ratedCapacity": 3000, "cycleCount": 250},
+                headers=headers)
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'http_requests_total{route="/battery/diagnose/soh",method="POST",status="200"}' in text
+    assert 'http_request_errors_total{route="/battery/diagnose/soh",method="POST",status="422"}' in text
+    assert 'battery_diagnostics_compute_seconds_count{operation="calculate_soh"}' in text
+    assert 'http_request_overhead_seconds_count{route="/battery/diagnose/soh"}' in text
+    assert 'http_request_duration_seconds_bucket{route="/battery/diagnose/soh",method="POST",le="+Inf"}' in text
+
+    # Workers sharing a directory see each other's counts
+    first, second = Metrics(str(tmp_path)), Metrics(str(tmp_path))
+    first.observe_request("/health", "GET", 200, 0.001, 0.0)
+    first.write_snapshot()
+    # Stand in for another worker process
+    os.replace(tmp_path / f"metrics-{os.getpid()}.json", tmp_path / "metrics-0.json")
+    second.observe_request("/health", "GET", 200, 0.002, 0.0)
+    rendered = second.render()
+    assert 'http_requests_total{route="/health",method="GET",status="200"} 2' in rendered
+    assert 'http_request_duration_seconds_count{route="/health",method="GET"} 2' in rendered
+
+
+def test_log_sampling_and_queue_handler():
+    """Test per-route log sampling rates and the non-blocking queue handler"""
+    import logging
+    import queue
+    from logging_config import (
+        JSONFormatter, LogSamplingMiddleware, NonBlockingQueueHandler, parse_sample_rates
+    )
+
+    rates = parse_sample_rates("/battery/diagnose/soc=0.01, /battery/diagnose/*=0.1,/battery/*=0.5")
+    middleware = LogSamplingMiddleware(None, default_rate=1.0, rates=rates)
+    assert middleware.rate_for("/battery/diagnose/soc") == 0.01
+    assert middleware.rate_for("/battery/diagnose/soh") == 0.1
+    assert middleware.rate_for("/battery/logs") == 0.5
+    assert middleware.rate_for("/health") == 1.0
+    with pytest.raises(ValueError):
+        parse_sample_rates("/battery/logs=2")
+
+    # Records are queued unformatted and dropped, not blocked on, when full
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    logger = logging.getLogger("test_log_queue")
+    logger.propagate = False
+    logger.addHandler(handler)
+    logger.warning("voltage %s", 3.7)
+    logger.warning("voltage %s", 3.8)
+    record = handler.queue.get_nowait()
+    assert record.msg == "voltage %s" and record.args == (3.7,)
+    assert handler.dropped == 1
+
+    entry = json.loads(JSONFormatter().format(record))
+    assert entry["message"] == "voltage 3.7" and entry["level"] == "WARNING"
+
+
+def test_binary_request_bodies():
+    """Test msgpack, Arrow and frame bodies and response negotiation"""
+    import msgpack
+    import numpy as np
+    import pyarrow as pa
+    from api_key_manager import api_key_manager
+    from body_codecs import decode_arrow, decode_frame, encode_frame
+
+    api_key_manager.add_key("binary_key")
+    headers = {"x-api-key": "binary_key"}
+    cells = np.array([3.70, 3.71, 3.50, 3.72])
+    expected = BatteryDiagnostics.check_cell_balance(cells.tolist(), 25.0)
+
+    frame = encode_frame({"batteryType": "Li-ion", "temperature": 25.0, "cellVoltages": cells})
+    assert decode_frame(frame)["cellVoltages"].tolist() == cells.tolist()
+    response = client.post("/battery/diagnose/cell-balance", content=frame,
+                           headers={**headers, "content-type": "application/x-battery-frame"})
+    assert response.status_code == 200
+    assert response.json() == expected
+
+    body = msgpack.packb({"batteryType": "Li-ion", "temperature": 25.0,
+                          "cellVoltages": msgpack.ExtType(2, cells.astype("<f8").tobytes())})
+    response = client.post("/battery/diagnose/cell-balance", content=body,
+                           headers={**headers, "content-type": "application/msgpack",
+                                    "accept": "application/msgpack"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/msgpack"
+    assert msgpack.unpackb(response.content) == expected
+
+    table = pa.table({
+        "batteryType": ["Li-ion"] * 3, "nominalVoltage": [48.0] * 3,
+        "voltage": [42.0, 50.0, 99.0], "temperature": [25.0] * 3, "current": [-1.0] * 3
+    })
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    response = client.post("/battery/diagnose/soc/batch", content=sink.getvalue().to_pybytes(),
+                           headers={**headers, "content-type": "application/vnd.apache.arrow.stream",
+                                    "accept": "application/vnd.apache.arrow.stream"})
+    assert response.status_code == 200
+    result = decode_arrow(response.content)
+    assert result["valid"] == [True, True, False]
+    assert np.isnan(result["stateOfCharge"][2])
+    assert [error["index"] for error in result["errors"]] == [2]
+
+    # Binary bodies can carry NaN, which JSON bodies cannot; such rows are rejected
+    body = msgpack.packb({
+        "batteryType": ["Li-ion"] * 3, "nominalVoltage": [48.0] * 3,
+        "voltage": [50.0, 50.0, 50.0], "temperature": [25.0, float("nan"), 25.0],
+        "current": [-1.0, -1.0, float("nan")]
+    })
+    response = client.post("/battery/diagnose/soc/batch", content=body,
+                           headers={**headers, "content-type": "application/msgpack"})
+    assert response.status_code == 200
+    result = response.json()
+    assert result["stateOfCharge"][0] is not None
+    assert result["stateOfCharge"][1:] == [None, None]
+    assert result["estimatedRange"][1:] == [None, None]
+    assert [error["index"] for error in result["errors"]] == [1, 2]
+
+    # Binary bodies go through the same model validation, and bad bodies are rejected
+    short = encode_frame({"batteryType": "Li-ion", "temperature": 25.0, "cellVoltages": cells[:1]})
+    response = client.post("/battery/diagnose/cell-balance", content=short,
+                           headers={**headers, "content-type": "application/x-battery-frame"})
+    assert response.status_code == 422
+    response = client.post("/battery/diagnose/cell-balance", content=b"BTF1",
+                           headers={**headers, "content-type": "application/x-battery-frame"})
+    assert response.status_code == 400
+    response = client.post("/battery/diagnose/cell-balance", content=b"cells",
+                           headers={**headers, "content-type": "text/plain"})
+    assert response.status_code == 415
+
+
+def test_fast_json_serialization():
+    """Test that NumPy values serialize natively, non-finite floats as null, on both encoders"""
+    import numpy as np
+    import fast_json
+
+    content = {
+        "stateOfCharge": np.array([50.0, np.nan, np.inf]),
+        "chargingStatus": np.array(["Charging", None], dtype=object),
+        "valid": np.array([True, False]),
+        "count": np.int64(2),
+        "factor": float("nan"),
+        "bounds": [float("-inf"), np.float64(np.inf)],
+        "capacity": np.array([[1.0, np.nan], [2.0, 3.0]]),
+        "label": "NaN"
+    }
+    expected = {
+        "stateOfCharge": [50.0, None, None], "chargingStatus": ["Charging", None],
+        "valid": [True, False], "count": 2, "factor": None, "bounds": [None, None],
+        "capacity": [[1.0, None], [2.0, 3.0]], "label": "NaN"
+    }
+    assert json.loads(fast_json.dumps(content)) == expected
+
+    orjson = fast_json.orjson
+    fast_json.orjson = None
+    try:
+        assert json.loads(fast_json.dumps(content)) == expected
+    finally:
+        fast_json.orjson = orjson
+
+    response = client.get("/health")
+    assert response.headers["content-type"] == "application/json"
+
+
+def test_coulomb_counting_soc():
+    """Test Coulomb-counted SOC, re-anchoring at rest and the voltage fallback"""
+    import numpy as np
+    from api_key_manager import api_key_manager
+    from soc_tracking import SOCTracker, soc_tracker
+
+    # One vectorized tick over many batteries: 10 A for 6 minutes takes 10% of 10 Ah
+    n = 100000
+    tracker = SOCTracker(max_batteries=n, rest_seconds=600, max_batteries_per_owner=n)
+    rows = tracker.rows_for("owner", [f"pack-{i}" for i in range(n)])
+    capacity = np.full(n, 10.0)
+    first = tracker.tick(rows, np.full(n, -10.0), np.zeros(n), capacity, np.full(n, 80.0))
+    assert first["anchored"].all()
+    ticked = tracker.tick(rows, np.full(n, -10.0), np.full(n, 360.0), capacity, np.full(n, 90.0))
+    assert not ticked["anchored"].any()
+    assert ticked["stateOfCharge"] == pytest.approx(np.full(n, 70.0))
+
+    api_key_manager.add_key("coulomb_key")
+    headers = {"x-api-key": "coulomb_key"}
+    body = {
+        "batteryId": ["a", "b"], "batteryType": ["Li-ion", "LFP"], "nominalVoltage": [48.0, 12.8],
+        "voltage": [50.0, 13.1], "temperature": [25.0, 25.0], "current": [-10.0, 0.0],
+        "capacity": [10000.0, 5000.0]
+    }
+    results = []
+    for timestamp in (0, 360, 720):
+        response = client.post("/battery/diagnose/soc/coulomb", headers=headers,
+                               json={**body, "timestamp": [timestamp, timestamp]})
+        assert response.status_code == 200
+        results.append(response.json())
+
+    voltage_soc = BatteryDiagnostics.calculate_soc(50.0, "Li-ion", 25.0, -10.0, 48.0)["stateOfCharge"]
+    assert results[0]["method"] == ["voltage", "voltage"]
+    assert results[0]["stateOfCharge"][0] == voltage_soc
+    assert results[1]["method"] == ["coulomb", "coulomb"]
+    assert results[2]["stateOfCharge"][0] == pytest.approx(voltage_soc - 20)
+    # Battery b has rested for the configured time, so it is re-anchored to its voltage
+    assert results[2]["method"] == ["coulomb", "voltage"]
+
+    response = client.post("/battery/diagnose/soc/coulomb", headers=headers,
+                           json={**body, "timestamp": [10, 10]})
+    assert [error["index"] for error in response.json()["errors"]] == [0, 1]
+    response = client.post("/battery/diagnose/soc/coulomb", headers=headers,
+                           json={**body, "batteryId": ["a", "a"]})
+    assert response.status_code == 422
+
+    # Each key has its own cap, and a full table reclaims idle rows, else the least recently used
+    tracker = SOCTracker(max_batteries=3, max_batteries_per_owner=2, idle_seconds=100)
+    assert tracker.rows_for("owner", ["a", "b", "c"], now=0).tolist() == [0, 1, -1]
+    assert tracker.full_detail("owner", "SOC tracker").startswith("SOC tracker is full for this API key")
+    tracker.soc[:2] = 50.0
+    assert tracker.rows_for("other", ["c"], now=10).tolist() == [2]
+    assert tracker.rows_for("owner", ["a"], now=20).tolist() == [0]
+    assert tracker.rows_for("other", ["d", "e"], now=30).tolist() == [1, -1]
+    assert ("owner", "b") not in tracker.rows and np.isnan(tracker.soc[1])
+    assert tracker.rows_for("third", ["f", "g"], now=200).tolist() == [2, 1]
+    assert tracker.owner_batteries == {"third": 2}
+
+    # A new battery whose first reading is rejected keeps no row
+    before = len(soc_tracker)
+    response = client.post("/battery/diagnose/soc/coulomb", headers=headers, json={
+        **body, "batteryId": ["rejected", "b"], "voltage": [500.0, 13.1]})
+    assert [error["index"] for error in response.json()["errors"]] == [0]
+    assert len(soc_tracker) == before and (hash_key("coulomb_key"), "rejected") not in soc_tracker.rows
+
+    # Process-local tracking is refused when run.py turned it off
+    import main
+    main.STATEFUL_ENDPOINTS = False
+    try:
+        response = client.post("/battery/diagnose/soc/coulomb", headers=headers, json=body)
+        assert response.status_code == 503
+    finally:
+        main.STATEFUL_ENDPOINTS = True
+
+
+def test_ocv_table(tmp_path):
+    """Test OCV-SOC curves: scalar/batched agreement, temperature, caching and the spec sheet"""
+    import numpy as np
+    from battery_diagnostics import ocv_table, spec_registry
+    from batch_diagnostics import BatchDiagnostics
+    from ocv_table import OCVTable, check_spreadsheet, load_ocv_table, table_key
+
+    # Cutoffs map to 0% and 100%; LFP's flat plateau puts 50 V of a 48 V pack far above 50%
+    assert BatteryDiagnostics.calculate_soc(37.5, "LFP", 25.0, 0.0, 48.0)["stateOfCharge"] == 0
+    assert BatteryDiagnostics.calculate_soc(54.6, "LFP", 25.0, 0.0, 48.0)["stateOfCharge"] == 100
+    assert BatteryDiagnostics.calculate_soc(50.0, "LFP", 25.0, 0.0, 48.0)["stateOfCharge"] > 80
+    cold = BatteryDiagnostics.calculate_soc(50.0, "LFP", 0.0, 0.0, 48.0)["stateOfCharge"]
+    assert cold != BatteryDiagnostics.calculate_soc(50.0, "LFP", 25.0, 0.0, 48.0)["stateOfCharge"]
+    report = BatteryDiagnostics.analyze_voltage(50.0, "LFP", 48.0, 0.0)
+    assert report["voltagePercentage"] == round(cold, 2)
+
+    # The batched lookup matches the scalar one exactly, off and on the grid points
+    rng = np.random.default_rng(7)
+    n = 2000
+    battery_types = rng.choice(["Li-ion", "LFP", "Lead-acid"], n).tolist()
+    nominal = np.array([{"Li-ion": 48.0, "LFP": 12.8, "Lead-acid": 12.0}[name] for name in battery_types])
+    chem_ids = spec_registry.chemistry_ids_for(battery_types)
+    nominal_ids = spec_registry.nominal_ids_for(chem_ids, nominal)
+    specs = spec_registry.gather(chem_ids, nominal_ids)
+    voltage = specs["min_voltage"] + (specs["max_voltage"] - specs["min_voltage"]) * rng.random(n)
+    temperature = rng.uniform(0.0, 40.0, n)
+    temperature[:100] = 25.0
+    batch = BatchDiagnostics.calculate_soc_batch(voltage, battery_types, temperature, np.zeros(n), nominal)
+    assert batch["valid"].all()
+    assert batch["stateOfCharge"].tolist() == [
+        BatteryDiagnostics.calculate_soc(float(v), name, float(t), 0.0, float(nom))["stateOfCharge"]
+        for v, name, t, nom in zip(voltage, battery_types, temperature, nominal)
+    ]
+    curve = ocv_table.curve(int(chem_ids[0]), int(nominal_ids[0]), 25.0)
+    assert [ocv_table.soc(int(chem_ids[0]), int(nominal_ids[0]), v, 25.0) for v in curve] == \
+        ocv_table.soc_points.tolist()
+
+    # A cache built from other inputs is ignored and rebuilt
+    path = str(tmp_path / "ocv.npz")
+    load_ocv_table(BatteryDiagnostics.BATTERY_TYPES, spec_registry, path)
+    key = table_key(BatteryDiagnostics.BATTERY_TYPES)
+    assert np.array_equal(OCVTable.load(path, key).voltages, ocv_table.voltages, equal_nan=True)
+    assert OCVTable.load(path, "stale") is None
+
+    pytest.importorskip("openpyxl")
+    check_spreadsheet("attached_assets/Battery_Specification.xlsx", spec_registry)
+
+
+def test_ekf_soc():
+    """Test the batched EKF converging on the true SOC, and its endpoint"""
+    import numpy as np
+    from api_key_manager import api_key_manager
+    from battery_diagnostics import ocv_table, spec_registry
+    from benchmarks import run_fleet_benchmarks
+    from soc_tracking import SOCFilter, soc_filter as soc_filter_state
+
+    # Simulate Li-ion 48 V packs at 50% discharging at 2 A, started from a wrong 60%
+    n = 1000
+    soc_filter = SOCFilter(max_batteries=n)
+    rows = soc_filter.rows_for("owner", [f"pack-{i}" for i in range(n)])
+    chem_ids = spec_registry.chemistry_ids_for(["Li-ion"] * n)
+    nominal_ids = spec_registry.nominal_ids_for(chem_ids, np.full(n, 48.0))
+    capacity, current, temperature = np.full(n, 10.0), np.full(n, -2.0), np.full(n, 25.0)
+    series = 48.0 / spec_registry.cell_voltages[chem_ids]
+    resistance = (spec_registry.ecm_r0[chem_ids] + spec_registry.ecm_r1[chem_ids]) * series
+    true_soc = 50.0
+    soc_filter.tick(rows, np.zeros(n), current, temperature, np.zeros(n), capacity,
+                    chem_ids, nominal_ids, np.full(n, 60.0))
+    for step in range(1, 300):
+        true_soc += 100 * -2.0 * 10 / (3600 * 10.0)
+        ocv, _ = ocv_table.voltage_batch(chem_ids, nominal_ids, np.full(n, true_soc), temperature)
+        ticked = soc_filter.tick(rows, ocv + resistance * current, current, temperature,
+                                 np.full(n, step * 10.0), capacity, chem_ids, nominal_ids,
+                                 np.full(n, np.nan))
+    assert ticked["ok"].all()
+    assert ticked["stateOfCharge"] == pytest.approx(np.full(n, true_soc), abs=1)
+    assert (ticked["stateOfChargeStdDev"] < 5).all()
+
+    api_key_manager.add_key("ekf_key")
+    headers = {"x-api-key": "ekf_key"}
+    body = {
+        "batteryId": ["a", "b"], "batteryType": ["Li-ion", "LFP"], "nominalVoltage": [48.0, 12.8],
+        "voltage": [50.0, 13.1], "temperature": [25.0, 25.0], "current": [-10.0, 0.0],
+        "capacity": [10000.0, 5000.0]
+    }
+    results = []
+    for timestamp in (0, 60):
+        response = client.post("/battery/diagnose/soc/ekf", headers=headers,
+                               json={**body, "timestamp": [timestamp, timestamp]})
+        assert response.status_code == 200
+        results.append(response.json())
+    assert results[0]["method"] == ["voltage", "voltage"]
+    assert results[1]["method"] == ["ekf", "ekf"]
+    assert all(std > 0 for std in results[1]["stateOfChargeStdDev"])
+    # A new battery whose first reading is rejected keeps no filter row
+    response = client.post("/battery/diagnose/soc/ekf", headers=headers, json={
+        **body, "batteryId": ["rejected", "b"], "voltage": [500.0, 13.1], "timestamp": [120, 120]})
+    assert [error["index"] for error in response.json()["errors"]] == [0]
+    assert (hash_key("ekf_key"), "rejected") not in soc_filter_state.rows
+
+    results = run_fleet_benchmarks(iterations=10, name_filter="fleet:ekf_tick:1k")
+    assert [result.name for result in results] == ["fleet:ekf_tick:1k"]
+
+
+def test_pack_balance_batch():
+    """Test the vectorized pack balance engine against check_cell_balance, and its endpoint"""
+    import numpy as np
+    from api_key_manager import api_key_manager
+    from batch_diagnostics import BatchDiagnostics
+    from body_codecs import FRAME_MEDIA_TYPE, decode_frame, encode_frame
+
+    rng = np.random.default_rng(3)
+    packs = 3.7 + rng.normal(0, 0.06, (200, 24))
+    batch = BatchDiagnostics.check_cell_balance_batch(packs, series=6, parallel=2)
+    for pack, cells in enumerate(packs):
+        scalar = BatteryDiagnostics.check_cell_balance(cells.tolist(), 25.0)
+        start, end = batch["problemOffsets"][pack:pack + 2]
+        assert batch["maxImbalance"][pack] == scalar["maxImbalance"]
+        assert batch["balanceStatus"][pack] == scalar["balanceStatus"]
+        assert batch["problemCells"][start:end].tolist() == (scalar["problematicCells"] or [])
+        assert batch["problemMask"][pack].tolist() == [
+            cell + 1 in (scalar["problematicCells"] or []) for cell in range(24)]
+    assert np.allclose(batch["zScores"], (packs - packs.mean(axis=1, keepdims=True))
+                       / packs.std(axis=1, keepdims=True))
+    assert np.allclose(batch["moduleVoltage"], packs.reshape(200, 2, 6, 2).mean(axis=3).sum(axis=2))
+
+    api_key_manager.add_key("balance_key")
+    headers = {"x-api-key": "balance_key"}
+    body = {"batteryType": "Li-ion", "series": 2, "parallel": 2,
+            "cellVoltages": [[3.70, 3.71, 3.69, 3.70, 3.71, 3.70, 3.52, 3.70],
+                             [3.80, 3.81, 3.80, 3.79, 3.80, 3.81, 3.80, 3.80]]}
+    response = client.post("/battery/diagnose/cell-balance/batch", headers=headers, json=body)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["problemOffsets"] == [0, 1, 1] and data["problemCells"] == [7]
+    assert data["balanceStatus"] == ["Acceptable", "Well Balanced"]
+    assert np.allclose(data["moduleVoltage"], [[7.4, 7.315], [7.6, 7.605]])
+
+    # Binary bodies carry the matrix flat, with its row length
+    frame = encode_frame({"batteryType": "Li-ion", "cellsPerPack": 8,
+                          "cellVoltages": np.array(body["cellVoltages"]).ravel()})
+    response = client.post("/battery/diagnose/cell-balance/batch", content=frame,
+                           headers={**headers, "content-type": FRAME_MEDIA_TYPE,
+                                    "accept": FRAME_MEDIA_TYPE})
+    assert response.status_code == 200
+    assert decode_frame(response.content)["problemCells"].tolist() == [7]
+
+    response = client.post("/battery/diagnose/cell-balance/batch", headers=headers,
+                           json={**body, "series": 3})
+    assert response.status_code == 422
+
+
+def test_capacity_fade_fit():
+    """Test the vectorized fade fits against per-battery polyfit, and their endpoint"""
+    import numpy as np
+    from api_key_manager import api_key_manager
+    from body_codecs import FRAME_MEDIA_TYPE, decode_frame, encode_frame
+    from capacity_fade import fit_capacity_fade
+
+    rng = np.random.default_rng(11)
+    cycles = np.arange(0, 1000, 5.0)
+    capacity = np.stack([3000 - 0.5 * cycles,
+                         3000 - 20 * np.sqrt(cycles),
+                         3000 * np.exp(-2e-4 * cycles),
+                         3000 + 0 * cycles]) + rng.normal(0, 5, (4, len(cycles)))
+    capacity[0, 150:] = np.nan
+    fit = fit_capacity_fade(capacity, cycles, chunk_points=400)
+
+    slope, intercept = np.polyfit(cycles[:150], capacity[0, :150], 1)
+    assert np.isclose(fit["linearSlope"][0], slope) and np.isclose(fit["linearIntercept"][0], intercept)
+    assert np.isclose(fit["linearEolCycle"][0], (0.8 * fit["initialCapacity"][0] - intercept) / slope)
+    slope, _ = np.polyfit(np.sqrt(cycles), capacity[1], 1)
+    assert np.isclose(fit["sqrtSlope"][1], slope)
+    slope, _ = np.polyfit(cycles, np.log(capacity[2]), 1)
+    assert np.isclose(fit["exponentialSlope"][2], slope)
+    assert fit["bestModel"].tolist() == ["linear", "sqrt", "exponential", "linear"]
+    assert fit["points"].tolist() == [150, 200, 200, 200]
+    assert (fit["eolCycleLower"][:3] < fit["eolCycle"][:3]).all()
+    assert (fit["eolCycle"][:3] < fit["eolCycleUpper"][:3]).all()
+    # No significant fade: no upper bound on end of life
+    assert np.isinf(fit["eolCycleUpper"][3])
+    # Constant capacity, with no fade and no noise, never reaches end of life
+    flat = fit_capacity_fade(np.full((1, 50), 3000.0), np.arange(50.0))
+    for model in ("linear", "sqrt", "exponential"):
+        for bound in ("EolCycle", "EolCycleLower", "EolCycleUpper"):
+            assert flat[model + bound][0] == np.inf, model + bound
+
+    api_key_manager.add_key("fade_key")
+    headers = {"x-api-key": "fade_key"}
+    body = {"batteryType": "Li-ion", "models": ["linear"],
+            "capacity": [[3000, 2950, 2905, 2848, 2801], [3000, None, 2990], [3000]],
+            "cycles": [0, 100, 200, 300, 400]}
+    response = client.post("/battery/diagnose/capacity-fade/fit", headers=headers, json=body)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["count"] == 3 and "valid" not in data
+    assert data["bestModel"] == ["linear", None, None]
+    assert data["points"] == [5, 0, 0]
+    assert 1190 < data["eolCycle"][0] < 1210 and data["eolCycle"][1] is None
+    assert "sqrtSlope" not in data
+
+    # Binary bodies carry the matrix flat, with its row length
+    frame = encode_frame({"batteryType": "Li-ion", "pointsPerBattery": len(cycles),
+                          "capacity": capacity[:3].astype(np.float32).ravel(), "cycles": cycles})
+    response = client.post("/battery/diagnose/capacity-fade/fit", content=frame,
+                           headers={**headers, "content-type": FRAME_MEDIA_TYPE,
+                                    "accept": FRAME_MEDIA_TYPE})
+    assert response.status_code == 200
+    result = decode_frame(response.content)
+    assert result["valid"].tolist() == [True, True, True]
+    assert np.allclose(result["linearSlope"], fit["linearSlope"][:3], rtol=1e-4)
+
+    response = client.post("/battery/diagnose/capacity-fade/fit", headers=headers,
+                           json={**body, "models": ["cubic"]})
+    assert response.status_code == 422
+    response = client.post("/battery/diagnose/capacity-fade/fit", headers=headers,
+                           json={**body, "cycles": [0, 100]})
+    assert response.status_code == 422
+
+
+def test_cycle_life_simulation():
+    """Test the Monte Carlo cycle life projection and its endpoint"""
+    import numpy as np
+    from api_key_manager import api_key_manager
+    from cycle_life import MAX_SIMULATED_BATTERIES, draws_within_budget, simulate_cycle_life
+
+    # Without spread every scenario is the point estimate
+    usage = [(85.0, 40.0, 90.0), (40.0, 10.0, 80.0), (60.0, 25.0, 70.0)]
+    dod, temperature, soh = (np.array(column) for column in zip(*usage))
+    fixed = simulate_cycle_life(dod, temperature, soh, dod_std=0, temperature_std=0, soh_std=0,
+                                draws=1000, seed=1)
+    for index, (d, t, s) in enumerate(usage):
+        scalar = BatteryDiagnostics.estimate_cycle_life(100, d, t, s)
+        assert fixed["remainingCyclesP5"][index] == fixed["remainingCyclesP95"][index] \
+            == scalar["remainingCycles"]
+        assert fixed["eolDateP50"][index] == scalar["estimatedEOL"]
+
+    first = simulate_cycle_life(dod, temperature, soh, draws=5000, seed=7, horizon_days=600)
+    again = simulate_cycle_life(dod, temperature, soh, draws=5000, seed=7, horizon_days=600)
+    for name, column in first.items():
+        assert np.array_equal(column, again[name]), name
+    assert (first["remainingCyclesP5"] <= first["remainingCyclesP50"]).all()
+    assert (first["remainingCyclesP50"] <= first["remainingCyclesP95"]).all()
+    assert (first["eolDateP5"] <= first["eolDateP95"]).all()
+    assert ((first["eolProbability"] > 0) & (first["eolProbability"] < 1)).any()
+
+    assert draws_within_budget(10, 20000, draw_budget=100000) == 10000
+    with pytest.raises(ValueError):
+        draws_within_budget(1000, 20000, draw_budget=100000)
+
+    api_key_manager.add_key("cycle_life_key")
+    headers = {"x-api-key": "cycle_life_key"}
+    body = {"batteryType": "Li-ion", "depthOfDischarge": [75.0, 45.0], "averageTemperature": [30.0, 20.0],
+            "currentSOH": [90.0, 95.0], "draws": 2000, "seed": 42, "percentiles": [50, 10, 90]}
+    response = client.post("/battery/diagnose/cycle-life/simulate", headers=headers, json=body)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["count"] == 2 and data["draws"] == 2000 and data["seed"] == 42
+    assert len(data["eolDateP90"]) == 2 and "remainingCyclesP5" not in data
+    assert data["remainingCyclesP10"][0] <= data["remainingCyclesP90"][0]
+    assert client.post("/battery/diagnose/cycle-life/simulate", headers=headers,
+                       json=body).json()["remainingCyclesMean"] == data["remainingCyclesMean"]
+
+    response = client.post("/battery/diagnose/cycle-life/simulate", headers=headers,
+                           json={**body, "currentSOH": [90.0, 120.0]})
+    assert response.status_code == 422
+    # Fleets beyond the draw budget are refused by validation, not by the simulation
+    fleet = MAX_SIMULATED_BATTERIES + 1
+    response = client.post("/battery/diagnose/cycle-life/simulate", headers=headers, json={
+        **body, "depthOfDischarge": [80.0] * fleet, "averageTemperature": [25.0] * fleet,
+        "currentSOH": [90.0] * fleet})
+    assert response.status_code == 422 and str(MAX_SIMULATED_BATTERIES) in response.text
+
+
+def test_rainflow_counting():
+    """Test streaming rainflow counting against the one-pass reference and its endpoint"""
+    import numpy as np
+    from api_key_manager import api_key_manager
+    from rainflow import RainflowCounter, rainflow_cycles
+
+    rng = np.random.default_rng(11)
+    series = np.clip(50 + np.cumsum(rng.normal(0, 8, (40, 300)), axis=1), 0, 100)
+    series[3, 100:120] = np.nan
+    series[5] = np.repeat(series[5, ::10], 10)
+
+    counter = RainflowCounter(max_batteries=64, chunk_points=1000)
+    rows = np.arange(40)
+    for start, stop in ((0, 1), (1, 77), (77, 200), (200, 300)):
+        counted = counter.count(rows, series[:, start:stop])
+    for row in rows:
+        cycles = rainflow_cycles(series[row])
+        assert counted["closedCycles"][row] == pytest.approx(sum(count for _, _, count in cycles))
+        assert counted["histogram"][row].sum() == pytest.approx(counted["closedCycles"][row])
+        depth = sum(count * d * d for d, _, count in cycles) / sum(count * d for d, _, count in cycles)
+        assert counted["depthOfDischarge"][row] == pytest.approx(depth)
+        assert counted["equivalentFullCycles"][row] == pytest.approx(
+            np.abs(np.diff(series[row][~np.isnan(series[row])])).sum() / 200)
+
+    # Three swings of 80 %: the first two close as half cycles, the last stays open
+    counter = RainflowCounter()
+    counted = counter.count(np.array([0]), np.array([[90.0, 10.0, 90.0, 10.0]]))
+    assert counted["equivalentFullCycles"][0] == 1.2 and counted["residualPoints"][0] == 2
+    assert counted["closedCycles"][0] == 1.0 and counted["depthOfDischarge"][0] == 80
+    assert counted["histogram"][0, 8, 5] == 1.0
+
+    api_key_manager.add_key("rainflow_key")
+    headers = {"x-api-key": "rainflow_key"}
+    body = {"batteryId": ["rf-1", "rf-2"], "batteryType": "Li-ion",
+            "stateOfCharge": [[95.0, 20.0, 90.0, 15.0, 95.0], [50.0, 60.0]],
+            "averageTemperature": [30.0, 25.0], "currentSOH": [92.0, 97.0],
+            "currentCapacity": [4600.0, 4900.0], "ratedCapacity": [5000.0, 5000.0]}
+    response = client.post("/battery/diagnose/rainflow", headers=headers, json=body)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["count"] == 2 and data["errors"] == [] and len(data["depthBins"]) == 11
+    assert data["depthOfDischarge"][1] is None and data["remainingCycles"][1] is None
+
+    # The next chunk continues each battery's series
+    body["stateOfCharge"] = [[20.0, 100.0, 0.0], [10.0, 70.0, 10.0, 70.0]]
+    data = client.post("/battery/diagnose/rainflow", headers=headers, json=body).json()
+    assert data["equivalentFullCycles"] == pytest.approx([(75 + 70 + 75 + 80 + 75 + 80 + 100) / 200,
+                                                          (10 + 50 + 60 + 60 + 60) / 200])
+    for index in range(2):
+        cycle_life = BatteryDiagnostics.estimate_cycle_life(
+            data["cycleCount"][index], data["depthOfDischarge"][index],
+            body["averageTemperature"][index], body["currentSOH"][index])
+        assert data["remainingCycles"][index] == cycle_life["remainingCycles"]
+        assert data["estimatedEOL"][index] == cycle_life["estimatedEOL"]
+        soh = BatteryDiagnostics.calculate_soh(
+            body["currentCapacity"][index], body["ratedCapacity"][index], data["cycleCount"][index])
+        assert data["stateOfHealth"][index] == soh["stateOfHealth"]
+        assert data["healthStatus"][index] == soh["healthStatus"]
+
+    # Another key's battery of the same id starts from scratch
+    api_key_manager.add_key("rainflow_other_key")
+    other = client.post("/battery/diagnose/rainflow", headers={"x-api-key": "rainflow_other_key"},
+                        json={**body, "batteryId": ["rf-1"], "stateOfCharge": [[20.0, 100.0, 0.0]],
+                              "averageTemperature": None, "currentSOH": None,
+                              "currentCapacity": None, "ratedCapacity": None}).json()
+    assert other["equivalentFullCycles"] == [1.8 / 2] and "remainingCycles" not in other
+
+    response = client.post("/battery/diagnose/rainflow", headers=headers,
+                           json={**body, "stateOfCharge": [[20.0, 120.0], [10.0]]})
+    assert response.status_code == 422
+    response = client.post("/battery/diagnose/rainflow", headers=headers,
+                           json={**body, "ratedCapacity": None})
+    assert response.status_code == 422
+
+    # A reclaimed battery counts again from zero; each key has its own cap
+    counter = RainflowCounter(max_batteries=1, max_batteries_per_owner=1)
+    rows = counter.rows_for("owner", ["a", "b"], now=0)
+    assert rows.tolist() == [0, -1]
+    assert counter.full_detail("owner", "Rainflow counter").endswith("for this API key (1 batteries)")
+    counter.count(rows[:1], np.array([[20.0, 100.0, 0.0]]))
+    assert counter.rows_for("other", ["a"], now=10).tolist() == [0]
+    assert counter.throughput[0] == 0 and counter.stack_size[0] == 0
+
+    # Process-local counts are refused when run.py turned them off
+    import main
+    main.STATEFUL_ENDPOINTS = False
+    try:
+        response = client.post("/battery/diagnose/rainflow", headers=headers, json=body)
+        assert response.status_code == 503
+    finally:
+        main.STATEFUL_ENDPOINTS = True
+
+
+def test_compute_pool():
+    """Test that offloaded calculations match inline ones and are labelled in metrics"""
+    import asyncio
+    import numpy as np
+    from batch_diagnostics import BatchDiagnostics
+    from compute_pool import ComputePool
+    from metrics import metrics
+
+    packs = 3.7 + np.random.default_rng(5).normal(0, 0.06, (400, 60))
+    expected = BatchDiagnostics.check_cell_balance_batch(packs, series=15, parallel=2)
+
+    async def scenario():
+        pool = ComputePool(workers=1, min_elements=10000, shared_memory_min_bytes=1024)
+        await pool.start()
+        try:
+            offloaded = await pool.run("pool_test", BatchDiagnostics.check_cell_balance_batch,
+                                       packs, series=15, parallel=2)
+            inline = await pool.run("pool_test", BatchDiagnostics.check_cell_balance_batch, packs[:2])
+            # A caller that knows the call's work offloads it regardless of the payload
+            await pool.run("pool_test", BatchDiagnostics.check_cell_balance_batch, packs[:2],
+                           work=10000)
+            with pytest.raises(ValueError):
+                await pool.run("pool_test", BatchDiagnostics.check_cell_balance_batch,
+                               packs, series=7)
+        finally:
+            await pool.stop()
+        return offloaded, inline
+
+    offloaded, inline = asyncio.run(scenario())
+    for name, column in expected.items():
+        assert np.array_equal(offloaded[name], column), name
+    assert inline["balanceStatus"].tolist() == expected["balanceStatus"][:2].tolist()
+    assert metrics.executions.values[("pool_test", "process")] == 2
+    assert metrics.executions.values[("pool_test", "inline")] == 1
+    assert ("pool_test",) in metrics.queue_wait.values
+
+    # A caller that goes away mid-call leaves no shared memory behind
+    import os
+    import time
+    values = np.random.default_rng(6).random(4_000_000)
+    before = set(os.listdir("/dev/shm"))
+
+    async def cancelled():
+        pool = ComputePool(workers=1, min_elements=1000)
+        await pool.start()
+        try:
+            call = asyncio.ensure_future(pool.run("pool_cancel_test", np.sort, values))
+            await asyncio.sleep(0.1)
+            call.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await call
+        finally:
+            await pool.stop()
+
+    asyncio.run(cancelled())
+    deadline = time.monotonic() + 5
+    while set(os.listdir("/dev/shm")) - before and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not set(os.listdir("/dev/shm")) - before
+
+
+def test_batch_jobs(tmp_path):
+    """Test batch jobs over uploaded files, including resuming after a restart"""
+    import asyncio
+    from api_key_manager import api_key_manager
+    from batch_jobs import JobRunner, chunk_path, iter_chunks, run_chunk
+    from fast_json import loads
+
+    lines = ["batteryId,batteryType,temperature,currentCapacity,ratedCapacity,cycleCount,cellVoltages"]
+    for i in range(30):
+        lines.append(f'pack-{i},Li-ion,25,{2000 + 20 * i},3000,{10 * i},"[3.7, 3.71, {3.5 + i / 100}]"')
+    lines[5] = "pack-4,Li-ion,25,abc,3000,40,"
+    upload = "\n".join(lines).encode()
+
+    runner = JobRunner(directory=str(tmp_path), url=f"sqlite:///{tmp_path}/jobs.db",
+                       workers=1, chunk_rows=8)
+
+    async def body():
+        yield upload[:100]
+        yield upload[100:]
+
+    async def wait(job_id):
+        for _ in range(300):
+            job = await runner.get(job_id, "owner")
+            if job.status in ("completed", "failed"):
+                return runner.describe(job)
+            await asyncio.sleep(0.05)
+        raise AssertionError("job did not finish")
+
+    async def scenario():
+        job = await runner.submit_upload("owner", "text/csv", body(), ["soh", "cell-balance"])
+        directory = runner.job_directory(job["id"])
+
+        # A runner that stopped after its first chunk
+        assert runner.store.claim("old-runner", 30).id == job["id"]
+        index, rows = next(iter_chunks(f"{directory}/input.csv", "csv", 8))
+        runner.store.checkpoint(job["id"], "old-runner", *run_chunk(
+            directory, index, 0, rows, ["soh", "cell-balance"]), 30)
+        runner.store.release(job["id"], "old-runner")
+        first_chunk = os.stat(chunk_path(directory, 0)).st_mtime_ns
+
+        await runner.start()
+        try:
+            status = await wait(job["id"])
+        finally:
+            await runner.stop()
+        results = b"".join([block async for block in runner.iter_results(job["id"])])
+        return status, results, first_chunk == os.stat(chunk_path(directory, 0)).st_mtime_ns
+
+    status, results, resumed = asyncio.run(scenario())
+    assert resumed
+    assert status["status"] == "completed" and status["progress"] == 1.0
+    assert (status["rows"], status["rowErrors"], status["chunksDone"], status["chunksTotal"]) == (30, 1, 4, 4)
+    results = [loads(line) for line in results.splitlines()]
+    assert [row["row"] for row in results] == list(range(30))
+    assert results[7]["batteryId"] == "pack-7"
+    assert results[7]["results"] == BatteryDiagnostics.full_report(
+        {"batteryType": "Li-ion", "temperature": 25.0, "currentCapacity": 2140.0,
+         "ratedCapacity": 3000.0, "cycleCount": 70, "cellVoltages": [3.7, 3.71, 3.57]},
+        ["soh", "cell-balance"])["results"]
+    assert set(results[4]["errors"]) == {"soh", "cell-balance"} and results[4]["results"] == {}
+
+    api_key_manager.add_key("jobs_key")
+    headers = {"x-api-key": "jobs_key"}
+    response = client.post("/battery/jobs?diagnostics=soh", content=upload,
+                           headers={**headers, "content-type": "text/csv"})
+    assert response.status_code == 202
+    job = response.json()
+    assert job["status"] == "queued" and job["diagnostics"] == ["soh"]
+    assert client.get(f"/battery/jobs/{job['id']}", headers=headers).json()["status"] == "queued"
+    assert client.get(f"/battery/jobs/{job['id']}", headers={"x-api-key": "binary_key"}).status_code == 404
+    response = client.post("/battery/jobs?diagnostics=bogus", content=upload,
+                           headers={**headers, "content-type": "text/csv"})
+    assert response.status_code == 422
+    response = client.post("/battery/jobs", json={"diagnostics": ["soh"]}, headers=headers)
+    assert response.status_code == 422
+    # Stored history holds results, not inputs, so it cannot feed a job
+    response = client.post("/battery/jobs", json={"history": {"type": "soh"}}, headers=headers)
+    assert response.status_code == 422 and "stored history cannot be used" in response.json()["detail"]
+
+    # Rejected uploads do not use up the key's quota
+    api_key_manager.add_key("job_rejected_key")
+    rejected = {"x-api-key": "job_rejected_key"}
+    for _ in range(api_key_manager.max_usage + 2):
+        response = client.post("/battery/jobs", content=upload,
+                               headers={**rejected, "content-type": "text/plain"})
+        assert response.status_code == 422
+        response = client.post("/battery/jobs?diagnostics=bogus", content=upload,
+                               headers={**rejected, "content-type": "text/csv"})
+        assert response.status_code == 422
+        response = client.post("/battery/jobs", content=b"\x00\x01",
+                               headers={**rejected, "content-type": "application/vnd.apache.parquet"})
+        assert response.status_code == 400
+    assert api_key_manager.get_usage("job_rejected_key") == 0
+    response = client.post("/battery/diagnose/soc", headers=rejected, json={
+        "batteryType": "Li-ion", "voltage": 51.8, "temperature": 25.0, "nominalVoltage": 48.0, "current": -10.0})
+    assert response.status_code == 200
+
+
+def test_battery_stream():
+    """Test stateful telemetry streaming over WebSocket and chunked HTTP"""
+    from api_key_manager import api_key_manager
+    from telemetry_stream import StreamState
+
+    state = StreamState(max_batteries=2)
+    first = {"batteryId": "pack-1", "batteryType": "Li-ion", "nominalVoltage": 48.0,
+             "voltage": 50.0, "current": -1.0, "temperature": 30.0, "timestamp": 0}
+    result = state.ingest("owner", [first, {"batteryId": "pack-2", "voltage": 50.0}])
+    assert [update["batteryId"] for update in result["updates"]] == ["pack-1"]
+    assert set(result["updates"][0]) == {"batteryId", "soc", "thermal", "safety", "faults"}
+    assert result["updates"][0]["soc"] == BatteryDiagnostics.calculate_soc(50.0, "Li-ion", 30.0, -1.0, 48.0)
+    assert [error["index"] for error in result["errors"]] == [1]
+
+    # Unchanged readings push nothing; rate of change is derived from the timestamps
+    sample = {"batteryId": "pack-1", "voltage": 50.0, "current": -1.0, "temperature": 30.0}
+    assert state.ingest("owner", [{**sample, "timestamp": 60}]) == {"updates": [], "errors": []}
+    result = state.ingest("owner", [{**sample, "temperature": 33.0, "timestamp": 120}])
+    thermal = result["updates"][0]["thermal"]
+    assert thermal["rateOfChange"] == pytest.approx(1.5)
+    assert set(result["updates"][0]) == {"batteryId", "thermal"}
+    result = state.ingest("owner", [{**sample, "timestamp": 30}])
+    assert "older" in result["errors"][0]["detail"]
+    # Batteries are scoped by owner
+    assert state.ingest("other", [sample])["errors"]
+
+    # Each key has its own cap; a full table reclaims idle batteries, else the least recent
+    state = StreamState(max_batteries=3, max_batteries_per_owner=2, idle_seconds=100)
+    state.ingest("owner", [{**first, "batteryId": "a"}, {**first, "batteryId": "b"}], now=0)
+    result = state.ingest("owner", [{**first, "batteryId": "c"}], now=10)
+    assert "for this API key" in result["errors"][0]["detail"]
+    state.ingest("other", [{**first, "batteryId": "c"}], now=20)
+    state.ingest("owner", [{**sample, "batteryId": "a", "timestamp": 30}], now=30)
+    state.ingest("other", [{**first, "batteryId": "d"}], now=40)
+    assert ("owner", "b") not in state.rows and len(state) == 3
+    state.ingest("third", [{**first, "batteryId": "e"}], now=200)
+    assert set(state.rows) == {("third", "e")} and state.owner_batteries == {"third": 1}
+    # Reused rows start from scratch
+    result = state.ingest("owner", [{**first, "batteryId": "f"}], now=210)
+    assert set(result["updates"][0]) == {"batteryId", "soc", "thermal", "safety", "faults"}
+
+    api_key_manager.add_key("stream_key")
+    headers = {"x-api-key": "stream_key"}
+    with client.websocket_connect("/battery/stream", headers=headers) as websocket:
+        websocket.send_text(json.dumps([{**first, "batteryId": "ws-1"}]))
+        update = websocket.receive_json()["updates"][0]
+        assert update["batteryId"] == "ws-1" and "soc" in update
+        websocket.send_text("not json")
+        assert "Malformed frame" in websocket.receive_json()["errors"][0]["detail"]
+    # Every frame counts against the quota
+    assert api_key_manager.get_usage("stream_key") == 2
+
+    body = "\n".join(json.dumps(frame) for frame in [
+        {**first, "batteryId": "http-1"},
+        {**sample, "batteryId": "http-1", "timestamp": 10},
+        {**sample, "batteryId": "http-1", "temperature": 50.0, "timestamp": 70},
+    ])
+    response = client.post("/battery/stream", content=body, headers=headers)
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 2
+    assert lines[1]["updates"][0]["thermal"]["thermalStatus"] == "Warning"
+    assert api_key_manager.get_usage("stream_key") == 5
+
+    # Frames beyond the quota are refused
+    api_key_manager.add_key("stream_quota_key")
+    for _ in range(api_key_manager.max_usage - 2):
+        api_key_manager.validate_key("stream_quota_key")
+        api_key_manager.increment_usage("stream_quota_key")
+    response = client.post("/battery/stream", content=body, headers={"x-api-key": "stream_quota_key"})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[-1]["errors"][0]["detail"] == "Usage limit exceeded"
+    assert api_key_manager.get_usage("stream_quota_key") == api_key_manager.max_usage
+
+    # Streams that end before their first frame hold on to no use
+    api_key_manager.add_key("stream_idle_key")
+    for _ in range(api_key_manager.max_usage - 1):
+        api_key_manager.validate_key("stream_idle_key")
+        api_key_manager.increment_usage("stream_idle_key")
+    for _ in range(3):
+        with client.websocket_connect("/battery/stream", headers={"x-api-key": "stream_idle_key"}):
+            pass
+        response = client.post("/battery/stream", content=b"", headers={"x-api-key": "stream_idle_key"})
+        assert response.status_code == 200 and response.text == ""
+    assert api_key_manager.validate_key("stream_idle_key")
+    api_key_manager.increment_usage("stream_idle_key")
+
+    assert client.post("/battery/stream", content=body).status_code == 422
+
+    # Process-local stream state is refused when run.py turned it off
+    import main
+    main.STATEFUL_ENDPOINTS = False
+    try:
+        assert client.post("/battery/stream", content=body, headers=headers).status_code == 503
+    finally:
+        main.STATEFUL_ENDPOINTS = True
+
+
 if __name__ == "__main__":
     print("\n===== RUNNING API TESTS =====")
     # Run pytest with -v (verbose) and -s (show print statements) flags